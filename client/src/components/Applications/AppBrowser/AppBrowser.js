@@ -3,7 +3,7 @@ import { NavLink as RRNavLink, useRouteMatch } from 'react-router-dom';
 import { useSelector, shallowEqual } from 'react-redux';
 // import PropTypes from 'prop-types';
 import { Nav, NavItem, NavLink, TabContent, TabPane } from 'reactstrap';
-import { AppIcon, Icon, Message } from '_common';
+import { AppIcon, Icon, LoadingSpinner, Message } from '_common';
 import './AppBrowser.scss';
 import * as ROUTES from '../../../constants/routes';
 
@@ -69,20 +69,34 @@ const AppBrowser = () => {
         {Object.keys(categoryDict).map(category => (
           <TabPane tabId={category} key={`${category}tabPane`}>
             <div className="apps-grid-list">
-              {categoryDict[category].map(app => (
-                <div key={app.appId} className="apps-grid-item">
-                  <NavLink
-                    tag={RRNavLink}
-                    to={`${ROUTES.WORKBENCH}${ROUTES.APPLICATIONS}/${app.appId}`}
-                    activeClassName="active"
+              {categoryDict[category].map(app =>
+                app.loading ? (
+                  <div
+                    key={`loading${app.trayEntryId}`}
+                    className="apps-grid-item"
                   >
-                    <span className="nav-content">
-                      <AppIcon appId={app.appId} />
-                      <span className="nav-text">{app.label}</span>
-                    </span>
-                  </NavLink>
-                </div>
-              ))}
+                    <NavLink disabled>
+                      <span className="nav-content">
+                        <LoadingSpinner placement="inline" />
+                        <span className="nav-text">{app.label}</span>
+                      </span>
+                    </NavLink>
+                  </div>
+                ) : (
+                  <div key={app.appId} className="apps-grid-item">
+                    <NavLink
+                      tag={RRNavLink}
+                      to={`${ROUTES.WORKBENCH}${ROUTES.APPLICATIONS}/${app.appId}`}
+                      activeClassName="active"
+                    >
+                      <span className="nav-content">
+                        <AppIcon appId={app.appId} />
+                        <span className="nav-text">{app.label}</span>
+                      </span>
+                    </NavLink>
+                  </div>
+                )
+              )}
             </div>
           </TabPane>
         ))}
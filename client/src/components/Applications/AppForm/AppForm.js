@@ -28,6 +28,13 @@ import {
 import DataFilesSelectModal from '../../DataFiles/DataFilesModals/DataFilesSelectModal';
 import * as ROUTES from '../../../constants/routes';
 
+const SUBMISSION_STAGES = {
+  queued: 'Queued',
+  clone_app: 'Preparing App',
+  check_keys: 'Checking System Keys',
+  submit: 'Submitting'
+};
+
 const appShape = PropTypes.shape({
   loading: PropTypes.bool,
   error: PropTypes.shape({}),
@@ -593,7 +600,11 @@ export const AppSchemaForm = ({ app }) => {
                     <LoadingSpinner placement="inline" />
                   )}{' '}
                   {jobSubmission.error && <Icon name="alert">Warning</Icon>}{' '}
-                  <span>Submit</span>
+                  <span>
+                    {(jobSubmission.submitting &&
+                      SUBMISSION_STAGES[jobSubmission.stage]) ||
+                      'Submit'}
+                  </span>
                 </Button>
                 <Button
                   onClick={handleReset}
@@ -27,6 +27,32 @@ function unpackCategoryDict(tabs) {
   return categoryDict;
 }
 
+/**
+ * Apply an apps_tray_update websocket event, replacing the loading
+ * placeholder of an app tray entry with the resolved app, or removing it
+ * if the app could not be retrieved.
+ */
+export const applyTrayUpdate = (state, update) => {
+  const category = state.categoryDict[update.category];
+  if (!category) {
+    return state;
+  }
+  const apps = category
+    .map(app =>
+      app.loading && app.trayEntryId === update.trayEntryId ? update.app : app
+    )
+    .filter(Boolean);
+  const appIcons = { ...state.appIcons };
+  if (update.app && update.app.icon) {
+    appIcons[update.app.appId] = update.app.icon;
+  }
+  return {
+    ...state,
+    categoryDict: { ...state.categoryDict, [update.category]: apps },
+    appIcons
+  };
+};
+
 export function apps(state = initialState, action) {
   switch (action.type) {
     case 'GET_APPS_SUCCESS': {
@@ -38,6 +64,8 @@ export function apps(state = initialState, action) {
         loading: false
       };
     }
+    case 'APPS_TRAY_UPDATE':
+      return applyTrayUpdate(state, action.payload);
     case 'GET_APPS_START':
       return {
         ...state,
@@ -141,6 +141,7 @@ export const initialFilesState = {
     FilesListing: null,
     modal: null
   },
+  transfers: {},
   modals: {
     addproject: false,
     preview: false,
@@ -183,6 +184,41 @@ export const initialFilesState = {
   }
 };
 
+const normalizePath = path => `/${(path || '').replace(/^\/+|\/+$/g, '')}`;
+
+/**
+ * Apply a listing_update websocket event to every section showing the
+ * folder it refers to.
+ */
+export const applyListingUpdate = (state, update) => {
+  const modified = {};
+  update.modified.forEach(file => {
+    modified[file.path] = file;
+  });
+  const sections = Object.keys(state.params).filter(
+    section =>
+      state.params[section].system === update.system &&
+      normalizePath(state.params[section].path) === normalizePath(update.path)
+  );
+  if (!sections.length) {
+    return state;
+  }
+  const listing = { ...state.listing };
+  const selected = { ...state.selected };
+  const selectAll = { ...state.selectAll };
+  sections.forEach(section => {
+    listing[section] = [
+      ...state.listing[section]
+        .filter(file => !update.removed.includes(file.path))
+        .map(file => modified[file.path] || file),
+      ...update.added
+    ];
+    selected[section] = [];
+    selectAll[section] = false;
+  });
+  return { ...state, listing, selected, selectAll };
+};
+
 let selectedSet, enabled, setValue;
 export function files(state = initialFilesState, action) {
   switch (action.type) {
@@ -389,6 +425,16 @@ export function files(state = initialFilesState, action) {
           [action.payload.operation]: action.payload.props
         }
       };
+    case 'DATA_FILES_SET_TRANSFER_PROGRESS':
+      return {
+        ...state,
+        transfers: {
+          ...state.transfers,
+          [action.payload.taskId]: action.payload
+        }
+      };
+    case 'DATA_FILES_APPLY_LISTING_UPDATE':
+      return applyListingUpdate(state, action.payload);
     case 'DATA_FILES_CLEAR_PROJECT_SELECTION':
       return {
         ...state,
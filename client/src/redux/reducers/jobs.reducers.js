@@ -59,6 +59,11 @@ export function jobs(state = initialState, action) {
         ...state,
         submit: { submitting: false }
       };
+    case 'SUBMIT_JOB_STAGE':
+      return {
+        ...state,
+        submit: { ...state.submit, stage: action.payload }
+      };
     case 'SUBMIT_JOB_SUCCESS':
       return {
         ...state,
@@ -1,4 +1,4 @@
-import {systems as datafilesReducer,  initialSystemState } from "../datafiles.reducers";
+import {systems as datafilesReducer,  initialSystemState, files as filesReducer, initialFilesState } from "../datafiles.reducers";
 import systemDefinitionFixture from '../../sagas/fixtures/systemDefinition.fixture';
 
 describe("Datafiles Reducer", () => {
@@ -24,3 +24,41 @@ describe("Datafiles Reducer", () => {
     });
   });
 });
+
+describe("Files Reducer", () => {
+  test("Apply listing update to matching section", () => {
+    const state = {
+      ...initialFilesState,
+      params: {
+        ...initialFilesState.params,
+        FilesListing: { api: 'tapis', scheme: 'community', system: 'test.system', path: 'dir/' }
+      },
+      listing: {
+        ...initialFilesState.listing,
+        FilesListing: [
+          { path: '/dir/a', length: 1 },
+          { path: '/dir/b', length: 1 }
+        ]
+      },
+      selected: { FilesListing: [0] }
+    };
+    const action = {
+      type: 'DATA_FILES_APPLY_LISTING_UPDATE',
+      payload: {
+        event_type: 'listing_update',
+        system: 'test.system',
+        path: '/dir',
+        added: [{ path: '/dir/c', length: 1 }],
+        removed: ['/dir/a'],
+        modified: [{ path: '/dir/b', length: 2 }]
+      }
+    };
+    const newState = filesReducer(state, action);
+    expect(newState.listing.FilesListing).toEqual([
+      { path: '/dir/b', length: 2 },
+      { path: '/dir/c', length: 1 }
+    ]);
+    expect(newState.selected.FilesListing).toEqual([]);
+    expect(newState.listing.modal).toEqual([]);
+  });
+});
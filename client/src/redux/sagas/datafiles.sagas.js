@@ -292,66 +292,76 @@ export function* renameFile(action) {
   }
 }
 
-export async function moveFileUtil(
-  api,
-  scheme,
-  system,
-  path,
-  destSystem,
-  destPath
-) {
-  const url = `/api/datafiles/${api}/move/${scheme}/${system}${path}/`;
+export async function batchUtil(api, scheme, operation, items) {
+  const url = `/api/datafiles/${api}/batch/${scheme}/`;
   const request = await fetch(url, {
     method: 'PUT',
     headers: { 'X-CSRFToken': Cookies.get('csrftoken') },
     credentials: 'same-origin',
-    body: JSON.stringify({ dest_system: destSystem, dest_path: destPath })
+    body: JSON.stringify({ operation, items })
   });
   if (!request.ok) {
     throw new Error(request.status);
   }
-  return request.data;
-}
-
-export function* watchMove() {
-  yield takeLeading('DATA_FILES_MOVE', moveFiles);
+  const response = await request.json();
+  return response.data;
 }
 
-export function* moveFile(src, dest, index) {
-  yield put({
-    type: 'DATA_FILES_SET_OPERATION_STATUS_BY_KEY',
-    payload: { status: 'RUNNING', key: index, operation: 'move' }
-  });
+/**
+ * Run an operation on many files in a single request, setting the status of
+ * each file from its result.
+ * @param {string} operation - move, copy or trash
+ * @param {Object[]} files - Selected files
+ * @param {Function} toItem - Maps a file to a batch item
+ */
+export function* batchFiles(operation, files, toItem) {
+  yield all(
+    files.map(file =>
+      put({
+        type: 'DATA_FILES_SET_OPERATION_STATUS_BY_KEY',
+        payload: { status: 'RUNNING', key: file.id, operation }
+      })
+    )
+  );
+  let results;
   try {
-    yield call(
-      moveFileUtil,
+    results = yield call(
+      batchUtil,
       'tapis',
       'private',
-      src.system,
-      src.path,
-      dest.system,
-      dest.path,
-      index
+      operation,
+      files.map(toItem)
     );
-    yield put({
-      type: 'DATA_FILES_SET_OPERATION_STATUS_BY_KEY',
-      payload: { status: 'SUCCESS', key: index, operation: 'move' }
-    });
   } catch (e) {
-    yield put({
-      type: 'DATA_FILES_SET_OPERATION_STATUS_BY_KEY',
-      payload: { status: 'ERROR', key: index, operation: 'move' }
-    });
+    results = files.map(() => ({ status: 'error' }));
   }
+  yield all(
+    files.map((file, i) =>
+      put({
+        type: 'DATA_FILES_SET_OPERATION_STATUS_BY_KEY',
+        payload: {
+          status: results[i].status === 'success' ? 'SUCCESS' : 'ERROR',
+          key: file.id,
+          operation
+        }
+      })
+    )
+  );
+}
+
+export function* watchMove() {
+  yield takeLeading('DATA_FILES_MOVE', moveFiles);
 }
+
 export function* moveFiles(action) {
   const { dest } = action.payload;
-  const moveCalls = action.payload.src.map(file => {
-    return call(moveFile, file, dest, file.id);
-  });
-
   yield race({
-    result: all(moveCalls),
+    result: call(batchFiles, 'move', action.payload.src, file => ({
+      system: file.system,
+      path: file.path,
+      dest_system: dest.system,
+      dest_path: dest.path
+    })),
     cancel: take('DATA_FILES_MODAL_CLOSE')
   });
 
@@ -446,6 +456,22 @@ export function* copyFile(src, dest, index) {
 }
 export function* copyFiles(action) {
   const { dest } = action.payload;
+  if (
+    dest.api === 'tapis' &&
+    action.payload.src.every(f => f.api === 'tapis')
+  ) {
+    yield race({
+      result: call(batchFiles, 'copy', action.payload.src, file => ({
+        system: file.system,
+        path: file.path,
+        dest_system: dest.system,
+        dest_path: dest.path
+      })),
+      cancel: take('DATA_FILES_MODAL_CLOSE')
+    });
+    yield call(action.payload.reloadCallback);
+    return;
+  }
   const copyCalls = action.payload.src.map(file => {
     return call(copyFile, file, dest, file.id);
   });
@@ -719,56 +745,21 @@ export function* download(action) {
   );
 }
 
-export async function trashUtil(api, scheme, system, path) {
-  const url = `/api/datafiles/${api}/trash/${scheme}/${system}${path}/`;
-  const request = await fetch(url, {
-    method: 'PUT',
-    headers: { 'X-CSRFToken': Cookies.get('csrftoken') },
-    credentials: 'same-origin',
-    body: JSON.stringify({})
-  });
-
-  if (!request.ok) {
-    throw new Error(request.status);
-  }
-  return request;
-}
-
 export function* watchTrash() {
   yield takeLeading('DATA_FILES_TRASH', trashFiles);
 }
 
 export function* trashFiles(action) {
-  const trashCalls = action.payload.src.map(file => {
-    return call(trashFile, file.system, file.path, file.id);
-  });
   yield race({
-    result: all(trashCalls),
+    result: call(batchFiles, 'trash', action.payload.src, file => ({
+      system: file.system,
+      path: file.path
+    })),
     cancel: take('DATA_FILES_MODAL_CLOSE')
   });
   yield call(action.payload.reloadCallback);
 }
 
-export function* trashFile(system, path, id) {
-  yield put({
-    type: 'DATA_FILES_SET_OPERATION_STATUS_BY_KEY',
-    payload: { status: 'RUNNING', key: id, operation: 'trash' }
-  });
-  try {
-    yield call(trashUtil, 'tapis', 'private', system, path);
-
-    yield put({
-      type: 'DATA_FILES_SET_OPERATION_STATUS_BY_KEY',
-      payload: { status: 'SUCCESS', key: id, operation: 'trash' }
-    });
-  } catch (e) {
-    yield put({
-      type: 'DATA_FILES_SET_OPERATION_STATUS_BY_KEY',
-      payload: { status: 'ERROR', key: id, operation: 'trash' }
-    });
-  }
-}
-
 export const getLatestApp = async name => {
   const res = await fetchUtil({
     url: '/api/workspace/apps',
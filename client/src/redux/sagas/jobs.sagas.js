@@ -1,9 +1,20 @@
-import { put, takeLatest, takeLeading, call, select } from 'redux-saga/effects';
+import {
+  put,
+  takeLatest,
+  takeLeading,
+  call,
+  select,
+  race,
+  take,
+  delay
+} from 'redux-saga/effects';
 import Cookies from 'js-cookie';
+import { v4 as uuidv4 } from 'uuid';
 import { fetchUtil } from 'utils/fetchUtil';
 import { fetchAppDefinitionUtil } from './apps.sagas';
 
 const LIMIT = 50;
+const SUBMISSION_POLL_INTERVAL = 5000;
 
 export async function fetchJobs(offset, limit) {
   const result = await fetchUtil({
@@ -51,34 +62,74 @@ export async function postSubmitJobUtil(jobPayload) {
     method: 'POST',
     headers: {
       'Content-Type': 'application/json',
-      'X-CSRFToken': Cookies.get('csrftoken')
+      'X-CSRFToken': Cookies.get('csrftoken'),
+      'Idempotency-Key': uuidv4()
     },
     body: JSON.stringify(jobPayload)
   });
   return result;
 }
 
+export async function fetchJobSubmissionUtil(ticket) {
+  const result = await fetchUtil({
+    url: '/api/workspace/jobs/',
+    params: { ticket }
+  });
+  return result.response;
+}
+
+/**
+ * Follow a job submission through its stages until it is done. Stages are
+ * pushed over the notifications socket, and polled for in case an update
+ * is missed.
+ * @param {Object} submission - submission ticket
+ */
+export function* waitForJobSubmission(submission) {
+  let current = submission;
+  while (!current.done) {
+    yield put({ type: 'SUBMIT_JOB_STAGE', payload: current.stage });
+    const { update } = yield race({
+      update: take(
+        action =>
+          action.type === 'JOB_SUBMISSION_UPDATE' &&
+          action.payload.ticket === current.ticket
+      ),
+      poll: delay(SUBMISSION_POLL_INTERVAL)
+    });
+    current = update
+      ? update.payload
+      : yield call(fetchJobSubmissionUtil, current.ticket);
+  }
+  return current;
+}
+
 export function* submitJob(action) {
   yield put({ type: 'FLUSH_SUBMIT' });
   yield put({ type: 'TOGGLE_SUBMITTING' });
   try {
     const res = yield call(postSubmitJobUtil, action.payload);
-    if (res.response.execSys) {
+    const submission = yield call(waitForJobSubmission, res.response);
+    if (submission.stage === 'keys_required') {
       yield put({
         type: 'SYSTEMS_TOGGLE_MODAL',
         payload: {
           operation: 'pushKeys',
           props: {
             onSuccess: { type: 'SUBMIT_JOB', payload: action.payload },
-            system: res.response.execSys
+            system: submission.response.execSys
           }
         }
       });
       yield put({ type: 'TOGGLE_SUBMITTING' });
+    } else if (submission.stage === 'failed') {
+      yield put({
+        type: 'SUBMIT_JOB_ERROR',
+        payload: { message: submission.message }
+      });
     } else {
       yield put({
         type: 'SUBMIT_JOB_SUCCESS',
-        payload: res.response
+        payload: submission.response
       });
     }
   } catch (error) {
@@ -11,7 +11,8 @@ import {
   getJobDetails,
   postSubmitJobUtil,
   watchJobDetails,
-  submitJob
+  submitJob,
+  waitForJobSubmission
 } from './jobs.sagas';
 import { fetchAppDefinitionUtil } from './apps.sagas';
 import executionSystemDetailFixture from './fixtures/executionsystemdetail.fixture';
@@ -83,7 +84,11 @@ describe('submitJob Saga', () => {
       .provide([
         [
           matchers.call.fn(postSubmitJobUtil),
-          { response: jobDetailFixture } /* TODO: fix response */
+          { response: { ticket: 'ticket', stage: 'queued', done: false } }
+        ],
+        [
+          matchers.call.fn(waitForJobSubmission),
+          { stage: 'submitted', done: true, response: jobDetailFixture }
         ]
       ])
       .put({ type: 'FLUSH_SUBMIT' })
@@ -112,7 +117,15 @@ describe('submitJob Saga', () => {
       .provide([
         [
           matchers.call.fn(postSubmitJobUtil),
-          { response: { execSys: executionSystemDetailFixture } }
+          { response: { ticket: 'ticket', stage: 'queued', done: false } }
+        ],
+        [
+          matchers.call.fn(waitForJobSubmission),
+          {
+            stage: 'keys_required',
+            done: true,
+            response: { execSys: executionSystemDetailFixture }
+          }
         ]
       ])
       .put({ type: 'FLUSH_SUBMIT' })
@@ -141,3 +154,29 @@ describe('submitJob Saga', () => {
       })
       .run());
 });
+
+describe('waitForJobSubmission Saga', () => {
+  it('should follow a submission until it is done', () =>
+    expectSaga(waitForJobSubmission, {
+      ticket: 'ticket',
+      stage: 'queued',
+      done: false
+    })
+      .withReducer(jobsReducer)
+      .put({ type: 'SUBMIT_JOB_STAGE', payload: 'queued' })
+      .dispatch({
+        type: 'JOB_SUBMISSION_UPDATE',
+        payload: { ticket: 'other', stage: 'submitted', done: true }
+      })
+      .dispatch({
+        type: 'JOB_SUBMISSION_UPDATE',
+        payload: { ticket: 'ticket', stage: 'submit', done: false }
+      })
+      .dispatch({
+        type: 'JOB_SUBMISSION_UPDATE',
+        payload: { ticket: 'ticket', stage: 'submitted', done: true }
+      })
+      .put({ type: 'SUBMIT_JOB_STAGE', payload: 'submit' })
+      .returns({ ticket: 'ticket', stage: 'submitted', done: true })
+      .run());
+});
@@ -50,6 +50,18 @@ export function* handleSocket(action) {
     case 'data_files':
       yield put({ type: 'ADD_TOAST', payload: action });
       break;
+    case 'listing_update':
+      yield put({ type: 'DATA_FILES_APPLY_LISTING_UPDATE', payload: action });
+      break;
+    case 'apps_tray_update':
+      yield put({ type: 'APPS_TRAY_UPDATE', payload: action });
+      break;
+    case 'transfer_progress':
+      yield put({ type: 'DATA_FILES_SET_TRANSFER_PROGRESS', payload: action });
+      break;
+    case 'job_submission':
+      yield put({ type: 'JOB_SUBMISSION_UPDATE', payload: action });
+      break;
     default:
       yield put({ type: 'NEW_NOTIFICATION', payload: action });
       yield put({ type: 'ADD_TOAST', payload: action });
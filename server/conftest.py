@@ -99,7 +99,8 @@ def authenticated_staff(client, staff_user):
 
 @pytest.fixture
 def agave_indexer(mocker):
-    yield mocker.patch('portal.libs.agave.operations.agave_indexer')
+    mocker.patch('portal.libs.agave.operations.move_indexed_files')
+    yield mocker.patch('portal.libs.agave.operations.queue_agave_indexer')
 
 
 @pytest.fixture
@@ -16,6 +16,7 @@ from django.shortcuts import redirect
 from pytas.http import TASClient
 
 from portal.apps.accounts import integrations
+from portal.apps.users.utils import invalidate_user_data
 from portal.apps.accounts import form_fields as forms
 # pylint: disable=invalid-name
 logger = logging.getLogger(__name__)
@@ -142,6 +143,7 @@ def edit_profile(request):
         body['piEligibility'] = tas_user['piEligibility']
         body['source'] = tas_user['source']
         tas.save_user(tas_user['id'], body)
+        invalidate_user_data(user.username)
     elif body['flag'] == 'Optional':
         portal_profile.website = body['website']
         portal_profile.professional_level = body['professional_level']
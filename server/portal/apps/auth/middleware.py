@@ -4,11 +4,16 @@ from requests.exceptions import RequestException, HTTPError
 from django.contrib import auth
 from django.db import transaction
 from django.http import HttpResponse
-from portal.apps.auth.models import AgaveOAuthToken
+from django.conf import settings
+from redis import RedisError
+from portal.apps.auth.models import AgaveOAuthToken, TOKEN_EXPIRY_THRESHOLD
+from portal.libs import cache
 import logging
+import time
 
 # pylint: disable=invalid-name
 logger = logging.getLogger(__name__)
+METRICS = logging.getLogger('metrics.{}'.format(__name__))
 # pylint: enable=invalid-name
 
 
@@ -18,7 +23,62 @@ def get_user(request):
     return request._cached_user
 
 
+def _expiry_key(username):
+    return 'agave-token:valid:{}'.format(username)
+
+
+def _cache_expiry(agave_oauth):
+    """Remember that a token is valid until its refresh window opens."""
+    valid_for = int(agave_oauth.created + agave_oauth.expires_in - time.time() - TOKEN_EXPIRY_THRESHOLD)
+    if valid_for > 0:
+        cache.get_redis().set(_expiry_key(agave_oauth.user.username), 1, ex=valid_for)
+
+
+def _refresh(user):
+    """Refresh a user's token if it is expired, holding a row lock."""
+    with transaction.atomic():
+        agave_oauth = AgaveOAuthToken.objects.filter(user=user).select_for_update().get()
+        if agave_oauth.expired:
+            start = time.time()
+            try:
+                agave_oauth.client.token.refresh()
+            except HTTPError:
+                raise Exception(
+                    'Agave Token refresh failed; Forcing logout for {}'.format(user.username)
+                )
+            METRICS.info("user:{} op:token_refresh elapsed:{:.3f}".format(user.username, time.time() - start))
+    return agave_oauth
+
+
+def _refresh_once(user):
+    """Refresh a user's token, sharing the refresh between concurrent requests.
+
+    The first request inside the refresh window takes a Redis lock and
+    refreshes; requests arriving meanwhile wait for it to finish instead of
+    queueing on the row lock.
+    """
+    redis_client = cache.get_redis()
+    lock_key = 'agave-token:refresh:{}'.format(user.username)
+    if redis_client.set(lock_key, 1, nx=True, ex=settings.PORTAL_TOKEN_REFRESH_LOCK_TIMEOUT):
+        try:
+            _cache_expiry(_refresh(user))
+        finally:
+            redis_client.delete(lock_key)
+        return
+
+    deadline = time.time() + settings.PORTAL_TOKEN_REFRESH_LOCK_TIMEOUT
+    while time.time() < deadline and redis_client.exists(lock_key):
+        time.sleep(0.05)
+
+
 class AgaveTokenRefreshMiddleware(object):
+    """Refresh the user's Tapis token when it is about to expire.
+
+    Tokens known to be valid are remembered in Redis until their refresh
+    window, so most requests don't touch the database. A row lock is only
+    taken to refresh, and concurrent requests share a single refresh.
+    """
+
     def __init__(self, get_response):
         self.get_response = get_response
 
@@ -27,15 +87,7 @@ class AgaveTokenRefreshMiddleware(object):
         try:
             if request.path != '/logout/' and user.is_authenticated:
                 try:
-                    with transaction.atomic():
-                        agave_oauth = AgaveOAuthToken.objects.filter(user=user).select_for_update().get()
-                        if agave_oauth.expired:
-                            try:
-                                agave_oauth.client.token.refresh()
-                            except HTTPError:
-                                raise Exception(
-                                    'Agave Token refresh failed; Forcing logout for {}'.format(user.username)
-                                )
+                    self.check_token(user)
                 except ObjectDoesNotExist:
                     raise Exception('Authenticated user {} missing Agave API Token'.format(user.username))
                 except RequestException:
@@ -48,3 +100,16 @@ class AgaveTokenRefreshMiddleware(object):
 
         response = self.get_response(request)
         return response
+
+    def check_token(self, user):
+        try:
+            if cache.get_redis().exists(_expiry_key(user.username)):
+                return
+            agave_oauth = AgaveOAuthToken.objects.get(user=user)
+            if not agave_oauth.expired:
+                _cache_expiry(agave_oauth)
+                return
+            _refresh_once(user)
+        except RedisError:
+            logger.warning('Unable to check the token cache for %s', user.username)
+            _refresh(user)
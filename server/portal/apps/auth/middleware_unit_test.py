@@ -2,7 +2,9 @@ from django.test import (
     TransactionTestCase,
     RequestFactory
 )
+import time
 from mock import patch, MagicMock
+from redis import RedisError
 from portal.apps.auth.middleware import AgaveTokenRefreshMiddleware
 from requests.exceptions import RequestException, HTTPError
 from django.core.exceptions import ObjectDoesNotExist
@@ -31,12 +33,17 @@ class TestAgaveOAuthMiddleware(TransactionTestCase):
         )
 
         # Mock the atomically retrieved AgaveOAuthToken object
-        self.mock_agave_oauth = MagicMock()
+        self.mock_agave_oauth = MagicMock(created=time.time(), expires_in=14400)
         self.AgaveOAuthToken_patcher = patch('portal.apps.auth.middleware.AgaveOAuthToken.objects')
         self.mock_AgaveOAuthToken = self.AgaveOAuthToken_patcher.start()
+        self.mock_AgaveOAuthToken.get.return_value = self.mock_agave_oauth
         self.mock_AgaveOAuthToken.filter.return_value.select_for_update.return_value.get.return_value = \
             self.mock_agave_oauth
 
+        self.cache_patcher = patch('portal.apps.auth.middleware.cache')
+        self.mock_redis = self.cache_patcher.start().get_redis.return_value
+        self.mock_redis.exists.return_value = False
+
         self.mock_get_response = MagicMock(return_value="MOCK_RESPONSE")
         self.middleware = AgaveTokenRefreshMiddleware(self.mock_get_response)
 
@@ -44,12 +51,21 @@ class TestAgaveOAuthMiddleware(TransactionTestCase):
         super(TestAgaveOAuthMiddleware, self).tearDown()
         self.get_user_patcher.stop()
         self.AgaveOAuthToken_patcher.stop()
+        self.cache_patcher.stop()
 
     def test_valid_user(self):
         # Test middleware for user that is fully authenticated
         self.mock_agave_oauth.expired = False
         response = self.middleware.__call__(self.request)
         self.assertEquals(response, "MOCK_RESPONSE")
+        self.mock_AgaveOAuthToken.filter.assert_not_called()
+        self.mock_redis.set.assert_called_once()
+
+    def test_cached_valid_user(self):
+        self.mock_redis.exists.return_value = True
+        response = self.middleware.__call__(self.request)
+        self.assertEquals(response, "MOCK_RESPONSE")
+        self.mock_AgaveOAuthToken.get.assert_not_called()
 
     def test_expired_user(self):
         self.mock_agave_oauth.expired = True
@@ -57,6 +73,22 @@ class TestAgaveOAuthMiddleware(TransactionTestCase):
         self.assertEquals(response, "MOCK_RESPONSE")
         self.mock_agave_oauth.client.token.refresh.assert_called_with()
 
+    def test_expired_user_concurrent_refresh(self):
+        self.mock_agave_oauth.expired = True
+        # Another request holds the refresh lock and releases it.
+        self.mock_redis.set.return_value = None
+        self.mock_redis.exists.side_effect = [False, True, False]
+        response = self.middleware.__call__(self.request)
+        self.assertEquals(response, "MOCK_RESPONSE")
+        self.mock_agave_oauth.client.token.refresh.assert_not_called()
+
+    def test_expired_user_without_redis(self):
+        self.mock_agave_oauth.expired = True
+        self.mock_redis.exists.side_effect = RedisError
+        response = self.middleware.__call__(self.request)
+        self.assertEquals(response, "MOCK_RESPONSE")
+        self.mock_agave_oauth.client.token.refresh.assert_called_with()
+
     def test_refresh_error(self):
         self.mock_agave_oauth.expired = True
         self.mock_agave_oauth.client.token.refresh.side_effect = HTTPError
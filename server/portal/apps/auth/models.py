@@ -6,8 +6,9 @@ import requests
 from requests import HTTPError
 from django.db import models
 from django.conf import settings
-from agavepy.agave import Agave
 from agavepy import agave
+from portal.libs.agave import clients
+from portal.libs.agave.clients import PooledAgave
 
 #pylint: disable=invalid-name
 logger = logging.getLogger(__name__)
@@ -87,10 +88,13 @@ class AgaveOAuthToken(models.Model):
     def client(self):
         """Agave client.
 
+        Clients are reused across requests while the access token is
+        current, see :mod:`portal.libs.agave.clients`.
+
         :return: Agave client using refresh token.
         :rtype: :class:Agave
         """
-        return Agave(
+        return clients.get_client(self.user.username, self.access_token, lambda: PooledAgave(
             api_server=getattr(settings, 'AGAVE_TENANT_BASEURL'),
             api_key=getattr(settings, 'AGAVE_CLIENT_KEY'),
             api_secret=getattr(settings, 'AGAVE_CLIENT_SECRET'),
@@ -99,7 +103,7 @@ class AgaveOAuthToken(models.Model):
             refresh_token=self.refresh_token,
             token_callback=self.update,
             token_username=self.user.username
-        )
+        ))
 
     def update(self, **kwargs):
         """Update and save.
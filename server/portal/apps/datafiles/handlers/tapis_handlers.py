@@ -1,4 +1,5 @@
 from portal.libs.agave import operations
+from django.conf import settings
 from django.core.exceptions import PermissionDenied
 import logging
 
@@ -18,6 +19,10 @@ allowed_actions = {
 def tapis_get_handler(client, scheme, system, path, operation, **kwargs):
     if operation not in allowed_actions[scheme]:
         raise PermissionDenied
+    # Indexed listings skip Tapis permission checks, so only the scheme decides.
+    kwargs.pop('indexed', None)
+    if operation == 'listing':
+        kwargs['indexed'] = scheme in settings.PORTAL_INDEXED_LISTING_SCHEMES
     op = getattr(operations, operation)
     return op(client, system, path, **kwargs)
 
@@ -39,3 +44,11 @@ def tapis_put_handler(client, scheme, system,
     op = getattr(operations, operation)
 
     return op(client, system, path, **body)
+
+
+def tapis_batch_handler(client, scheme, operation, items):
+    if operation not in allowed_actions[scheme] or \
+            operation not in operations.BATCH_OPERATIONS:
+        raise PermissionDenied
+
+    return operations.batch(client, operation, items)
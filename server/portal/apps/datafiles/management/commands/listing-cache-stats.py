@@ -0,0 +1,30 @@
+"""Management command."""
+
+from django.core.management.base import BaseCommand
+from portal.libs import cache
+from portal.libs.agave import listing_cache
+
+
+class Command(BaseCommand):
+    """Show Tapis listing cache hit/miss counters.
+
+    Examples:
+
+        >>> ./manage.py listing-cache-stats
+
+        Reset the counters after reading them:
+
+        >>> ./manage.py listing-cache-stats --reset
+
+    """
+    help = 'Show how many Tapis listings were served from the listing cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', help='Reset the counters after printing them.',
+                            default=False, action='store_true')
+
+    def handle(self, *args, **options):
+        stats = listing_cache.stats()
+        self.stdout.write('hits: {hits}\nmisses: {misses}\nhit rate: {hitRate}'.format(**stats))
+        if options.get('reset'):
+            cache.reset_stats(listing_cache.CACHE_NAME)
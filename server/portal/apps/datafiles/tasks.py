@@ -0,0 +1,93 @@
+import json
+import logging
+import os
+import time
+from celery import shared_task
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from portal.apps.datafiles.utils import get_client, notify
+from portal.libs.transfer.operations import (transfer, transfer_folder,
+                                             TransferState, TransferStats)
+
+logger = logging.getLogger(__name__)
+METRICS = logging.getLogger('metrics.{}'.format(__name__))
+
+
+def _push_transfer_progress(username, task_id, progress):
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+    body = json.loads(json.dumps(dict(progress, event_type='transfer_progress', taskId=task_id),
+                                 cls=DjangoJSONEncoder))
+    async_to_sync(get_channel_layer().group_send)(
+        username,
+        {
+            'type': 'portal_notification',
+            'body': body
+        }
+    )
+
+
+@shared_task(bind=True, max_retries=3, queue='files')
+def transfer_files(self, username, filetype, body):
+    """Copy a file or folder between APIs for a user.
+
+    Progress is reported as the task's ``PROGRESS`` state and pushed to the
+    user as ``transfer_progress`` events. Files already copied are recorded in
+    Redis under the task ID, so a retry only copies what is left.
+
+    :param str username: User making the transfer.
+    :param str filetype: ``'dir'`` or ``'file'``.
+    :param dict body: Transfer parameters, as sent to
+        :class:`~portal.apps.datafiles.views.TransferFilesView`.
+    """
+    user = get_user_model().objects.get(username=username)
+    src_client = get_client(user, body['src_api'])
+    dest_client = get_client(user, body['dest_api'])
+    stats = TransferStats()
+    state = TransferState('transfer:{}'.format(self.request.id))
+    last_progress = [0]
+
+    def on_progress(stats):
+        now = time.time()
+        if now - last_progress[0] < settings.PORTAL_TRANSFER_PROGRESS_INTERVAL:
+            return
+        last_progress[0] = now
+        progress = stats.to_dict()
+        self.update_state(state='PROGRESS', meta=progress)
+        try:
+            _push_transfer_progress(username, self.request.id, progress)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Error sending transfer progress to %s', username)
+
+    try:
+        if filetype == 'dir':
+            transfer_folder(src_client, dest_client, **body, stats=stats, state=state,
+                            on_progress=on_progress,
+                            src_client_factory=lambda: get_client(user, body['src_api']),
+                            dest_client_factory=lambda: get_client(user, body['dest_api']))
+        else:
+            transfer(src_client, dest_client, **body, stats=stats)
+    except Exception as exc:
+        logger.exception('Error transferring files for %s: %s', username, body)
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc, countdown=2 ** self.request.retries * 10)
+        state.clear()
+        notify(username, 'copy', 'error', {})
+        raise
+
+    state.clear()
+    result = stats.to_dict()
+    METRICS.info("user:{} op:transfer src_api:{} dest_api:{} filetype:{} "
+                 "files:{} bytes:{} elapsed:{} bytesPerSec:{}".format(
+                     username, body['src_api'], body['dest_api'], filetype,
+                     result['files'], result['bytes'], result['elapsed'], result['bytesPerSec']))
+    # Respond with tapis-like info for a toast notification
+    file_info = {
+        'nativeFormat': filetype,
+        'name': body['dirname'],
+        'path': os.path.join(body['dest_path_name'], body['dirname']),
+        'systemId': body['dest_system']
+    }
+    notify(username, 'copy', 'success', {'response': file_info})
+    return result
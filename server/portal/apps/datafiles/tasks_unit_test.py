@@ -0,0 +1,50 @@
+import pytest
+from portal.apps.datafiles.tasks import transfer_files
+from portal.libs.transfer.operations import TransferStats
+
+
+@pytest.fixture
+def transfer_body():
+    yield {
+        'src_api': 'tapis',
+        'dest_api': 'googledrive',
+        'src_system': 'src.system',
+        'dest_system': 'googledrive',
+        'src_path': '/src/dir',
+        'dest_path': 'root',
+        'dest_path_name': '/',
+        'dirname': 'dir'
+    }
+
+
+@pytest.fixture
+def mock_transfer(mocker):
+    mocker.patch('portal.apps.datafiles.tasks.get_client')
+    mocker.patch('portal.apps.datafiles.tasks.TransferState')
+    yield mocker.patch('portal.apps.datafiles.tasks.transfer_folder')
+
+
+def test_transfer_files(regular_user, mocker, mock_transfer, transfer_body):
+    mock_notify = mocker.patch('portal.apps.datafiles.tasks.notify')
+
+    result = transfer_files.apply(args=['username', 'dir', transfer_body]).get()
+
+    assert isinstance(mock_transfer.call_args[1]['stats'], TransferStats)
+    assert result['files'] == 0
+    mock_notify.assert_called_once_with('username', 'copy', 'success', {'response': {
+        'nativeFormat': 'dir',
+        'name': 'dir',
+        'path': '/dir',
+        'systemId': 'googledrive'
+    }})
+
+
+def test_transfer_files_error(regular_user, mocker, mock_transfer, transfer_body):
+    mock_notify = mocker.patch('portal.apps.datafiles.tasks.notify')
+    mock_transfer.side_effect = Exception('transfer failed')
+    mocker.patch.object(transfer_files, 'max_retries', 0)
+
+    with pytest.raises(Exception):
+        transfer_files.apply(args=['username', 'dir', transfer_body]).get()
+
+    mock_notify.assert_called_once_with('username', 'copy', 'error', {})
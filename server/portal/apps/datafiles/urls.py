@@ -1,5 +1,6 @@
 from django.urls import path
 from portal.apps.datafiles.views import (TapisFilesView,
+                                         TapisBatchView,
                                          GoogleDriveFilesView,
                                          TransferFilesView,
                                          LinkView,
@@ -12,6 +13,7 @@ urlpatterns = [
     path('systems/list/', SystemListingView.as_view()),
     path('transfer/<str:filetype>/', TransferFilesView.as_view()),
     path('systems/definition/<str:systemId>/', SystemDefinitionView.as_view()),
+    path('tapis/batch/<str:scheme>/', TapisBatchView.as_view()),
     path('tapis/<str:operation>/<str:scheme>/<str:system>/',
          TapisFilesView.as_view()),
     path('tapis/<str:operation>/<str:scheme>/<str:system>/<path:path>/',
@@ -19,3 +19,14 @@ def notify(username, operation, status, extra):
         Notification.READ: True
     }
     Notification.objects.create(**event_data)
+
+
+def get_client(user, api):
+    client_mappings = {
+        'tapis': 'agave_oauth',
+        'shared': 'agave_oauth',
+        'googledrive': 'googledrive_user_token',
+        'box': 'box_user_token',
+        'dropbox': 'dropbox_user_token'
+    }
+    return getattr(user, client_mappings[api]).client
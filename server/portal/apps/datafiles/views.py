@@ -1,6 +1,5 @@
 import json
 import logging
-import os
 from portal.apps.accounts.managers.user_systems import UserSystemsManager
 from portal.apps.users.utils import get_allocations
 from portal.apps.auth.tasks import get_user_storage_systems
@@ -12,16 +11,17 @@ from portal.views.base import BaseApiView
 from portal.libs.agave.utils import service_account
 from portal.apps.datafiles.handlers.tapis_handlers import (tapis_get_handler,
                                                            tapis_put_handler,
-                                                           tapis_post_handler)
+                                                           tapis_post_handler,
+                                                           tapis_batch_handler)
 from portal.apps.datafiles.handlers.googledrive_handlers import \
     (googledrive_get_handler,
      googledrive_put_handler)
-from portal.libs.transfer.operations import transfer, transfer_folder
+from portal.apps.datafiles.tasks import transfer_files
 from portal.exceptions.api import ApiException
 from portal.apps.datafiles.models import Link
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
-from .utils import notify, NOTIFY_ACTIONS
+from .utils import get_client, notify, NOTIFY_ACTIONS
 
 logger = logging.getLogger(__name__)
 METRICS = logging.getLogger('metrics.{}'.format(__name__))
@@ -164,6 +164,44 @@ class TapisFilesView(BaseApiView):
         return JsonResponse({"data": response})
 
 
+class TapisBatchView(BaseApiView):
+    """Run one operation on many files.
+
+    Expects a body like ``{"operation": "move", "items": [{"system": ...,
+    "path": ..., "dest_system": ..., "dest_path": ...}]}`` and responds with
+    one result per item.
+    """
+
+    def put(self, request, scheme=None):
+        body = json.loads(request.body)
+        operation = body.get('operation')
+        items = body.get('items', [])
+        try:
+            client = request.user.agave_oauth.client
+        except AttributeError:
+            return HttpResponseForbidden()
+
+        METRICS.info("user:{} op:batch-{} api:tapis scheme:{} "
+                     "items:{}".format(request.user.username,
+                                       operation,
+                                       scheme,
+                                       len(items)))
+        try:
+            results = tapis_batch_handler(client, scheme, operation, items)
+        except Exception as exc:
+            operation in NOTIFY_ACTIONS and notify(request.user.username, operation, 'error', {})
+            raise exc
+
+        # One toast per batch rather than one per file.
+        succeeded = [result['response'] for result in results if result['status'] == 'success']
+        if succeeded:
+            notify(request.user.username, operation, 'success', {'response': succeeded[-1]})
+        if len(succeeded) < len(results):
+            notify(request.user.username, operation, 'error', {})
+
+        return JsonResponse({"data": results})
+
+
 class GoogleDriveFilesView(BaseApiView):
     def get(self, request, operation=None, scheme=None, system=None,
             path='root'):
@@ -200,43 +238,22 @@ class GoogleDriveFilesView(BaseApiView):
         return JsonResponse({"data": response})
 
 
-def get_client(user, api):
-    client_mappings = {
-        'tapis': 'agave_oauth',
-        'shared': 'agave_oauth',
-        'googledrive': 'googledrive_user_token',
-        'box': 'box_user_token',
-        'dropbox': 'dropbox_user_token'
-    }
-    return getattr(user, client_mappings[api]).client
-
-
 class TransferFilesView(BaseApiView):
     def put(self, request, filetype):
         body = json.loads(request.body)
 
-        src_client = get_client(request.user, body['src_api'])
-        dest_client = get_client(request.user, body['dest_api'])
-
+        # Fail early if the user isn't connected to either API.
         try:
-            if filetype == 'dir':
-                transfer_folder(src_client, dest_client, **body)
-            else:
-                transfer(src_client, dest_client, **body)
-
-            # Respond with tapis-like info for a toast notification
-            file_info = {
-                'nativeFormat': filetype,
-                'name': body['dirname'],
-                'path': os.path.join(body['dest_path_name'], body['dirname']),
-                'systemId': body['dest_system']
-            }
-            notify(request.user.username, 'copy', 'success', {'response': file_info})
-            return JsonResponse({'success': True})
-        except Exception as exc:
-            logger.info(exc)
-            notify(request.user.username, 'copy', 'error', {})
-            raise exc
+            get_client(request.user, body['src_api'])
+            get_client(request.user, body['dest_api'])
+        except AttributeError:
+            return HttpResponseForbidden()
+
+        METRICS.info("user:{} op:transfer filetype:{} body:{}".format(request.user.username,
+                                                                      filetype,
+                                                                      body))
+        task = transfer_files.apply_async(args=[request.user.username, filetype, body])
+        return JsonResponse({'success': True, 'taskId': task.id})
 
 
 @method_decorator(login_required, name='dispatch')
@@ -200,6 +200,17 @@ def test_tapis_file_view_get_is_logged_for_metrics(client, authenticated_user, m
             authenticated_user.username))
 
 
+def test_tapis_file_view_get_ignores_indexed_param(client, authenticated_user, mock_agave_client,
+                                                   agave_file_listing_mock, agave_listing_indexer, mocker):
+    mock_indexed_listing = mocker.patch('portal.libs.agave.operations.indexed_listing')
+    mock_agave_client.files.list.return_value = agave_file_listing_mock
+    response = client.get("/api/datafiles/tapis/listing/private/frontera.home.username/?indexed=1")
+    assert response.status_code == 200
+    assert response.json() == {"data": {"listing": agave_file_listing_mock, "reachedEnd": True}}
+    mock_indexed_listing.assert_not_called()
+    mock_agave_client.files.list.assert_called()
+
+
 def test_tapis_file_view_put_is_logged_for_metrics(client, authenticated_user, mock_agave_client,
                                                    agave_indexer, logging_metric_mock):
     mock_response = {'nativeFormat': 'dir'}
@@ -274,3 +285,30 @@ def test_tapis_file_view_preview_other_text_file(client, authenticated_user, moc
                           data={"href": "https//tapis.example/href"})
     assert response.status_code == 200
     assert response.json() == {"data": {"href": POSTIT_HREF, "fileType": "other", "content": "file content", "error": None}}
+
+
+def test_tapis_batch(client, authenticated_user, mocker):
+    mock_batch = mocker.patch('portal.libs.agave.operations.batch')
+    mock_batch.return_value = [{'status': 'success', 'response': {'nativeFormat': 'raw', 'path': '/dest/a'}},
+                               {'status': 'error', 'message': 'failed'}]
+    items = [{'system': 'test.system', 'path': '/a', 'dest_system': 'test.system', 'dest_path': '/dest'},
+             {'system': 'test.system', 'path': '/b', 'dest_system': 'test.system', 'dest_path': '/dest'}]
+
+    response = client.put('/api/datafiles/tapis/batch/private/',
+                          content_type='application/json',
+                          data={'operation': 'move', 'items': items})
+
+    assert response.status_code == 200
+    assert response.json()['data'] == mock_batch.return_value
+    assert Notification.objects.filter(operation='move').count() == 2
+
+
+def test_tapis_batch_not_allowed(client, authenticated_user, mocker):
+    mock_batch = mocker.patch('portal.libs.agave.operations.batch')
+
+    response = client.put('/api/datafiles/tapis/batch/community/',
+                          content_type='application/json',
+                          data={'operation': 'move', 'items': []})
+
+    assert response.status_code == 403
+    mock_batch.assert_not_called()
@@ -67,17 +67,13 @@ class JupyterMountsApiView(BaseApiView):
         result = []
         names = []
         for project in projects:
-            name = project.description
+            name = project['description']
             # Resolve project name collisions
             if any([existing == name for existing in names]):
-                name = "{name} ({id})".format(name=project.description, id=project.storage.id)
+                name = "{name} ({id})".format(name=project['description'], id=project['id'])
             names.append(name)
 
-            # Find a matching role, or return None
-            role = next(
-                (role.role for role in project.roles.roles if role.username == user.username),
-                None
-            )
+            role = project['role']
             if role == "OWNER" or role == "ADMIN":
                 permissions = "rw"
             elif role == "GUEST":
@@ -87,7 +83,7 @@ class JupyterMountsApiView(BaseApiView):
 
             result.append(
                 {
-                    "path": project.absolute_path,
+                    "path": project['absolutePath'],
                     "mountPath": "/{namespace}/My Projects/{name}".format(
                         namespace=settings.PORTAL_NAMESPACE,
                         name=name),
@@ -1,4 +1,3 @@
-from mock import MagicMock
 import pytest
 import json
 
@@ -25,30 +24,18 @@ def mock_manager(mocker):
 @pytest.fixture
 def mock_projects(mocker):
     mock = mocker.patch('portal.apps.jupyter_mounts.api.views.ProjectsManager')
-    project1 = MagicMock()
-    project1.description = "test"
-    project1.storage = MagicMock(id="cep.project-1")
-    project1.absolute_path = "/projects/cep.project-1"
-    project1.roles = MagicMock(
-        roles=[
-            MagicMock(
-                role="ADMIN",
-                username="username"
-            )
-        ]
-    )
-    project2 = MagicMock()
-    project2.description = "test"
-    project2.storage = MagicMock(id="cep.project-2")
-    project2.absolute_path = "/projects/cep.project-2"
-    project2.roles = MagicMock(
-        roles=[
-            MagicMock(
-                role="GUEST",
-                username="username"
-            )
-        ]
-    )
+    project1 = {
+        'description': "test",
+        'id': "cep.project-1",
+        'absolutePath': "/projects/cep.project-1",
+        'role': "ADMIN"
+    }
+    project2 = {
+        'description': "test",
+        'id': "cep.project-2",
+        'absolutePath': "/projects/cep.project-2",
+        'role': "USER"
+    }
     mock.return_value.list.return_value = [project1, project2]
     yield mock
 
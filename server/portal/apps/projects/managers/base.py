@@ -5,13 +5,17 @@
 """
 from __future__ import unicode_literals, absolute_import
 import logging
+import os
 from future.utils import python_2_unicode_compatible
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Q
+from elasticsearch_dsl import Q as ESQ
 from portal.libs.agave.utils import service_account
 from portal.libs.agave.models.systems.storage import StorageSystem
 from portal.libs.elasticsearch.docs.base import IndexedProject
-from portal.apps.projects.models import Project, ProjectId, ProjectSystemSerializer
+from portal.apps.projects.models import Project, ProjectId, ProjectMetadata, ProjectSystemSerializer
+from portal.apps.projects.utils import project_id_to_system_id
 from portal.apps.projects.serializers import MetadataJSONSerializer
 from portal.apps.projects.models.utils import get_latest_project_storage, get_latest_project_directory
 from django.core.exceptions import ObjectDoesNotExist
@@ -204,29 +208,81 @@ class ProjectsManager(object):
 
         return prj
 
+    def _member_projects(self):
+        """Metadata of every project the user is a part of."""
+        return ProjectMetadata.objects.filter(
+            Q(pi=self.user) | Q(owner=self.user) |
+            Q(co_pis=self.user) | Q(team_members=self.user)
+        ).distinct().select_related('pi')
+
+    def _listing_entry(self, meta, co_pi_ids):
+        """Serialize project metadata like a project storage system.
+
+        :param meta: ProjectMetadata instance.
+        :param set co_pi_ids: Ids of projects where the user is a Co-PI.
+        """
+        if meta.pi_id == self.user.pk:
+            role = 'OWNER'
+        elif meta.pk in co_pi_ids or meta.owner_id == self.user.pk:
+            role = 'ADMIN'
+        else:
+            role = 'USER'
+        owner = None
+        if meta.pi is not None:
+            owner = {
+                'username': meta.pi.username,
+                'first_name': meta.pi.first_name,
+                'last_name': meta.pi.last_name,
+                'email': meta.pi.email
+            }
+        return {
+            'id': project_id_to_system_id(meta.project_id),
+            'name': meta.project_id,
+            'description': meta.title,
+            'absolutePath': os.path.join(settings.PORTAL_PROJECTS_ROOT_DIR, meta.project_id),
+            'lastModified': meta.last_modified.isoformat(),
+            'owner': owner,
+            'role': role,
+            'type': 'STORAGE'
+        }
+
+    def _listing(self, metas):
+        co_pi_ids = set(ProjectMetadata.objects.filter(co_pis=self.user).values_list('pk', flat=True))
+        return [self._listing_entry(meta, co_pi_ids) for meta in metas]
+
     def list(self, offset=0, limit=100):
-        """List projects."""
-        return [prj.storage for prj in Project.listing(
-            self.user.agave_oauth.client,
-            offset=offset,
-            limit=limit
-        )]
+        """List projects.
+
+        Projects are listed from their metadata, most recently modified
+        first. Access to a project's storage system is only checked when
+        the project is opened.
+        """
+        metas = self._member_projects().order_by('-last_modified')[offset:offset + limit]
+        return self._listing(metas)
 
     def search(self, query_string, offset=0, limit=100):
         """Search projects by query string"""
+        username = self.user.username
         search_result = IndexedProject.search()
         search_result = search_result.query("query_string",
                                             query=query_string,
                                             minimum_should_match="80%")
+        search_result = search_result.filter(
+            'bool',
+            should=[ESQ('term', **{field: username}) for field in
+                    ('pi.username', 'owner.username', 'coPIs.username', 'teamMembers.username')],
+            minimum_should_match=1
+        )
+        search_result = search_result.source(['projectId']).extra(from_=offset, size=limit)
 
         search_result = search_result.execute()
-        result_ids = list(map(lambda hit: hit.projectId, search_result))
-
-        project_list = self.list()
-        filtered_list = filter(lambda prj: prj.name in result_ids,
-                               project_list)
+        result_ids = [hit.projectId for hit in search_result]
 
-        return list(filtered_list)
+        # Membership is checked again against the database, in case the index
+        # is behind.
+        metas = {meta.project_id: meta for meta in
+                 self._member_projects().filter(project_id__in=result_ids)}
+        return self._listing(metas[prj_id] for prj_id in result_ids if prj_id in metas)
 
     def apply_permissions(self, project, username, acl):
         """Index project and update acls
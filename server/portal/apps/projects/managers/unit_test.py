@@ -7,8 +7,10 @@ from __future__ import unicode_literals, absolute_import
 import logging
 import os
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from portal.apps.projects.managers.base import ProjectsManager
 from portal.apps.projects.models.base import ProjectId
+from portal.apps.projects.models.metadata import ProjectMetadata
 import pytest
 
 LOGGER = logging.getLogger(__name__)
@@ -38,15 +40,58 @@ def project_manager(mocker, authenticated_user):
     return project
 
 
-def test_search(mocker, authenticated_user, project_manager, mock_index):
-    mock_listing = mocker.patch('portal.apps.projects.managers.base.ProjectsManager.list')
-    mock_listing.return_value = []
-    mock_index.search().query().execute().return_value = []
-    project_manager.search('testquery')
-    assert mock_listing.call_count == 1
+@pytest.fixture()
+def project_metadata(authenticated_user, mock_project_save_signal):
+    other = get_user_model().objects.create_user('other', 'other@test.com', 'password')
+    pi_prj = ProjectMetadata.objects.create(title='PI Project', project_id='PRJ-1', pi=authenticated_user)
+    co_pi_prj = ProjectMetadata.objects.create(title='Co-PI Project', project_id='PRJ-2', pi=other)
+    co_pi_prj.co_pis.add(authenticated_user)
+    member_prj = ProjectMetadata.objects.create(title='Member Project', project_id='PRJ-3', pi=other)
+    member_prj.team_members.add(authenticated_user)
+    ProjectMetadata.objects.create(title='Other Project', project_id='PRJ-4', pi=other)
+    yield [pi_prj, co_pi_prj, member_prj]
+
+
+def test_list(authenticated_user, project_metadata):
+    projects = ProjectsManager(authenticated_user).list()
+    assert sorted((prj['name'], prj['role']) for prj in projects) == [
+        ('PRJ-1', 'OWNER'), ('PRJ-2', 'ADMIN'), ('PRJ-3', 'USER')
+    ]
+    prj = next(prj for prj in projects if prj['name'] == 'PRJ-1')
+    assert prj['id'] == '{}.PRJ-1'.format(settings.PORTAL_PROJECTS_SYSTEM_PREFIX)
+    assert prj['description'] == 'PI Project'
+    assert prj['absolutePath'] == os.path.join(settings.PORTAL_PROJECTS_ROOT_DIR, 'PRJ-1')
+    assert prj['owner']['username'] == authenticated_user.username
+
+
+def test_list_paginates(authenticated_user, project_metadata):
+    mgr = ProjectsManager(authenticated_user)
+    first = mgr.list(offset=0, limit=2)
+    second = mgr.list(offset=2, limit=2)
+    assert len(first) == 2
+    assert len(second) == 1
+    assert {prj['name'] for prj in first + second} == {'PRJ-1', 'PRJ-2', 'PRJ-3'}
+
+
+def test_search(mocker, authenticated_user, project_metadata, mock_index):
+    search = mock_index.search.return_value.query.return_value.filter.return_value
+    search.source.return_value.extra.return_value.execute.return_value = [
+        mocker.MagicMock(projectId='PRJ-3'),
+        mocker.MagicMock(projectId='PRJ-4'),
+        mocker.MagicMock(projectId='PRJ-1')
+    ]
+
+    projects = ProjectsManager(authenticated_user).search('testquery', offset=10, limit=5)
+
+    # Projects the user is not a member of are left out, and hits keep their order.
+    assert [prj['name'] for prj in projects] == ['PRJ-3', 'PRJ-1']
     mock_index.search().query.assert_called_with('query_string',
                                                  query='testquery',
                                                  minimum_should_match="80%")
+    search.source.return_value.extra.assert_called_with(from_=10, size=5)
+    _, kwargs = mock_index.search().query().filter.call_args
+    assert len(kwargs['should']) == 4
+    assert kwargs['minimum_should_match'] == 1
 
 
 def test_add_member_pi(authenticated_user, project_manager, service_account):
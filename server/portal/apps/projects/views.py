@@ -47,36 +47,18 @@ class ProjectsApiView(BaseApiView):
         ```json
         {"response": [{
             "absolutePath": "/corral-repl/tacc/aci/CEP/projects/CEP-7",
-            "available": true,
-            "default": false,
             "description": "Project Title",
-            "globalDefault": false,
             "id": "cep.project.CEP-7",
+            "lastModified": "2021-03-12T17:43:00.000000+00:00",
             "name": "CEP-7",
-            "owner": null,
-            "public": false,
-            "revision": null,
-            "site": null,
-            "status": "UP",
-            "storage": {
-                "auth": {
-                    "password": null,
-                    "privateKey": null,
-                    "publicKey": null,
-                    "type": null,
-                    "username": null
-                },
-                "homeDir": null,
-                "host": null,
-                "mirror": false,
-                "port": null,
-                "protocol": null,
-                "proxy": null,
-                "publicAppsDir": null,
-                "rootDir": null
+            "owner": {
+                "username": "username",
+                "first_name": "First",
+                "last_name": "Last",
+                "email": "user@example.com"
             },
-            "type": "STORAGE",
-            "uuid": null
+            "role": "OWNER",
+            "type": "STORAGE"
         }, ... ],
         "status": 200
         }
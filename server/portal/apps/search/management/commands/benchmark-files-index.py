@@ -0,0 +1,71 @@
+"""Management command."""
+
+import time
+from django.core.management.base import BaseCommand
+from elasticsearch_dsl import Search
+from portal.libs.agave.operations import search_query
+from portal.libs.elasticsearch.docs.base import IndexedFile
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    """Measure the latency of the files index queries made by the portal.
+
+    Each query is run ``--runs`` times against ``--index`` (the files alias by
+    default) and the wall clock and Elasticsearch ``took`` times are printed.
+    Run it against the old and the new index around reindex-files to compare
+    index settings, or with ``--no-routing`` to see what routing saves.
+
+    Examples:
+
+        >>> ./manage.py benchmark-files-index --system cep.storage.community
+
+        Compare with the previous index after reindex-files swapped aliases:
+
+        >>> ./manage.py benchmark-files-index --system cep.storage.community \\
+                --index cep-staging-files-reindex --no-routing
+
+    """
+    help = 'Benchmark listing, search and usage queries on the files index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--system', help='System whose files are queried.', required=True)
+        parser.add_argument('--path', help='Folder to list and search in.', default='/')
+        parser.add_argument('--query', help='Search query string.', default='*')
+        parser.add_argument('--runs', help='Times each query is run.', type=int, default=20)
+        parser.add_argument('--index', help='Index or alias to query.', default=IndexedFile.Index.name)
+        parser.add_argument('--no-routing', help='Query every shard instead of routing by system.',
+                            dest='routing', default=True, action='store_false')
+
+    def queries(self, system, path, query, index, routing):
+        """The queries to time, as ``(name, search)`` tuples."""
+        base = Search(index=index).params(routing=system if routing else None)\
+            .filter('term', **{'system._exact': system})
+        listing = base.filter('term', **{'basePath._exact': path})\
+            .sort('name._exact').extra(size=100)
+        subtree = base.filter('prefix', **{'basePath._exact': path}).extra(size=0, track_total_hits=True)
+        usage = base.exclude('term', format='folder').extra(size=0)
+        usage.aggs.metric('bytes', 'sum', field='length')
+        search = search_query(system, 0, 100, query, path=path).index().index(index)\
+            .params(routing=system if routing else None)
+        return [('listing', listing), ('subtree count', subtree), ('usage', usage), ('search', search)]
+
+    def handle(self, *args, **options):
+        self.stdout.write('index: {index} system: {system} routing: {routing}'.format(**options))
+        for name, search in self.queries(options['system'], '/' + options['path'].strip('/'),
+                                         options['query'], options['index'], options['routing']):
+            wall = []
+            took = []
+            for _ in range(options['runs']):
+                start = time.perf_counter()
+                res = search.execute(ignore_cache=True)
+                wall.append((time.perf_counter() - start) * 1000)
+                took.append(res.took)
+            self.stdout.write(
+                '{:<14} hits: {:<8} p50: {:>7.1f}ms p95: {:>7.1f}ms took p50: {:>5}ms shards: {}'.format(
+                    name, res.hits.total.value, _percentile(wall, 50), _percentile(wall, 95),
+                    _percentile(took, 50), res._shards.total))  # pylint: disable=protected-access
@@ -1,12 +1,13 @@
-import logging
+import time
 from django.core.management import BaseCommand, CommandError
 from django.utils.six.moves import input
 from django.conf import settings
 import elasticsearch
-from elasticsearch import TransportError
-from elasticsearch_dsl import Index
-from elasticsearch_dsl.connections import connections
-from portal.libs.elasticsearch.indexes import setup_files_index
+from portal.libs.elasticsearch.bulk import start_dual_write, stop_dual_write
+from portal.libs.elasticsearch.exceptions import ReindexFailed
+from portal.libs.elasticsearch.indexes import (setup_files_index, alias_index, bulk_load_settings,
+                                               restore_settings, reindex, replay_dual_writes)
+
 
 class Command(BaseCommand):
     """
@@ -20,6 +21,14 @@ class Command(BaseCommand):
      class) and reindexing from the default files index to this new index. The
      aliases are then swapped so that any Elasticsearch queries on the backend now
      target the reindexed documents.
+
+    Documents are copied by a server-side _reindex task, sliced and throttled
+    by settings.ES_REINDEX_SLICES and settings.ES_REINDEX_REQUESTS_PER_SECOND,
+    into an index with replicas and refreshes turned off until the copy is
+    done. Writes to the default index are also sent to the new one while the
+    task runs. Deletes and updates that raced the copy are replayed once it is
+    done, and aliases are only swapped once both hold the same number of
+    documents.
     """
 
     help = "Reindex all files into a fresh index, then swap aliases with the current default index."
@@ -27,45 +36,94 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--cleanup', help='Remove documents after swapping aliases to save space.', default=False, action='store_true')
         parser.add_argument('--swap-only', help='Only swap index aliases without reindexing.', default=False, action='store_true')
+        parser.add_argument('--noinput', '--no-input', help='Do not prompt before deleting the reindexing index.',
+                            dest='interactive', default=True, action='store_false')
+        parser.add_argument('--requests-per-second', help='Throttle the copy to this many documents per second.',
+                            type=float, default=settings.ES_REINDEX_REQUESTS_PER_SECOND)
+        parser.add_argument('--slices', help="Number of parallel slices, or 'auto' for one per shard.",
+                            default=settings.ES_REINDEX_SLICES)
+        parser.add_argument('--skip-verify', help='Swap aliases even if document counts differ.', default=False, action='store_true')
 
     def handle(self, *args, **options):
         es_client = elasticsearch.Elasticsearch([{'host': settings.ES_HOSTS, 'http_auth': settings.ES_AUTH}], timeout=60)
         cleanup = options.get('cleanup')
-        swap_only = options.get('swap-only')
+        swap_only = options.get('swap_only')
         default_index_alias = settings.ES_INDEX_PREFIX.format('files')
         reindex_index_alias = settings.ES_INDEX_PREFIX.format('files-reindex')
 
         if not swap_only:
-            confirm = input('This will delete any documents in the index "{}" and recreate the index. Continue? (Y/n) '.format(reindex_index_alias))
-            if confirm != 'Y':
-                self.stdout.write('Aborting reindex.')
-                raise SystemExit
+            if options.get('interactive', True):
+                confirm = input('This will delete any documents in the index "{}" and recreate the index. Continue? (Y/n) '.format(reindex_index_alias))
+                if confirm != 'Y':
+                    self.stdout.write('Aborting reindex.')
+                    raise SystemExit
             # Set up a fresh reindexing alias.
             setup_files_index(reindex=True, force=True)
 
         try:
-            default_index_name = Index(default_index_alias, using=es_client).get_alias().keys()[0]
-            reindex_index_name = Index(reindex_index_alias, using=es_client).get_alias().keys()[0]
-        except Exception as e:
+            default_index_name = alias_index(default_index_alias, using=es_client)
+            reindex_index_name = alias_index(reindex_index_alias, using=es_client)
+        except Exception:
             self.stdout.write('Unable to lookup required indices by alias. Have you set up both a default and a reindexing index?')
             raise SystemExit
 
-        if not swap_only:
-            # Reindex file metadata from the default index to the reindexing index
-            elasticsearch.helpers.reindex(es_client, default_index_name, reindex_index_name)
-
-        alias_body = {
-            'actions': [
-                {'remove': {'index': default_index_name, 'alias': default_index_alias}},
-                {'remove': {'index': reindex_index_name, 'alias': reindex_index_alias}},
-                {'add': {'index': default_index_name, 'alias': reindex_index_alias}},
-                {'add': {'index': reindex_index_name, 'alias': default_index_alias}},
-            ]
-        }
-        # Swap the aliases of the default and reindexing aliases.
-        es_client.indices.update_aliases(alias_body)
+        try:
+            if not swap_only:
+                self._reindex(es_client, default_index_alias, default_index_name, reindex_index_name, options)
+
+            alias_body = {
+                'actions': [
+                    {'remove': {'index': default_index_name, 'alias': default_index_alias}},
+                    {'remove': {'index': reindex_index_name, 'alias': reindex_index_alias}},
+                    {'add': {'index': default_index_name, 'alias': reindex_index_alias}},
+                    {'add': {'index': reindex_index_name, 'alias': default_index_alias}},
+                ]
+            }
+            # Swap the aliases of the default and reindexing aliases.
+            es_client.indices.update_aliases(alias_body)
+        finally:
+            if not swap_only:
+                stop_dual_write(default_index_alias)
 
         # Re-initialize the new reindexing index to save space.
         if cleanup:
-            reindex_index_name = Index(reindex_index_alias, using=es_client).get_alias().keys()[0]
-            Index(reindex_index_name, using=es_client).delete(ignore=404)
+            reindex_index_name = alias_index(reindex_index_alias, using=es_client)
+            es_client.indices.delete(index=reindex_index_name, ignore=404)
+
+    def _reindex(self, es_client, default_index_alias, default_index_name, reindex_index_name, options):
+        """Copy the default index into the reindexing index, sending live
+        writes to both, and check that both hold the same documents.
+        """
+        original_settings = bulk_load_settings(es_client, reindex_index_name)
+        start_dual_write(default_index_alias, reindex_index_name)
+        # Let every process pick up the dual write before the copy starts.
+        time.sleep(settings.ES_DUAL_WRITE_CHECK_INTERVAL)
+
+        def on_progress(status):
+            self.stdout.write('Reindexed {} of {} documents'.format(
+                status.get('created', 0) + status.get('version_conflicts', 0), status.get('total', 0)))
+
+        # Route copied documents by system, see setup_files_index.
+        script = {'source': 'ctx._routing = ctx._source.system', 'lang': 'painless'}
+        try:
+            result = reindex(es_client, default_index_name, reindex_index_name,
+                             requests_per_second=options.get('requests_per_second'),
+                             slices=options.get('slices'),
+                             on_progress=on_progress,
+                             script=script)
+        except ReindexFailed as exc:
+            raise CommandError('Reindex failed: {}'.format(exc))
+        finally:
+            restore_settings(es_client, reindex_index_name, original_settings)
+        self.stdout.write('Reindexed {} documents in {}ms'.format(result.get('total'), result.get('took')))
+
+        replayed = replay_dual_writes(es_client, default_index_name, reindex_index_name, script=script)
+        self.stdout.write('Caught up with writes made during the copy: {copied} documents copied again, '
+                          '{deleted} deleted'.format(**replayed))
+
+        es_client.indices.refresh(index=default_index_name)
+        default_count = es_client.count(index=default_index_name)['count']
+        reindex_count = es_client.count(index=reindex_index_name)['count']
+        if default_count != reindex_count and not options.get('skip_verify'):
+            raise CommandError('Index {} has {} documents but {} has {}, not swapping aliases.'.format(
+                default_index_name, default_count, reindex_index_name, reindex_count))
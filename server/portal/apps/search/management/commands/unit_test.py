@@ -1,22 +1,42 @@
+from io import StringIO
 from mock import patch, MagicMock
 from django.test import TestCase
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from portal.libs.elasticsearch.exceptions import ReindexFailed
 
 
 class TestSwapReindex(TestCase):
 
     def setUp(self):
         self.patch_setup = patch('portal.apps.search.management.commands.reindex-files.setup_files_index')
-        self.patch_connections = patch('portal.apps.search.management.commands.reindex-files.connections')
         self.patch_elasticsearch = patch('portal.apps.search.management.commands.reindex-files.elasticsearch')
+        self.patch_alias_index = patch('portal.apps.search.management.commands.reindex-files.alias_index')
+        self.patch_reindex = patch('portal.apps.search.management.commands.reindex-files.reindex')
+        self.patch_bulk_load = patch('portal.apps.search.management.commands.reindex-files.bulk_load_settings')
+        self.patch_restore = patch('portal.apps.search.management.commands.reindex-files.restore_settings')
+        self.patch_start_dual_write = patch('portal.apps.search.management.commands.reindex-files.start_dual_write')
+        self.patch_stop_dual_write = patch('portal.apps.search.management.commands.reindex-files.stop_dual_write')
+        self.patch_replay = patch('portal.apps.search.management.commands.reindex-files.replay_dual_writes')
 
         self.mock_setup = self.patch_setup.start()
-        self.mock_connections = self.patch_connections.start()
         self.mock_elasticsearch = self.patch_elasticsearch.start()
-
-        self.addCleanup(self.patch_setup.stop)
-        self.addCleanup(self.patch_connections.stop)
-        self.addCleanup(self.patch_elasticsearch.stop)
+        self.mock_alias_index = self.patch_alias_index.start()
+        self.mock_reindex = self.patch_reindex.start()
+        self.mock_bulk_load = self.patch_bulk_load.start()
+        self.mock_restore = self.patch_restore.start()
+        self.mock_start_dual_write = self.patch_start_dual_write.start()
+        self.mock_stop_dual_write = self.patch_stop_dual_write.start()
+        self.mock_replay = self.patch_replay.start()
+        self.mock_replay.return_value = {'copied': 0, 'deleted': 0}
+
+        self.addCleanup(patch.stopall)
+
+        self.mock_client = MagicMock()
+        self.mock_client.count.return_value = {'count': 10}
+        self.mock_elasticsearch.Elasticsearch.return_value = self.mock_client
+        self.mock_alias_index.side_effect = ['DEFAULT_NAME', 'REINDEX_NAME', 'DEFAULT_NAME']
+        self.mock_reindex.return_value = {'total': 10, 'took': 100}
 
     @patch('portal.apps.search.management.commands.reindex-files.input')
     def test_raises_when_user_does_not_proceed(self, mock_input):
@@ -25,37 +45,41 @@ class TestSwapReindex(TestCase):
         with self.assertRaises(SystemExit):
             call_command('reindex-files')
 
-    @patch('portal.apps.search.management.commands.reindex-files.Index')
+    def test_noinput_skips_prompt(self):
+        with patch('portal.apps.search.management.commands.reindex-files.input') as mock_input:
+            call_command('reindex-files', interactive=False)
+        mock_input.assert_not_called()
+        self.mock_reindex.assert_called_once()
+
     @patch('portal.apps.search.management.commands.reindex-files.input')
-    def test_raises_exception_when_no_index(self, mock_input, mock_index):
+    def test_raises_exception_when_no_index(self, mock_input):
         mock_input.return_value = 'Y'
 
-        mock_index.return_value.get_alias.return_value.keys.side_effect = Exception
+        self.mock_alias_index.side_effect = Exception
 
         with self.assertRaises(SystemExit):
             call_command('reindex-files')
 
-    @patch('portal.apps.search.management.commands.reindex-files.Index')
     @patch('portal.apps.search.management.commands.reindex-files.input')
-    def test_performs_reindex_from_default_to_reindex(self, mock_input, mock_index):
+    def test_performs_reindex_from_default_to_reindex(self, mock_input):
         mock_input.return_value = 'Y'
 
-        mock_index.return_value.get_alias.return_value.keys.side_effect = [['DEFAULT_NAME'], ['REINDEX_NAME']]
-
-        mock_client = MagicMock()
-        self.mock_elasticsearch.Elasticsearch.return_value = mock_client
-
-        call_command('reindex-files')
+        call_command('reindex-files', requests_per_second=500, slices=6)
 
-        self.mock_elasticsearch.helpers.reindex.assert_called_with(mock_client, 'DEFAULT_NAME', 'REINDEX_NAME')
+        self.mock_bulk_load.assert_called_with(self.mock_client, 'REINDEX_NAME')
+        self.mock_start_dual_write.assert_called_with('test-staging-files', 'REINDEX_NAME')
+        self.assertEqual(self.mock_reindex.call_args[0], (self.mock_client, 'DEFAULT_NAME', 'REINDEX_NAME'))
+        self.assertEqual(self.mock_reindex.call_args[1]['requests_per_second'], 500)
+        self.assertEqual(self.mock_reindex.call_args[1]['slices'], 6)
+        self.mock_restore.assert_called_with(self.mock_client, 'REINDEX_NAME', self.mock_bulk_load.return_value)
+        self.mock_replay.assert_called_once_with(self.mock_client, 'DEFAULT_NAME', 'REINDEX_NAME',
+                                                 script=self.mock_reindex.call_args[1]['script'])
+        self.mock_stop_dual_write.assert_called_with('test-staging-files')
 
-    @patch('portal.apps.search.management.commands.reindex-files.Index')
     @patch('portal.apps.search.management.commands.reindex-files.input')
-    def test_performs_swap_with_correct_args(self, mock_input, mock_index):
+    def test_performs_swap_with_correct_args(self, mock_input):
         mock_input.return_value = 'Y'
 
-        mock_index.return_value.get_alias.return_value.keys.side_effect = [['DEFAULT_NAME'], ['REINDEX_NAME']]
-
         call_command('reindex-files')
 
         mock_alias = {
@@ -66,16 +90,74 @@ class TestSwapReindex(TestCase):
                 {'add': {'index': 'REINDEX_NAME', 'alias': 'test-staging-files'}},
             ]
         }
-        self.mock_elasticsearch.Elasticsearch().indices.update_aliases.assert_called_with(mock_alias)
+        self.mock_client.indices.update_aliases.assert_called_with(mock_alias)
+
+    def test_swap_only(self):
+        call_command('reindex-files', swap_only=True)
+
+        self.mock_setup.assert_not_called()
+        self.mock_reindex.assert_not_called()
+        self.mock_client.indices.update_aliases.assert_called_once()
+
+    @patch('portal.apps.search.management.commands.reindex-files.input')
+    def test_does_not_swap_when_counts_differ(self, mock_input):
+        mock_input.return_value = 'Y'
+        self.mock_client.count.side_effect = [{'count': 10}, {'count': 9}]
+
+        with self.assertRaises(CommandError):
+            call_command('reindex-files')
+
+        self.mock_client.indices.update_aliases.assert_not_called()
+        self.mock_stop_dual_write.assert_called_with('test-staging-files')
+
+    @patch('portal.apps.search.management.commands.reindex-files.input')
+    def test_restores_settings_when_reindex_fails(self, mock_input):
+        mock_input.return_value = 'Y'
+        self.mock_reindex.side_effect = ReindexFailed('failed')
+
+        with self.assertRaises(CommandError):
+            call_command('reindex-files')
+
+        self.mock_restore.assert_called_once()
+        self.mock_client.indices.update_aliases.assert_not_called()
 
-    @patch('portal.apps.search.management.commands.reindex-files.Index')
     @patch('portal.apps.search.management.commands.reindex-files.input')
-    def test_cleanup(self, mock_input, mock_index):
+    def test_cleanup(self, mock_input):
         mock_input.return_value = 'Y'
 
-        mock_index.return_value.get_alias.return_value.keys.side_effect = [['DEFAULT_NAME'], ['REINDEX_NAME'], ['REINDEX_NAME']]
         opts = {'cleanup': True}
 
         call_command('reindex-files', **opts)
 
-        self.assertEqual(mock_index.return_value.delete.call_count, 1)
+        self.mock_client.indices.delete.assert_called_once_with(index='DEFAULT_NAME', ignore=404)
+
+
+class TestBenchmarkFilesIndex(TestCase):
+
+    @patch('portal.apps.search.management.commands.benchmark-files-index.Search.execute')
+    def test_benchmark(self, mock_execute):
+        mock_execute.return_value.took = 3
+        mock_execute.return_value.hits.total.value = 7
+        mock_execute.return_value._shards.total = 1
+        out = StringIO()
+
+        call_command('benchmark-files-index', system='test.system', path='/path', runs=2, stdout=out)
+
+        self.assertEqual(mock_execute.call_count, 8)
+        output = out.getvalue()
+        for name in ('listing', 'subtree count', 'usage', 'search'):
+            self.assertIn(name, output)
+        self.assertIn('routing: True', output)
+
+
+class TestUpdateFilesMapping(TestCase):
+
+    @patch('portal.apps.search.management.commands.update-files-mapping.update_files_mapping')
+    def test_update_files_mapping(self, mock_update):
+        mock_update.return_value = ['extension']
+        out = StringIO()
+
+        call_command('update-files-mapping', stdout=out)
+
+        mock_update.assert_called_once_with()
+        self.assertIn('run reindex-files to fix: extension', out.getvalue())
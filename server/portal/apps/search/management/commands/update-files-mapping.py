@@ -0,0 +1,28 @@
+"""Management command."""
+
+from django.core.management.base import BaseCommand
+from portal.libs.elasticsearch.indexes import update_files_mapping
+
+
+class Command(BaseCommand):
+    """Map the fields added to the files document on the live files index.
+
+    Run it after deploying a change that adds a field to
+    portal.libs.elasticsearch.docs.base.IndexedFile, before documents with the
+    field are indexed. Fields that dynamic mapping already typed differently
+    are listed; they are only fixed by rebuilding the index with reindex-files.
+
+    Example:
+
+        >>> ./manage.py update-files-mapping
+
+    """
+    help = 'Add fields missing from the files index mapping.'
+
+    def handle(self, *args, **options):
+        conflicts = update_files_mapping()
+        if conflicts:
+            self.stdout.write('Mapped with a different type, run reindex-files to fix: {}'.format(
+                ', '.join(conflicts)))
+        else:
+            self.stdout.write('Files index mapping is up to date.')
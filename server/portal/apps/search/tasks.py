@@ -1,57 +1,309 @@
 
+import json
 import logging
+import os
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import User
 # from django.core.management import call_command
 from celery import shared_task
+from redis import RedisError
+from portal.libs import cache
 from portal.libs.agave.utils import service_account
+from portal.libs.agave import listing_cache
+from portal.libs.elasticsearch.indexes import crawl_refresh_interval
 from portal.libs.elasticsearch.utils import index_listing
-from portal.apps.users.utils import get_tas_allocations
+from portal.libs.elasticsearch.bulk import bulk_write
+from portal.apps.users import utils as users_utils
 from portal.apps.projects.models.metadata import ProjectMetadata
-from portal.libs.elasticsearch.docs.base import (IndexedAllocation,
-                                                 IndexedProject)
-from portal.libs.elasticsearch.utils import get_sha256_hash
+from portal.libs.elasticsearch.docs.base import IndexedProject
 logger = logging.getLogger(__name__)
 
 
 # Crawl and index agave files
 @shared_task(bind=True, max_retries=3, queue='indexing', retry_backoff=True, rate_limit="12/m")
-def agave_indexer(self, systemId, filePath='/', recurse=True, update_pems=False, ignore_hidden=True, reindex=False):
+def agave_indexer(self, systemId, filePath='/', recurse=True, update_pems=False, ignore_hidden=True, reindex=False,
+                  frontier=None, incremental=False):
+    """
+    Index a Tapis folder. When `recurse` is True the whole subtree is crawled
+    inside this task using a bounded pool of concurrent listings. Crawls that
+    list more than settings.PORTAL_INDEXER_CHECKPOINT_FOLDERS folders, or that
+    fail part way, continue from their remaining `frontier` in a new task.
+
+    When `incremental` is True, only new, changed and vanished entries are
+    written, and folders whose contents are unchanged since they were last
+    crawled are not descended into.
+    """
 
-    from portal.libs.elasticsearch.utils import index_level
+    from portal.libs.elasticsearch.utils import index_level, clear_crawled
     from portal.libs.agave.utils import walk_levels
+    from portal.libs.agave.crawler import TapisCrawler
 
     client = service_account()
 
     if not filePath.startswith('/'):
         filePath = '/' + filePath
 
+    if not recurse:
+        try:
+            filePath, folders, files = walk_levels(client, systemId, filePath, ignore_hidden=ignore_hidden).__next__()
+        except Exception as exc:
+            logger.error("Error walking files under system {} and path {}".format(systemId, filePath))
+            raise self.retry(exc=exc)
+
+        index_level(filePath, folders, files, systemId, reindex=reindex, incremental=incremental)
+        queue_usage_rollup(systemId, filePath, recurse=False)
+        return
+
+    # mtimes of the folders queued by this crawl, so that each folder is
+    # recorded as crawled with the mtime it was listed with.
+    listed_modified = {}
+
+    def _index_level(path, folders, files):
+        descend = index_level(path, folders, files, systemId, reindex=reindex, incremental=incremental,
+                              crawled_modified=listed_modified.pop(path, None))
+        listed_modified.update((folder['path'], folder.get('lastModified')) for folder in descend)
+        return descend
+
+    crawler = TapisCrawler(client, systemId, _index_level, ignore_hidden=ignore_hidden)
+    continuation = {'systemId': systemId, 'filePath': filePath, 'recurse': True,
+                    'ignore_hidden': ignore_hidden, 'reindex': reindex, 'incremental': incremental}
     try:
-        filePath, folders, files = walk_levels(client, systemId, filePath, ignore_hidden=ignore_hidden).__next__()
+        with crawl_refresh_interval():
+            finished = crawler.crawl(frontier or [filePath], max_folders=settings.PORTAL_INDEXER_CHECKPOINT_FOLDERS)
     except Exception as exc:
-        logger.error("Error walking files under system {} and path {}".format(systemId, filePath))
-        raise self.retry(exc=exc)
+        logger.error("Error crawling files under system {} and path {}".format(systemId, filePath))
+        clear_crawled(systemId, crawler.skipped)
+        raise self.retry(exc=exc, kwargs=dict(continuation, frontier=crawler.frontier()))
+    clear_crawled(systemId, crawler.skipped)
+
+    if not finished:
+        self.apply_async(kwargs=dict(continuation, frontier=crawler.frontier()))
+    else:
+        queue_usage_rollup(systemId, filePath, recurse=True)
+
+    return crawler.stats.to_dict()
+
+
+INDEXER_PENDING_KEY = 'agave-indexer:pending'
+INDEXER_FLUSH_KEY = 'agave-indexer:flush-scheduled'
+
+
+def queue_agave_indexer(systemId, filePath='/', recurse=False):
+    """
+    Request an `agave_indexer` run, coalescing duplicate requests.
+
+    Requests are collected in Redis for settings.PORTAL_INDEXER_DEBOUNCE
+    seconds and then flushed by `flush_agave_indexer`, so repeated requests
+    for the same (system, path) in that window run once. A non-recursive
+    request is upgraded to recursive if a recursive one is also pending.
+    If Redis is unavailable, or the window is 0, the task is queued directly.
+    """
+    if not filePath.startswith('/'):
+        filePath = '/' + filePath
+    filePath = filePath.rstrip('/') or '/'
+
+    window = settings.PORTAL_INDEXER_DEBOUNCE
+    if window > 0:
+        field = '{}:{}'.format(systemId, filePath)
+        try:
+            redis_client = cache.get_redis()
+            if recurse:
+                redis_client.hset(INDEXER_PENDING_KEY, field, 1)
+            else:
+                redis_client.hsetnx(INDEXER_PENDING_KEY, field, 0)
+            if redis_client.set(INDEXER_FLUSH_KEY, 1, nx=True, ex=window * 10):
+                flush_agave_indexer.apply_async(countdown=window)
+            return
+        except RedisError:
+            logger.warning('Unable to coalesce indexing of %s:%s, queueing it directly', systemId, filePath)
 
-    index_level(filePath, folders, files, systemId, reindex=reindex)
+    agave_indexer.apply_async(kwargs={'systemId': systemId,
+                                      'filePath': filePath,
+                                      'recurse': recurse},
+                              routing_key='indexing')
+
+
+@shared_task(bind=True, queue='indexing')
+def flush_agave_indexer(self):
+    """
+    Queue one `agave_indexer` task per pending (system, path) request.
+    Requests covered by a pending recursive request for an ancestor folder
+    are dropped.
+    """
+    redis_client = cache.get_redis()
+    # Clear the flag first so requests made while flushing schedule a new flush.
+    redis_client.delete(INDEXER_FLUSH_KEY)
+    pipe = redis_client.pipeline()
+    pipe.hgetall(INDEXER_PENDING_KEY)
+    pipe.delete(INDEXER_PENDING_KEY)
+    pending, _ = pipe.execute()
+
+    requests = {}
+    for field, recurse in pending.items():
+        systemId, filePath = field.decode().split(':', 1)
+        requests[(systemId, filePath)] = recurse == b'1'
+
+    queued = 0
+    for (systemId, filePath), recurse in requests.items():
+        if _covered_by_recursive(requests, systemId, filePath):
+            continue
+        agave_indexer.apply_async(kwargs={'systemId': systemId,
+                                          'filePath': filePath,
+                                          'recurse': recurse},
+                                  routing_key='indexing')
+        queued += 1
+    logger.info('Coalesced %s indexing requests into %s tasks', len(requests), queued)
+    return queued
+
+
+def _covered_by_recursive(requests, systemId, filePath):
+    parent = filePath
+    while parent != '/':
+        parent = os.path.dirname(parent)
+        if requests.get((systemId, parent)):
+            return True
+    return False
+
+
+USAGE_ROLLUP_KEY = 'usage-rollup:{}:{}:{}'
+
+
+def queue_usage_rollup(systemId, filePath='/', recurse=True):
+    """
+    Request a `usage_rollup` run in settings.PORTAL_USAGE_ROLLUP_DEBOUNCE
+    seconds. Repeated requests for the same folder in that window run once.
+    If Redis is unavailable, or the window is 0, the task is queued directly.
+    """
+    filePath = '/' + filePath.strip('/')
+    window = settings.PORTAL_USAGE_ROLLUP_DEBOUNCE
+    if window > 0:
+        try:
+            if not cache.get_redis().set(USAGE_ROLLUP_KEY.format(systemId, filePath, int(recurse)), 1,
+                                         nx=True, ex=window * 10):
+                return
+        except RedisError:
+            logger.warning('Unable to coalesce usage rollup of %s:%s, queueing it directly', systemId, filePath)
+    usage_rollup.apply_async(args=[systemId, filePath, recurse], countdown=window)
+
+
+@shared_task(bind=True, queue='indexing')
+def usage_rollup(self, systemId, filePath='/', recurse=True):
+    """
+    Recompute folder usage rollups after `filePath` was indexed: for its
+    whole subtree if `recurse`, otherwise for the folder itself. Ancestors
+    are updated in both cases.
+    """
+    from portal.libs.elasticsearch import usage
+    try:
+        # Clear the flag first so changes made while rolling up queue a new run.
+        cache.get_redis().delete(USAGE_ROLLUP_KEY.format(systemId, filePath, int(recurse)))
+    except RedisError:
+        pass
     if recurse:
-        for child in folders:
-            self.delay(systemId, filePath=child.path, reindex=reindex)
+        return usage.rollup_subtree(systemId, filePath)
+    result = usage.rollup_folder(systemId, filePath)
+    usage.rollup_ancestors(systemId, filePath, result)
+    return result
+
+
+@shared_task(bind=True, queue='indexing')
+def move_indexed_files(self, systemId, moves):
+    """
+    Update the index after files were moved within `systemId`, without
+    listing their contents from Tapis again. `moves` holds
+    ``[source path, destination path, is folder]`` items.
+
+    Indexed documents are rewritten to their new paths, then the source and
+    destination folders are reindexed, and each moved folder gets an
+    incremental crawl that only lists it, since the crawled state of its
+    contents moved with them. If the rewrite fails, moved folders are
+    crawled in full instead.
+    """
+    from portal.libs.elasticsearch.utils import move_subtrees
+    moves = [('/' + src.strip('/'), '/' + dest.strip('/'), is_folder) for src, dest, is_folder in moves]
+    try:
+        stats = move_subtrees(systemId, [(src, dest) for src, dest, _ in moves])
+        verified = not stats.failed
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('Error moving indexed files on %s', systemId)
+        stats = None
+        verified = False
+
+    parents = set()
+    for src, dest, is_folder in moves:
+        parents.update([os.path.dirname(src), os.path.dirname(dest)])
+        if not is_folder:
+            continue
+        if verified:
+            agave_indexer.apply_async(kwargs={'systemId': systemId, 'filePath': dest,
+                                              'recurse': True, 'incremental': True})
+        else:
+            queue_agave_indexer(systemId, dest, recurse=True)
+    for parent in parents:
+        queue_agave_indexer(systemId, parent, recurse=False)
+    return stats.to_dict() if stats is not None else None
 
 
 @shared_task(bind=True, max_retries=3, queue='default')
-def agave_listing_indexer(self, listing):
-    index_listing(listing)
+def agave_listing_indexer(self, listing=None, systemId=None, filePath=None, username=None):
+    """
+    Index the result of a Tapis listing.
+
+    When called without a `listing`, revalidate the indexed level at
+    `systemId`/`filePath` instead: the folder is listed from Tapis, new,
+    changed and vanished entries are written to the index, and the
+    differences are pushed to `username` over the notifications websocket.
+    """
+    if listing is not None:
+        index_listing(listing)
+        return
+
+    from portal.libs.elasticsearch.utils import walk_children, listing_diff, delete_recursive, mark_validated
+    from portal.libs.agave.utils import walk_levels
+
+    client = service_account()
+    try:
+        filePath, folders, files = walk_levels(client, systemId, filePath, ignore_hidden=True).__next__()
+    except Exception as exc:
+        logger.error("Error revalidating files under system {} and path {}".format(systemId, filePath))
+        raise self.retry(exc=exc)
+
+    indexed = [hit.to_dict() for hit in walk_children(systemId, filePath, include_parent=False)]
+    diff = listing_diff(indexed, folders + files)
+    index_listing(diff['added'] + diff['modified'])
+    if diff['removed']:
+        delete_recursive(systemId, diff['removed'])
+    mark_validated(systemId, filePath)
+
+    if any(diff.values()):
+        listing_cache.invalidate(systemId, filePath)
+    if username and any(diff.values()):
+        _push_listing_update(username, dict(diff, system=systemId, path=filePath))
+
+
+def _push_listing_update(username, update):
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+    body = json.loads(json.dumps(dict(update, event_type='listing_update'), cls=DjangoJSONEncoder))
+    async_to_sync(get_channel_layer().group_send)(
+        username,
+        {
+            'type': 'portal_notification',
+            'body': body
+        }
+    )
 
 
 @shared_task(bind=True, queue='indexing')
-def index_community_data(self, reindex=False):
+def index_community_data(self, reindex=False, incremental=False):
     # s = IndexedFile.search()
     # s = s.query("match", **{"system._exact": settings.AGAVE_COMMUNITY_DATA_SYSTEM})
     # resp = s.delete()
     for sys in settings.PORTAL_DATAFILES_STORAGE_SYSTEMS:
-        if sys.api == 'tapis':
-            logger.info('INDEXING {} SYSTEM'.format(sys.name))
-            agave_indexer.apply_async(args=[sys.system], kwargs={'reindex': reindex})
+        if sys['api'] == 'tapis' and 'system' in sys:
+            logger.info('INDEXING {} SYSTEM'.format(sys['name']))
+            agave_indexer.apply_async(args=[sys['system']], kwargs={'reindex': reindex, 'incremental': incremental})
 
 
 @shared_task(bind=True, max_retries=3, queue='default')
@@ -65,14 +317,15 @@ def project_indexer(self, listing):
 #     """
 #     index_project(projectId)
 
-# @shared_task(bind=True, queue='indexing')
-# def index_all_projects(self):
-#     """
-#     Retrieve all project metadata records from the database and index them
-#     """
-#     project_records = ProjectMetadata.objects.all()
-#     for project in project_records:
-#         project_indexer.apply_async(args=[project.project_id])
+
+@shared_task(bind=True, queue='indexing')
+def index_all_projects(self):
+    """
+    Retrieve all project metadata records from the database and index them
+    """
+    project_records = ProjectMetadata.objects.all().iterator()
+    stats = bulk_write(_project_doc(project).to_dict(include_meta=True) for project in project_records)
+    return stats.to_dict()
 
 # @shared_task(bind=True, queue='indexing')
 # def index_project_files(self, reindex=False):
@@ -92,7 +345,7 @@ def project_indexer(self, listing):
 
 # Indexing task for My Data.
 @shared_task(bind=True, queue='indexing')
-def index_my_data(self, reindex=False):
+def index_my_data(self, reindex=False, incremental=False):
     users = User.objects.all()
     for user in users:
         uname = user.username
@@ -105,7 +358,7 @@ def index_my_data(self, reindex=False):
         # resp = s.delete()
         agave_indexer.apply_async(
             args=[systemId],
-            kwargs={'filePath': '/', 'reindex': reindex}
+            kwargs={'filePath': '/', 'reindex': reindex, 'incremental': incremental}
         )
 
 
@@ -118,24 +371,17 @@ def index_my_data(self, reindex=False):
 
 @shared_task(bind=True, max_retries=3, queue='api')
 def index_allocations(self, username):
-    allocations = get_tas_allocations(username)
-    doc = IndexedAllocation(username=username, value=allocations)
-    doc.meta.id = get_sha256_hash(username)
-    doc.save()
-    """
-    try:
-            doc = IndexedAllocation.from_username(username)
-            doc.update(value=allocations)
-    except NotFoundError:
-            doc = IndexedAllocation(username=username, value=allocations)
-            doc.save()
-    """
+    """Refresh a user's cached allocations from TAS."""
+    users_utils.index_allocations(username, users_utils.get_tas_allocations(username))
 
 
 @shared_task(bind=True, max_retries=3, queue='indexing')
 def index_project(self, project_id):
     project = ProjectMetadata.objects.get(project_id=project_id)
-    project_dict = project.to_dict()
-    project_doc = IndexedProject(**project_dict)
-    project_doc.meta.id = project_id
-    project_doc.save()
+    bulk_write([_project_doc(project).to_dict(include_meta=True)])
+
+
+def _project_doc(project):
+    project_doc = IndexedProject(**project.to_dict())
+    project_doc.meta.id = project.project_id
+    return project_doc
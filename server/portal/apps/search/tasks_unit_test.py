@@ -0,0 +1,236 @@
+import pytest
+import redis
+from portal.apps.search.tasks import (agave_indexer, agave_listing_indexer, queue_agave_indexer,
+                                      flush_agave_indexer, queue_usage_rollup, usage_rollup, move_indexed_files)
+
+
+@pytest.fixture
+def mock_service_account(mocker):
+    yield mocker.patch('portal.apps.search.tasks.service_account')
+
+
+@pytest.fixture
+def mock_crawler(mocker):
+    yield mocker.patch('portal.libs.agave.crawler.TapisCrawler')
+
+
+@pytest.fixture
+def mock_rollup(mocker):
+    yield mocker.patch('portal.apps.search.tasks.queue_usage_rollup')
+
+
+def test_agave_indexer_non_recursive(mocker, mock_service_account, mock_rollup):
+    mock_walk = mocker.patch('portal.libs.agave.utils.walk_levels')
+    mock_walk.return_value = iter([('/path', ['folder'], ['file'])])
+    mock_index = mocker.patch('portal.libs.elasticsearch.utils.index_level')
+
+    agave_indexer('test.system', filePath='path', recurse=False)
+
+    mock_walk.assert_called_with(mock_service_account(), 'test.system', '/path', ignore_hidden=True)
+    mock_index.assert_called_once_with('/path', ['folder'], ['file'], 'test.system', reindex=False, incremental=False)
+    mock_rollup.assert_called_once_with('test.system', '/path', recurse=False)
+
+
+def test_agave_indexer_crawls_subtree(mocker, mock_service_account, mock_crawler, mock_rollup):
+    mock_crawler.return_value.crawl.return_value = True
+    mock_apply = mocker.patch('portal.apps.search.tasks.agave_indexer.apply_async')
+
+    agave_indexer('test.system', filePath='/path')
+
+    mock_crawler.return_value.crawl.assert_called_once_with(['/path'], max_folders=5000)
+    mock_apply.assert_not_called()
+    mock_rollup.assert_called_once_with('test.system', '/path', recurse=True)
+
+
+def test_agave_indexer_marks_listed_levels(mocker, mock_service_account, mock_crawler, mock_rollup):
+    mock_index = mocker.patch('portal.libs.elasticsearch.utils.index_level')
+    mock_clear = mocker.patch('portal.libs.elasticsearch.utils.clear_crawled')
+    folder = {'path': '/path/folder', 'lastModified': 'MTIME'}
+    mock_index.side_effect = lambda path, folders, files, *args, **kwargs: folders
+
+    def crawl(paths, max_folders):
+        on_level = mock_crawler.call_args[0][2]
+        on_level('/path', [folder], [])
+        on_level('/path/folder', [], [])
+        return True
+    mock_crawler.return_value.crawl.side_effect = crawl
+    mock_crawler.return_value.skipped = ['/path/folder/skipped']
+
+    agave_indexer('test.system', filePath='/path')
+
+    assert [call[1]['crawled_modified'] for call in mock_index.call_args_list] == [None, 'MTIME']
+    mock_clear.assert_called_once_with('test.system', ['/path/folder/skipped'])
+
+
+def test_agave_indexer_resumes_from_frontier(mocker, mock_service_account, mock_crawler, mock_rollup):
+    mock_crawler.return_value.crawl.return_value = True
+
+    agave_indexer('test.system', filePath='/path', frontier=['/path/a', '/path/b'])
+
+    mock_crawler.return_value.crawl.assert_called_once_with(['/path/a', '/path/b'], max_folders=5000)
+
+
+def test_agave_indexer_checkpoints_unfinished_crawl(mocker, mock_service_account, mock_crawler, mock_rollup):
+    mock_crawler.return_value.crawl.return_value = False
+    mock_crawler.return_value.frontier.return_value = ['/path/c']
+    mock_apply = mocker.patch('portal.apps.search.tasks.agave_indexer.apply_async')
+
+    agave_indexer('test.system', filePath='/path')
+
+    mock_apply.assert_called_once_with(kwargs={'systemId': 'test.system',
+                                               'filePath': '/path',
+                                               'recurse': True,
+                                               'ignore_hidden': True,
+                                               'reindex': False,
+                                               'incremental': False,
+                                               'frontier': ['/path/c']})
+    mock_rollup.assert_not_called()
+
+
+def test_agave_listing_indexer_indexes_listing(mocker):
+    mock_index = mocker.patch('portal.apps.search.tasks.index_listing')
+
+    agave_listing_indexer([{'path': '/path/file'}])
+
+    mock_index.assert_called_once_with([{'path': '/path/file'}])
+
+
+def test_agave_listing_indexer_revalidates(mocker, mock_service_account):
+    folder = {'path': '/path/folder', 'name': 'folder'}
+    new_file = {'path': '/path/new', 'name': 'new'}
+    mocker.patch('portal.libs.agave.utils.walk_levels').return_value = iter([('/path', [folder], [new_file])])
+    mock_children = mocker.patch('portal.libs.elasticsearch.utils.walk_children')
+    mock_children.return_value = [mocker.MagicMock(to_dict=lambda: {'path': '/path/folder'}),
+                                  mocker.MagicMock(to_dict=lambda: {'path': '/path/gone'})]
+    mock_index = mocker.patch('portal.apps.search.tasks.index_listing')
+    mock_delete = mocker.patch('portal.libs.elasticsearch.utils.delete_recursive')
+    mock_cache = mocker.patch('portal.apps.search.tasks.listing_cache')
+    mock_push = mocker.patch('portal.apps.search.tasks._push_listing_update')
+    mocker.patch('portal.libs.elasticsearch.utils.mark_validated')
+
+    agave_listing_indexer(systemId='test.system', filePath='/path', username='username')
+
+    mock_index.assert_called_once_with([new_file])
+    mock_delete.assert_called_once_with('test.system', ['/path/gone'])
+    mock_cache.invalidate.assert_called_once_with('test.system', '/path')
+    mock_push.assert_called_once_with('username', {'added': [new_file], 'modified': [], 'removed': ['/path/gone'],
+                                                   'system': 'test.system', 'path': '/path'})
+
+
+def test_agave_listing_indexer_revalidates_unchanged(mocker, mock_service_account):
+    mocker.patch('portal.libs.agave.utils.walk_levels').return_value = iter([('/path', [], [])])
+    mocker.patch('portal.libs.elasticsearch.utils.walk_children').return_value = []
+    mocker.patch('portal.apps.search.tasks.index_listing')
+    mock_push = mocker.patch('portal.apps.search.tasks._push_listing_update')
+    mock_mark = mocker.patch('portal.libs.elasticsearch.utils.mark_validated')
+
+    agave_listing_indexer(systemId='test.system', filePath='/path', username='username')
+
+    mock_push.assert_not_called()
+    # An unchanged level is still recorded as fresh.
+    mock_mark.assert_called_once_with('test.system', '/path')
+
+
+@pytest.fixture
+def mock_redis(mocker, settings):
+    settings.PORTAL_INDEXER_DEBOUNCE = 5
+    yield mocker.patch('portal.libs.cache.get_redis').return_value
+
+
+def test_queue_agave_indexer(mocker, mock_redis):
+    mock_flush = mocker.patch('portal.apps.search.tasks.flush_agave_indexer')
+    mock_redis.set.return_value = True
+
+    queue_agave_indexer('test.system', 'path/', recurse=False)
+    queue_agave_indexer('test.system', '/path', recurse=True)
+
+    mock_redis.hsetnx.assert_called_once_with('agave-indexer:pending', 'test.system:/path', 0)
+    mock_redis.hset.assert_called_once_with('agave-indexer:pending', 'test.system:/path', 1)
+    mock_flush.apply_async.assert_called_with(countdown=5)
+
+
+def test_queue_agave_indexer_flush_already_scheduled(mocker, mock_redis):
+    mock_flush = mocker.patch('portal.apps.search.tasks.flush_agave_indexer')
+    mock_redis.set.return_value = None
+
+    queue_agave_indexer('test.system', '/path')
+
+    mock_flush.apply_async.assert_not_called()
+
+
+def test_queue_agave_indexer_without_redis(mocker, mock_redis):
+    mock_apply = mocker.patch('portal.apps.search.tasks.agave_indexer.apply_async')
+    mock_redis.hsetnx.side_effect = redis.ConnectionError
+
+    queue_agave_indexer('test.system', '/path')
+
+    mock_apply.assert_called_once_with(kwargs={'systemId': 'test.system', 'filePath': '/path', 'recurse': False},
+                                       routing_key='indexing')
+
+
+def test_flush_agave_indexer(mocker, mock_redis):
+    mock_apply = mocker.patch('portal.apps.search.tasks.agave_indexer.apply_async')
+    mock_redis.pipeline.return_value.execute.return_value = [{
+        b'test.system:/a': b'1',
+        b'test.system:/a/b': b'0',
+        b'test.system:/a/c/d': b'1',
+        b'test.system:/e': b'0',
+        b'other.system:/a/b': b'0',
+    }, 1]
+
+    assert flush_agave_indexer() == 3
+
+    mock_redis.delete.assert_called_with('agave-indexer:flush-scheduled')
+    queued = sorted((c[1]['kwargs']['systemId'], c[1]['kwargs']['filePath'], c[1]['kwargs']['recurse'])
+                    for c in mock_apply.call_args_list)
+    assert queued == [('other.system', '/a/b', False), ('test.system', '/a', True), ('test.system', '/e', False)]
+
+
+def test_queue_usage_rollup(mocker, mock_redis, settings):
+    settings.PORTAL_USAGE_ROLLUP_DEBOUNCE = 5
+    mock_apply = mocker.patch('portal.apps.search.tasks.usage_rollup.apply_async')
+    mock_redis.set.side_effect = [True, None]
+
+    queue_usage_rollup('test.system', 'path/', recurse=True)
+    queue_usage_rollup('test.system', '/path', recurse=True)
+
+    mock_redis.set.assert_called_with('usage-rollup:test.system:/path:1', 1, nx=True, ex=50)
+    mock_apply.assert_called_once_with(args=['test.system', '/path', True], countdown=5)
+
+
+def test_usage_rollup(mocker, mock_redis):
+    mock_folder = mocker.patch('portal.libs.elasticsearch.usage.rollup_folder', return_value={'bytes': 1})
+    mock_ancestors = mocker.patch('portal.libs.elasticsearch.usage.rollup_ancestors')
+    mock_subtree = mocker.patch('portal.libs.elasticsearch.usage.rollup_subtree')
+
+    usage_rollup('test.system', '/path', recurse=False)
+
+    mock_redis.delete.assert_called_once_with('usage-rollup:test.system:/path:0')
+    mock_folder.assert_called_once_with('test.system', '/path')
+    mock_ancestors.assert_called_once_with('test.system', '/path', {'bytes': 1})
+    mock_subtree.assert_not_called()
+
+
+def test_move_indexed_files(mocker):
+    mock_move = mocker.patch('portal.libs.elasticsearch.utils.move_subtrees')
+    mock_move.return_value.failed = 0
+    mock_crawl = mocker.patch('portal.apps.search.tasks.agave_indexer.apply_async')
+    mock_queue = mocker.patch('portal.apps.search.tasks.queue_agave_indexer')
+
+    move_indexed_files('test.system', [['/src/dir', 'dest/dir', True], ['/src/file', 'dest/file', False]])
+
+    mock_move.assert_called_once_with('test.system', [('/src/dir', '/dest/dir'), ('/src/file', '/dest/file')])
+    mock_crawl.assert_called_once_with(kwargs={'systemId': 'test.system', 'filePath': '/dest/dir',
+                                               'recurse': True, 'incremental': True})
+    assert sorted(c[0][1] for c in mock_queue.call_args_list) == ['/dest', '/src']
+
+
+def test_move_indexed_files_falls_back_to_crawl(mocker):
+    mocker.patch('portal.libs.elasticsearch.utils.move_subtrees', side_effect=Exception)
+    mock_crawl = mocker.patch('portal.apps.search.tasks.agave_indexer.apply_async')
+    mock_queue = mocker.patch('portal.apps.search.tasks.queue_agave_indexer')
+
+    move_indexed_files('test.system', [['/src/dir', '/dest/dir', True]])
+
+    mock_crawl.assert_not_called()
+    mock_queue.assert_any_call('test.system', '/dest/dir', recurse=True)
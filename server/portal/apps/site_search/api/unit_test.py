@@ -1,4 +1,5 @@
 from mock import MagicMock
+import json
 import pytest
 
 
@@ -8,24 +9,32 @@ def mock_dsl_search(mocker):
 
 
 @pytest.fixture
-def mock_file_search(mocker):
-    yield mocker.patch('portal.apps.site_search.api.views.search_operation')
+def mock_msearch(mocker):
+    mocked_cls = mocker.patch('portal.apps.site_search.api.views.MultiSearch')
+    msearch = mocked_cls.return_value.params.return_value
+    msearch.add.return_value = msearch
+    msearch.execute.side_effect = lambda raise_on_error: [MagicMock(timed_out=False)
+                                                          for _ in msearch.add.call_args_list]
+    yield msearch
 
 
 @pytest.fixture
-def mock_cms_search(mocker):
-    mocked_fn = mocker.patch('portal.apps.site_search.api.views.cms_search')
+def mock_cms_search(mocker, mock_msearch):
+    mocker.patch('portal.apps.site_search.api.views.cms_query')
+    mocked_fn = mocker.patch('portal.apps.site_search.api.views.cms_result')
     mocked_fn.return_value = (1, [{'title': 'test res',
                                    'highlight': []}])
     yield mocked_fn
 
 
 @pytest.fixture
-def mock_files_search(mocker):
-    mocked_fn = mocker.patch('portal.apps.site_search.api.views.files_search')
+def mock_files_search(mocker, mock_msearch):
+    mocker.patch('portal.apps.site_search.api.views.search_query')
+    mocked_fn = mocker.patch('portal.apps.site_search.api.views.search_result')
 
-    mocked_fn.return_value = (1, [{'name': 'testfile',
-                                           'path': '/path/to/testfile'}])
+    mocked_fn.return_value = {'count': 1,
+                              'listing': [{'name': 'testfile',
+                                           'path': '/path/to/testfile'}]}
     yield mocked_fn
 
 
@@ -107,8 +116,67 @@ def test_search_public(client, configure_public, mock_cms_search,
                    'include': True}}
 
 
-def test_cms_search_util(mock_dsl_search):
-    from portal.apps.site_search.api.views import cms_search
+def test_search_single_request(client, mock_cms_search, mock_files_search, mock_msearch):
+    client.get('/api/site-search/?page=0&query_string=test')
+
+    assert mock_msearch.add.call_count == 2
+    mock_msearch.execute.assert_called_once_with(raise_on_error=False)
+
+
+def test_search_partial_results(client, mock_cms_search, mock_files_search, mock_msearch):
+    mock_msearch.execute.side_effect = None
+    mock_msearch.execute.return_value = [MagicMock(timed_out=True), None]
+
+    response = client.get('/api/site-search/?page=0&query_string=test')
+
+    assert response.json() == {
+        'cms': {'count': 1,
+                'listing': [{'title': 'test res',
+                             'highlight': []}],
+                'type': 'cms',
+                'include': True,
+                'timedOut': True},
+        'public': {'count': 0,
+                   'listing': [],
+                   'type': 'file',
+                   'include': True,
+                   'error': True}}
+
+
+def test_search_no_auth_cached(client, settings, mocker, mock_cms_search, mock_files_search, mock_msearch):
+    settings.PORTAL_SITE_SEARCH_CACHE_TTL = 60
+    mock_redis = mocker.patch('portal.libs.cache.get_redis').return_value
+    mock_redis.get.return_value = None
+
+    response = client.get('/api/site-search/?page=0&query_string=test')
+
+    key, value = mock_redis.set.call_args[0]
+    assert mock_redis.set.call_args[1] == {'ex': 60}
+    assert json.loads(value) == response.json()
+
+    mock_redis.get.return_value = value
+    mock_msearch.execute.reset_mock()
+    cached = client.get('/api/site-search/?page=0&query_string=test')
+
+    assert cached.json() == response.json()
+    mock_redis.get.assert_called_with(key)
+    mock_msearch.execute.assert_not_called()
+
+
+def test_search_with_auth_not_cached(regular_user, client, settings, mocker, mock_cms_search,
+                                     mock_files_search):
+    settings.PORTAL_SITE_SEARCH_CACHE_TTL = 60
+    mock_redis = mocker.patch('portal.libs.cache.get_redis').return_value
+    client.force_login(regular_user)
+
+    client.get('/api/site-search/?page=0&query_string=test')
+
+    mock_redis.get.assert_not_called()
+    mock_redis.set.assert_not_called()
+
+
+def test_cms_query_and_result(mock_dsl_search, settings):
+    from portal.apps.site_search.api.views import cms_query, cms_result
     dummy_hit = MagicMock()
     dummy_hit.to_dict.return_value = {'title': 'test title'}
     dummy_hit.meta.highlight.to_dict.return_value = {'body': ['highlight 1']}
@@ -117,31 +185,23 @@ def test_cms_search_util(mock_dsl_search):
     dummy_result.hits.__iter__.return_value = [dummy_hit]
     dummy_result.hits.total.value = 1
 
-    mock_dsl_search()\
-        .query()\
-        .highlight()\
-        .highlight()\
-        .highlight_options()\
-        .extra()\
-        .execute.return_value = dummy_result
-
-    res = cms_search('test_query', offset=0, limit=10)
-    assert res == (1, [{'title': 'test title',
-                        'highlight': {'body': ['highlight 1']}}])
-
-
-def test_file_search_util(mock_file_search):
-    from portal.apps.site_search.api.views import files_search
-    mock_file_search.return_value = {'count': 1,
-                                     'listing':
-                                     [{'name': 'testfile',
-                                       'path': '/path/to/testfile'}]}
-    res = files_search('test_query', 'test_system')
-
-    mock_file_search.assert_called_with(None, 'test_system', '/',
-                                        query_string='test_query',
-                                        offset=0,
-                                        limit=10)
-
-    assert res == (1, [{'name': 'testfile',
-                        'path': '/path/to/testfile'}])
+    search = cms_query('test_query', offset=10, limit=10)
+
+    mock_dsl_search.assert_called_once_with(index=settings.ES_INDEX_PREFIX.format('cms'))
+    mock_dsl_search().query.assert_called_once_with('query_string', query='test_query',
+                                                    default_operator='and', fields=['title', 'body'])
+    mock_dsl_search().query().highlight().highlight().highlight_options().extra\
+        .assert_called_once_with(from_=10, size=10)
+    assert search == mock_dsl_search().query().highlight().highlight().highlight_options().extra()
+    assert cms_result(dummy_result) == (1, [{'title': 'test title',
+                                             'highlight': {'body': ['highlight 1']}}])
+
+
+def test_files_query_and_result(client, configure_public, mock_cms_search, mock_files_search, mocker):
+    mock_query = mocker.patch('portal.apps.site_search.api.views.search_query')
+
+    client.get('/api/site-search/?page=2&query_string=test')
+
+    mock_query.assert_called_once_with('portal.storage.public', 10, 10, 'test')
+    assert mock_files_search.call_count == 1
+    assert mock_files_search.call_args[0][1] == 10
@@ -1,13 +1,20 @@
 from django.http import JsonResponse
-from elasticsearch_dsl import Search
-from portal.libs.agave.operations import search as search_operation
+from elasticsearch.exceptions import ElasticsearchException
+from elasticsearch_dsl import MultiSearch, Search
+from portal.libs import cache
+from portal.libs.agave.operations import search_query, search_result
+from portal.libs.elasticsearch.utils import get_sha256_hash
 from portal.views.base import BaseApiView
 from django.conf import settings
+from redis import RedisError
+import json
 import logging
 logger = logging.getLogger(__name__)
 
+CACHE_NAME = 'site-search'
 
-def cms_search(query_string, offset=0, limit=10):
+
+def cms_query(query_string, offset=0, limit=10):
     cms_index = settings.ES_INDEX_PREFIX.format('cms')
     cms_search = Search(index=cms_index)\
         .query(
@@ -24,8 +31,10 @@ def cms_search(query_string, offset=0, limit=10):
         post_tags=["</b>"],
         require_field_match=False)\
         .extra(from_=offset, size=limit)
+    return cms_search
+
 
-    cms_search = cms_search.execute()
+def cms_result(cms_search):
     res = cms_search.hits
     total = cms_search.hits.total.value
 
@@ -35,10 +44,77 @@ def cms_search(query_string, offset=0, limit=10):
     return total, results
 
 
-def files_search(query_string, system, offset=0, limit=10):
-    res = search_operation(None, system, '/', offset=offset,
-                           limit=limit, query_string=query_string)
-    return (res['count'], res['listing'])
+def _storage_system(scheme):
+    return next((conf['system'] for conf
+                 in settings.PORTAL_DATAFILES_STORAGE_SYSTEMS
+                 if conf['scheme'] == scheme), None)
+
+
+def multi_search(sections):
+    """Run every section's query in one msearch request.
+
+    Each query is given settings.PORTAL_SITE_SEARCH_TIMEOUT seconds, after
+    which Elasticsearch returns the hits found so far. A section whose query
+    failed is returned empty, with ``error`` set.
+
+    :param list sections: ``(name, type, search, format)`` tuples, where
+        ``format`` turns a response into a ``(count, listing)`` tuple.
+    :rtype: dict
+    """
+    timeout = settings.PORTAL_SITE_SEARCH_TIMEOUT
+    msearch = MultiSearch().params(request_timeout=timeout + 1)
+    for _, _, search, _ in sections:
+        msearch = msearch.add(search.extra(timeout='{}ms'.format(int(timeout * 1000))))
+    try:
+        responses = msearch.execute(raise_on_error=False)
+    except ElasticsearchException:
+        logger.exception('Site search failed')
+        responses = [None] * len(sections)
+
+    response = {}
+    for (name, section_type, _, format_result), res in zip(sections, responses):
+        section = {'count': 0,
+                   'listing': [],
+                   'type': section_type,
+                   'include': True}
+        if res is None:
+            logger.error('Site search section %s failed', name)
+            section['error'] = True
+        else:
+            section['count'], section['listing'] = format_result(res)
+            if res.timed_out:
+                section['timedOut'] = True
+        response[name] = section
+    return response
+
+
+def _cache_key(query_string, page):
+    return 'site-search:{}:{}'.format(page, get_sha256_hash(query_string))
+
+
+def _get_cached(query_string, page):
+    if settings.PORTAL_SITE_SEARCH_CACHE_TTL <= 0:
+        return None
+    try:
+        value = cache.get_redis().get(_cache_key(query_string, page))
+    except RedisError:
+        logger.warning('Site search cache unavailable')
+        return None
+    cache.record(CACHE_NAME, 'misses' if value is None else 'hits')
+    return json.loads(value) if value is not None else None
+
+
+def _set_cached(query_string, page, response):
+    if settings.PORTAL_SITE_SEARCH_CACHE_TTL <= 0:
+        return
+    # Don't keep partial results.
+    if any(section.get('error') or section.get('timedOut') for section in response.values()):
+        return
+    try:
+        cache.get_redis().set(_cache_key(query_string, page), json.dumps(response),
+                              ex=settings.PORTAL_SITE_SEARCH_CACHE_TTL)
+    except RedisError:
+        logger.warning('Unable to cache site search results')
 
 
 class SiteSearchApiView(BaseApiView):
@@ -48,41 +124,34 @@ class SiteSearchApiView(BaseApiView):
         page = request.GET.get('page', 1)
         limit = 10
         offset = (int(page) - 1) * limit
-        cms_total, cms_results = cms_search(qs, offset, limit)
-
-        response = {
-            'cms': {'count': cms_total,
-                    'listing': cms_results,
-                    'type': 'cms',
-                    'include': True}}
-
-        try:
-            public_conf = next(conf for conf
-                               in settings.PORTAL_DATAFILES_STORAGE_SYSTEMS
-                               if conf['scheme'] == 'public')
-            (public_total, public_results) = \
-                files_search(qs, public_conf['system'], offset, limit)
-            response['public'] = {'count': public_total,
-                                  'listing': public_results,
-                                  'type': 'file',
-                                  'include': True}
-        except StopIteration:
-            pass
+
+        # Anonymous users all get the same sections, so their results can be
+        # shared.
+        anonymous = not request.user.is_authenticated
+        if anonymous:
+            cached = _get_cached(qs, page)
+            if cached is not None:
+                return JsonResponse(cached)
+
+        sections = [('cms', 'cms', cms_query(qs, offset, limit), cms_result)]
+
+        def format_files(res):
+            result = search_result(res, limit)
+            return result['count'], result['listing']
+
+        public_system = _storage_system('public')
+        if public_system:
+            sections.append(('public', 'file', search_query(public_system, offset, limit, qs),
+                             format_files))
 
         if request.user.is_authenticated and \
                 request.user.profile.setup_complete:
-            try:
-                community_conf = \
-                    next(conf for conf
-                         in settings.PORTAL_DATAFILES_STORAGE_SYSTEMS
-                         if conf['scheme'] == 'community')
-                (community_total, community_results) = \
-                    files_search(qs, community_conf['system'], offset, limit)
-                response['community'] = {'count': community_total,
-                                         'listing': community_results,
-                                         'type': 'file',
-                                         'include': True}
-            except StopIteration:
-                pass
+            community_system = _storage_system('community')
+            if community_system:
+                sections.append(('community', 'file', search_query(community_system, offset, limit, qs),
+                                 format_files))
 
+        response = multi_search(sections)
+        if anonymous:
+            _set_cached(qs, page, response)
         return JsonResponse(response)
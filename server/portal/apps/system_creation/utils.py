@@ -2,7 +2,7 @@ from portal.apps.webhooks.utils import register_webhook
 from portal.libs.agave.utils import service_account
 from django.conf import settings
 import logging
-from pytas.http import TASClient
+from portal.apps.users.utils import get_user_data
 
 logger = logging.getLogger(__name__)
 
@@ -66,14 +66,7 @@ def substitute_user_variables(user, systemId, variables):
 
 def _get_tas_dir(user):
     # Get $WORK directory
-    tas_client = TASClient(
-        baseURL=settings.TAS_URL,
-        credentials={
-            'username': settings.TAS_CLIENT_KEY,
-            'password': settings.TAS_CLIENT_SECRET
-        }
-    )
-    tas_user = tas_client.get_user(username=user.username)
+    tas_user = get_user_data(user.username)
     return tas_user['homeDirectory']
 
 
@@ -47,7 +47,7 @@ def test_call_reactor(regular_user, mocker):
 
 def test_create_substitutions(regular_user, mocker):
     # Setup mocks to external services
-    mock_tas = mocker.patch('portal.apps.system_creation.utils.TASClient.get_user')
+    mock_tas = mocker.patch('portal.apps.system_creation.utils.get_user_data')
     mock_tas.return_value = {
         'homeDirectory': "12345/MOCK_WORK"
     }
@@ -1,10 +1,15 @@
+import datetime
+import json
 from mock import patch
+from django.test import override_settings
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from portal.apps.auth.models import AgaveOAuthToken
 from pytas.http import TASClient
-from portal.apps.users.utils import get_tas_allocations, get_allocations
+from portal.apps.users.utils import (get_tas_allocations, get_allocations, fetch_allocations,
+                                     get_user_data, invalidate_user_data)
 from elasticsearch.exceptions import NotFoundError
+from redis import RedisError
 
 
 class AttrDict(dict):
@@ -56,19 +61,29 @@ class TestUserApiViews(TestCase):
         self.assertEqual(resp.status_code, 401)
         # should only return user data system and community
 
-    @patch('portal.apps.users.views.IndexedFile')
-    def test_usage_view(self, mocked_file):
-        # TODO: this is hideous, there must be a better way to write that or
-        # re-write the route to be less disgusting.
-        mocked_file.search.return_value.filter.return_value.extra.return_value.execute.return_value.to_dict.return_value = {
-            "aggregations": {
-                "total_storage_bytes": {"value": 10}
-            }
-        }
+    @patch('portal.apps.users.views.usage')
+    def test_usage_view(self, mock_usage):
+        mock_usage.system_usage.return_value = {'bytes': 10, 'files': 1, 'lastModified': None}
         self.client.login(username='test', password='test')
         resp = self.client.get("/api/users/usage/systemId", follow=True)
         data = resp.json()
         self.assertTrue(data["total_storage_bytes"] == 10)
+        mock_usage.system_usage.assert_called_with('systemId')
+
+    @patch('portal.apps.users.views.usage')
+    def test_usage_report_view(self, mock_usage):
+        mock_usage.report.return_value = {'usage': {'bytes': 10}}
+        self.client.login(username='test', password='test')
+        resp = self.client.get("/api/users/usage/frontera.home.test/report?path=/folder")
+        self.assertEqual(resp.json(), {'response': {'usage': {'bytes': 10}}})
+        mock_usage.report.assert_called_with('frontera.home.test', '/folder', 10)
+
+    @patch('portal.apps.users.views.usage')
+    def test_usage_report_view_forbidden(self, mock_usage):
+        self.client.login(username='test', password='test')
+        resp = self.client.get("/api/users/usage/frontera.home.other/report")
+        self.assertEqual(resp.status_code, 403)
+        mock_usage.report.assert_not_called()
 
     def test_usage_view_noauth(self):
         # TODO: API routes should return a 401 not a 302 that redirects to login
@@ -89,9 +104,10 @@ class TestGetAllocations(TestCase):
         super(TestGetAllocations, self).tearDown()
         self.mock_tas_patcher.stop()
 
+    @patch('portal.apps.users.utils.bulk_write')
     @patch('portal.apps.users.utils.IndexedAllocation')
     @patch('portal.apps.users.utils.get_tas_allocations')
-    def test_force_get_allocations(self, mock_get, mock_idx):
+    def test_force_get_allocations(self, mock_get, mock_idx, mock_bulk_write):
         mock_get.return_value = []
         get_allocations("username", force=True)
         mock_get.assert_called_with("username")
@@ -210,15 +226,110 @@ class TestGetAllocations(TestCase):
 
 class TestGetIndexedAllocations(TestCase):
 
+    def setUp(self):
+        super(TestGetIndexedAllocations, self).setUp()
+        self.mock_cache_patcher = patch('portal.apps.users.utils.cache')
+        self.mock_redis = self.mock_cache_patcher.start().get_redis.return_value
+        self.mock_redis.set.return_value = True
+        self.mock_redis.exists.return_value = False
+        self.mock_task_patcher = patch('portal.apps.search.tasks.index_allocations')
+        self.mock_task = self.mock_task_patcher.start()
+
+    def tearDown(self):
+        super(TestGetIndexedAllocations, self).tearDown()
+        self.mock_cache_patcher.stop()
+        self.mock_task_patcher.stop()
+
     @patch('portal.apps.users.utils.IndexedAllocation')
     def test_checks_allocations(self, mock_idx):
         get_allocations('testuser')
         mock_idx.from_username.assert_called_with('testuser')
 
+    @patch('portal.apps.users.utils.bulk_write')
     @patch('portal.apps.users.utils.IndexedAllocation')
     @patch('portal.apps.users.utils.get_tas_allocations')
-    def test_allocation_fallback(self, mock_get_alloc, mock_idx):
+    def test_allocation_fallback(self, mock_get_alloc, mock_idx, mock_bulk_write):
         mock_idx.from_username.side_effect = NotFoundError
         get_allocations('testuser')
         mock_get_alloc.assert_called_with('testuser')
-        mock_idx().save.assert_called_with()
+        mock_bulk_write.assert_called_with([mock_idx().to_dict(include_meta=True)])
+        self.mock_redis.delete.assert_called_with('allocations:fetch:testuser')
+
+    @patch('portal.apps.users.utils.IndexedAllocation')
+    @patch('portal.apps.users.utils.get_tas_allocations')
+    def test_fresh_allocations(self, mock_get_alloc, mock_idx):
+        mock_idx.from_username.return_value.updated = datetime.datetime.utcnow()
+        mock_idx.from_username.return_value.value.to_dict.return_value = {'active': ['alloc']}
+
+        self.assertEqual(get_allocations('testuser')['active'], ['alloc'])
+        mock_get_alloc.assert_not_called()
+        self.mock_task.apply_async.assert_not_called()
+
+    @patch('portal.apps.users.utils.IndexedAllocation')
+    @patch('portal.apps.users.utils.get_tas_allocations')
+    def test_stale_allocations(self, mock_get_alloc, mock_idx):
+        mock_idx.from_username.return_value.updated = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        mock_idx.from_username.return_value.value.to_dict.return_value = {'active': ['alloc']}
+
+        self.assertEqual(get_allocations('testuser')['active'], ['alloc'])
+        mock_get_alloc.assert_not_called()
+        self.mock_task.apply_async.assert_called_once_with(args=['testuser'])
+
+    @patch('portal.apps.users.utils.IndexedAllocation')
+    @patch('portal.apps.users.utils.get_tas_allocations')
+    def test_stale_allocations_refresh_queued(self, mock_get_alloc, mock_idx):
+        mock_idx.from_username.return_value.updated = None
+        self.mock_redis.set.return_value = None
+
+        get_allocations('testuser')
+        self.mock_task.apply_async.assert_not_called()
+
+    @patch('portal.apps.users.utils.IndexedAllocation')
+    @patch('portal.apps.users.utils.get_tas_allocations')
+    def test_concurrent_fetch(self, mock_get_alloc, mock_idx):
+        # Another request is fetching allocations and caches them.
+        self.mock_redis.set.return_value = None
+        self.mock_redis.exists.side_effect = [True, False]
+        mock_idx.from_username.return_value.value.to_dict.return_value = {'active': ['alloc']}
+
+        self.assertEqual(fetch_allocations('testuser'), {'active': ['alloc']})
+        mock_get_alloc.assert_not_called()
+
+
+@override_settings(PORTAL_TAS_PROFILE_TTL=60)
+class TestGetUserData(TestCase):
+
+    def setUp(self):
+        super(TestGetUserData, self).setUp()
+        self.mock_redis_patcher = patch('portal.libs.cache.get_redis')
+        self.mock_redis = self.mock_redis_patcher.start().return_value
+        self.mock_redis.get.return_value = None
+        self.mock_tas_patcher = patch('portal.apps.users.utils.TASClient')
+        self.mock_get_user = self.mock_tas_patcher.start().return_value.get_user
+        self.mock_get_user.side_effect = lambda username: {'username': username,
+                                                           'homeDirectory': '01234/{}'.format(username)}
+
+    def tearDown(self):
+        super(TestGetUserData, self).tearDown()
+        self.mock_redis_patcher.stop()
+        self.mock_tas_patcher.stop()
+
+    def test_get_user_data_caches_profile(self):
+        self.assertEqual(get_user_data('testuser')['homeDirectory'], '01234/testuser')
+        self.mock_get_user.assert_called_once_with(username='testuser')
+        self.mock_redis.set.assert_called_once_with(
+            'tas-profile:testuser', json.dumps({'username': 'testuser', 'homeDirectory': '01234/testuser'}), ex=60)
+
+    def test_get_user_data_cached(self):
+        self.mock_redis.get.return_value = json.dumps({'username': 'testuser'})
+        self.assertEqual(get_user_data('testuser'), {'username': 'testuser'})
+        self.mock_get_user.assert_not_called()
+
+    def test_get_user_data_redis_unavailable(self):
+        self.mock_redis.get.side_effect = RedisError
+        self.assertEqual(get_user_data('testuser')['username'], 'testuser')
+        self.mock_redis.set.assert_not_called()
+
+    def test_invalidate_user_data(self):
+        invalidate_user_data('testuser')
+        self.mock_redis.delete.assert_called_once_with('tas-profile:testuser')
@@ -1,12 +1,15 @@
 from django.conf.urls import url
 from django.urls import path
-from portal.apps.users.views import SearchView, AuthenticatedView, UsageView, AllocationsView, TeamView, UserDataView, AllocationUsageView
+from portal.apps.users.views import (SearchView, AuthenticatedView, UsageView, UsageReportView, UsageTotalsView,
+                                     AllocationsView, TeamView, UserDataView, AllocationUsageView)
 
 app_name = 'users'
 urlpatterns = [
     url(r'^$', SearchView.as_view(), name='user_search'),
     url(r'^auth/$', AuthenticatedView.as_view(), name='user_authenticated'),
     path('usage/<slug:system_id>', UsageView.as_view(), name='user_usage'),
+    path('usage/<str:system_id>/report', UsageReportView.as_view(), name='user_usage_report'),
+    path('usage-totals/', UsageTotalsView.as_view(), name='usage_totals'),
     url(r'^allocations/$', AllocationsView.as_view(), name='user_allocations'),
     path('team/<slug:project_name>', TeamView.as_view(), name='user_team'),
     path('team/user/<slug:username>', UserDataView.as_view(), name='user_data'),
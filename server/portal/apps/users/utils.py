@@ -4,14 +4,23 @@ from pytas.http import TASClient
 from portal.libs.elasticsearch.docs.base import IndexedAllocation
 from elasticsearch.exceptions import NotFoundError
 from portal.libs.elasticsearch.utils import get_sha256_hash
+from portal.libs.elasticsearch.bulk import bulk_write
+import datetime
+import functools
 import json
 import logging
+import os
+import time
 import requests
+from redis import RedisError
+from portal.libs import cache
 
 from portal.exceptions.api import ApiException
 
 logger = logging.getLogger(__name__)
 
+CACHE_NAME = 'tas-profile'
+
 
 def list_to_model_queries(q_comps):
     query = None
@@ -43,6 +52,18 @@ def q_to_model_queries(q):
     return query
 
 
+@functools.lru_cache(maxsize=None)
+def get_tas_to_tacc_resources():
+    """Map of TAS resource names to TACC systems, loaded once per process.
+
+    Callers must copy entries before modifying them.
+
+    : rtype: dict
+    """
+    with open(os.path.join(os.path.dirname(__file__), 'tas_to_tacc_resources.json')) as f:
+        return json.load(f)
+
+
 def get_tas_allocations(username):
     """Returns user allocations on TACC resources
 
@@ -50,17 +71,8 @@ def get_tas_allocations(username):
     : rtype: dict
     """
 
-    tas_client = TASClient(
-        baseURL=settings.TAS_URL,
-        credentials={
-            'username': settings.TAS_CLIENT_KEY,
-            'password': settings.TAS_CLIENT_SECRET
-        }
-    )
-    tas_projects = tas_client.projects_for_user(username)
-
-    with open('portal/apps/users/tas_to_tacc_resources.json') as f:
-        tas_to_tacc_resources = json.load(f)
+    tas_projects = _tas_client().projects_for_user(username)
+    tas_to_tacc_resources = get_tas_to_tacc_resources()
 
     hosts = {}
     active_allocations = {}
@@ -111,37 +123,104 @@ def get_tas_allocations(username):
     }
 
 
+def index_allocations(username, allocations):
+    """Cache a user's allocations in Elasticsearch."""
+    doc = IndexedAllocation(username=username, value=allocations, updated=datetime.datetime.utcnow())
+    doc.meta.id = get_sha256_hash(username)
+    bulk_write([doc.to_dict(include_meta=True)])
+
+
+def fetch_allocations(username):
+    """
+    Fetch allocations from TAS and cache them. Concurrent calls for the same
+    user share a single TAS request: the first caller fetches while the others
+    wait for the result to be cached.
+    """
+    lock_key = 'allocations:fetch:{}'.format(username)
+    try:
+        redis_client = cache.get_redis()
+        if not redis_client.set(lock_key, 1, nx=True, ex=settings.PORTAL_ALLOCATIONS_FETCH_TIMEOUT):
+            deadline = time.time() + settings.PORTAL_ALLOCATIONS_FETCH_TIMEOUT
+            while time.time() < deadline and redis_client.exists(lock_key):
+                time.sleep(0.1)
+            try:
+                return IndexedAllocation.from_username(username).value.to_dict()
+            except NotFoundError:
+                # The other request failed, fetch allocations ourselves.
+                pass
+    except RedisError:
+        logger.warning('Unable to lock allocation retrieval for %s', username)
+        redis_client = None
+
+    try:
+        allocations = get_tas_allocations(username)
+        index_allocations(username, allocations)
+        return allocations
+    finally:
+        if redis_client is not None:
+            try:
+                redis_client.delete(lock_key)
+            except RedisError:
+                pass
+
+
+def _is_stale(doc):
+    updated = getattr(doc, 'updated', None)
+    if not isinstance(updated, datetime.datetime):
+        return True
+    age = datetime.datetime.utcnow() - updated.replace(tzinfo=None)
+    return age.total_seconds() > settings.PORTAL_ALLOCATIONS_TTL
+
+
+def _revalidate(username):
+    """Queue a background refresh of a user's allocations, at most once per
+    settings.PORTAL_ALLOCATIONS_REVALIDATE_INTERVAL seconds.
+    """
+    from portal.apps.search.tasks import index_allocations as index_allocations_task
+    try:
+        if not cache.get_redis().set('allocations:revalidate:{}'.format(username), 1, nx=True,
+                                     ex=settings.PORTAL_ALLOCATIONS_REVALIDATE_INTERVAL):
+            return
+    except RedisError:
+        logger.warning('Unable to throttle allocation refresh for %s', username)
+    index_allocations_task.apply_async(args=[username])
+
+
 def get_allocations(username, force=False):
     """
-    Returns indexed allocation data cached in Elasticsearch, or fetches
-    allocations from TAS and indexes them if not cached yet.
+    Returns allocation data cached in Elasticsearch, or fetches allocations
+    from TAS and caches them if not cached yet.
+
+    Cached allocations older than settings.PORTAL_ALLOCATIONS_TTL seconds are
+    still returned, and refreshed in the background by `index_allocations`.
     Parameters
         ----------
         username: str
             TACC username to fetch allocations for.
+        force: bool
+            Fetch allocations from TAS even if they are cached.
         Returns
         -------
         dict
     """
+    result = {
+        'hosts': {},
+        'portal_alloc': None,
+        'active': [],
+        'inactive': []
+    }
+    if force:
+        logger.debug("Forcing TAS allocation retrieval")
+        return fetch_allocations(username)
     try:
-        if force:
-            logger.debug("Forcing TAS allocation retrieval")
-            raise NotFoundError
-        result = {
-            'hosts': {},
-            'portal_alloc': None,
-            'active': [],
-            'inactive': []
-        }
-        result.update(IndexedAllocation.from_username(username).value.to_dict())
-        return result
+        doc = IndexedAllocation.from_username(username)
     except NotFoundError:
         # Fall back to getting allocations from TAS
-        allocations = get_tas_allocations(username)
-        doc = IndexedAllocation(username=username, value=allocations)
-        doc.meta.id = get_sha256_hash(username)
-        doc.save()
-        return allocations
+        return fetch_allocations(username)
+    if _is_stale(doc):
+        _revalidate(username)
+    result.update(doc.value.to_dict())
+    return result
 
 
 def get_usernames(project_name):
@@ -160,23 +239,56 @@ def get_usernames(project_name):
         raise ApiException('Failed to get project users', resp['message'])
 
 
-def get_user_data(username):
-    """Returns user contact information
-
-    : returns: user_data
-    : rtype: dict
-    """
-    tas_client = TASClient(
+def _tas_client():
+    return TASClient(
         baseURL=settings.TAS_URL,
         credentials={
             'username': settings.TAS_CLIENT_KEY,
             'password': settings.TAS_CLIENT_SECRET
         }
     )
-    user_data = tas_client.get_user(username=username)
+
+
+def _profile_key(username):
+    return 'tas-profile:{}'.format(username)
+
+
+def get_user_data(username):
+    """Returns user contact information
+
+    Profiles are cached in Redis for settings.PORTAL_TAS_PROFILE_TTL
+    seconds, so repeated lookups only reach TAS once.
+
+    : returns: user_data
+    : rtype: dict
+    """
+    ttl = settings.PORTAL_TAS_PROFILE_TTL
+    if ttl <= 0:
+        return _tas_client().get_user(username=username)
+    try:
+        value = cache.get_redis().get(_profile_key(username))
+        cache.record(CACHE_NAME, 'misses' if value is None else 'hits')
+        if value is not None:
+            return json.loads(value)
+    except RedisError:
+        logger.warning('TAS profile cache unavailable, fetching %s', username)
+        return _tas_client().get_user(username=username)
+    user_data = _tas_client().get_user(username=username)
+    try:
+        cache.get_redis().set(_profile_key(username), json.dumps(user_data), ex=ttl)
+    except RedisError:
+        logger.warning('Unable to cache TAS profile of %s', username)
     return user_data
 
 
+def invalidate_user_data(username):
+    """Drop a cached TAS profile, e.g. after it was updated."""
+    try:
+        cache.get_redis().delete(_profile_key(username))
+    except RedisError:
+        logger.exception('Unable to drop cached TAS profile of %s', username)
+
+
 def get_per_user_allocation_usage(allocation_id):
     auth = requests.auth.HTTPBasicAuth(settings.TAS_CLIENT_KEY, settings.TAS_CLIENT_SECRET)
     r = requests.get('{0}/v1/allocations/{1}/usage'.format(settings.TAS_URL, allocation_id), auth=auth)
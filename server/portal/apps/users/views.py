@@ -8,8 +8,10 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.conf import settings
-from elasticsearch_dsl import Q
-from portal.libs.elasticsearch.docs.base import IndexedFile
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models import Q
+from portal.apps.projects.models.metadata import ProjectMetadata
+from portal.libs.elasticsearch import usage
 from pytas.http import TASClient
 from portal.apps.users.utils import get_allocations, get_usernames, get_user_data, get_per_user_allocation_usage
 
@@ -50,19 +52,60 @@ class UsageView(BaseApiView):
             default_system_prefix = settings.PORTAL_DATA_DEPOT_LOCAL_STORAGE_SYSTEMS[default_sys]['prefix']
             system_id = default_system_prefix.format(username)
 
-        search = IndexedFile.search()
-        # search = search.filter(Q({'nested': {'path': 'pems', 'query': {'term': {'pems.username': username} }} }))
-        search = search.filter(Q('term', **{"system._exact": system_id}))
-        search = search.extra(size=0)
-        search.aggs.metric('total_storage_bytes', 'sum', field="length")
-        resp = search.execute()
-        resp = resp.to_dict()
-        aggs = resp["aggregations"]["total_storage_bytes"]
         out = {}
-        out["total_storage_bytes"] = aggs.get("value", 0.0)
+        out["total_storage_bytes"] = usage.system_usage(system_id)['bytes']
         return JsonResponse(out, safe=False)
 
 
+def _can_view_usage(user, system_id):
+    """Whether a user may see file names and sizes on a system."""
+    if user.is_staff:
+        return True
+    if any(conf.get('system') == system_id and conf.get('scheme') in ('public', 'community')
+           for conf in settings.PORTAL_DATAFILES_STORAGE_SYSTEMS):
+        return True
+    if any(system['systemId'].format(username=user.username) == system_id
+           for system in settings.PORTAL_DATA_DEPOT_LOCAL_STORAGE_SYSTEMS.values()):
+        return True
+    prefix = '{}.'.format(settings.PORTAL_PROJECTS_SYSTEM_PREFIX)
+    if system_id.startswith(prefix):
+        return ProjectMetadata.objects.filter(
+            Q(pi=user) | Q(owner=user) | Q(co_pis=user) | Q(team_members=user),
+            project_id=system_id[len(prefix):]
+        ).exists()
+    return False
+
+
+@method_decorator(login_required, name='dispatch')
+class UsageReportView(BaseApiView):
+
+    def get(self, request, system_id):
+        """Returns storage usage of a folder, with its largest files and
+        folders and a breakdown by extension
+
+        : returns: {'response': {'usage': usage, 'largestFiles': files, 'largestFolders': folders, 'extensions': extensions}}
+        : rtype: dict
+        """
+        if not _can_view_usage(request.user, system_id):
+            return JsonResponse({'message': 'Forbidden'}, status=403)
+        path = request.GET.get('path', '/')
+        size = min(int(request.GET.get('size', 10)), 100)
+        return JsonResponse({'response': usage.report(system_id, path, size)})
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class UsageTotalsView(BaseApiView):
+
+    def get(self, request):
+        """Returns storage usage per user and per project
+
+        : returns: {'response': {'users': users, 'projects': projects}}
+        : rtype: dict
+        """
+        return JsonResponse({'response': {'users': usage.user_totals(),
+                                          'projects': usage.project_totals()}})
+
+
 @method_decorator(login_required, name='dispatch')
 class SearchView(BaseApiView):
 
@@ -7,6 +7,7 @@ from django.contrib.auth import get_user_model
 from django.db.models import signals
 from django.urls import reverse
 from portal.apps.notifications.models import Notification
+from portal.apps.workspace.models import JobSubmission
 from portal.apps.signals.receivers import send_notification_ws
 from portal.libs.exceptions import PortalLibException
 from portal.apps.webhooks.views import validate_agave_job
@@ -74,6 +75,19 @@ class TestJobsWebhookView(TransactionTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(Notification.objects.all()), 0)
 
+    @override_settings(PORTAL_JOB_NOTIFICATION_STATES=["RUNNING"])
+    @patch('portal.apps.webhooks.views.validate_agave_job')
+    def test_webhook_job_post_updates_job_state(self, mock_validate_agave_job):
+        job_event = json.load(open(os.path.join(os.path.dirname(__file__), 'fixtures/job_staging.json')))
+        mock_validate_agave_job.return_value = job_event
+        user = get_user_model().objects.create(username='sal')
+        JobSubmission.objects.create(user=user, jobId=job_event['id'])
+
+        self.client.post(reverse('webhooks:jobs_wh_handler'), json.dumps(job_event), content_type='application/json')
+
+        job = JobSubmission.objects.get(jobId=job_event['id'])
+        self.assertEqual((job.status, job.archiveSystem), ('STAGING', 'cep.home.sal'))
+
 
 class TestInteractiveWebhookView(TestCase):
     fixtures = ['users', 'auth']
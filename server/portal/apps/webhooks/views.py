@@ -14,6 +14,7 @@ from agavepy.agave import AgaveException
 
 from portal.apps.notifications.models import Notification
 from portal.apps.search.tasks import agave_indexer
+from portal.apps.workspace.models import JobSubmission
 from portal.views.base import BaseApiView
 from portal.libs.exceptions import PortalLibException
 from portal.exceptions.api import ApiException
@@ -106,10 +107,14 @@ class JobsWebhookView(BaseApiView):
             target_path = os.path.join('/workbench/data/', archive_id.strip('/'))
 
             # Verify the job UUID against the username
-            valid_state = validate_agave_job(job_id, username)
+            job_data = validate_agave_job(job_id, username)
+
+            # Keep the job history's copy of the job state current
+            if job_data is not None:
+                JobSubmission.objects.update_state(job_data, user__username=username)
 
             # Verify that the job status should generate a notification
-            valid_state = valid_state is not None and job_status in settings.PORTAL_JOB_NOTIFICATION_STATES
+            valid_state = job_data is not None and job_status in settings.PORTAL_JOB_NOTIFICATION_STATES
 
             # If the job state is not valid for generating a notification,
             # return an OK response
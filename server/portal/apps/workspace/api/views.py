@@ -2,30 +2,36 @@
 .. :module:: apps.workspace.api.views
    :synopsys: Views to handle Workspace API
 """
+import copy
 import logging
 import json
-from urllib.parse import urlparse
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
 from datetime import timedelta
 from django.utils import timezone
 from django.http import JsonResponse
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.urls import reverse
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from portal.utils.translations import get_jupyter_url
 from portal.apps.workspace.api import lookups as LookupManager
 from portal.views.base import BaseApiView
 from portal.exceptions.api import ApiException
-from portal.apps.licenses.models import LICENSE_TYPES, get_license_info
+from portal.apps.licenses.models import get_license_info
 from portal.libs.agave.utils import service_account
 from agavepy.agave import Agave
-from portal.libs.agave.models.systems.execution import ExecutionSystem
 from portal.libs.agave.models.systems.storage import StorageSystem
-from portal.apps.workspace.managers.user_applications import UserApplicationsManager
-from portal.utils.translations import url_parse_inputs
-from portal.apps.workspace.models import JobSubmission
+from portal.apps.workspace.models import JobSubmission, JobSubmissionTicket
+from portal.apps.workspace.tasks import submit_job
+from portal.apps.workspace.utils import get_app_license_type
 from portal.apps.accounts.managers.user_systems import UserSystemsManager
 from portal.apps.workspace.models import AppTrayCategory, AppTrayEntry
+from portal.apps.workspace import app_cache
 
 logger = logging.getLogger(__name__)
 METRICS = logging.getLogger('metrics.{}'.format(__name__))
@@ -40,28 +46,81 @@ def get_manager(request, file_mgr_name):
     return fmgr
 
 
-def _app_license_type(app_id):
-    app_lic_type = app_id.replace('-{}'.format(app_id.split('-')[-1]), '').upper()
-    lic_type = next((t for t in LICENSE_TYPES if t in app_lic_type), None)
-    return lic_type
+def _sweep_job(job_post, entry, index):
+    """Job `index` of a parameter sweep over `job_post`.
+
+    Sweep entries override the job's fields, and are merged into its
+    parameters and inputs. Jobs are named after the sweep's job, unless the
+    entry names them.
+    """
+    job = copy.deepcopy(job_post)
+    for field, value in entry.items():
+        if field in ('parameters', 'inputs'):
+            job[field].update(value)
+        else:
+            job[field] = value
+    if 'name' not in entry:
+        job['name'] = '{}-{}'.format(job_post['name'], index)
+    return job
+
+
+def _validate_sweep(sweep):
+    """Check that a parameter sweep is a list of up to
+    PORTAL_JOB_SWEEP_MAX_JOBS job entries.
+
+    :raises ApiException: if the sweep is malformed or too large.
+    """
+    if not isinstance(sweep, list) or not 0 < len(sweep) <= settings.PORTAL_JOB_SWEEP_MAX_JOBS:
+        raise ApiException("A parameter sweep must be a list of between 1 and {} jobs.".format(
+            settings.PORTAL_JOB_SWEEP_MAX_JOBS))
+    for entry in sweep:
+        if not isinstance(entry, dict) or not all(
+                isinstance(entry.get(field, {}), dict) for field in ('parameters', 'inputs')):
+            raise ApiException("Parameter sweep jobs must be objects, with object parameters and inputs.")
+
+
+def _requeue_stale_ticket(ticket):
+    """Claim a submission ticket that has not moved on for
+    PORTAL_JOB_SUBMIT_STALE_AFTER seconds, e.g. because the worker submitting
+    it stopped, so that it can be queued again.
+
+    :returns: Whether the ticket was claimed.
+    """
+    if ticket.done or ticket.updated > timezone.now() - timedelta(seconds=settings.PORTAL_JOB_SUBMIT_STALE_AFTER):
+        return False
+    # Only one of concurrent requests for the ticket claims it.
+    return JobSubmissionTicket.objects.filter(id=ticket.id, updated=ticket.updated)\
+        .update(updated=timezone.now()) == 1
+
+
+def _fetch_job_states(agave, jobs):
+    """Store the state of job submissions recorded before job states were
+    kept locally, with a single Tapis query.
+
+    Jobs that Tapis no longer has (see https://jira.tacc.utexas.edu/browse/FP-975)
+    are marked with an UNKNOWN status, so that they are not queried again.
+    """
+    if not jobs:
+        return
+    submissions = {job.jobId: job for job in jobs}
+    for data in agave.jobs.list(query={'id.in': ','.join(submissions)}, limit=len(submissions)):
+        job = submissions.get(data['id'])
+        if job is not None:
+            job.update_from_job(data)
+    for job in jobs:
+        job.status = job.status or JobSubmission.UNKNOWN
+    JobSubmission.objects.bulk_update(jobs, [
+        'name', 'appId', 'status', 'created', 'lastUpdated', 'remoteStarted', 'ended',
+        'archiveSystem', 'archivePath', 'archiveDataHref'
+    ])
 
 
 def _get_app(app_id, user):
     agave = user.agave_oauth.client
-    data = {'definition': agave.apps.get(appId=app_id)}
-
-    # GET EXECUTION SYSTEM INFO FOR USER APPS
-    exec_sys = ExecutionSystem(agave, data['definition']['executionSystem'])
-    data['exec_sys'] = exec_sys.to_dict()
-
-    # set maxNodes from system queue for app
-    if (data['definition']['parallelism'] == 'PARALLEL') and ('defaultQueue' in data['definition']):
-        for queue in exec_sys.queues.all():
-            if queue.name == data['definition']['defaultQueue']:
-                data['definition']['maxNodes'] = queue.maxNodes
-                break
+    data = app_cache.get_or_set('app', app_id, lambda: app_cache.load_app(agave, app_id),
+                                username=user.username, is_shared=app_cache.is_public_app)
 
-    lic_type = _app_license_type(app_id)
+    lic_type = get_app_license_type(app_id)
     data['license'] = {
         'type': lic_type
     }
@@ -148,7 +207,7 @@ class MetadataView(BaseApiView):
             assert len(data) == 1, "Expected single app response, got {}.".format(len(data))
             data = data[0]
 
-            lic_type = _app_license_type(app_id)
+            lic_type = get_app_license_type(app_id)
             data['license'] = {
                 'type': lic_type
             }
@@ -194,10 +253,19 @@ class JobsView(BaseApiView):
     def get(self, request, *args, **kwargs):
         agave = request.user.agave_oauth.client
         job_id = request.GET.get('job_id')
+        ticket = request.GET.get('ticket')
+
+        # get job submission ticket
+        if ticket:
+            try:
+                data = JobSubmissionTicket.objects.get(user=request.user, id=ticket).to_dict()
+            except (JobSubmissionTicket.DoesNotExist, ValidationError):
+                raise ApiException("Job submission {} not found.".format(ticket), status=404)
 
         # get specific job info
-        if job_id:
+        elif job_id:
             data = agave.jobs.get(jobId=job_id)
+            JobSubmission.objects.update_state(data, user=request.user)
             q = {"associationIds": job_id}
             job_meta = agave.meta.listMetadata(q=json.dumps(q))
             data['_embedded'] = {"metadata": job_meta}
@@ -223,8 +291,10 @@ class JobsView(BaseApiView):
             limit = int(request.GET.get('limit', 10))
             offset = int(request.GET.get('offset', 0))
             period = request.GET.get('period', 'all')
+            status = request.GET.get('status')
 
-            jobs = JobSubmission.objects.all().filter(user=request.user).order_by('-time')
+            jobs = JobSubmission.objects.filter(user=request.user)\
+                .exclude(status=JobSubmission.UNKNOWN).order_by('-time')
 
             if period != "all":
                 enddate = timezone.now()
@@ -237,16 +307,14 @@ class JobsView(BaseApiView):
                 startdate = enddate - timedelta(days=days)
                 jobs = jobs.filter(time__range=[startdate, enddate])
 
-            all_user_job_ids = [job.jobId for job in jobs]
-            user_job_ids = all_user_job_ids[offset:offset + limit]
-            if user_job_ids:
-                data = agave.jobs.list(query={'id.in': ','.join(user_job_ids)})
-                # re-order agave job info to match our time-ordered jobs
-                # while also taking care that tapis in rare cases might no longer
-                # have that job (see https://jira.tacc.utexas.edu/browse/FP-975)
-                data = list(filter(None, [next((job for job in data if job["id"] == id), None) for id in user_job_ids]))
-            else:
-                data = []
+            if status:
+                jobs = jobs.filter(status__in=status.upper().split(','))
+
+            page = list(jobs[offset:offset + limit])
+            # The states of older submissions are backfilled by import-jobs;
+            # fill in the ones on this page that it has not reached yet.
+            _fetch_job_states(agave, [job for job in page if not job.status])
+            data = [job.to_dict() for job in page if job.status != JobSubmission.UNKNOWN]
 
         return JsonResponse({"response": data})
 
@@ -255,6 +323,7 @@ class JobsView(BaseApiView):
         job_id = request.GET.get('job_id')
         METRICS.info("user:{} is deleting job id:{}".format(request.user.username, job_id))
         data = agave.jobs.delete(jobId=job_id)
+        JobSubmission.objects.filter(user=request.user, jobId=job_id).delete()
         return JsonResponse({"response": data})
 
     def post(self, request, *args, **kwargs):
@@ -271,58 +340,10 @@ class JobsView(BaseApiView):
         # submit job
         elif job_post:
             METRICS.info("user:{} is submitting job:{}".format(request.user.username, job_post))
-            default_sys = UserSystemsManager(
-                request.user,
-                settings.PORTAL_DATA_DEPOT_LOCAL_STORAGE_SYSTEM_DEFAULT
-            )
-
-            # cleaning archive path value
-            if job_post.get('archivePath'):
-                parsed = urlparse(job_post['archivePath'])
-                if parsed.path.startswith('/') and len(parsed.path) > 1:
-                    # strip leading '/'
-                    archive_path = parsed.path[1:]
-                elif parsed.path == '':
-                    # if path is blank, set to root of system
-                    archive_path = '/'
-                else:
-                    archive_path = parsed.path
-
-                job_post['archivePath'] = archive_path
-
-                if parsed.netloc:
-                    job_post['archiveSystem'] = parsed.netloc
-                else:
-                    job_post['archiveSystem'] = default_sys.get_system_id()
-            else:
-                job_post['archivePath'] = \
-                    'archive/jobs/{}/${{JOB_NAME}}-${{JOB_ID}}'.format(
-                        timezone.now().strftime('%Y-%m-%d'))
-                job_post['archiveSystem'] = default_sys.get_system_id()
-
-            # check for running licensed apps
-            lic_type = _app_license_type(job_post['appId'])
-            if lic_type is not None:
-                _, license_models = get_license_info()
-                license_model = [x for x in license_models if x.license_type == lic_type][0]
-                lic = license_model.objects.filter(user=request.user).first()
-                if not lic:
-                    raise ApiException("You are missing the required license for this application.")
-                job_post['parameters']['_license'] = lic.license_as_str()
-
-            # url encode inputs
-            if job_post['inputs']:
-                job_post = url_parse_inputs(job_post)
-
-            # Get or create application based on allocation and execution system
-            apps_mgr = UserApplicationsManager(request.user)
-            app = apps_mgr.get_or_create_app(job_post['appId'], job_post['allocation'])
-
-            if app.exec_sys:
-                return JsonResponse({"response": {"execSys": app.exec_sys.to_dict()}})
-
-            job_post['appId'] = app.id
-            del job_post['allocation']
+            idempotency_key = request.META.get('HTTP_IDEMPOTENCY_KEY') or job_post.pop('idempotencyKey', None)
+            sweep = job_post.pop('sweep', None)
+            if sweep is not None:
+                _validate_sweep(sweep)
 
             if settings.DEBUG:
                 wh_base_url = settings.WH_BASE_URL + '/webhooks/'
@@ -337,21 +358,29 @@ class JobsView(BaseApiView):
                  'event': e}
                 for e in settings.PORTAL_JOB_NOTIFICATION_STATES]
 
-            # Remove any params from job_post that are not in appDef
-            job_post['parameters'] = {param: job_post['parameters'][param]
-                                      for param in job_post['parameters']
-                                      if param in [p['id'] for p in app.parameters]}
-
-            response = agave.jobs.submit(body=job_post)
-
-            if "id" in response:
-                job = JobSubmission.objects.create(
-                    user=request.user,
-                    jobId=response["id"]
-                )
-                job.save()
+            if sweep is None:
+                jobs = [(idempotency_key, job_post)]
+            else:
+                jobs = [(idempotency_key and '{}:{}'.format(idempotency_key, i), _sweep_job(job_post, entry, i))
+                        for i, entry in enumerate(sweep)]
+
+            tickets = []
+            queued = []
+            for key, job in jobs:
+                if key:
+                    ticket, created = JobSubmissionTicket.objects.get_or_create(
+                        user=request.user, idempotencyKey=key, defaults={'job': json.dumps(job)})
+                else:
+                    ticket, created = JobSubmissionTicket.objects.create(user=request.user, job=json.dumps(job)), True
+                tickets.append(ticket)
+                if created or _requeue_stale_ticket(ticket):
+                    queued.append(str(ticket.id))
+            if queued:
+                submit_job.apply_async(args=[request.user.username, queued])
 
-            return JsonResponse({"response": response})
+            if sweep is None:
+                return JsonResponse({"response": tickets[0].to_dict()})
+            return JsonResponse({"response": [ticket.to_dict() for ticket in tickets]})
 
 
 @method_decorator(login_required, name='dispatch')
@@ -394,26 +423,44 @@ class JobHistoryView(BaseApiView):
         return JsonResponse({"response": data})
 
 
+# Resolves app tray entries for every request, so that the number of threads
+# calling Tapis is bounded. Late apps keep resolving after a response is sent.
+_apps_tray_executor = ThreadPoolExecutor(max_workers=settings.PORTAL_APPS_TRAY_MAX_WORKERS,
+                                         thread_name_prefix='apps-tray')
+
+
+def _push_tray_update(username, category, tray_entry_id, app_record, future):
+    """Send an app tray entry that was resolved after the tray was returned
+    to the user. The app is removed from the tray if it failed to resolve.
+    """
+    timing = future.result()
+    app = dict(app_record, appId=timing["appId"], loading=False) if timing["appId"] else None
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            username,
+            {
+                'type': 'portal_notification',
+                'body': {
+                    'event_type': 'apps_tray_update',
+                    'category': category,
+                    'trayEntryId': tray_entry_id,
+                    'app': app,
+                    'timing': timing
+                }
+            }
+        )
+    except Exception:
+        logger.exception("Unable to send app tray update to {}".format(username))
+
+
 @method_decorator(login_required, name='dispatch')
 class AppsTrayView(BaseApiView):
-    def getAppIdBySpec(self, app, user):
+    def getAppIdBySpec(self, app, client):
         # Retrieve the app specified in the portal
         # Any fields that are left blank assume that we
         # are retrieving the "latest" version
-        agave = user.agave_oauth.client
-        query = {
-            "name": app.name,
-            "isPublic": True
-        }
-        if app.version and len(app.version):
-            query['version'] = app.version
-        if app.revision and len(app.revision):
-            query['revision'] = app.revision
-        appList = agave.apps.list(query=query)
-        appList.sort(
-            key=lambda appDef: [int(u) for u in appDef['version'].split('.')] + [int(appDef['revision'])]
-        )
-        return appList[-1]['id']
+        return app_cache.get_or_set('spec', app_cache.spec_name(app),
+                                    lambda: app_cache.app_id_by_spec(client, app))
 
     def getApp(self, app, user):
         return _get_app(self.getAppId(app, user), user)
@@ -422,15 +469,42 @@ class AppsTrayView(BaseApiView):
         if app.appId and len(app.appId) > 0:
             appId = app.appId
         else:
-            appId = self.getAppIdBySpec(app, user)
+            appId = self.getAppIdBySpec(app, user.agave_oauth.client)
+        self.setLastRetrieved(app, appId)
+        return appId
+
+    def setLastRetrieved(self, app, appId):
         if appId != app.lastRetrieved:
+            if app.lastRetrieved:
+                app_cache.invalidate()
             app.lastRetrieved = appId
             app.save()
-        return appId
+
+    def resolveAppId(self, app, client):
+        """Resolve an app tray entry's app ID, timing the Tapis call.
+        Runs in a worker thread, so it is given the user's Tapis client
+        rather than looking it up in the database.
+        """
+        start = time.perf_counter()
+        try:
+            appId = app.appId or self.getAppIdBySpec(app, client)
+            error = None
+        except Exception as e:
+            logger.exception("Could not retrieve app {}".format(app))
+            appId = None
+            error = str(e)
+        return {
+            "label": app.label or app.name,
+            "appId": appId,
+            "took": round((time.perf_counter() - start) * 1000),
+            "status": "error" if error else "ok",
+            "error": error
+        }
 
     def getPrivateApps(self, user):
         agave = user.agave_oauth.client
-        apps_listing = agave.apps.list(privateOnly=True)
+        apps_listing = app_cache.get_or_set('private-apps', '', lambda: agave.apps.list(privateOnly=True),
+                                            username=user.username)
         my_apps = []
         # Get private apps that are not prtl.clone
         for app in filter(lambda app: not app['id'].startswith("prtl.clone"), apps_listing):
@@ -456,8 +530,19 @@ class AppsTrayView(BaseApiView):
         return my_apps
 
     def getPublicApps(self, user):
+        """
+        Returns app tray categories with their apps, definitions of HTML apps,
+        and the time taken to resolve each agave app.
+
+        Agave apps are resolved concurrently. Apps that are not resolved
+        within settings.PORTAL_APPS_TRAY_TIMEOUT seconds are returned as
+        "loading" placeholders, and sent to the user over the websocket once
+        resolved.
+        """
         categories = []
         definitions = {}
+        pending = []
+        client = user.agave_oauth.client
         # Traverse category records in descending priority
         for category in AppTrayCategory.objects.all().order_by('-priority'):
             categoryResult = {
@@ -477,33 +562,51 @@ class AppsTrayView(BaseApiView):
                     "type": app.appType
                 }
 
-                try:
-                    if str(app.appType).lower() == 'html':
-                        # If this is an HTML app, create a definition for it
-                        # that has the 'html' field
-                        appRecord["appId"] = app.htmlId
-                        definitions[app.htmlId] = {
-                            "html": app.html,
-                            "id": app.htmlId,
-                            "label": app.label,
-                            "shortDescription": app.shortDescription,
-                            "appType": "html"
-                        }
-                    elif str(app.appType).lower() == 'agave':
-                        # If this is an agave app, retrieve the definition
-                        # from the tenant, with any license or queue
-                        # post processing
-                        appId = self.getAppId(app, user)
-                        appRecord["appId"] = appId
-
+                if str(app.appType).lower() == 'html':
+                    # If this is an HTML app, create a definition for it
+                    # that has the 'html' field
+                    appRecord["appId"] = app.htmlId
+                    definitions[app.htmlId] = {
+                        "html": app.html,
+                        "id": app.htmlId,
+                        "label": app.label,
+                        "shortDescription": app.shortDescription,
+                        "appType": "html"
+                    }
                     categoryResult["apps"].append(appRecord)
-                except Exception:
-                    logger.info("Could not retrieve app {}".format(app))
+                elif str(app.appType).lower() == 'agave':
+                    # If this is an agave app, resolve its app ID from
+                    # the tenant
+                    future = _apps_tray_executor.submit(self.resolveAppId, app, client)
+                    pending.append((categoryResult, app, appRecord, future))
 
-            categoryResult["apps"].sort(key=lambda app: app['label'])
             categories.append(categoryResult)
 
-        return categories, definitions
+        wait([future for _, _, _, future in pending], timeout=settings.PORTAL_APPS_TRAY_TIMEOUT)
+        timings = []
+        for categoryResult, app, appRecord, future in pending:
+            if future.done():
+                timing = future.result()
+                timings.append(timing)
+                if timing["appId"] is None:
+                    continue
+                self.setLastRetrieved(app, timing["appId"])
+                appRecord["appId"] = timing["appId"]
+            else:
+                logger.warning("App {} was not retrieved within {}s".format(app, settings.PORTAL_APPS_TRAY_TIMEOUT))
+                timings.append({"label": appRecord["label"], "appId": None, "took": None,
+                                "status": "loading", "error": None})
+                appRecord.update(appId=None, trayEntryId=app.pk, loading=True)
+                future.add_done_callback(
+                    partial(_push_tray_update, user.username, categoryResult["title"], app.pk, dict(appRecord))
+                )
+            categoryResult["apps"].append(appRecord)
+
+        for categoryResult in categories:
+            categoryResult["apps"].sort(key=lambda app: app['label'])
+        METRICS.info("user:{} app tray timings: {}".format(user.username, json.dumps(timings)))
+
+        return categories, definitions, timings
 
     def get(self, request):
         """
@@ -523,9 +626,15 @@ class AppsTrayView(BaseApiView):
             "definitions": {
                 "jupyterhub": { ... }
             }
+            "timings": [
+                {"label": "Jupyter", "appId": "jupyterhub", "took": 120, "status": "ok", "error": null}
+            ]
         }
+
+        Apps still resolving are returned with "loading": true and a
+        "trayEntryId", and are sent later as "apps_tray_update" events.
         """
-        tabs, definitions = self.getPublicApps(request.user)
+        tabs, definitions, timings = self.getPublicApps(request.user)
         my_apps = self.getPrivateApps(request.user)
         tabs.insert(
             0,
@@ -542,4 +651,4 @@ class AppsTrayView(BaseApiView):
             )
         )
 
-        return JsonResponse({"tabs": tabs, "definitions": definitions})
+        return JsonResponse({"tabs": tabs, "definitions": definitions, "timings": timings})
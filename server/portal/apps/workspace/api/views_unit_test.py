@@ -1,11 +1,15 @@
 from portal.apps.workspace.models import JobSubmission
 from mock import MagicMock
+from requests.exceptions import ConnectionError, HTTPError
 from django.conf import settings
-from portal.apps.workspace.api.views import JobsView, AppsTrayView
-from portal.apps.workspace.models import AppTrayCategory
+from portal.apps.workspace.api.views import JobsView, AppsTrayView, _push_tray_update
+from portal.apps.workspace.models import AppTrayCategory, JobSubmissionTicket
+from portal.apps.workspace.tasks import submit_job
 from portal.apps.workspace.models import JobSubmission
 import json
 import os
+import threading
+import time
 import pytest
 import copy
 from datetime import timedelta
@@ -28,16 +32,24 @@ def get_user_data(mocker):
 @pytest.fixture
 def apps_manager(mocker):
     mock_apps_manager = mocker.patch(
-        'portal.apps.workspace.api.views.UserApplicationsManager'
+        'portal.apps.workspace.managers.user_applications.UserApplicationsManager'
     )
     # Patch the User Applications Manager to return a fake cloned app
     mock_app = MagicMock()
     mock_app.id = "mock_app"
     mock_app.exec_sys = False
+    mock_app.recorded = False
     mock_apps_manager.return_value.get_or_create_app.return_value = mock_app
     yield mock_apps_manager
 
 
+@pytest.fixture
+def submit_job_eagerly(mocker):
+    # Submit jobs in the request rather than queueing them
+    yield mocker.patch('portal.apps.workspace.api.views.submit_job.apply_async',
+                       side_effect=lambda args: submit_job(*args))
+
+
 @pytest.fixture
 def job_submmission_definition():
     with open(os.path.join(settings.BASE_DIR, 'fixtures', 'job-submission.json')) as f:
@@ -50,8 +62,8 @@ def logging_metric_mock(mocker):
 
 
 def test_job_post(client, authenticated_user, get_user_data, mock_agave_client,
-                  apps_manager, job_submmission_definition):
-    mock_agave_client.jobs.submit.return_value = {"id": "1234"}
+                  apps_manager, submit_job_eagerly, job_submmission_definition):
+    mock_agave_client.jobs.submit.return_value = {"id": "1234", "status": "ACCEPTED"}
 
     response = client.post(
         "/api/workspace/jobs",
@@ -59,15 +71,20 @@ def test_job_post(client, authenticated_user, get_user_data, mock_agave_client,
         content_type="application/json"
     )
     assert response.status_code == 200
-    assert response.json() == {"response": {"id": "1234"}}
+    ticket = JobSubmissionTicket.objects.get()
+    assert response.json()["response"]["ticket"] == str(ticket.id)
+    assert ticket.stage == "submitted"
+    assert ticket.to_dict()["response"] == {"id": "1234", "status": "ACCEPTED"}
 
     # The job submission request
     job = JobSubmission.objects.all()[0]
     assert job.jobId == "1234"
+    assert job.status == "ACCEPTED"
 
 
 def test_job_post_is_logged_for_metrics(client, authenticated_user, get_user_data, mock_agave_client,
-                                        apps_manager, job_submmission_definition, logging_metric_mock):
+                                        apps_manager, submit_job_eagerly, job_submmission_definition,
+                                        logging_metric_mock):
     mock_agave_client.jobs.submit.return_value = {"id": "1234"}
 
     client.post(
@@ -76,8 +93,239 @@ def test_job_post_is_logged_for_metrics(client, authenticated_user, get_user_dat
         content_type="application/json"
     )
     # Ensure metric-related logging is being performed
-    logging_metric_mock.assert_called_with("user:{} is submitting job:{}".format(authenticated_user.username,
-                                                                                 job_submmission_definition))
+    logging_metric_mock.assert_any_call("user:{} is submitting job:{}".format(authenticated_user.username,
+                                                                              job_submmission_definition))
+
+
+def test_job_post_returns_ticket(client, authenticated_user, mock_agave_client, mocker,
+                                 job_submmission_definition):
+    mock_apply_async = mocker.patch('portal.apps.workspace.api.views.submit_job.apply_async')
+
+    response = client.post(
+        "/api/workspace/jobs",
+        data=json.dumps(job_submmission_definition),
+        content_type="application/json"
+    )
+    ticket = JobSubmissionTicket.objects.get()
+    assert response.json()["response"] == {
+        "ticket": str(ticket.id), "stage": "queued", "done": False, "jobId": None, "message": "", "response": None
+    }
+    mock_apply_async.assert_called_once_with(args=[authenticated_user.username, [str(ticket.id)]])
+    mock_agave_client.jobs.submit.assert_not_called()
+
+    response = client.get("/api/workspace/jobs/", {"ticket": str(ticket.id)})
+    assert response.json()["response"]["stage"] == "queued"
+
+
+def test_job_post_idempotency_key(client, authenticated_user, mock_agave_client, mocker,
+                                  job_submmission_definition):
+    mock_apply_async = mocker.patch('portal.apps.workspace.api.views.submit_job.apply_async')
+
+    tickets = [
+        client.post(
+            "/api/workspace/jobs",
+            data=json.dumps(job_submmission_definition),
+            content_type="application/json",
+            HTTP_IDEMPOTENCY_KEY="submit-1"
+        ).json()["response"]["ticket"]
+        for _ in range(2)
+    ]
+    assert tickets[0] == tickets[1]
+    assert JobSubmissionTicket.objects.count() == 1
+    mock_apply_async.assert_called_once()
+
+
+def test_job_post_sweep(client, authenticated_user, get_user_data, mock_agave_client,
+                        apps_manager, submit_job_eagerly, job_submmission_definition):
+    mock_agave_client.jobs.submit.side_effect = [{"id": "1"}, {"id": "2"}]
+    apps_manager.return_value.get_or_create_app.return_value.parameters = [{"id": "mem"}]
+    job_submmission_definition["sweep"] = [{"parameters": {"mem": 1}}, {"parameters": {"mem": 2}}]
+
+    response = client.post(
+        "/api/workspace/jobs",
+        data=json.dumps(job_submmission_definition),
+        content_type="application/json"
+    )
+    tickets = [JobSubmissionTicket.objects.get(id=ticket["ticket"]) for ticket in response.json()["response"]]
+    assert [ticket.jobId for ticket in tickets] == ["1", "2"]
+    apps_manager.return_value.get_or_create_app.assert_called_once()
+    bodies = [kwargs["body"] for _, kwargs in mock_agave_client.jobs.submit.call_args_list]
+    assert [body["parameters"] for body in bodies] == [{"mem": 1}, {"mem": 2}]
+    assert [body["name"] for body in bodies] == [job_submmission_definition["name"] + "-0",
+                                                 job_submmission_definition["name"] + "-1"]
+
+
+def test_job_post_sweep_too_large(client, authenticated_user, mock_agave_client, mocker,
+                                  job_submmission_definition):
+    mock_apply_async = mocker.patch('portal.apps.workspace.api.views.submit_job.apply_async')
+    job_submmission_definition["sweep"] = [{}] * (settings.PORTAL_JOB_SWEEP_MAX_JOBS + 1)
+
+    response = client.post(
+        "/api/workspace/jobs",
+        data=json.dumps(job_submmission_definition),
+        content_type="application/json"
+    )
+    assert response.status_code == 400
+    mock_apply_async.assert_not_called()
+
+
+@pytest.mark.parametrize("sweep", [
+    {"parameters": {}},
+    ["not a job"],
+    [{"parameters": ["not", "parameters"]}],
+    [{"inputs": "not inputs"}],
+])
+def test_job_post_sweep_malformed(client, authenticated_user, mock_agave_client, mocker,
+                                  job_submmission_definition, sweep):
+    mock_apply_async = mocker.patch('portal.apps.workspace.api.views.submit_job.apply_async')
+    job_submmission_definition["sweep"] = sweep
+
+    response = client.post(
+        "/api/workspace/jobs",
+        data=json.dumps(job_submmission_definition),
+        content_type="application/json"
+    )
+    assert response.status_code == 400
+    assert not JobSubmissionTicket.objects.exists()
+    mock_apply_async.assert_not_called()
+
+
+def test_job_post_keys_required(client, authenticated_user, get_user_data, mock_agave_client,
+                                apps_manager, submit_job_eagerly, job_submmission_definition):
+    exec_sys = apps_manager.return_value.get_or_create_app.return_value.exec_sys = MagicMock()
+    exec_sys.to_dict.return_value = {"id": "exec.system"}
+
+    response = client.post(
+        "/api/workspace/jobs",
+        data=json.dumps(job_submmission_definition),
+        content_type="application/json"
+    )
+    ticket = JobSubmissionTicket.objects.get(id=response.json()["response"]["ticket"])
+    assert ticket.stage == "keys_required"
+    assert ticket.to_dict()["response"] == {"execSys": {"id": "exec.system"}}
+    mock_agave_client.jobs.submit.assert_not_called()
+
+
+def test_job_post_failure_forgets_app(client, authenticated_user, get_user_data, mock_agave_client,
+                                      apps_manager, submit_job_eagerly, job_submmission_definition):
+    error_response = MagicMock(status_code=400)
+    error_response.json.return_value = {"message": "Invalid job"}
+    mock_agave_client.jobs.submit.side_effect = HTTPError(response=error_response)
+
+    response = client.post(
+        "/api/workspace/jobs",
+        data=json.dumps(job_submmission_definition),
+        content_type="application/json"
+    )
+    ticket = JobSubmissionTicket.objects.get(id=response.json()["response"]["ticket"])
+    assert ticket.stage == "failed"
+    assert ticket.message == "Invalid job"
+    apps_manager.return_value.forget_app.assert_called_once_with("mock_app")
+    assert not JobSubmission.objects.exists()
+    apps_manager.return_value.validate_app.assert_not_called()
+
+
+def test_job_post_failure_with_recorded_app_checks_keys(client, authenticated_user, get_user_data,
+                                                        mock_agave_client, apps_manager, submit_job_eagerly,
+                                                        job_submmission_definition):
+    apps_manager.return_value.get_or_create_app.return_value.recorded = True
+    validated_app = MagicMock()
+    validated_app.exec_sys.to_dict.return_value = {"id": "exec.system"}
+    apps_manager.return_value.validate_app.return_value = (validated_app, validated_app.exec_sys)
+    error_response = MagicMock(status_code=400)
+    error_response.json.return_value = {"message": "Permission denied"}
+    mock_agave_client.jobs.submit.side_effect = HTTPError(response=error_response)
+
+    response = client.post(
+        "/api/workspace/jobs",
+        data=json.dumps(job_submmission_definition),
+        content_type="application/json"
+    )
+    ticket = JobSubmissionTicket.objects.get(id=response.json()["response"]["ticket"])
+    assert ticket.stage == "keys_required"
+    assert ticket.to_dict()["response"] == {"execSys": {"id": "exec.system"}}
+    apps_manager.return_value.forget_app.assert_called_once_with("mock_app")
+    apps_manager.return_value.validate_app.assert_called_once_with(
+        job_submmission_definition["appId"], job_submmission_definition["allocation"])
+
+
+def test_submit_job_retries_service_errors(authenticated_user, get_user_data, mock_agave_client,
+                                           apps_manager, job_submmission_definition, mocker):
+    mock_retry = mocker.patch.object(submit_job, 'retry', return_value=RuntimeError('retry'))
+    apps_manager.return_value.get_or_create_app.side_effect = HTTPError(response=MagicMock(status_code=503))
+    ticket = JobSubmissionTicket.objects.create(user=authenticated_user, job=json.dumps(job_submmission_definition))
+
+    with pytest.raises(RuntimeError):
+        submit_job(authenticated_user.username, [str(ticket.id)])
+    assert mock_retry.call_args[1]['countdown'] == settings.PORTAL_JOB_SUBMIT_RETRY_DELAY
+    ticket.refresh_from_db()
+    assert ticket.stage == "clone_app"
+
+
+def test_submit_job_does_not_retry_submission(authenticated_user, get_user_data, mock_agave_client,
+                                              apps_manager, job_submmission_definition, mocker):
+    mock_retry = mocker.patch.object(submit_job, 'retry')
+    mock_agave_client.jobs.submit.side_effect = HTTPError(response=MagicMock(status_code=503))
+    mock_agave_client.jobs.list.return_value = []
+    ticket = JobSubmissionTicket.objects.create(user=authenticated_user, job=json.dumps(job_submmission_definition))
+
+    submit_job(authenticated_user.username, [str(ticket.id)])
+    mock_retry.assert_not_called()
+    assert mock_agave_client.jobs.list.call_args[1]['query']['name'] == job_submmission_definition['name']
+    ticket.refresh_from_db()
+    assert ticket.stage == "failed"
+    apps_manager.return_value.forget_app.assert_not_called()
+
+
+def test_submit_job_finds_interrupted_submission(authenticated_user, get_user_data, mock_agave_client,
+                                                 apps_manager, job_submmission_definition, mocker):
+    mock_retry = mocker.patch.object(submit_job, 'retry')
+    mock_agave_client.jobs.submit.side_effect = ConnectionError()
+    mock_agave_client.jobs.list.return_value = [{"id": "1234", "status": "PENDING"}]
+    ticket = JobSubmissionTicket.objects.create(user=authenticated_user, job=json.dumps(job_submmission_definition))
+
+    submit_job(authenticated_user.username, [str(ticket.id)])
+    mock_retry.assert_not_called()
+    ticket.refresh_from_db()
+    assert ticket.stage == "submitted"
+    assert ticket.jobId == "1234"
+    assert JobSubmission.objects.get(jobId="1234").status == "PENDING"
+
+
+def test_submit_job_recovers_ticket_stuck_in_submit(authenticated_user, get_user_data, mock_agave_client,
+                                                    apps_manager, job_submmission_definition):
+    mock_agave_client.jobs.list.return_value = [{"id": "1234", "status": "QUEUED"}]
+    ticket = JobSubmissionTicket.objects.create(user=authenticated_user, stage="submit",
+                                                job=json.dumps(job_submmission_definition))
+
+    submit_job(authenticated_user.username, [str(ticket.id)])
+    mock_agave_client.jobs.submit.assert_not_called()
+    ticket.refresh_from_db()
+    assert ticket.stage == "submitted"
+    assert ticket.jobId == "1234"
+
+
+def test_job_post_requeues_stale_ticket(client, authenticated_user, mock_agave_client, mocker,
+                                        job_submmission_definition):
+    mock_apply_async = mocker.patch('portal.apps.workspace.api.views.submit_job.apply_async')
+
+    def post():
+        return client.post(
+            "/api/workspace/jobs",
+            data=json.dumps(job_submmission_definition),
+            content_type="application/json",
+            HTTP_IDEMPOTENCY_KEY="submit-1"
+        ).json()["response"]["ticket"]
+
+    ticket_id = post()
+    JobSubmissionTicket.objects.filter(id=ticket_id).update(
+        stage="submit", updated=timezone.now() - timedelta(seconds=settings.PORTAL_JOB_SUBMIT_STALE_AFTER + 1))
+    assert post() == ticket_id
+    assert mock_apply_async.call_count == 2
+    assert mock_apply_async.call_args[1]['args'] == [authenticated_user.username, [ticket_id]]
+    # The re-queued ticket is not stale any more.
+    post()
+    assert mock_apply_async.call_count == 2
 
 
 def request_jobs_util(rf, authenticated_user, query_params={}):
@@ -104,6 +352,35 @@ def test_get_no_portal_jobs(rf, authenticated_user, mock_agave_client):
     ]
     jobs = request_jobs_util(rf, authenticated_user)
     assert len(jobs) == 0
+    assert JobSubmission.objects.get(jobId="9876").status == "UNKNOWN"
+    # Jobs Tapis no longer has are not queried again.
+    request_jobs_util(rf, authenticated_user)
+    mock_agave_client.jobs.list.assert_called_once()
+
+
+def test_get_jobs_only_fetches_page_states(rf, authenticated_user, mock_agave_client):
+    now = timezone.now()
+    for i, job_id in enumerate(["1", "2", "3"]):
+        JobSubmission.objects.create(user=authenticated_user, jobId=job_id, time=now - timedelta(minutes=i))
+    mock_agave_client.jobs.list.return_value = [{"id": "1", "status": "FINISHED"}, {"id": "2", "status": "FAILED"}]
+
+    jobs = request_jobs_util(rf, authenticated_user, query_params={"limit": 2})
+
+    assert [job["id"] for job in jobs] == ["1", "2"]
+    mock_agave_client.jobs.list.assert_called_once_with(query={"id.in": "1,2"}, limit=2)
+    assert JobSubmission.objects.get(jobId="3").status == ""
+
+
+def test_get_jobs_skips_unknown_jobs_when_paginating(rf, authenticated_user, mock_agave_client):
+    now = timezone.now()
+    for i, (job_id, status) in enumerate([("1", "UNKNOWN"), ("2", "FINISHED"), ("3", "FAILED")]):
+        JobSubmission.objects.create(user=authenticated_user, jobId=job_id, status=status,
+                                     time=now - timedelta(minutes=i))
+
+    jobs = request_jobs_util(rf, authenticated_user, query_params={"limit": 2})
+
+    assert [job["id"] for job in jobs] == ["2", "3"]
+    mock_agave_client.jobs.list.assert_not_called()
 
 
 def test_get_jobs_bad_offset(rf, authenticated_user, mock_agave_client):
@@ -112,13 +389,37 @@ def test_get_jobs_bad_offset(rf, authenticated_user, mock_agave_client):
     assert len(jobs) == 0
 
 
+def test_get_jobs_fetches_missing_states(rf, authenticated_user, mock_agave_client):
+    JobSubmission.objects.create(user=authenticated_user, jobId="9876")
+    mock_agave_client.jobs.list.return_value = [{"id": "9876", "status": "FINISHED", "appId": "app-1.0"}]
+
+    jobs = request_jobs_util(rf, authenticated_user)
+
+    assert [(job["id"], job["status"]) for job in jobs] == [("9876", "FINISHED")]
+    assert JobSubmission.objects.get(jobId="9876").status == "FINISHED"
+    # Stored states are listed without Tapis.
+    request_jobs_util(rf, authenticated_user)
+    mock_agave_client.jobs.list.assert_called_once()
+
+
+def test_status_filter(rf, authenticated_user, mock_agave_client):
+    for job_id, status in [("1", "RUNNING"), ("2", "FINISHED"), ("3", "FAILED")]:
+        JobSubmission.objects.create(user=authenticated_user, jobId=job_id, status=status)
+
+    jobs = request_jobs_util(rf, authenticated_user, query_params={"status": "finished,failed"})
+
+    assert sorted(job["id"] for job in jobs) == ["2", "3"]
+    mock_agave_client.jobs.list.assert_not_called()
+
+
 def test_date_filter(rf, authenticated_user, mock_agave_client):
     test_time = timezone.now()
 
     # today_job
     JobSubmission.objects.create(
         user=authenticated_user,
-        jobId="9876"
+        jobId="9876",
+        status="FINISHED"
     )
     JobSubmission.objects.filter(jobId="9876").update(time=test_time)
 
@@ -126,6 +427,7 @@ def test_date_filter(rf, authenticated_user, mock_agave_client):
     JobSubmission.objects.create(
         user=authenticated_user,
         jobId="1234",
+        status="FINISHED"
     )
     JobSubmission.objects.filter(jobId="1234").update(time=test_time - timedelta(days=3))
 
@@ -133,6 +435,7 @@ def test_date_filter(rf, authenticated_user, mock_agave_client):
     JobSubmission.objects.create(
         user=authenticated_user,
         jobId="2345",
+        status="FINISHED"
     )
     JobSubmission.objects.filter(jobId="2345").update(time=test_time - timedelta(days=15))
 
@@ -140,16 +443,10 @@ def test_date_filter(rf, authenticated_user, mock_agave_client):
     JobSubmission.objects.create(
         user=authenticated_user,
         jobId="3456",
+        status="FINISHED"
     )
     JobSubmission.objects.filter(jobId="3456").update(time=test_time - timedelta(days=120))
 
-    mock_agave_client.jobs.list.return_value = [
-        {"id": "9876"},
-        {"id": "1234"},
-        {"id": "2345"},
-        {"id": "3456"}
-    ]
-
     # Test request for jobs with no period query param
     jobs = request_jobs_util(rf, authenticated_user)
     assert len(jobs) == 4
@@ -193,10 +490,10 @@ def test_get_appid_by_spec(authenticated_user, mock_agave_client):
     view = AppsTrayView()
     mock_agave_client.apps.list.return_value = [compress_01u1, compress_01u2]
     assert view.getAppIdBySpec(
-        MagicMock(name='compress', version='0.1'), authenticated_user) == 'compress-0.1u2'
+        MagicMock(name='compress', version='0.1'), mock_agave_client) == 'compress-0.1u2'
     mock_agave_client.apps.list.return_value = [compress_01u2, compress_02u1]
     assert view.getAppIdBySpec(
-        MagicMock(name='compress', version='0.1'), authenticated_user) == 'compress-0.2u1'
+        MagicMock(name='compress', version='0.1'), mock_agave_client) == 'compress-0.2u1'
 
 
 def test_get_app(mocker, authenticated_user):
@@ -253,7 +550,61 @@ def test_get_public_apps(django_db_setup, django_db_blocker, mocker,
     assert len(AppTrayCategory.objects.all()) == 3
     mocker.patch.object(AppsTrayView, 'getApp')
     view = AppsTrayView()
-    categories, definitions = view.getPublicApps(authenticated_user)
+    categories, definitions, timings = view.getPublicApps(authenticated_user)
     assert len(categories) == 3
     assert categories[0]['title'] == 'Simulation'
     assert len(categories[0]['apps']) == 1
+    assert all(timing['status'] == 'ok' for timing in timings)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_get_public_apps_timeout(django_db_setup, django_db_blocker, mocker, settings, authenticated_user,
+                                 mock_agave_client):
+    with django_db_blocker.unblock():
+        call_command('loaddata', 'app-tray.json')
+    settings.PORTAL_APPS_TRAY_TIMEOUT = 0.1
+    release = threading.Event()
+
+    def resolve(app, client):
+        assert client is mock_agave_client
+        if app.name == 'namd-frontera':
+            release.wait(5)
+        return {'label': app.label, 'appId': '{}-1.0'.format(app.name), 'took': 1, 'status': 'ok', 'error': None}
+    mocker.patch.object(AppsTrayView, 'resolveAppId', side_effect=resolve)
+    mock_push = mocker.patch('portal.apps.workspace.api.views._push_tray_update')
+
+    categories, definitions, timings = AppsTrayView().getPublicApps(authenticated_user)
+
+    placeholder = categories[0]['apps'][0]
+    assert placeholder['loading'] is True
+    assert placeholder['appId'] is None
+    assert [timing['status'] for timing in timings].count('loading') == 1
+    mock_push.assert_not_called()
+    release.set()
+    for _ in range(50):
+        if mock_push.called:
+            break
+        time.sleep(0.1)
+    assert mock_push.call_args[0][:3] == (authenticated_user.username, 'Simulation', placeholder['trayEntryId'])
+
+
+def test_push_tray_update(mocker):
+    mock_layer = mocker.patch('portal.apps.workspace.api.views.get_channel_layer').return_value
+    mock_async_to_sync = mocker.patch('portal.apps.workspace.api.views.async_to_sync')
+    mock_send = mock_async_to_sync.return_value
+    future = MagicMock()
+    future.result.return_value = {'label': 'NAMD', 'appId': 'namd-1.0', 'took': 5000, 'status': 'ok', 'error': None}
+
+    _push_tray_update('username', 'Simulation', 1, {'label': 'NAMD', 'appId': None, 'loading': True}, future)
+
+    mock_send.assert_called_once_with('username', {
+        'type': 'portal_notification',
+        'body': {
+            'event_type': 'apps_tray_update',
+            'category': 'Simulation',
+            'trayEntryId': 1,
+            'app': {'label': 'NAMD', 'appId': 'namd-1.0', 'loading': False},
+            'timing': future.result.return_value
+        }
+    })
+    mock_async_to_sync.assert_called_once_with(mock_layer.group_send)
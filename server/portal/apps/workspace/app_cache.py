@@ -0,0 +1,159 @@
+"""
+.. module: portal.apps.workspace.app_cache
+   :synopsis: Cache of Tapis app definitions for the app tray and app forms.
+
+App tray specs resolved to app IDs, app definitions with their execution
+system, and private app listings are stored in Redis under a cache version.
+Bumping the version, which happens when an app tray entry resolves to a new
+app (its ``lastRetrieved`` changes), drops every entry at once.
+
+Public apps are cached for every user for ``settings.PORTAL_APP_CACHE_TTL``
+seconds and kept warm by :func:`portal.apps.workspace.tasks.warm_app_cache`.
+Anything else is cached per user for ``settings.PORTAL_APP_CACHE_USER_TTL``
+seconds.
+"""
+import json
+import logging
+import redis
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from portal.libs import cache
+from portal.libs.agave.models.systems.execution import ExecutionSystem
+
+# pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+# pylint: enable=invalid-name
+
+CACHE_NAME = 'apps'
+VERSION_KEY = 'app-cache:version'
+
+
+def enabled():
+    return settings.PORTAL_APP_CACHE_TTL > 0
+
+
+def _version():
+    return int(cache.get_redis().get(VERSION_KEY) or 0)
+
+
+def _key(version, kind, name, username=None):
+    return 'apps:{}:{}:{}:{}'.format(version, kind, username or '*', name)
+
+
+def _dumps(value):
+    return json.dumps(value, cls=DjangoJSONEncoder)
+
+
+def get_or_set(kind, name, compute, username=None, is_shared=None):
+    """Return a cached value, or compute and cache it on a miss.
+
+    :param str kind: Kind of value, e.g. ``'app'``.
+    :param str name: Name of the value within its kind, e.g. an app ID.
+    :param compute: Callable returning the value.
+    :param str username: User the value is cached for when it is not shared.
+    :param is_shared: Callable telling whether a computed value can be
+        cached for every user. Values are shared if omitted, and never
+        shared if it is omitted and a username is given.
+    """
+    if not enabled():
+        return compute()
+    try:
+        version = _version()
+        keys = [_key(version, kind, name)]
+        if username:
+            keys.append(_key(version, kind, name, username))
+        values = cache.get_redis().mget(keys)
+    except redis.RedisError:
+        logger.warning('App cache unavailable, loading %s %s from Tapis', kind, name)
+        return compute()
+    for value in values:
+        if value is not None:
+            cache.record(CACHE_NAME, 'hits')
+            return json.loads(value)
+    cache.record(CACHE_NAME, 'misses')
+
+    value = compute()
+    shared = is_shared(value) if is_shared is not None else not username
+    try:
+        if shared:
+            cache.get_redis().set(_key(version, kind, name), _dumps(value), ex=settings.PORTAL_APP_CACHE_TTL)
+        elif username:
+            cache.get_redis().set(_key(version, kind, name, username), _dumps(value),
+                                  ex=settings.PORTAL_APP_CACHE_USER_TTL)
+    except redis.RedisError:
+        logger.warning('Unable to cache %s %s', kind, name)
+    return value
+
+
+def set_shared(kind, name, value):
+    """Cache a value for every user, replacing any cached value."""
+    if not enabled():
+        return
+    try:
+        cache.get_redis().set(_key(_version(), kind, name), _dumps(value), ex=settings.PORTAL_APP_CACHE_TTL)
+    except redis.RedisError:
+        logger.warning('Unable to cache %s %s', kind, name)
+
+
+def invalidate():
+    """Drop every cached entry by moving to a new cache version."""
+    if not enabled():
+        return
+    try:
+        cache.get_redis().incr(VERSION_KEY)
+    except redis.RedisError:
+        logger.exception('Unable to invalidate the app cache')
+
+
+def spec_name(app):
+    """Cache name of an app tray entry's app specification."""
+    return '{}-{}u{}'.format(app.name, app.version or 'latest', app.revision or 'latest')
+
+
+def app_id_by_spec(client, app):
+    """Resolve an app tray entry to the ID of the latest public app that
+    matches its name and, if given, version and revision.
+    """
+    query = {
+        "name": app.name,
+        "isPublic": True
+    }
+    if app.version and len(app.version):
+        query['version'] = app.version
+    if app.revision and len(app.revision):
+        query['revision'] = app.revision
+    app_list = client.apps.list(query=query)
+    app_list.sort(
+        key=lambda app_def: [int(u) for u in app_def['version'].split('.')] + [int(app_def['revision'])]
+    )
+    return app_list[-1]['id']
+
+
+def load_app(client, app_id):
+    """Load an app definition and its execution system from Tapis.
+
+    :return: ``{'definition': dict, 'exec_sys': dict}``, with ``maxNodes``
+        of parallel apps set from the app's default queue.
+    """
+    data = {'definition': client.apps.get(appId=app_id)}
+
+    exec_sys = ExecutionSystem(client, data['definition']['executionSystem'])
+    data['exec_sys'] = exec_sys.to_dict()
+
+    # set maxNodes from system queue for app
+    if (data['definition']['parallelism'] == 'PARALLEL') and ('defaultQueue' in data['definition']):
+        for queue in exec_sys.queues.all():
+            if queue.name == data['definition']['defaultQueue']:
+                data['definition']['maxNodes'] = queue.maxNodes
+                break
+    return data
+
+
+def is_public_app(data):
+    """Whether a :func:`load_app` result can be shared by every user."""
+    return bool(data['definition'].get('isPublic') and data['exec_sys'].get('public'))
+
+
+def stats():
+    """App cache hit/miss counters. See :func:`portal.libs.cache.stats`."""
+    return cache.stats(CACHE_NAME)
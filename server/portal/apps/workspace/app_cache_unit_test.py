@@ -0,0 +1,68 @@
+import json
+import pytest
+from mock import MagicMock
+from portal.apps.workspace import app_cache
+from portal.apps.workspace.api.views import AppsTrayView
+from portal.apps.workspace.models import AppTrayCategory, AppTrayEntry
+from portal.apps.workspace.tasks import warm_app_cache
+
+
+@pytest.fixture
+def mock_redis(mocker, settings):
+    settings.PORTAL_APP_CACHE_TTL = 60
+    settings.PORTAL_APP_CACHE_USER_TTL = 10
+    mock_redis = mocker.patch('portal.libs.cache.get_redis').return_value
+    mock_redis.get.return_value = b'3'
+    yield mock_redis
+
+
+def test_get_or_set_hit(mock_redis):
+    mock_redis.mget.return_value = [None, json.dumps({'id': 'app-1.0'})]
+    compute = MagicMock()
+
+    assert app_cache.get_or_set('app', 'app-1.0', compute, username='username') == {'id': 'app-1.0'}
+    mock_redis.mget.assert_called_with(['apps:3:app:*:app-1.0', 'apps:3:app:username:app-1.0'])
+    compute.assert_not_called()
+
+
+def test_get_or_set_miss(mock_redis):
+    mock_redis.mget.return_value = [None, None]
+
+    app_cache.get_or_set('app', 'app-1.0', lambda: {'public': True}, username='username',
+                         is_shared=lambda value: value['public'])
+    mock_redis.set.assert_called_with('apps:3:app:*:app-1.0', json.dumps({'public': True}), ex=60)
+
+    app_cache.get_or_set('app', 'app-1.0', lambda: {'public': False}, username='username',
+                         is_shared=lambda value: value['public'])
+    mock_redis.set.assert_called_with('apps:3:app:username:app-1.0', json.dumps({'public': False}), ex=10)
+
+
+def test_get_app_id_invalidates_on_new_revision(mocker, authenticated_user):
+    mock_invalidate = mocker.patch('portal.apps.workspace.app_cache.invalidate')
+    mocker.patch.object(AppsTrayView, 'getAppIdBySpec', return_value='compress-0.1u2')
+    app = MagicMock(appId=None, lastRetrieved='compress-0.1u1')
+
+    assert AppsTrayView().getAppId(app, authenticated_user) == 'compress-0.1u2'
+    assert app.lastRetrieved == 'compress-0.1u2'
+    mock_invalidate.assert_called_once()
+
+
+@pytest.mark.django_db
+def test_warm_app_cache(mocker):
+    mocker.patch('portal.libs.agave.utils.service_account')
+    mocker.patch('portal.apps.workspace.app_cache.app_id_by_spec', return_value='compress-0.2u1')
+    mock_load = mocker.patch('portal.apps.workspace.app_cache.load_app')
+    mock_load.return_value = {'definition': {'isPublic': True}, 'exec_sys': {'public': True}}
+    mock_set = mocker.patch('portal.apps.workspace.app_cache.set_shared')
+    mock_invalidate = mocker.patch('portal.apps.workspace.app_cache.invalidate')
+    category = AppTrayCategory.objects.create(category='Simulation')
+    AppTrayEntry.objects.create(category=category, name='compress', version='latest', label='Compress',
+                                lastRetrieved='compress-0.1u1')
+    AppTrayEntry.objects.create(category=category, appType='html', htmlId='jupyter', label='Jupyter')
+
+    assert warm_app_cache() == 1
+
+    mock_invalidate.assert_called_once()
+    assert AppTrayEntry.objects.get(name='compress').lastRetrieved == 'compress-0.2u1'
+    mock_set.assert_any_call('spec', 'compress-latestulatest', 'compress-0.2u1')
+    mock_set.assert_any_call('app', 'compress-0.2u1', mock_load.return_value)
@@ -1,41 +1,65 @@
-import logging
-from django.core.management import BaseCommand, CommandError
-from django.conf import settings
+from django.core.management import BaseCommand
 from portal.libs.agave.utils import service_account
 from django.contrib.auth import get_user_model
 from portal.apps.workspace.models import JobSubmission
 import dateutil.parser
 
+PAGE_SIZE = 100
+
+
 class Command(BaseCommand):
     """
     This command imports the job histories for all existing users from the Agave
     tenant to the JobSubmission model. This populates the job history from the tenant
     as if this portal submitted them. (The originating portal cannot be determined
     from the tenant respnose.)
+
+    The state of jobs that are already recorded (status, app, timestamps and
+    archive location) is refreshed as well, so running this command backfills
+    the job states that the job history is listed from. Recorded jobs that
+    the tenant no longer has are marked with an UNKNOWN status.
     """
 
-    help = "Import all jobs from the tenant into JobSubmission history."
+    help = "Import all jobs from the tenant into JobSubmission history, and refresh the state of existing ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Only import the jobs of this user.')
 
     def handle(self, *args, **options):
         agave = service_account()
         users = get_user_model().objects.all()
+        if options.get('username'):
+            users = users.filter(username=options['username'])
         print("Importing jobs for users...")
         for user in users:
-            userjobs = list(JobSubmission.objects.filter(user=user))
+            userjobs = {job.jobId: job for job in JobSubmission.objects.filter(user=user)}
             done = False
             offset = 0
             total = 0
             while not done:
-                jobs = agave.jobs.list(query={"owner": user.username }, offset=offset, limit=100)
+                jobs = agave.jobs.list(query={"owner": user.username}, offset=offset, limit=PAGE_SIZE)
+                created = []
+                updated = []
                 for job in jobs:
-                    if not any(existing.jobId == job["id"] for existing in userjobs):
-                        job = JobSubmission(
+                    existing = userjobs.get(job["id"])
+                    if existing is None:
+                        existing = JobSubmission(
                             user=user,
                             jobId=job["id"],
                             time=dateutil.parser.parse(job["created"])
                         )
-                        job.save()
-                offset += 100
-                done = len(jobs) < 100
+                        userjobs[job["id"]] = existing
+                        created.append(existing)
+                    elif existing.pk is not None:
+                        updated.append(existing)
+                    existing.update_from_job(job)
+                JobSubmission.objects.bulk_create(created)
+                JobSubmission.objects.bulk_update(updated, [
+                    'name', 'appId', 'status', 'created', 'lastUpdated', 'remoteStarted', 'ended',
+                    'archiveSystem', 'archivePath', 'archiveDataHref'
+                ])
+                offset += PAGE_SIZE
+                done = len(jobs) < PAGE_SIZE
                 total += len(jobs)
+            JobSubmission.objects.filter(user=user, status='').update(status=JobSubmission.UNKNOWN)
             print("{} jobs for {}".format(total, user.username))
@@ -26,18 +26,23 @@ class TestImportJobs(TransactionTestCase):
             user=self.user
         )
         existing.save()
+        JobSubmission.objects.create(jobId="9876", user=self.user)
         self.mock_client.return_value.jobs.list.return_value = [
             {
                 "id": "1234",
-                "created": "2019-10-29T18:30:13Z"
+                "created": "2019-10-29T18:30:13Z",
+                "status": "FINISHED"
             },
             {
                 "id": "5678",
-                "created": "2019-10-29T19:30:13Z"
+                "created": "2019-10-29T19:30:13Z",
+                "status": "RUNNING"
             }
         ]
 
         call_command('import-jobs')
 
         result = JobSubmission.objects.all().filter(user=self.user)
-        self.assertEqual(len(result), 2)
+        self.assertEqual(len(result), 3)
+        self.assertEqual({job.jobId: job.status for job in result},
+                         {"1234": "FINISHED", "5678": "RUNNING", "9876": "UNKNOWN"})
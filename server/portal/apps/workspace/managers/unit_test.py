@@ -7,6 +7,7 @@ from django.contrib.auth import get_user_model
 import pytest
 
 from portal.apps.workspace.managers.user_applications import UserApplicationsManager
+from portal.apps.workspace.models import ClonedApp
 from portal.libs.agave.models.applications import Application
 from portal.libs.agave.models.systems.execution import ExecutionSystem
 
@@ -105,3 +106,44 @@ class TestUserApplicationsManager(TransactionTestCase):
         cloned_app = Application(mock_client)
 
         self.assertTrue(self.user_application_manager.check_app_for_updates(cloned_app=cloned_app, host_app=host_app))
+
+    def test_get_or_create_app_records_validated_app(self):
+        host_def = {'id': 'app-1.0u3', 'revision': 3, 'executionSystem': 'host.system'}
+        user_app = Application(self.magave, id='username-app-1.0u3', owner='username', revision=1, load=False)
+        exec_sys = ExecutionSystem.from_dict(self.magave, self.execution_sys)
+        self.magave.apps.get.return_value = host_def
+        with patch.object(UserApplicationsManager, 'validate_app',
+                          return_value=(user_app, exec_sys)) as mock_validate:
+            app = self.user_application_manager.get_or_create_app('app-1.0u3', 'TACC-ACI')
+            self.assertEqual(app.id, 'username-app-1.0u3')
+
+            app = self.user_application_manager.get_or_create_app('app-1.0u3', 'TACC-ACI')
+            self.assertEqual(mock_validate.call_count, 1)
+            self.assertEqual(app.id, 'username-app-1.0u3')
+            self.assertEqual(app.execution_system, exec_sys.id)
+            self.assertFalse(app.exec_sys)
+            self.assertTrue(app.recorded)
+
+    def test_get_or_create_app_revalidates_on_new_revision(self):
+        user = get_user_model().objects.get(username='username')
+        ClonedApp.objects.create(user=user, hostAppId='app-1.0u3', hostRevision=2, allocation='TACC-ACI',
+                                 appId='username-app-1.0u3', execSystemId='old.system')
+        host_def = {'id': 'app-1.0u3', 'revision': 3, 'executionSystem': 'host.system'}
+        user_app = Application(self.magave, id='username-app-1.0u3', owner='username', revision=2, load=False)
+        exec_sys = ExecutionSystem.from_dict(self.magave, self.execution_sys)
+        self.magave.apps.get.return_value = host_def
+        with patch.object(UserApplicationsManager, 'validate_app',
+                          return_value=(user_app, exec_sys)) as mock_validate:
+            self.user_application_manager.get_or_create_app('app-1.0u3', 'TACC-ACI')
+        self.magave.apps.get.assert_any_call(appId='app-1.0u3')
+        mock_validate.assert_called_once_with('app-1.0u3', 'TACC-ACI')
+        cloned = ClonedApp.objects.get(user=user, hostAppId='app-1.0u3', allocation='TACC-ACI')
+        self.assertEqual(cloned.hostRevision, 3)
+        self.assertEqual(cloned.execSystemId, exec_sys.id)
+
+    def test_forget_app(self):
+        user = get_user_model().objects.get(username='username')
+        ClonedApp.objects.create(user=user, hostAppId='app-1.0u3', hostRevision=3, allocation='TACC-ACI',
+                                 appId='username-app-1.0u3', execSystemId='exec.system')
+        self.user_application_manager.forget_app('username-app-1.0u3')
+        self.assertFalse(ClonedApp.objects.filter(user=user).exists())
@@ -12,6 +12,7 @@ from django.conf import settings
 from portal.libs.agave.models.systems.execution import ExecutionSystem
 from portal.libs.agave.models.applications import Application
 from portal.apps.workspace.managers.base import AbstractApplicationsManager
+from portal.apps.workspace.models import ClonedApp
 from portal.apps.accounts.managers.user_systems import UserSystemsManager
 
 # pylint: disable=invalid-name
@@ -237,6 +238,11 @@ class UserApplicationsManager(AbstractApplicationsManager):
         else clone the app to the same exec system with the
         specified allocation.
 
+        The app and execution system are recorded per host app and
+        allocation once validated, and reused with only a lookup of the
+        host app until its revision changes. Reused apps are flagged as
+        ``recorded``: their execution system keys were not tested.
+
         ..note: Entry point.
 
         :param str appId: Agave id of application selected to run
@@ -245,6 +251,35 @@ class UserApplicationsManager(AbstractApplicationsManager):
         :returns: Application instance
         :rtype: class Application
         """
+        # Not read from the app cache, which may still hold an older revision.
+        host_def = self.client.apps.get(appId=appId)
+        revision = host_def.get('revision')
+        cloned = ClonedApp.objects.filter(user=self.user, hostAppId=appId, allocation=allocation).first()
+        if cloned and revision is not None and cloned.hostRevision == revision:
+            logger.debug('Using recorded app {} for {}'.format(cloned.appId, appId))
+            app = Application.from_dict(self.client, dict(host_def, id=cloned.appId,
+                                                          executionSystem=cloned.execSystemId))
+            app.recorded = True
+            return app
+
+        app, exec_sys = self.validate_app(appId, allocation)
+        if not app.exec_sys and revision is not None:
+            ClonedApp.objects.update_or_create(
+                user=self.user, hostAppId=appId, allocation=allocation,
+                defaults={'hostRevision': revision, 'appId': app.id, 'execSystemId': exec_sys.id}
+            )
+        return app
+
+    def validate_app(self, appId, allocation):
+        """Gets or creates application for user, validating the cloned app
+        and execution system against the host app.
+
+        :param str appId: Agave id of application selected to run
+        :param str allocation: Project alloction for app to run on
+
+        :returns: Application and ExecutionSystem instances
+        :rtype: tuple
+        """
 
         host_app = self.get_application(appId)
 
@@ -265,7 +300,15 @@ class UserApplicationsManager(AbstractApplicationsManager):
                 logger.info('System {} needs new keys.'.format(exec_sys.id))
                 app.exec_sys = exec_sys
 
-        return app
+        return app, exec_sys
+
+    def forget_app(self, appId):
+        """Drops recorded apps that jobs were submitted with as `appId`, so
+        that the next submission validates them again.
+
+        :param str appId: Agave id of the cloned or owned application
+        """
+        ClonedApp.objects.filter(user=self.user, appId=appId).delete()
 
     def clone_execution_system(self, host_system_id, new_system_id, alloc):
         """Clone execution system for user.
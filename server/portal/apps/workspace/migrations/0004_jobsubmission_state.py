@@ -0,0 +1,76 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workspace', '0003_apptraycategory_apptrayentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobsubmission',
+            name='appId',
+            field=models.CharField(blank=True, default='', max_length=300),
+        ),
+        migrations.AddField(
+            model_name='jobsubmission',
+            name='archiveDataHref',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='jobsubmission',
+            name='archivePath',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='jobsubmission',
+            name='archiveSystem',
+            field=models.CharField(blank=True, default='', max_length=300),
+        ),
+        migrations.AddField(
+            model_name='jobsubmission',
+            name='created',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='jobsubmission',
+            name='ended',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='jobsubmission',
+            name='lastUpdated',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='jobsubmission',
+            name='name',
+            field=models.CharField(blank=True, default='', max_length=300),
+        ),
+        migrations.AddField(
+            model_name='jobsubmission',
+            name='remoteStarted',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='jobsubmission',
+            name='status',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='jobsubmission',
+            name='jobId',
+            field=models.CharField(db_index=True, max_length=300),
+        ),
+        migrations.AddIndex(
+            model_name='jobsubmission',
+            index=models.Index(fields=['user', '-time'], name='workspace_j_user_id_d1a4c3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='jobsubmission',
+            index=models.Index(fields=['user', 'status', '-time'], name='workspace_j_user_id_174190_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('workspace', '0004_jobsubmission_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClonedApp',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hostAppId', models.CharField(max_length=300)),
+                ('hostRevision', models.IntegerField()),
+                ('allocation', models.CharField(max_length=64)),
+                ('appId', models.CharField(max_length=300)),
+                ('execSystemId', models.CharField(max_length=300)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'hostAppId', 'allocation')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('workspace', '0005_clonedapp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobSubmissionTicket',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('idempotencyKey', models.CharField(blank=True, max_length=255, null=True)),
+                ('stage', models.CharField(default='queued', max_length=32)),
+                ('job', models.TextField()),
+                ('jobId', models.CharField(blank=True, default='', max_length=300)),
+                ('response', models.TextField(blank=True, default='')),
+                ('message', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'idempotencyKey')},
+            },
+        ),
+    ]
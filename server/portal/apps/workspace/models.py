@@ -1,12 +1,50 @@
+import json
+import uuid
+from datetime import datetime
+import dateutil.parser
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
 
 
+def _parse_time(value):
+    """Parse a Tapis timestamp, which may already be a datetime."""
+    if not value or value == 'None':
+        return None
+    if isinstance(value, datetime):
+        return value
+    return dateutil.parser.parse(value)
+
+
+def _format_time(value):
+    return value.isoformat() if value is not None else None
+
+
+class JobSubmissionManager(models.Manager):
+
+    def record(self, user, job):
+        """Create or update the submission of a Tapis job by `user`."""
+        submission = self.filter(user=user, jobId=job['id']).first() or \
+            self.model(user=user, jobId=job['id'])
+        submission.update_from_job(job)
+        submission.save()
+        return submission
+
+    def update_state(self, job, **filters):
+        """Update the stored state of the existing submissions of a Tapis job."""
+        submissions = list(self.filter(jobId=job['id'], **filters))
+        for submission in submissions:
+            if submission.update_from_job(job):
+                submission.save()
+        return submissions
+
+
 class JobSubmission(models.Model):
     """Job Submission
 
-    Used for tracking jobs that originate from this portal for filtering purposes
+    Used for tracking jobs that originate from this portal for filtering purposes.
+    The state of each job is kept up to date by the jobs webhook, so that job
+    history can be listed without querying Tapis.
     """
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -18,7 +56,159 @@ class JobSubmission(models.Model):
     time = models.DateTimeField(default=timezone.now)
 
     # ID of job returned from Agave
-    jobId = models.CharField(max_length=300)
+    jobId = models.CharField(max_length=300, db_index=True)
+
+    # Job state, as last reported by Tapis. An empty status means the state
+    # has not been retrieved yet, and UNKNOWN that Tapis no longer has the job.
+    UNKNOWN = 'UNKNOWN'
+    name = models.CharField(max_length=300, blank=True, default='')
+    appId = models.CharField(max_length=300, blank=True, default='')
+    status = models.CharField(max_length=32, blank=True, default='')
+    created = models.DateTimeField(null=True, blank=True)
+    lastUpdated = models.DateTimeField(null=True, blank=True)
+    remoteStarted = models.DateTimeField(null=True, blank=True)
+    ended = models.DateTimeField(null=True, blank=True)
+    archiveSystem = models.CharField(max_length=300, blank=True, default='')
+    archivePath = models.TextField(blank=True, default='')
+    archiveDataHref = models.TextField(blank=True, default='')
+
+    objects = JobSubmissionManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-time']),
+            models.Index(fields=['user', 'status', '-time']),
+        ]
+
+    def update_from_job(self, job):
+        """Update the stored state from a Tapis job or job listing entry.
+
+        Returns False, leaving the state as is, if `job` is older than the
+        stored state, which happens when webhook notifications arrive out of
+        order.
+        """
+        last_updated = _parse_time(job.get('lastUpdated'))
+        if last_updated and self.lastUpdated and last_updated < self.lastUpdated:
+            return False
+        self.lastUpdated = last_updated or self.lastUpdated
+        for field in ('name', 'appId', 'status', 'archiveSystem', 'archivePath'):
+            if job.get(field):
+                setattr(self, field, job[field])
+        for field in ('created', 'remoteStarted', 'ended'):
+            value = _parse_time(job.get(field))
+            if value is not None:
+                setattr(self, field, value)
+        href = job.get('_links', {}).get('archiveData', {}).get('href')
+        if href:
+            self.archiveDataHref = href
+        return True
+
+    def to_dict(self):
+        """Job in the format of a Tapis job listing entry."""
+        job = {
+            'id': self.jobId,
+            'name': self.name,
+            'appId': self.appId,
+            'status': self.status,
+            'created': _format_time(self.created or self.time),
+            'lastUpdated': _format_time(self.lastUpdated),
+            'remoteStarted': _format_time(self.remoteStarted),
+            'ended': _format_time(self.ended),
+            'archiveSystem': self.archiveSystem,
+            'archivePath': self.archivePath,
+            '_links': {'archiveData': {'href': self.archiveDataHref}}
+        }
+        if self.archiveSystem:
+            job['outputLocation'] = '{}/{}'.format(self.archiveSystem, self.archivePath)
+        return job
+
+
+class JobSubmissionTicket(models.Model):
+    """Job Submission Ticket
+
+    A job submitted in the background by
+    :func:`portal.apps.workspace.tasks.submit_job`. The ticket goes through the
+    ``clone_app``, ``check_keys`` and ``submit`` stages and ends up
+    ``submitted``, ``keys_required`` if the user must push keys to the app's
+    execution system first, or ``failed``.
+
+    Tickets created with the same idempotency key by a user are the same
+    submission, so a repeated request does not submit the job twice, unless
+    the ticket is stuck, in which case it is queued again.
+    """
+    QUEUED = 'queued'
+    CLONE_APP = 'clone_app'
+    CHECK_KEYS = 'check_keys'
+    SUBMIT = 'submit'
+    SUBMITTED = 'submitted'
+    KEYS_REQUIRED = 'keys_required'
+    FAILED = 'failed'
+    DONE = (SUBMITTED, KEYS_REQUIRED, FAILED)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="+",
+        on_delete=models.CASCADE
+    )
+    idempotencyKey = models.CharField(max_length=255, null=True, blank=True)
+    stage = models.CharField(max_length=32, default=QUEUED)
+    # Job definition to submit, as JSON
+    job = models.TextField()
+    # ID of the submitted job
+    jobId = models.CharField(max_length=300, blank=True, default='')
+    # Tapis submission response, or the execution system to push keys to, as JSON
+    response = models.TextField(blank=True, default='')
+    message = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [['user', 'idempotencyKey']]
+
+    @property
+    def done(self):
+        return self.stage in self.DONE
+
+    def to_dict(self):
+        return {
+            'ticket': str(self.id),
+            'stage': self.stage,
+            'done': self.done,
+            'jobId': self.jobId or None,
+            'message': self.message,
+            'response': json.loads(self.response) if self.response else None
+        }
+
+    def __str__(self):
+        return "%s: %s (%s)" % (self.user, self.id, self.stage)
+
+
+class ClonedApp(models.Model):
+    """Cloned App
+
+    The app and execution system a user's jobs for a host app are submitted
+    with, under an allocation. Recorded once the clone has been validated
+    against the host app's revision, so later submissions for the same
+    revision can skip validation.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="+",
+        on_delete=models.CASCADE
+    )
+    hostAppId = models.CharField(max_length=300)
+    hostRevision = models.IntegerField()
+    allocation = models.CharField(max_length=64)
+    appId = models.CharField(max_length=300)
+    execSystemId = models.CharField(max_length=300)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [['user', 'hostAppId', 'allocation']]
+
+    def __str__(self):
+        return "%s: %s (%s) -> %s" % (self.user, self.hostAppId, self.allocation, self.appId)
 
 
 class AppTrayCategory(models.Model):
@@ -16,6 +16,41 @@ def test_job_submission_model(django_db_reset_sequences, regular_user):
     assert event.jobId == "1234"
 
 
+def test_job_submission_update_from_job(django_db_reset_sequences, regular_user):
+    job = JobSubmission.objects.record(regular_user, {
+        "id": "1234",
+        "name": "test-job",
+        "appId": "app-1.0",
+        "status": "RUNNING",
+        "created": "2020-01-01T10:00:00.000-05:00",
+        "lastUpdated": "2020-01-01T10:05:00.000-05:00",
+        "archiveSystem": "test.system",
+        "archivePath": "archive/test-job"
+    })
+    # Notifications that arrive out of order do not overwrite newer states.
+    JobSubmission.objects.update_state({"id": "1234", "status": "QUEUED",
+                                        "lastUpdated": "2020-01-01T10:01:00.000-05:00"})
+    JobSubmission.objects.update_state({"id": "1234", "status": "FINISHED",
+                                        "lastUpdated": "2020-01-01T10:10:00.000-05:00",
+                                        "ended": "2020-01-01T10:10:00.000-05:00"})
+
+    job = JobSubmission.objects.get(pk=job.pk)
+    assert job.to_dict() == {
+        "id": "1234",
+        "name": "test-job",
+        "appId": "app-1.0",
+        "status": "FINISHED",
+        "created": "2020-01-01T15:00:00+00:00",
+        "lastUpdated": "2020-01-01T15:10:00+00:00",
+        "remoteStarted": None,
+        "ended": "2020-01-01T15:10:00+00:00",
+        "archiveSystem": "test.system",
+        "archivePath": "archive/test-job",
+        "_links": {"archiveData": {"href": ""}},
+        "outputLocation": "test.system/archive/test-job"
+    }
+
+
 def test_app_tray_models(django_db_reset_sequences):
     category = AppTrayCategory.objects.create(
         category="test_category"
@@ -1,59 +1,299 @@
+import json
+import logging
+from urllib.parse import urlparse
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 from agavepy.agave import AgaveException
 from celery import shared_task
 from requests import ConnectionError, HTTPError
-import logging
 from portal.apps.notifications.models import Notification
 from portal.apps.search.tasks import agave_indexer
+from portal.apps.workspace.utils import get_app_license_type
+from portal.exceptions.api import ApiException
+from portal.utils.translations import url_parse_inputs
 
 logger = logging.getLogger(__name__)
 
-class JobSubmitError(Exception):
+SERVICE_INTERRUPTION = ('We were unable to submit your job at this time due '
+                        'to a Job Service Interruption. Please try again later.')
+
+
+def _is_transient(exc):
+    """Whether a Tapis request failed because the service is unavailable."""
+    if isinstance(exc, ConnectionError):
+        return True
+    return isinstance(exc, HTTPError) and exc.response is not None and exc.response.status_code >= 500
 
-    def __init__(self, *args, **kwargs):
-        self.status = kwargs.pop('status', 'error')
-        self.status_code = kwargs.pop('status_code', 500)
-        self.message = kwargs.pop('message', None)
 
-    def json(self):
-        return {
-            'status': getattr(self, 'status', 'error'),
-            'message': getattr(self, 'message', None)
+def _error_message(exc):
+    if _is_transient(exc):
+        return SERVICE_INTERRUPTION
+    if isinstance(exc, ApiException):
+        return exc.response.reason
+    if isinstance(exc, HTTPError) and exc.response is not None:
+        try:
+            return exc.response.json().get('message') or str(exc)
+        except ValueError:
+            return str(exc)
+    return 'An error occurred while submitting your job.'
+
+
+def _push_submission_update(username, ticket):
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+    async_to_sync(get_channel_layer().group_send)(
+        username,
+        {
+            'type': 'portal_notification',
+            'body': dict(ticket.to_dict(), event_type='job_submission')
         }
+    )
+
+
+def _set_stage(ticket, stage, **fields):
+    """Move a submission ticket to `stage` and tell its user."""
+    ticket.stage = stage
+    for name, value in fields.items():
+        setattr(ticket, name, value)
+    ticket.save()
+    try:
+        _push_submission_update(ticket.user.username, ticket)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('Error sending job submission update to %s', ticket.user.username)
+
+
+def prepare_job(user, job_post):
+    """Fill in the archive location and app license of a job, and URL encode
+    its inputs.
+
+    :raises ApiException: if the user is missing the app's license.
+    """
+    from portal.apps.accounts.managers.user_systems import UserSystemsManager
+    from portal.apps.licenses.models import get_license_info
+    default_sys = UserSystemsManager(
+        user,
+        settings.PORTAL_DATA_DEPOT_LOCAL_STORAGE_SYSTEM_DEFAULT
+    )
+
+    # cleaning archive path value
+    if job_post.get('archivePath'):
+        parsed = urlparse(job_post['archivePath'])
+        if parsed.path.startswith('/') and len(parsed.path) > 1:
+            # strip leading '/'
+            archive_path = parsed.path[1:]
+        elif parsed.path == '':
+            # if path is blank, set to root of system
+            archive_path = '/'
+        else:
+            archive_path = parsed.path
+
+        job_post['archivePath'] = archive_path
+
+        if parsed.netloc:
+            job_post['archiveSystem'] = parsed.netloc
+        else:
+            job_post['archiveSystem'] = default_sys.get_system_id()
+    else:
+        job_post['archivePath'] = \
+            'archive/jobs/{}/${{JOB_NAME}}-${{JOB_ID}}'.format(
+                timezone.now().strftime('%Y-%m-%d'))
+        job_post['archiveSystem'] = default_sys.get_system_id()
+
+    # check for running licensed apps
+    lic_type = get_app_license_type(job_post['appId'])
+    if lic_type is not None:
+        _, license_models = get_license_info()
+        license_model = [x for x in license_models if x.license_type == lic_type][0]
+        lic = license_model.objects.filter(user=user).first()
+        if not lic:
+            raise ApiException("You are missing the required license for this application.")
+        job_post['parameters']['_license'] = lic.license_as_str()
+
+    # url encode inputs
+    if job_post['inputs']:
+        job_post = url_parse_inputs(job_post)
+    return job_post
+
 
+def _recover_submission(user, ticket):
+    """Look for the job Tapis created for a ticket whose submission was
+    interrupted, and mark the ticket submitted if there is one.
 
-def submit_job(request, username, job_post):
-    logger.info('Submitting job for user=%s: %s' % (username, job_post))
+    Tapis may create a job even if the request to submit it failed, so the
+    job is looked up by its name among the user's jobs created since the
+    ticket was.
 
+    :returns: Whether the job was found.
+    """
+    from portal.apps.workspace.models import JobSubmission, JobSubmissionTicket
     try:
-        user = get_user_model().objects.get(username=username)
-        agave = user.agave_oauth.client
-        response = agave.jobs.submit(body=job_post)
-        logger.debug('Job Submission Response: {}'.format(response))
-
-        return response
-
-    except ConnectionError as e:
-        logger.error('ConnectionError while submitting job: %s' % e,
-                     extra={'job': job_post})
-        raise JobSubmitError(status='error',
-                             status_code=500,
-                             message='We were unable to submit your job at this time due '
-                                     'to a Job Service Interruption. Please try again later.')
-
-    except HTTPError as e:
-        logger.error('HTTPError while submitting job: %s' % e,
-                       extra={'job': job_post})
-        if e.response.status_code >= 500:
-            raise JobSubmitError(
-                status='error',
-                status_code=e.response.status_code,
-                message='We were unable to submit your job at this time due '
-                        'to a Job Service Interruption. Please try again later.')
+        jobs = user.agave_oauth.client.jobs.list(
+            query={'name': json.loads(ticket.job)['name'], 'created.after': ticket.created.isoformat()},
+            limit=1
+        )
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('Could not look up the job of interrupted submission %s', ticket)
+        return False
+    if not jobs:
+        return False
+    JobSubmission.objects.record(user, jobs[0])
+    _set_stage(ticket, JobSubmissionTicket.SUBMITTED, jobId=jobs[0]['id'],
+               response=json.dumps(jobs[0], cls=DjangoJSONEncoder))
+    return True
+
+
+def _keys_required(apps_mgr, apps, app_key, ticket):
+    """Validate a recorded app that a job could not be submitted with, and
+    move the ticket to ``keys_required`` if its execution system needs keys.
+
+    :return: Whether the ticket needs keys.
+    """
+    from portal.apps.workspace.models import JobSubmissionTicket
+    try:
+        app, _ = apps_mgr.validate_app(*app_key)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('Could not validate app %s with allocation %s', *app_key)
+        return False
+    if not app.exec_sys:
+        return False
+    apps[app_key] = app
+    _set_stage(ticket, JobSubmissionTicket.KEYS_REQUIRED,
+               response=json.dumps({'execSys': app.exec_sys.to_dict()}, cls=DjangoJSONEncoder))
+    return True
+
+
+@shared_task(bind=True, max_retries=None, queue='api')
+def submit_job(self, username, ticket_ids):
+    """Submit the jobs of submission tickets to Tapis.
+
+    Each ticket goes through its stages (see
+    :class:`~portal.apps.workspace.models.JobSubmissionTicket`), and every
+    stage is pushed to the user as a ``job_submission`` event. Apps are cloned
+    once for all tickets with the same app and allocation, e.g. the jobs of a
+    parameter sweep.
+
+    The task is retried with a backoff while Tapis is unavailable, up to
+    ``settings.PORTAL_JOB_SUBMIT_MAX_RETRIES`` times. Tickets that are done
+    are skipped, so a retry only submits the jobs that are left. Submitting a
+    job is never retried: if it fails, or a ticket is picked up in the
+    ``submit`` stage, Tapis is checked for the job instead, and the ticket
+    fails if there is none.
+
+    When a job is rejected with an app that was reused from an earlier
+    submission, the app is validated again, so that missing execution system
+    keys move the ticket to ``keys_required`` rather than failing it.
+
+    :param str username: User submitting the jobs.
+    :param list ticket_ids: IDs of the user's submission tickets.
+    """
+    from portal.apps.workspace.managers.user_applications import UserApplicationsManager
+    from portal.apps.workspace.models import JobSubmission, JobSubmissionTicket
+    user = get_user_model().objects.get(username=username)
+    tickets = JobSubmissionTicket.objects.filter(user=user, id__in=ticket_ids)\
+        .exclude(stage__in=JobSubmissionTicket.DONE).order_by('created')
+    apps_mgr = UserApplicationsManager(user)
+    apps = {}
+
+    for ticket in tickets:
+        ticket.user = user
+        try:
+            if ticket.stage == JobSubmissionTicket.SUBMIT:
+                # The job of a re-queued ticket may have been submitted already.
+                if _recover_submission(user, ticket):
+                    continue
+            _set_stage(ticket, JobSubmissionTicket.CLONE_APP)
+            job_post = prepare_job(user, json.loads(ticket.job))
+            app_key = (job_post['appId'], job_post['allocation'])
+            if app_key not in apps:
+                apps[app_key] = apps_mgr.get_or_create_app(*app_key)
+            app = apps[app_key]
+
+            _set_stage(ticket, JobSubmissionTicket.CHECK_KEYS)
+            if app.exec_sys:
+                _set_stage(ticket, JobSubmissionTicket.KEYS_REQUIRED,
+                           response=json.dumps({'execSys': app.exec_sys.to_dict()}, cls=DjangoJSONEncoder))
+                continue
+
+            job_post['appId'] = app.id
+            del job_post['allocation']
+            # Remove any params from job_post that are not in appDef
+            job_post['parameters'] = {param: job_post['parameters'][param]
+                                      for param in job_post['parameters']
+                                      if param in [p['id'] for p in app.parameters]}
+
+            _set_stage(ticket, JobSubmissionTicket.SUBMIT)
+            try:
+                response = user.agave_oauth.client.jobs.submit(body=job_post)
+            except Exception as exc:
+                if isinstance(exc, HTTPError) and not _is_transient(exc):
+                    # The recorded app or system may no longer be usable.
+                    apps_mgr.forget_app(app.id)
+                    apps.pop(app_key)
+                    if getattr(app, 'recorded', False) and _keys_required(apps_mgr, apps, app_key, ticket):
+                        continue
+                elif _recover_submission(user, ticket):
+                    continue
+                raise
+            logger.debug('Job Submission Response: {}'.format(response))
+            if "id" in response:
+                JobSubmission.objects.record(user, response)
+            _set_stage(ticket, JobSubmissionTicket.SUBMITTED, jobId=response.get('id', ''),
+                       response=json.dumps(response, cls=DjangoJSONEncoder))
+        except Exception as exc:  # pylint: disable=broad-except
+            if ticket.stage != JobSubmissionTicket.SUBMIT and _is_transient(exc) and \
+                    self.request.retries < settings.PORTAL_JOB_SUBMIT_MAX_RETRIES:
+                logger.warning('Tapis unavailable while submitting %s, retrying: %s', ticket, exc)
+                raise self.retry(exc=exc, countdown=2 ** self.request.retries * settings.PORTAL_JOB_SUBMIT_RETRY_DELAY)
+            logger.exception('Error submitting job for user=%s: %s', username, ticket.job)
+            _set_stage(ticket, JobSubmissionTicket.FAILED, message=_error_message(exc))
+
+
+@shared_task(bind=True, queue='api')
+def warm_app_cache(self):
+    """Resolve every available app tray entry with the service account and
+    cache the definitions of the public apps they point to, so that loading
+    the app tray and app forms does not call Tapis.
+
+    The app cache is invalidated first if any entry resolves to a different
+    app than it last did.
+    """
+    from portal.libs.agave.utils import service_account
+    from portal.apps.workspace import app_cache
+    from portal.apps.workspace.models import AppTrayEntry
+    agave = service_account()
+    entries = AppTrayEntry.objects.filter(available=True, appType='agave')
+
+    resolved = []
+    changed = False
+    for entry in entries:
+        try:
+            app_id = entry.appId or app_cache.app_id_by_spec(agave, entry)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Could not resolve app tray entry %s', entry)
+            continue
+        if entry.lastRetrieved and entry.lastRetrieved != app_id:
+            changed = True
+        if entry.lastRetrieved != app_id:
+            entry.lastRetrieved = app_id
+            entry.save()
+        resolved.append((entry, app_id))
+    if changed:
+        app_cache.invalidate()
 
-        err_resp = e.response.json()
-        err_resp['status_code'] = e.response.status_code
-        logger.warning(err_resp)
-        raise JobSubmitError(**err_resp)
+    warmed = 0
+    for entry, app_id in resolved:
+        if not entry.appId:
+            app_cache.set_shared('spec', app_cache.spec_name(entry), app_id)
+        try:
+            data = app_cache.load_app(agave, app_id)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Could not load app %s', app_id)
+            continue
+        if app_cache.is_public_app(data):
+            app_cache.set_shared('app', app_id, data)
+            warmed += 1
+    logger.info('Warmed app cache with %s of %s app tray entries', warmed, len(resolved))
+    return warmed
@@ -5,6 +5,7 @@ from django.test import TestCase
 from django.conf import settings
 from django.contrib.auth import get_user_model
 import pytest
+from portal.apps.workspace.tasks import submit_job
 
 
 @pytest.mark.django_db(transaction=True)
@@ -29,6 +30,12 @@ class TestAppsApiViews(TestCase):
         cls.mock_client_patcher.stop()
 
     def setUp(self):
+        # Submit jobs in the request rather than queueing them
+        submit_job_patcher = patch('portal.apps.workspace.api.views.submit_job.apply_async',
+                                   side_effect=lambda args: submit_job(*args))
+        submit_job_patcher.start()
+        self.addCleanup(submit_job_patcher.stop)
+
         agave_path = os.path.join(settings.BASE_DIR, 'fixtures/agave')
         with open(
             os.path.join(
@@ -0,0 +1,12 @@
+"""
+.. :module:: portal.apps.workspace.utils
+   :synopsis: Utils for workspace apps and jobs
+"""
+from portal.apps.licenses.models import LICENSE_TYPES
+
+
+def get_app_license_type(app_id):
+    """License type an app requires, e.g. 'MATLAB', or None."""
+    app_lic_type = app_id.replace('-{}'.format(app_id.split('-')[-1]), '').upper()
+    lic_type = next((t for t in LICENSE_TYPES if t in app_lic_type), None)
+    return lic_type
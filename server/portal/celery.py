@@ -37,7 +37,20 @@ app.conf.beat_schedule = {
 if settings.COMMUNITY_INDEX_SCHEDULE:
     app.conf.beat_schedule['index_community'] = {
         'task': 'portal.apps.search.tasks.index_community_data',
-        'schedule': crontab(**settings.COMMUNITY_INDEX_SCHEDULE)
+        'schedule': crontab(**settings.COMMUNITY_INDEX_SCHEDULE),
+    }
+
+if settings.COMMUNITY_INCREMENTAL_INDEX_SCHEDULE:
+    app.conf.beat_schedule['index_community_incremental'] = {
+        'task': 'portal.apps.search.tasks.index_community_data',
+        'schedule': crontab(**settings.COMMUNITY_INCREMENTAL_INDEX_SCHEDULE),
+        'kwargs': {'incremental': True}
+    }
+
+if settings.PORTAL_APP_CACHE_WARM_SCHEDULE:
+    app.conf.beat_schedule['warm_app_cache'] = {
+        'task': 'portal.apps.workspace.tasks.warm_app_cache',
+        'schedule': crontab(**settings.PORTAL_APP_CACHE_WARM_SCHEDULE),
     }
 
 
@@ -0,0 +1,180 @@
+"""Per-process registry of Tapis clients.
+
+.. module:: portal.libs.agave.clients
+
+Building an :class:`~agavepy.agave.Agave` client parses the API resources
+and opens a new ``requests`` session, so building one per request wastes CPU
+and a TLS handshake on every call. Clients are instead kept per user and
+reused while their access token is current, and every client sends its
+requests through one HTTP connection pool per process.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from agavepy.agave import Agave
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+# pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+METRICS = logging.getLogger('metrics.{}'.format(__name__))
+# pylint: enable=invalid-name
+
+_adapter = None
+_adapter_lock = threading.Lock()
+_adapter_pid = None
+
+
+def http_adapter():
+    """Return the process-wide HTTP adapter shared by every Tapis client.
+
+    Requests carry their own ``Authorization`` header, so connections can be
+    reused across users. A new adapter is created after a fork, so that
+    gunicorn and celery workers never share sockets with their parent.
+
+    :rtype: requests.adapters.HTTPAdapter
+    """
+    global _adapter, _adapter_pid  # pylint: disable=global-statement
+    with _adapter_lock:
+        if _adapter is None or _adapter_pid != os.getpid():
+            _adapter = HTTPAdapter(pool_connections=settings.PORTAL_AGAVE_POOL_CONNECTIONS,
+                                   pool_maxsize=settings.PORTAL_AGAVE_POOL_MAXSIZE)
+            _adapter_pid = os.getpid()
+        return _adapter
+
+
+class PooledAgave(Agave):
+    """Agave client that uses the shared HTTP connection pool.
+
+    Concurrent token refreshes from several threads are collapsed into one,
+    since a refresh token can only be used once.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.token is not None:
+            self.token.refresh = self._locked_refresh(self.token.refresh)
+
+    def _locked_refresh(self, refresh):
+        lock = threading.Lock()
+
+        def _refresh():
+            stale = self._token
+            with lock:
+                if self._token != stale:
+                    # Another thread refreshed the token while we waited.
+                    return self._token
+                return refresh()
+        return _refresh
+
+    def resource(self, auth_type, *args):
+        swagger_client = super().resource(auth_type, *args)
+        if swagger_client is not None:
+            session = swagger_client.http_client.session
+            session.mount('https://', http_adapter())
+            session.mount('http://', http_adapter())
+        return swagger_client
+
+
+class ClientRegistry:
+    """LRU registry of clients keyed by user.
+
+    A cached client is reused as long as its access token matches the one
+    requested, including after the client refreshed its own token.
+
+    :param int max_size: Maximum number of clients kept. 0 disables caching.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._last_report = time.time()
+
+    def get(self, key, token, factory):
+        """Return the client for ``key``, building it with ``factory`` if
+        there is none or its token is not ``token``.
+        """
+        if self.max_size <= 0:
+            return factory()
+        with self._lock:
+            if self._pid != os.getpid():
+                self._clients.clear()
+                self._pid = os.getpid()
+            client = self._clients.get(key)
+            if client is not None and client._token == token:  # pylint: disable=protected-access
+                self._clients.move_to_end(key)
+                self.hits += 1
+                self._report()
+                return client
+            self.misses += 1
+
+        client = factory()
+        with self._lock:
+            self._clients[key] = client
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+            self._report()
+        return client
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+    def stats(self):
+        """Registry and connection pool counters for this process.
+
+        :rtype: dict
+        """
+        pools = []
+        for key in list(http_adapter().poolmanager.pools.keys()):
+            pool = http_adapter().poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({'host': pool.host,
+                          'connections': pool.num_connections,
+                          'requests': pool.num_requests,
+                          'idle': pool.pool.qsize() if pool.pool else 0})
+        return {'pid': os.getpid(),
+                'clients': len(self._clients),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'pools': pools}
+
+    def _report(self):
+        now = time.time()
+        if now - self._last_report < settings.PORTAL_AGAVE_CLIENT_STATS_INTERVAL:
+            return
+        self._last_report = now
+        METRICS.info('agave-clients %s', self.stats())
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def registry():
+    """Return this process' :class:`ClientRegistry`."""
+    global _registry  # pylint: disable=global-statement
+    with _registry_lock:
+        if _registry is None:
+            _registry = ClientRegistry(settings.PORTAL_AGAVE_CLIENT_CACHE_SIZE)
+        return _registry
+
+
+def get_client(key, token, factory):
+    """Return a cached client, see :meth:`ClientRegistry.get`."""
+    return registry().get(key, token, factory)
+
+
+def stats():
+    return registry().stats()
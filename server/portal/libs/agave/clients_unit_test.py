@@ -0,0 +1,102 @@
+import threading
+import time
+import pytest
+from mock import MagicMock
+from portal.apps.auth.models import AGAVE_RESOURCES
+from portal.libs.agave.clients import ClientRegistry, PooledAgave, http_adapter
+
+
+def _client(token):
+    return MagicMock(_token=token)
+
+
+def test_registry_reuses_client():
+    registry = ClientRegistry(max_size=2)
+    factory = MagicMock(side_effect=_client)
+
+    first = registry.get('username', 'token', lambda: factory('token'))
+    second = registry.get('username', 'token', lambda: factory('token'))
+
+    assert first is second
+    assert factory.call_count == 1
+    assert registry.stats()['hits'] == 1
+    assert registry.stats()['misses'] == 1
+
+
+def test_registry_rebuilds_on_new_token():
+    registry = ClientRegistry(max_size=2)
+
+    first = registry.get('username', 'token', lambda: _client('token'))
+    second = registry.get('username', 'new-token', lambda: _client('new-token'))
+
+    assert first is not second
+
+
+def test_registry_keeps_client_refreshed_in_place():
+    registry = ClientRegistry(max_size=2)
+    first = registry.get('username', 'token', lambda: _client('token'))
+    # The client refreshed its token and saved it through its callback.
+    first._token = 'new-token'
+
+    assert registry.get('username', 'new-token', lambda: _client('new-token')) is first
+
+
+def test_registry_evicts_least_recently_used():
+    registry = ClientRegistry(max_size=2)
+    first = registry.get('a', 'token', lambda: _client('token'))
+    registry.get('b', 'token', lambda: _client('token'))
+    registry.get('a', 'token', lambda: _client('token'))
+    registry.get('c', 'token', lambda: _client('token'))
+
+    assert registry.get('a', 'token', lambda: _client('token')) is first
+    assert registry.stats()['evictions'] == 1
+    assert registry.stats()['clients'] == 2
+
+
+def test_registry_resets_after_fork(mocker):
+    registry = ClientRegistry(max_size=2)
+    first = registry.get('username', 'token', lambda: _client('token'))
+    mocker.patch('portal.libs.agave.clients.os.getpid', return_value=-1)
+
+    assert registry.get('username', 'token', lambda: _client('token')) is not first
+
+
+def test_registry_disabled():
+    registry = ClientRegistry(max_size=0)
+    assert registry.get('username', 'token', lambda: _client('token')) is not \
+        registry.get('username', 'token', lambda: _client('token'))
+
+
+@pytest.fixture
+def pooled_client():
+    yield PooledAgave(api_server='https://api.example.com', token='token',
+                      refresh_token='refresh', resources=AGAVE_RESOURCES)
+
+
+def test_pooled_agave_uses_shared_adapter(pooled_client):
+    assert pooled_client.all.http_client.session.get_adapter('https://api.example.com') is http_adapter()
+
+
+def test_pooled_agave_refreshes_once(pooled_client, mocker):
+    entered = threading.Event()
+    release = threading.Event()
+
+    def refresh(data):
+        entered.set()
+        release.wait(1)
+        pooled_client._token = 'new-token'
+        return 'new-token'
+    mock_token = mocker.patch.object(pooled_client.token, '_token', side_effect=refresh)
+
+    threads = [threading.Thread(target=pooled_client.token.refresh) for _ in range(3)]
+    threads[0].start()
+    entered.wait(1)
+    for thread in threads[1:]:
+        thread.start()
+    # Let the other threads read the stale token and wait on the lock.
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert mock_token.call_count == 1
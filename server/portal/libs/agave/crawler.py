@@ -0,0 +1,210 @@
+"""Concurrent crawler for Tapis storage systems.
+
+.. module:: portal.libs.agave.crawler
+"""
+import logging
+import threading
+import time
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from django.conf import settings
+
+# pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+# pylint: enable=invalid-name
+
+_system_semaphores = {}
+_system_semaphores_lock = threading.Lock()
+
+
+def system_semaphore(system):
+    """Return the process-wide semaphore capping concurrent listings on a system.
+
+    Limits are read from ``settings.PORTAL_INDEXER_SYSTEM_CONCURRENCY`` and
+    default to ``settings.PORTAL_INDEXER_MAX_WORKERS``. Every crawl running in
+    the same worker process shares the semaphore for its system.
+
+    :param str system: Tapis system ID.
+    :rtype: threading.BoundedSemaphore
+    """
+    with _system_semaphores_lock:
+        if system not in _system_semaphores:
+            limit = settings.PORTAL_INDEXER_SYSTEM_CONCURRENCY.get(
+                system, settings.PORTAL_INDEXER_MAX_WORKERS
+            )
+            _system_semaphores[system] = threading.BoundedSemaphore(limit)
+        return _system_semaphores[system]
+
+
+class CrawlStats:
+    """Counters collected during a crawl."""
+
+    def __init__(self):
+        self.folders = 0
+        self.files = 0
+        self.api_calls = 0
+        self.errors = 0
+        self.started = time.time()
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    def to_dict(self):
+        elapsed = max(self.elapsed, 1e-6)
+        return {
+            'folders': self.folders,
+            'files': self.files,
+            'apiCalls': self.api_calls,
+            'errors': self.errors,
+            'elapsed': round(elapsed, 3),
+            'foldersPerSec': round(self.folders / elapsed, 3),
+            'apiCallsPerSec': round(self.api_calls / elapsed, 3),
+        }
+
+
+class TapisCrawler:
+    """Walk a Tapis subtree with a bounded pool of concurrent ``files.list`` calls.
+
+    Listings run on a thread pool while the calling thread owns the frontier
+    and hands every completed level to ``on_level``, so results are streamed
+    out level by level instead of being accumulated in memory.
+
+    :param client: Tapis client used for listings.
+    :param str system: Tapis system ID to crawl.
+    :param callable on_level: Called as ``on_level(path, folders, files)`` for
+        every listed folder, in the calling thread. It may return the subset of
+        ``folders`` to crawl next; if it returns ``None`` every folder is
+        crawled.
+    :param int max_workers: Maximum concurrent listings for this crawl.
+    :param bool ignore_hidden: Skip files and folders starting with ``.``.
+    :param int page_size: Number of entries retrieved per ``files.list`` call.
+    :param int max_attempts: Listing attempts per folder before it is skipped.
+        Skipped folders are collected in ``skipped``.
+
+    :Example:
+    >>> crawler = TapisCrawler(client, 'cep.home.user', on_level=print)
+    >>> crawler.crawl(['/'])
+    >>> crawler.stats.to_dict()
+    """
+
+    def __init__(self, client, system, on_level, max_workers=None,
+                 ignore_hidden=True, page_size=100, max_attempts=3):
+        self.client = client
+        self.system = system
+        self.on_level = on_level
+        self.max_workers = max_workers or settings.PORTAL_INDEXER_MAX_WORKERS
+        self.ignore_hidden = ignore_hidden
+        self.page_size = page_size
+        self.max_attempts = max_attempts
+        self.stats = CrawlStats()
+        self.skipped = []
+        self._frontier = deque()
+        self._in_flight = {}
+        self._attempts = {}
+        self._stats_lock = threading.Lock()
+
+    def frontier(self):
+        """Paths that still need to be crawled, including in-flight listings.
+
+        Passing the result back to :meth:`crawl` resumes the crawl.
+
+        :rtype: list
+        """
+        return list(self._in_flight.values()) + list(self._frontier)
+
+    def list_level(self, path):
+        """List a single folder, returning ``(path, folders, files)``.
+
+        Entries are filtered the same way as
+        :func:`~portal.libs.agave.utils.walk_levels`.
+        """
+        folders = []
+        files = []
+        offset = 0
+        with system_semaphore(self.system):
+            while True:
+                page = self.client.files.list(systemId=self.system,
+                                              filePath=urllib.parse.quote(path),
+                                              offset=offset,
+                                              limit=self.page_size)
+                with self._stats_lock:
+                    self.stats.api_calls += 1
+                for agave_file in page:
+                    if agave_file['name'] == '.':
+                        continue
+                    if self.ignore_hidden and agave_file['name'][0] == '.':
+                        continue
+                    if agave_file['format'] == 'folder':
+                        folders.append(agave_file)
+                    else:
+                        files.append(agave_file)
+                offset += self.page_size
+                if len(page) != self.page_size:
+                    break
+        return path, folders, files
+
+    def crawl(self, paths, max_folders=None):
+        """Crawl every folder under ``paths``.
+
+        :param list paths: Folders to start from, e.g. ``['/']`` or the result
+            of :meth:`frontier` from an earlier, interrupted crawl.
+        :param int max_folders: Stop once this many folders have been listed.
+            Remaining work is available from :meth:`frontier`.
+
+        :returns: Whether the crawl finished (``False`` if it stopped at
+            ``max_folders``).
+        :rtype: bool
+        """
+        self._frontier.extend(paths)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while self._frontier or self._in_flight:
+                budget_left = max_folders is None or \
+                    self.stats.folders + len(self._in_flight) < max_folders
+                while self._frontier and budget_left and \
+                        len(self._in_flight) < self.max_workers:
+                    path = self._frontier.popleft()
+                    self._in_flight[executor.submit(self.list_level, path)] = path
+                    budget_left = max_folders is None or \
+                        self.stats.folders + len(self._in_flight) < max_folders
+
+                if not self._in_flight:
+                    break
+
+                done, _ = wait(list(self._in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = self._in_flight.pop(future)
+                    try:
+                        path, folders, files = future.result()
+                    except Exception:  # pylint: disable=broad-except
+                        self._retry_or_skip(path)
+                        continue
+                    try:
+                        descend = self.on_level(path, folders, files)
+                    except Exception:
+                        # Keep the level in the frontier so a resumed crawl
+                        # picks it up again.
+                        self._frontier.appendleft(path)
+                        raise
+                    self.stats.folders += 1
+                    self.stats.files += len(files)
+                    if descend is None:
+                        descend = folders
+                    self._frontier.extend(folder['path'] for folder in descend)
+
+        logger.info('Crawled system %s: %s', self.system, self.stats.to_dict())
+        return not self._frontier
+
+    def _retry_or_skip(self, path):
+        attempts = self._attempts.get(path, 0) + 1
+        self._attempts[path] = attempts
+        if attempts < self.max_attempts:
+            self._frontier.append(path)
+            return
+        self.stats.errors += 1
+        self.skipped.append(path)
+        logger.exception(
+            'Error listing files under system %s and path %s, skipping.',
+            self.system, path
+        )
@@ -0,0 +1,95 @@
+import pytest
+from mock import MagicMock
+from portal.libs.agave.crawler import TapisCrawler
+
+
+def _entry(path, fmt='raw'):
+    return {'name': path.split('/')[-1], 'path': path, 'format': fmt, 'system': 'test.system'}
+
+
+TREE = {
+    '/': [_entry('/.', 'folder'), _entry('/a', 'folder'), _entry('/b', 'folder'), _entry('/file1')],
+    '/a': [_entry('/a/.', 'folder'), _entry('/a/c', 'folder'), _entry('/a/file2'), _entry('/a/.hidden')],
+    '/b': [_entry('/b/.', 'folder')],
+    '/a/c': [_entry('/a/c/.', 'folder'), _entry('/a/c/file3')],
+}
+
+
+@pytest.fixture
+def tree_client():
+    client = MagicMock()
+
+    def list_side_effect(systemId, filePath, offset, limit):
+        return TREE[filePath][offset:offset + limit]
+    client.files.list.side_effect = list_side_effect
+    yield client
+
+
+def test_crawl_walks_whole_tree(tree_client):
+    on_level = MagicMock(return_value=None)
+    crawler = TapisCrawler(tree_client, 'test.system', on_level)
+
+    assert crawler.crawl(['/'])
+
+    levels = {call[0][0]: call[0] for call in on_level.call_args_list}
+    assert set(levels) == {'/', '/a', '/b', '/a/c'}
+    assert levels['/a'][1] == [_entry('/a/c', 'folder')]
+    assert levels['/a'][2] == [_entry('/a/file2')]
+    assert crawler.stats.folders == 4
+    assert crawler.stats.files == 3
+    assert crawler.stats.api_calls == 4
+    assert crawler.frontier() == []
+
+
+def test_crawl_only_descends_into_returned_folders(tree_client):
+    on_level = MagicMock(side_effect=lambda path, folders, files: [f for f in folders if f['path'] != '/a'])
+    crawler = TapisCrawler(tree_client, 'test.system', on_level)
+
+    crawler.crawl(['/'])
+    assert sorted(call[0][0] for call in on_level.call_args_list) == ['/', '/b']
+
+
+def test_crawl_paginates(tree_client):
+    crawler = TapisCrawler(tree_client, 'test.system', MagicMock(return_value=None), page_size=2)
+    crawler.crawl(['/'])
+    # Full pages trigger another call: 3 for '/', 3 for '/a', 1 for '/b', 2 for '/a/c'.
+    assert crawler.stats.api_calls == 9
+
+
+def test_crawl_stops_at_max_folders(tree_client):
+    crawler = TapisCrawler(tree_client, 'test.system', MagicMock(return_value=None), max_workers=1)
+
+    assert not crawler.crawl(['/'], max_folders=1)
+    assert crawler.stats.folders == 1
+    assert sorted(crawler.frontier()) == ['/a', '/b']
+
+
+def test_crawl_resumes_from_frontier(tree_client):
+    on_level = MagicMock(return_value=None)
+    crawler = TapisCrawler(tree_client, 'test.system', on_level)
+
+    assert crawler.crawl(['/a/c', '/b'])
+    assert sorted(call[0][0] for call in on_level.call_args_list) == ['/a/c', '/b']
+
+
+def test_crawl_skips_failing_folder(tree_client):
+    def list_side_effect(systemId, filePath, offset, limit):
+        if filePath == '/b':
+            raise Exception('listing failed')
+        return TREE[filePath][offset:offset + limit]
+    tree_client.files.list.side_effect = list_side_effect
+    crawler = TapisCrawler(tree_client, 'test.system', MagicMock(return_value=None), max_attempts=2)
+
+    assert crawler.crawl(['/'])
+    assert crawler.stats.errors == 1
+    assert crawler.stats.folders == 3
+    assert crawler.skipped == ['/b']
+
+
+def test_crawl_keeps_level_on_callback_error(tree_client):
+    on_level = MagicMock(side_effect=Exception('bulk failed'))
+    crawler = TapisCrawler(tree_client, 'test.system', on_level, max_workers=1)
+
+    with pytest.raises(Exception):
+        crawler.crawl(['/'])
+    assert crawler.frontier() == ['/']
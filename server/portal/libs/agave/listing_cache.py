@@ -0,0 +1,92 @@
+"""
+.. module: portal.libs.agave.listing_cache
+   :synopsis: Short-lived, per-user cache of Tapis file listings.
+
+Listings are stored in one Redis hash per ``(system, path)`` with a field per
+``(user, offset, limit)``, so invalidating a folder after a write is a single
+``DEL`` that covers every user and page of that folder.
+"""
+import json
+import logging
+import time
+import redis
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from portal.libs import cache
+
+# pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+# pylint: enable=invalid-name
+
+CACHE_NAME = 'listing'
+
+
+def _key(system, path):
+    return 'listing:{}:/{}'.format(system, path.strip('/'))
+
+
+def _field(client, offset, limit):
+    # Service account clients (public systems) have no token username and
+    # share a single entry.
+    username = getattr(client, 'token_username', None) or ''
+    return '{}:{}:{}'.format(username, int(offset), int(limit))
+
+
+def enabled():
+    return settings.PORTAL_LISTING_CACHE_TTL > 0
+
+
+def get(client, system, path, offset, limit):
+    """Return a cached listing, or ``None`` on a miss.
+
+    :param client: Tapis client the listing is made with.
+    :param str system: Tapis system ID.
+    :param str path: Folder path.
+    :param int offset: Pagination offset.
+    :param int limit: Page size.
+    :rtype: dict
+    """
+    if not enabled():
+        return None
+    try:
+        value = cache.get_redis().hget(_key(system, path), _field(client, offset, limit))
+    except redis.RedisError:
+        logger.warning('Listing cache unavailable, reading %s:%s from Tapis', system, path)
+        return None
+    if value is not None:
+        entry = json.loads(value)
+        if time.time() - entry['cached'] < settings.PORTAL_LISTING_CACHE_TTL:
+            cache.record(CACHE_NAME, 'hits')
+            return entry['result']
+    cache.record(CACHE_NAME, 'misses')
+    return None
+
+
+def set(client, system, path, offset, limit, result):  # pylint: disable=redefined-builtin
+    """Store a listing result."""
+    if not enabled():
+        return
+    key = _key(system, path)
+    value = json.dumps({'cached': time.time(), 'result': result}, cls=DjangoJSONEncoder)
+    try:
+        pipe = cache.get_redis().pipeline()
+        pipe.hset(key, _field(client, offset, limit), value)
+        pipe.expire(key, settings.PORTAL_LISTING_CACHE_TTL)
+        pipe.execute()
+    except redis.RedisError:
+        logger.warning('Unable to cache listing for %s:%s', system, path)
+
+
+def invalidate(system, *paths):
+    """Drop cached listings of ``paths`` on ``system`` for every user."""
+    if not enabled():
+        return
+    try:
+        cache.get_redis().delete(*[_key(system, path) for path in paths])
+    except redis.RedisError:
+        logger.exception('Unable to invalidate cached listings for %s: %s', system, paths)
+
+
+def stats():
+    """Listing cache hit/miss counters. See :func:`portal.libs.cache.stats`."""
+    return cache.stats(CACHE_NAME)
@@ -0,0 +1,74 @@
+import json
+import pytest
+import redis
+from mock import MagicMock
+from portal.libs.agave import listing_cache
+
+
+@pytest.fixture
+def mock_redis(mocker, settings):
+    settings.PORTAL_LISTING_CACHE_TTL = 30
+    yield mocker.patch('portal.libs.cache.get_redis').return_value
+
+
+@pytest.fixture
+def mock_record(mocker):
+    yield mocker.patch('portal.libs.cache.record')
+
+
+@pytest.fixture
+def client():
+    return MagicMock(token_username='username')
+
+
+def test_get_hit(mock_redis, mock_record, client, mocker):
+    mocker.patch('portal.libs.agave.listing_cache.time.time', return_value=110)
+    mock_redis.hget.return_value = json.dumps({'cached': 100, 'result': {'listing': []}})
+
+    assert listing_cache.get(client, 'test.system', 'path/to/dir/', 0, 100) == {'listing': []}
+    mock_redis.hget.assert_called_with('listing:test.system:/path/to/dir', 'username:0:100')
+    mock_record.assert_called_with('listing', 'hits')
+
+
+def test_get_expired(mock_redis, mock_record, client, mocker):
+    mocker.patch('portal.libs.agave.listing_cache.time.time', return_value=200)
+    mock_redis.hget.return_value = json.dumps({'cached': 100, 'result': {'listing': []}})
+
+    assert listing_cache.get(client, 'test.system', '/path', 0, 100) is None
+    mock_record.assert_called_with('listing', 'misses')
+
+
+def test_get_fails_open(mock_redis, mock_record, client):
+    mock_redis.hget.side_effect = redis.ConnectionError
+
+    assert listing_cache.get(client, 'test.system', '/path', 0, 100) is None
+
+
+def test_disabled(mock_redis, client, settings):
+    settings.PORTAL_LISTING_CACHE_TTL = 0
+
+    assert listing_cache.get(client, 'test.system', '/path', 0, 100) is None
+    listing_cache.set(client, 'test.system', '/path', 0, 100, {})
+    listing_cache.invalidate('test.system', '/path')
+    assert not mock_redis.method_calls
+
+
+def test_set(mock_redis, client):
+    listing_cache.set(client, 'test.system', '/path', 0, 100, {'listing': []})
+
+    pipe = mock_redis.pipeline.return_value
+    assert pipe.hset.call_args[0][:2] == ('listing:test.system:/path', 'username:0:100')
+    assert json.loads(pipe.hset.call_args[0][2])['result'] == {'listing': []}
+    pipe.expire.assert_called_with('listing:test.system:/path', 30)
+
+
+def test_set_service_account(mock_redis):
+    listing_cache.set(MagicMock(token_username=None), 'test.system', '/path', 0, 100, {})
+
+    assert mock_redis.pipeline.return_value.hset.call_args[0][1] == ':0:100'
+
+
+def test_invalidate(mock_redis):
+    listing_cache.invalidate('test.system', '/path/', 'path/to/file')
+
+    mock_redis.delete.assert_called_with('listing:test.system:/path', 'listing:test.system:/path/to/file')
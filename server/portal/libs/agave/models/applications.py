@@ -95,6 +95,8 @@ class Application(BaseAgaveResource):
             #         raise
 
         wrapped.update(**kwargs)
+        if id is not None:
+            wrapped.setdefault('id', id)
 
         super(Application, self).__init__(client, **wrapped)
 
@@ -1,21 +1,36 @@
 import urllib
 import os
+import json
 import io
+import uuid
 import datetime
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from agavepy.agave import with_refresh
 from django.conf import settings
 from requests.exceptions import HTTPError
+from redis import RedisError
 import logging
 from elasticsearch_dsl import Q
 from portal.libs.elasticsearch.indexes import IndexedFile
-from portal.apps.search.tasks import agave_indexer, agave_listing_indexer
+from portal.apps.search.tasks import queue_agave_indexer, agave_listing_indexer, move_indexed_files
 from portal.exceptions.api import ApiException
 from portal.libs.agave.utils import text_preview, get_file_size, increment_file_name
+from portal.libs.agave import listing_cache
+from portal.libs import cache
+from portal.libs.elasticsearch.utils import indexed_level, current_time, file_routing, files_keyword_field
 logger = logging.getLogger(__name__)
 
 
-def listing(client, system, path, offset=0, limit=100, *args, **kwargs):
+def _is_set(value):
+    """Whether a flag, possibly passed as a query string value, is set."""
+    return str(value).lower() not in ('', '0', 'false', 'none')
+
+
+def listing(client, system, path, offset=0, limit=100, fresh=False, indexed=False, *args, **kwargs):
     """
-    Perform a Tapis file listing
+    Perform a Tapis file listing. Results are cached per user for
+    ``settings.PORTAL_LISTING_CACHE_TTL`` seconds.
 
     Params
     ------
@@ -29,6 +44,12 @@ def listing(client, system, path, offset=0, limit=100, *args, **kwargs):
         Offset for pagination.
     limit: int
         Number of results to return.
+    fresh: bool
+        Bypass the listing cache. Truthy strings such as ``'1'`` (from the
+        ``?fresh=1`` query parameter) are accepted.
+    indexed: bool
+        Answer from Elasticsearch when the level was indexed recently. See
+        :func:`indexed_listing`.
 
     Returns
     -------
@@ -36,6 +57,15 @@ def listing(client, system, path, offset=0, limit=100, *args, **kwargs):
         List of dicts containing file metadata from Elasticsearch
 
     """
+    if not _is_set(fresh):
+        cached = listing_cache.get(client, system, path, offset, limit)
+        if cached is not None:
+            return cached
+        if _is_set(indexed):
+            result = indexed_listing(client, system, path, offset, limit)
+            if result is not None:
+                return result
+
     raw_listing = client.files.list(systemId=system,
                                     filePath=urllib.parse.quote(path),
                                     offset=int(offset) + 1,
@@ -50,7 +80,57 @@ def listing(client, system, path, offset=0, limit=100, *args, **kwargs):
 
     # Update Elasticsearch after each listing.
     agave_listing_indexer.delay(listing)
-    return {'listing': listing, 'reachedEnd': len(listing) < int(limit)}
+    result = {'listing': listing, 'reachedEnd': len(listing) < int(limit)}
+    listing_cache.set(client, system, path, offset, limit, result)
+    return result
+
+
+def indexed_listing(client, system, path, offset=0, limit=100):
+    """
+    Answer a listing from Elasticsearch and revalidate it in the background.
+
+    The indexed level is used if it was last checked against Tapis, by a crawl
+    or a revalidation, within ``settings.PORTAL_INDEXED_LISTING_MAX_AGE``
+    seconds. The response
+    is marked ``stale`` and ``agave_listing_indexer`` is queued to list the
+    folder from Tapis, update the index and push any differences to the user
+    over the notifications websocket.
+
+    Params
+    ------
+    client: agavepy.agave.Agave
+        Tapis client of the user the listing is made for.
+    system: str
+        Tapis system ID.
+    path: str
+        Path in which to peform the listing.
+    offset: int
+        Offset for pagination.
+    limit: int
+        Number of results to return.
+
+    Returns
+    -------
+    dict
+        The listing, or None if the level is not indexed or too old.
+    """
+    path = '/' + path.strip('/')
+    hits, validated_at = indexed_level(system, path, offset, limit)
+    if validated_at is None or \
+            (current_time() - validated_at).total_seconds() > settings.PORTAL_INDEXED_LISTING_MAX_AGE:
+        return None
+
+    # Revalidate a level at most once per PORTAL_INDEXED_LISTING_REVALIDATE_INTERVAL.
+    try:
+        queue = cache.get_redis().set('listing-revalidate:{}:{}'.format(system, path), 1, nx=True,
+                                      ex=settings.PORTAL_INDEXED_LISTING_REVALIDATE_INTERVAL)
+    except RedisError:
+        queue = True
+    if queue:
+        agave_listing_indexer.delay(systemId=system, filePath=path,
+                                    username=getattr(client, 'token_username', None))
+
+    return {'listing': hits, 'reachedEnd': len(hits) < int(limit), 'stale': True}
 
 
 def iterate_listing(client, system, path, limit=100):
@@ -66,7 +146,7 @@ def iterate_listing(client, system, path, limit=100):
     offset = 0
 
     while True:
-        page = listing(client, system, path, offset, limit)['listing']
+        page = listing(client, system, path, offset, limit, fresh=True)['listing']
         yield from page
         offset += limit
         if len(page) != limit:
@@ -74,7 +154,24 @@ def iterate_listing(client, system, path, limit=100):
             break
 
 
-def search(client, system, path, offset=0, limit=100, query_string='', **kwargs):
+SEARCH_FACET_SIZE = 20
+SEARCH_SIZE_FACETS = [
+    {'key': 'small', 'to': 1024 ** 2},
+    {'key': 'medium', 'from': 1024 ** 2, 'to': 100 * 1024 ** 2},
+    {'key': 'large', 'from': 100 * 1024 ** 2, 'to': 1024 ** 3},
+    {'key': 'huge', 'from': 1024 ** 3},
+]
+SEARCH_MODIFIED_FACETS = [
+    {'key': 'day', 'from': 'now-1d/d'},
+    {'key': 'week', 'from': 'now-1w/d'},
+    {'key': 'month', 'from': 'now-1M/d'},
+    {'key': 'year', 'from': 'now-1y/d'},
+    {'key': 'older', 'to': 'now-1y/d'},
+]
+
+
+def search(client, system, path, offset=0, limit=100, query_string='',
+           nextPageToken=None, facets=False, **kwargs):  # pylint: disable=invalid-name
     """
     Perform a search for files using a query string.
 
@@ -83,19 +180,47 @@ def search(client, system, path, offset=0, limit=100, query_string='', **kwargs)
     client: NoneType
     system: str
         Tapis system ID to filter on.
-    path: NoneType
+    path: str
+        Only files under this folder are returned. Searches the whole system
+        if empty or ``/``.
     offset: int
         Search offset for pagination.
     limit: int
         Number of search results to return
     query_string: str
         Query string to pass to Elasticsearch
+    nextPageToken: str
+        ``nextPageToken`` of the previous page, used as a ``search_after``
+        cursor. Takes precedence over ``offset``, and stays fast for deep
+        pages.
+    facets: bool
+        Whether to return counts by extension, mimeType, size and lastModified.
 
     Returns
     -------
-    list
-        List of dicts containing file metadata from Elasticsearch
+    dict
+        ``listing``: list of dicts containing file metadata from
+        Elasticsearch, with highlighted name matches under ``highlight``.
+        ``count``, ``reachedEnd``, ``nextPageToken`` (cursor for the next
+        page) and ``facets`` if requested.
+
+    """
+    search_after = json.loads(nextPageToken) if nextPageToken else None
+    facets = _is_set(facets)
+    query = search_query(system, offset, limit, query_string, path=path,
+                         search_after=search_after, facets=facets)
+    return search_result(query.execute(), limit, facets=facets)
+
 
+def search_query(system, offset=0, limit=100, query_string='', path=None,
+                 search_after=None, facets=False):
+    """
+    Build the Elasticsearch query used by :func:`search`, so that it can be
+    sent along with other queries.
+
+    Returns
+    -------
+    elasticsearch_dsl.Search
     """
     ngram_query = Q("query_string", query=query_string,
                     fields=["name"],
@@ -106,15 +231,50 @@ def search(client, system, path, offset=0, limit=100, query_string='', **kwargs)
                         "name._exact, name._pattern"],
                     default_operator='and')
 
-    search = IndexedFile.search()
+    search = IndexedFile.search().params(routing=file_routing(system))
     search = search.query(ngram_query | match_query)
     search = search.filter('term', **{'system._exact': system})
-    search = search.extra(from_=int(offset), size=int(limit))
-    res = search.execute()
-    hits = [hit.to_dict() for hit in res]
-
-    return {'listing': hits, 'count': res.hits.total.value,
-            'reachedEnd': len(hits) < int(limit)}
+    scope = (path or '').strip('/')
+    if scope:
+        # basePath._comps holds every ancestor of a file's folder.
+        search = search.filter('term', **{'basePath._comps': '/{}'.format(scope)})
+    # path._exact breaks ties so search_after cursors are stable.
+    search = search.sort({'_score': {'order': 'desc'}}, {'path._exact': {'order': 'asc'}})
+    search = search.highlight('name', 'name._pattern', number_of_fragments=0)\
+        .highlight_options(pre_tags=['<b>'], post_tags=['</b>'], require_field_match=False)
+    if search_after:
+        search = search.extra(search_after=list(search_after), size=int(limit))
+    else:
+        search = search.extra(from_=int(offset), size=int(limit))
+    if facets:
+        search.aggs.bucket('extension', 'terms', field=files_keyword_field('extension'), size=SEARCH_FACET_SIZE)
+        search.aggs.bucket('mimeType', 'terms', field='mimeType', size=SEARCH_FACET_SIZE)
+        search.aggs.bucket('size', 'range', field='length', keyed=False, ranges=SEARCH_SIZE_FACETS)
+        search.aggs.bucket('lastModified', 'date_range', field='lastModified', keyed=False,
+                           ranges=SEARCH_MODIFIED_FACETS)
+    return search
+
+
+def search_result(res, limit=100, facets=False):
+    """Format a response to :func:`search_query` like :func:`search`."""
+    hits = []
+    for hit in res:
+        hit_dict = hit.to_dict()
+        if 'highlight' in hit.meta:
+            hit_dict['highlight'] = hit.meta.highlight.to_dict()
+        hits.append(hit_dict)
+
+    result = {'listing': hits, 'count': res.hits.total.value,
+              'reachedEnd': len(hits) < int(limit)}
+    if hits and 'sort' in res.hits[-1].meta:
+        result['nextPageToken'] = json.dumps(list(res.hits[-1].meta.sort))
+    if facets:
+        result['facets'] = {
+            name: [{'key': bucket.key, 'count': bucket.doc_count}
+                   for bucket in res.aggregations[name].buckets]
+            for name in ('extension', 'mimeType', 'size', 'lastModified')
+        }
+    return result
 
 
 def download(client, system, path, href, force=True, max_uses=3, lifetime=600, **kwargs):
@@ -182,12 +342,38 @@ def mkdir(client, system, path, dir_name):
                                  filePath=urllib.parse.quote(path),
                                  body=body)
 
-    agave_indexer.apply_async(kwargs={'systemId': system,
-                                      'filePath': path,
-                                      'recurse': False})
+    listing_cache.invalidate(system, path)
+    queue_agave_indexer(system, path, recurse=False)
     return result
 
 
+def _move(client, src_system, src_path, full_dest_path):
+    body = {'action': 'move',
+            'path': full_dest_path}
+    return client.files.manage(systemId=src_system,
+                               filePath=urllib.parse.quote(src_path),
+                               body=body)
+
+
+def _copy(client, src_system, src_path, dest_system, dest_path, file_name):
+    if src_system == dest_system:
+        body = {'action': 'copy',
+                'path': os.path.join(dest_path.strip('/'), file_name)}
+        return client.files.manage(systemId=src_system,
+                                   filePath=urllib.parse.quote(src_path),
+                                   body=body)
+    src_url = 'agave://{}/{}'.format(
+        src_system,
+        urllib.parse.quote(src_path)
+    )
+    return client.files.importData(
+        systemId=dest_system,
+        filePath=urllib.parse.quote(dest_path),
+        fileName=str(file_name),
+        urlToIngest=src_url
+    )
+
+
 def move(client, src_system, src_path, dest_system, dest_path, file_name=None):
     """Move a current file to the given destination.
 
@@ -233,27 +419,13 @@ def move(client, src_system, src_path, dest_system, dest_path, file_name=None):
             raise
 
     full_dest_path = os.path.join(dest_path.strip('/'), file_name)
+    move_result = _move(client, src_system, src_path, full_dest_path)
 
-    if src_system == dest_system:
-        body = {'action': 'move',
-                'path': full_dest_path}
-        move_result = client.files.manage(systemId=src_system,
-                                          filePath=urllib.parse.quote(
-                                              src_path),
-                                          body=body)
-
-    if os.path.dirname(src_path) != dest_path or src_path != dest_path:
-        agave_indexer.apply_async(kwargs={'systemId': src_system,
-                                          'filePath': os.path.dirname(src_path),
-                                          'recurse': False},
-                                  routing_key='indexing')
-    agave_indexer.apply_async(kwargs={'systemId': dest_system,
-                                      'filePath': os.path.dirname(full_dest_path),
-                                      'recurse': False}, routing_key='indexing')
-    if move_result['nativeFormat'] == 'dir':
-        agave_indexer.apply_async(kwargs={'systemId': dest_system,
-                                          'filePath': full_dest_path, 'recurse': True},
-                                  routing_key='indexing')
+    listing_cache.invalidate(src_system, os.path.dirname(src_path), src_path,
+                             dest_path, full_dest_path)
+
+    move_indexed_files.apply_async(args=[src_system, [[src_path, full_dest_path,
+                                                       move_result['nativeFormat'] == 'dir']]])
     return move_result
 
 
@@ -292,33 +464,11 @@ def copy(client, src_system, src_path, dest_system, dest_path, file_name=None,
             raise
 
     full_dest_path = os.path.join(dest_path.strip('/'), file_name)
-    if src_system == dest_system:
-        body = {'action': 'copy',
-                'path': full_dest_path}
-        copy_result = client.files.manage(systemId=src_system,
-                                          filePath=urllib.parse.quote(
-                                              src_path),
-                                          body=body)
-    else:
-        src_url = 'agave://{}/{}'.format(
-            src_system,
-            urllib.parse.quote(src_path)
-        )
-        copy_result = client.files.importData(
-            systemId=dest_system,
-            filePath=urllib.parse.quote(dest_path),
-            fileName=str(file_name),
-            urlToIngest=src_url
-        )
-
-    agave_indexer.apply_async(kwargs={'systemId': dest_system,
-                                      'filePath': os.path.dirname(full_dest_path),
-                                      'recurse': False},
-                              routing_key='indexing')
-    agave_indexer.apply_async(kwargs={'systemId': dest_system,
-                                      'filePath': full_dest_path,
-                                      'recurse': True},
-                              routing_key='indexing')
+    copy_result = _copy(client, src_system, src_path, dest_system, dest_path, file_name)
+
+    listing_cache.invalidate(dest_system, dest_path, full_dest_path)
+    queue_agave_indexer(dest_system, os.path.dirname(full_dest_path), recurse=False)
+    queue_agave_indexer(dest_system, full_dest_path, recurse=True)
 
     return copy_result
 
@@ -337,8 +487,10 @@ def makepublic(client, src_system, src_path, dest_path='/', *args, **kwargs):
 
 
 def delete(client, system, path):
-    return client.files.delete(systemId=system,
-                               filePath=urllib.parse.quote(path))
+    result = client.files.delete(systemId=system,
+                                 filePath=urllib.parse.quote(path))
+    listing_cache.invalidate(system, os.path.dirname(path), path)
+    return result
 
 
 def rename(client, system, path, new_name):
@@ -385,6 +537,16 @@ def trash(client, system, path):
     file_name = path.strip('/').split('/')[-1]
 
     # Create a .Trash path if none exists
+    _ensure_trash(client, system)
+
+    resp = move(client, system, path, system,
+                settings.AGAVE_DEFAULT_TRASH_NAME, file_name)
+
+    return resp
+
+
+def _ensure_trash(client, system):
+    """Create the .Trash folder on a system if none exists."""
     try:
         client.files.list(systemId=system,
                           filePath=settings.AGAVE_DEFAULT_TRASH_NAME)
@@ -394,10 +556,150 @@ def trash(client, system, path):
             raise
         mkdir(client, system, '/', settings.AGAVE_DEFAULT_TRASH_NAME)
 
-    resp = move(client, system, path, system,
-                settings.AGAVE_DEFAULT_TRASH_NAME, file_name)
 
-    return resp
+def _list_names(client, system, path, page_size=1000):
+    """Names of every entry in a folder, or an empty set if it doesn't exist."""
+    names = set()
+    offset = 0
+    try:
+        while True:
+            page = client.files.list(systemId=system,
+                                     filePath=urllib.parse.quote(path),
+                                     offset=offset,
+                                     limit=page_size)
+            names.update(f['name'] for f in page)
+            if len(page) < page_size:
+                return names
+            offset += page_size
+    except HTTPError as err:
+        if err.response.status_code != 404:
+            raise
+    return names
+
+
+def _unique_name(names, file_name):
+    """Same naming as :func:`increment_file_name`, against a set of names."""
+    if file_name not in names:
+        return file_name
+    _name, _ext = os.path.splitext(file_name)
+    inc = 1
+    while '{}({}){}'.format(_name, inc, _ext) in names:
+        inc += 1
+    return '{}({}){}'.format(_name, inc, _ext)
+
+
+BATCH_OPERATIONS = ('move', 'copy', 'trash')
+
+
+def batch(client, operation, items, max_workers=None):
+    """Move, copy or trash many files in one call.
+
+    Items are grouped by destination folder. Each destination is listed once
+    and name collisions, including collisions between items of the batch,
+    are resolved in memory the same way as :func:`move` and :func:`copy`.
+    The Tapis calls then run on a pool of ``max_workers`` threads
+    (``settings.PORTAL_DATAFILES_BATCH_MAX_WORKERS`` by default), and cache
+    invalidation and reindexing are requested once per affected folder.
+
+    Params
+    ------
+    client: agavepy.agave.Agave
+        Tapis client to use.
+    operation: str
+        One of ``'move'``, ``'copy'`` or ``'trash'``.
+    items: list
+        Dicts with ``system`` and ``path`` keys for the source file, and
+        ``dest_system``, ``dest_path`` and optionally ``file_name`` for moves
+        and copies.
+
+    Returns
+    -------
+    list
+        One ``{'status': 'success', 'response': ...}`` or
+        ``{'status': 'error', 'message': ...}`` dict per item, in order.
+    """
+    if operation not in BATCH_OPERATIONS:
+        raise ApiException("Unsupported batch operation: {}".format(operation), status=400)
+    if len(items) > settings.PORTAL_DATAFILES_BATCH_MAX_ITEMS:
+        raise ApiException("Batches are limited to {} files".format(
+            settings.PORTAL_DATAFILES_BATCH_MAX_ITEMS), status=400)
+
+    results = [None] * len(items)
+    if operation == 'trash':
+        for system in {item['system'] for item in items}:
+            _ensure_trash(client, system)
+        items = [dict(item,
+                      dest_system=item['system'],
+                      dest_path=settings.AGAVE_DEFAULT_TRASH_NAME) for item in items]
+
+    groups = {}
+    for index, item in enumerate(items):
+        if operation != 'copy' and item['system'] != item['dest_system']:
+            results[index] = {'status': 'error', 'message': 'Cross-system file moves are not supported'}
+            continue
+        groups.setdefault((item['dest_system'], item['dest_path']), []).append(index)
+
+    # Resolve destination names up front so the Tapis calls are independent.
+    calls = []
+    for (dest_system, dest_path), indexes in groups.items():
+        try:
+            names = _list_names(client, dest_system, dest_path)
+        except HTTPError as exc:
+            for index in indexes:
+                results[index] = {'status': 'error', 'message': str(exc)}
+            continue
+        for index in indexes:
+            item = items[index]
+            file_name = item.get('file_name') or item['path'].strip('/').split('/')[-1]
+            full_dest_path = os.path.join(dest_path.strip('/'), file_name)
+            if operation != 'copy' and item['path'].strip('/') == full_dest_path:
+                # Moving a file into its current path.
+                results[index] = {'status': 'success',
+                                  'response': {'system': item['system'], 'path': full_dest_path, 'name': file_name}}
+                continue
+            file_name = _unique_name(names, file_name)
+            names.add(file_name)
+            calls.append((index, item, file_name))
+
+    def _run(item, file_name):
+        if operation == 'copy':
+            return _copy(client, item['system'], item['path'], item['dest_system'], item['dest_path'], file_name)
+        return _move(client, item['system'], item['path'],
+                     os.path.join(item['dest_path'].strip('/'), file_name))
+
+    invalidated = {}
+    reindex = set()
+    moved = {}
+    max_workers = max_workers or settings.PORTAL_DATAFILES_BATCH_MAX_WORKERS
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(index, item, file_name, executor.submit(_run, item, file_name))
+                   for index, item, file_name in calls]
+        for index, item, file_name, future in futures:
+            try:
+                result = future.result()
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.exception('Error running %s on %s:%s', operation, item['system'], item['path'])
+                results[index] = {'status': 'error', 'message': str(exc)}
+                continue
+            results[index] = {'status': 'success', 'response': result}
+            dest_system = item['dest_system']
+            full_dest_path = os.path.join(item['dest_path'].strip('/'), file_name)
+            invalidated.setdefault(dest_system, set()).update([item['dest_path'], full_dest_path])
+            if operation != 'copy':
+                invalidated.setdefault(item['system'], set()).update([os.path.dirname(item['path']), item['path']])
+                moved.setdefault(item['system'], []).append(
+                    [item['path'], full_dest_path, dict(result).get('nativeFormat') == 'dir'])
+                continue
+            reindex.add((dest_system, os.path.dirname(full_dest_path), False))
+            reindex.add((dest_system, full_dest_path, True))
+
+    for system, paths in invalidated.items():
+        listing_cache.invalidate(system, *paths)
+    for system, path, recurse in reindex:
+        queue_agave_indexer(system, path, recurse=recurse)
+    for system, moves in moved.items():
+        move_indexed_files.apply_async(args=[system, moves])
+    return results
 
 
 def upload(client, system, path, uploaded_file):
@@ -429,10 +731,8 @@ def upload(client, system, path, uploaded_file):
                                    filePath=urllib.parse.quote(path),
                                    fileToUpload=uploaded_file)
 
-    agave_indexer.apply_async(kwargs={'systemId': system,
-                                      'filePath': path,
-                                      'recurse': False},
-                              )
+    listing_cache.invalidate(system, path)
+    queue_agave_indexer(system, path, recurse=False)
     return dict(resp)
 
 
@@ -521,3 +821,97 @@ def download_bytes(client, system, path):
     result = io.BytesIO(resp.content)
     result.name = file_name
     return result
+
+
+def download_stream(client, system, path, chunk_size=None):
+    """Stream a file's contents without loading it into memory.
+
+    Params
+    ------
+    client: agavepy.agave.Agave
+        Tapis client to use.
+    system: str
+    path: str
+    chunk_size: int
+        Size of each chunk in bytes. Defaults to
+        ``settings.PORTAL_TRANSFER_CHUNK_SIZE``.
+
+    Returns
+    -------
+    tuple
+        The file name and an iterator over the file's contents.
+    """
+    url = '{}/files/v2/media/system/{}/{}'.format(client.api_server, system,
+                                                  urllib.parse.quote(path.strip('/')))
+
+    def _get():
+        # pylint: disable=protected-access
+        resp = requests.get(url, headers={'Authorization': 'Bearer {}'.format(client._token)},
+                            stream=True)
+        # pylint: enable=protected-access
+        resp.raise_for_status()
+        return resp
+
+    # with_refresh may return an error response instead of raising.
+    resp = with_refresh(client, _get)
+    resp.raise_for_status()
+
+    def _chunks():
+        with resp:
+            yield from resp.iter_content(chunk_size or settings.PORTAL_TRANSFER_CHUNK_SIZE)
+
+    return os.path.basename(path.rstrip('/')), _chunks()
+
+
+def _multipart_stream(file_name, chunks, boundary):
+    yield ('--{}\r\n'
+           'Content-Disposition: form-data; name="fileToUpload"; filename="{}"\r\n'
+           'Content-Type: application/octet-stream\r\n\r\n').format(boundary, file_name).encode()
+    yield from chunks
+    yield '\r\n--{}--\r\n'.format(boundary).encode()
+
+
+def upload_stream(client, system, path, file_name, chunks):
+    """Upload a file from an iterator of chunks, without buffering it.
+
+    Params
+    ------
+    client: agavepy.agave.Agave
+        Tapis client to use.
+    system: str
+        Tapis system ID for the file.
+    path: str
+        Path to upload the file to.
+    file_name: str
+        Name of the uploaded file. A numeric suffix is added if a file with
+        this name already exists.
+    chunks: iterable
+        File contents as bytes.
+
+    Returns
+    -------
+    dict
+    """
+    # Listing first also refreshes an expired token, since a streamed body
+    # cannot be replayed after a 401.
+    try:
+        file_listing = client.files.list(systemId=system, filePath=path)
+        file_name = increment_file_name(listing=file_listing, file_name=file_name)
+    except HTTPError as err:
+        if err.response.status_code != 404:
+            raise
+
+    boundary = uuid.uuid4().hex
+    url = '{}/files/v2/media/system/{}/{}'.format(client.api_server, system,
+                                                  urllib.parse.quote(path.strip('/')))
+    # pylint: disable=protected-access
+    resp = requests.post(url,
+                         headers={'Authorization': 'Bearer {}'.format(client._token),
+                                  'Content-Type': 'multipart/form-data; boundary={}'.format(boundary)},
+                         data=_multipart_stream(file_name, chunks, boundary))
+    # pylint: enable=protected-access
+    resp.raise_for_status()
+
+    listing_cache.invalidate(system, path)
+    queue_agave_indexer(system, path, recurse=False)
+    return resp.json()['result']
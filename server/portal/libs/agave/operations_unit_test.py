@@ -1,10 +1,12 @@
+import datetime
 from mock import patch, MagicMock
 from requests.exceptions import HTTPError
 from django.test import TestCase
 from agavepy.agave import AttrDict
 from elasticsearch_dsl import Q
 from elasticsearch_dsl.response import Hit
-from portal.libs.agave.operations import listing, search, mkdir, move, copy, rename, makepublic
+from portal.libs.agave.operations import (listing, indexed_listing, search, mkdir, move, copy, rename, makepublic,
+                                          upload_stream, batch)
 from portal.exceptions.api import ApiException
 
 
@@ -30,42 +32,142 @@ class TestOperations(TestCase):
                                            'path': '/path/to/file'}],
                               'reachedEnd': True})
 
+    @patch('portal.libs.agave.operations.agave_listing_indexer')
+    @patch('portal.libs.agave.operations.listing_cache')
+    def test_listing_cached(self, mock_cache, mock_indexer):
+        client = MagicMock()
+        mock_cache.get.return_value = {'listing': [], 'reachedEnd': True}
+
+        ls = listing(client, 'test.system', '/path/to/file')
+
+        mock_cache.get.assert_called_with(client, 'test.system', '/path/to/file', 0, 100)
+        client.files.list.assert_not_called()
+        mock_indexer.delay.assert_not_called()
+        self.assertEqual(ls, {'listing': [], 'reachedEnd': True})
+
+    @patch('portal.libs.agave.operations.agave_listing_indexer')
+    @patch('portal.libs.agave.operations.listing_cache')
+    def test_listing_fresh(self, mock_cache, mock_indexer):
+        client = MagicMock()
+        client.files.list.return_value = []
+
+        ls = listing(client, 'test.system', '/path/to/file', fresh='1')
+
+        mock_cache.get.assert_not_called()
+        mock_cache.set.assert_called_with(client, 'test.system', '/path/to/file', 0, 100, ls)
+
+    @patch('portal.libs.agave.operations.indexed_listing')
+    @patch('portal.libs.agave.operations.listing_cache')
+    def test_listing_indexed(self, mock_cache, mock_indexed):
+        client = MagicMock()
+        mock_cache.get.return_value = None
+        mock_indexed.return_value = {'listing': [], 'reachedEnd': True, 'stale': True}
+
+        ls = listing(client, 'test.system', '/path', indexed='1')
+
+        mock_indexed.assert_called_with(client, 'test.system', '/path', 0, 100)
+        client.files.list.assert_not_called()
+        self.assertEqual(ls, {'listing': [], 'reachedEnd': True, 'stale': True})
+
+    @patch('portal.libs.agave.operations.agave_listing_indexer')
+    @patch('portal.libs.agave.operations.cache')
+    @patch('portal.libs.agave.operations.current_time')
+    @patch('portal.libs.agave.operations.indexed_level')
+    def test_indexed_listing(self, mock_level, mock_time, mock_cache, mock_indexer):
+        client = MagicMock(token_username='username')
+        mock_time.return_value = datetime.datetime(2020, 1, 1, 12)
+        mock_level.return_value = ([{'path': '/path/file'}], datetime.datetime(2020, 1, 1, 11))
+        mock_cache.get_redis().set.return_value = True
+
+        ls = indexed_listing(client, 'test.system', 'path/')
+
+        mock_level.assert_called_with('test.system', '/path', 0, 100)
+        mock_indexer.delay.assert_called_with(systemId='test.system', filePath='/path', username='username')
+        self.assertEqual(ls, {'listing': [{'path': '/path/file'}], 'reachedEnd': True, 'stale': True})
+
+        # Revalidation is only queued once per interval.
+        mock_cache.get_redis().set.return_value = None
+        mock_indexer.reset_mock()
+        indexed_listing(client, 'test.system', 'path/')
+        mock_indexer.delay.assert_not_called()
+
+    @patch('portal.libs.agave.operations.agave_listing_indexer')
+    @patch('portal.libs.agave.operations.current_time')
+    @patch('portal.libs.agave.operations.indexed_level')
+    def test_indexed_listing_too_old(self, mock_level, mock_time, mock_indexer):
+        mock_time.return_value = datetime.datetime(2020, 1, 3)
+        mock_level.return_value = ([{'path': '/path/file'}], datetime.datetime(2020, 1, 1))
+
+        self.assertIsNone(indexed_listing(MagicMock(), 'test.system', '/path'))
+        mock_level.return_value = ([], None)
+        self.assertIsNone(indexed_listing(MagicMock(), 'test.system', '/path'))
+        mock_indexer.delay.assert_not_called()
+
     @patch('portal.libs.agave.operations.IndexedFile.search')
     def test_search(self, mock_search):
-        mock_hit = Hit({})
-        mock_hit.system = 'test.system'
-        mock_hit.path = '/path/to/file'
+        mock_hit = Hit({'_source': {'system': 'test.system', 'path': '/path/to/file'},
+                        'highlight': {'name': ['<b>fil</b>e']},
+                        'sort': [1.5, '/path/to/file']})
 
         mock_result = MagicMock()
         mock_result.__iter__.return_value = [mock_hit]
+        mock_result.hits.__getitem__.return_value = mock_hit
         mock_result.hits.total.value = 1
-        mock_search().query().filter().extra().execute\
-            .return_value = mock_result
-
-        search_res = search(None, 'test.system', '/path', query_string='query')
-
-        mock_search().query.assert_called_with(Q("query_string", query='query',
-                                                 fields=["name"],
-                                                 minimum_should_match='100%',
-                                                 default_operator='or') |
-                                               Q("query_string", query='query',
-                                                 fields=[
-                                                     "name._exact, name._pattern"],
-                                                 default_operator='and'))
-        mock_search().query().filter.assert_called_with('term', **{'system._exact': 'test.system'})
-        mock_search().query().filter().extra.assert_called_with(from_=int(0), size=int(100))
+        query = mock_search().params().query().filter().sort().highlight().highlight_options()
+        query.extra().execute.return_value = mock_result
+
+        search_res = search(None, 'test.system', '/', query_string='query')
+
+        mock_search().params().query.assert_called_with(Q("query_string", query='query',
+                                                          fields=["name"],
+                                                          minimum_should_match='100%',
+                                                          default_operator='or') |
+                                                        Q("query_string", query='query',
+                                                          fields=[
+                                                              "name._exact, name._pattern"],
+                                                          default_operator='and'))
+        mock_search().params().query().filter.assert_called_with('term', **{'system._exact': 'test.system'})
+        mock_search().params().query().filter().filter.assert_not_called()
+        mock_search().params().query().filter().sort.assert_called_with({'_score': {'order': 'desc'}},
+                                                                        {'path._exact': {'order': 'asc'}})
+        query.extra.assert_called_with(from_=int(0), size=int(100))
         self.assertEqual(search_res, {'listing':
                                       [{'system': 'test.system',
-                                        'path': '/path/to/file'}],
-                                      'reachedEnd': True, 'count': 1})
+                                        'path': '/path/to/file',
+                                        'highlight': {'name': ['<b>fil</b>e']}}],
+                                      'reachedEnd': True, 'count': 1,
+                                      'nextPageToken': '[1.5, "/path/to/file"]'})
+
+    @patch('portal.libs.agave.operations.IndexedFile.search')
+    def test_search_scoped(self, mock_search):
+        query = mock_search().params().query().filter().filter().sort().highlight().highlight_options()
+
+        search(None, 'test.system', '/path/to/folder/', query_string='query',
+               nextPageToken='[1.5, "/path/to/file"]', limit='10')
+
+        mock_search().params().query().filter().filter.assert_called_with(
+            'term', **{'basePath._comps': '/path/to/folder'})
+        query.extra.assert_called_with(search_after=[1.5, '/path/to/file'], size=10)
+
+    @patch('portal.libs.agave.operations.IndexedFile.search')
+    def test_search_facets(self, mock_search):
+        query = mock_search().params().query().filter().sort().highlight().highlight_options().extra()
+        bucket = MagicMock(key='txt', doc_count=2)
+        query.execute.return_value.aggregations.__getitem__.return_value.buckets = [bucket]
+
+        search_res = search(None, 'test.system', '', query_string='query', facets='true')
+
+        self.assertEqual(sorted(query.aggs.bucket.call_args_list[i][0][0] for i in range(4)),
+                         ['extension', 'lastModified', 'mimeType', 'size'])
+        self.assertEqual(search_res['facets']['extension'], [{'key': 'txt', 'count': 2}])
 
-    @patch('portal.libs.agave.operations.agave_indexer')
+    @patch('portal.libs.agave.operations.queue_agave_indexer')
     def test_mkdir(self, mock_indexer):
         client = MagicMock()
         mkdir(client, 'test.system', '/root', 'testfolder')
         client.files.manage.assert_called_with(systemId='test.system', filePath='/root', body={'action': 'mkdir', 'path': 'testfolder'})
 
-        mock_indexer.apply_async.assert_called_with(kwargs={'systemId': 'test.system', 'filePath': '/root', 'recurse': False})
+        mock_indexer.assert_called_with('test.system', '/root', recurse=False)
 
     @patch('portal.libs.agave.operations.move')
     def test_rename(self, mock_move):
@@ -77,8 +179,8 @@ class TestOperations(TestCase):
                                      dest_system='test.system', dest_path='/path/to',
                                      file_name='newname')
 
-    @patch('portal.libs.agave.operations.agave_indexer')
-    def test_move(self, mock_indexer):
+    @patch('portal.libs.agave.operations.move_indexed_files')
+    def test_move(self, mock_move_index):
         client = MagicMock()
         client.files.list.side_effect = HTTPError(response=MagicMock(status_code=404))
         client.files.manage.return_value = {'nativeFormat': 'dir'}
@@ -89,14 +191,27 @@ class TestOperations(TestCase):
             'action': 'move', 'path': 'path/to/dest/src'
         })
 
-        self.assertEqual(mock_indexer.apply_async.call_count, 3)
+        mock_move_index.apply_async.assert_called_once_with(
+            args=['test.system', [['/path/to/src', 'path/to/dest/src', True]]])
+
+    @patch('portal.libs.agave.operations.move_indexed_files')
+    @patch('portal.libs.agave.operations.listing_cache')
+    def test_move_invalidates_listings(self, mock_cache, mock_move_index):
+        client = MagicMock()
+        client.files.list.side_effect = HTTPError(response=MagicMock(status_code=404))
+        client.files.manage.return_value = {'nativeFormat': 'raw'}
+
+        move(client, 'test.system', '/path/to/src', 'test.system', '/path/to/dest')
+
+        mock_cache.invalidate.assert_called_with('test.system', '/path/to', '/path/to/src',
+                                                 '/path/to/dest', 'path/to/dest/src')
 
     def test_cross_system_move(self):
         client = MagicMock()
         with self.assertRaises(ApiException):
             move(client, 'test.system', '/path/to/src', 'other.system', '/path/to/dest')
 
-    @patch('portal.libs.agave.operations.agave_indexer')
+    @patch('portal.libs.agave.operations.queue_agave_indexer')
     def test_copy(self, mock_indexer):
         client = MagicMock()
         client.files.list.side_effect = HTTPError(response=MagicMock(status_code=404))
@@ -108,7 +223,54 @@ class TestOperations(TestCase):
             'action': 'copy', 'path': 'path/to/dest/src'
         })
 
-        self.assertEqual(mock_indexer.apply_async.call_count, 2)
+        self.assertEqual(mock_indexer.call_count, 2)
+
+    @patch('portal.libs.agave.operations.move_indexed_files')
+    @patch('portal.libs.agave.operations.listing_cache')
+    def test_batch_move(self, mock_cache, mock_move_index):
+        client = MagicMock()
+        client.files.list.return_value = [{'name': 'a.txt'}]
+        client.files.manage.side_effect = lambda systemId, filePath, body: {'nativeFormat': 'raw',
+                                                                            'path': body['path']}
+        items = [{'system': 'test.system', 'path': '/src/a.txt', 'dest_system': 'test.system', 'dest_path': '/dest'},
+                 {'system': 'test.system', 'path': '/other/a.txt', 'dest_system': 'test.system', 'dest_path': '/dest'},
+                 {'system': 'test.system', 'path': '/src/b.txt', 'dest_system': 'test.system', 'dest_path': '/dest'},
+                 {'system': 'test.system', 'path': '/src/c.txt', 'dest_system': 'other.system', 'dest_path': '/'}]
+
+        results = batch(client, 'move', items)
+
+        # The destination is listed once for the whole batch.
+        client.files.list.assert_called_once_with(systemId='test.system', filePath='/dest', offset=0, limit=1000)
+        self.assertEqual([r['status'] for r in results], ['success', 'success', 'success', 'error'])
+        self.assertEqual([r['response']['path'] for r in results[:3]],
+                         ['dest/a(1).txt', 'dest/a(2).txt', 'dest/b.txt'])
+        mock_cache.invalidate.assert_called_once()
+        # Moves are rewritten in the index with one task per system.
+        mock_move_index.apply_async.assert_called_once_with(args=['test.system', [
+            ['/src/a.txt', 'dest/a(1).txt', False],
+            ['/other/a.txt', 'dest/a(2).txt', False],
+            ['/src/b.txt', 'dest/b.txt', False]
+        ]])
+
+    @patch('portal.libs.agave.operations.move_indexed_files')
+    @patch('portal.libs.agave.operations.listing_cache')
+    def test_batch_trash(self, mock_cache, mock_move_index):
+        client = MagicMock()
+        client.files.list.return_value = []
+        client.files.manage.side_effect = [{'nativeFormat': 'dir'}, HTTPError('move failed')]
+        items = [{'system': 'test.system', 'path': '/dir'},
+                 {'system': 'test.system', 'path': '/file.txt'}]
+
+        results = batch(client, 'trash', items, max_workers=1)
+
+        self.assertEqual([r['status'] for r in results], ['success', 'error'])
+        client.files.manage.assert_any_call(systemId='test.system', filePath='/dir',
+                                            body={'action': 'move', 'path': 'test/dir'})
+        mock_move_index.apply_async.assert_called_once_with(args=['test.system', [['/dir', 'test/dir', True]]])
+
+    def test_batch_unsupported(self):
+        with self.assertRaises(ApiException):
+            batch(MagicMock(), 'rename', [])
 
     @patch('portal.libs.agave.operations.copy')
     def test_make_public(self, mock_copy):
@@ -120,3 +282,22 @@ class TestOperations(TestCase):
                                      'test.system',
                                      '/path/to/src',
                                      'portal.storage.public', '/')
+
+    @patch('portal.libs.agave.operations.queue_agave_indexer')
+    @patch('portal.libs.agave.operations.requests')
+    def test_upload_stream(self, mock_requests, mock_indexer):
+        client = MagicMock(api_server='https://api.example.com', _token='token')
+        client.files.list.return_value = [{'name': 'file.txt'}]
+        sent = []
+        mock_requests.post.side_effect = lambda url, headers, data: sent.extend(data) or MagicMock(
+            json=MagicMock(return_value={'result': {'name': 'file(1).txt'}}))
+
+        result = upload_stream(client, 'test.system', '/path', 'file.txt', iter([b'ab', b'cd']))
+
+        self.assertEqual(result, {'name': 'file(1).txt'})
+        url = mock_requests.post.call_args[0][0]
+        self.assertEqual(url, 'https://api.example.com/files/v2/media/system/test.system/path')
+        body = b''.join(sent)
+        self.assertIn(b'filename="file(1).txt"', body)
+        self.assertIn(b'\r\n\r\nabcd\r\n', body)
+        mock_indexer.assert_called_with('test.system', '/path', recurse=False)
@@ -8,7 +8,8 @@ import urllib.request
 import urllib.parse
 import urllib.error
 from django.conf import settings
-from agavepy.agave import Agave
+from portal.libs.agave import clients
+from portal.libs.agave.clients import PooledAgave
 import requests
 
 # pylint: disable=invalid-name
@@ -194,10 +195,14 @@ def walk_levels(client, system, path, bottom_up=False, ignore_hidden=False):
 
 
 def service_account():
-    """Return an agave instance with the admin account."""
-    return Agave(
+    """Return an agave instance with the admin account.
+
+    The client is shared within the process, see
+    :mod:`portal.libs.agave.clients`.
+    """
+    return clients.get_client(None, settings.AGAVE_SUPER_TOKEN, lambda: PooledAgave(
         api_server=settings.AGAVE_TENANT_BASEURL,
-        token=settings.AGAVE_SUPER_TOKEN)
+        token=settings.AGAVE_SUPER_TOKEN))
 
 
 def text_preview(url):
@@ -0,0 +1,60 @@
+"""
+.. module: portal.libs.cache
+   :synopsis: Shared Redis connection and hit/miss counters for portal caches.
+"""
+import logging
+import redis
+from django.conf import settings
+
+# pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+# pylint: enable=invalid-name
+
+STATS_KEY = 'portal-cache:stats'
+
+_client = None
+
+
+def get_redis():
+    """Return the process-wide Redis client used for portal caches.
+
+    :rtype: redis.Redis
+    """
+    global _client  # pylint: disable=global-statement
+    if _client is None:
+        _client = redis.Redis.from_url(settings.PORTAL_CACHE_REDIS_URL,
+                                       socket_timeout=settings.PORTAL_CACHE_SOCKET_TIMEOUT,
+                                       socket_connect_timeout=settings.PORTAL_CACHE_SOCKET_TIMEOUT)
+    return _client
+
+
+def record(cache, event):
+    """Increment the counter for a cache event, e.g. ``record('listing', 'hits')``.
+
+    Counter failures are logged and otherwise ignored.
+    """
+    try:
+        get_redis().hincrby(STATS_KEY, '{}:{}'.format(cache, event))
+    except redis.RedisError:
+        logger.warning('Unable to record %s %s', cache, event)
+
+
+def stats(cache):
+    """Hit/miss counters for a cache.
+
+    :param str cache: Cache name passed to :func:`record`.
+    :return: ``{'hits': int, 'misses': int, 'hitRate': float}``
+    :rtype: dict
+    """
+    hits, misses = get_redis().hmget(STATS_KEY, '{}:hits'.format(cache), '{}:misses'.format(cache))
+    hits = int(hits or 0)
+    misses = int(misses or 0)
+    total = hits + misses
+    return {'hits': hits,
+            'misses': misses,
+            'hitRate': round(hits / total, 3) if total else 0.0}
+
+
+def reset_stats(cache):
+    """Reset the hit/miss counters for a cache."""
+    get_redis().hdel(STATS_KEY, '{}:hits'.format(cache), '{}:misses'.format(cache))
@@ -0,0 +1,320 @@
+"""
+.. module: portal.libs.elasticsearch.bulk
+   :synopsis: Shared, streaming bulk writer for Elasticsearch indexing paths.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from elasticsearch.helpers import streaming_bulk
+from elasticsearch_dsl.connections import get_connection
+from redis import RedisError
+from portal.libs import cache
+from portal.libs.elasticsearch.utils import routing_required
+
+# pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+# pylint: enable=invalid-name
+
+# Hash of alias -> index that writes to the alias are copied to, e.g. while
+# reindex-files copies the files index.
+DUAL_WRITE_KEY = 'es-dual-write'
+# Writes to a dual-write target that raced the copy into it, by target index:
+# IDs of deleted documents, IDs of documents whose partial update missed
+# because they had not been copied yet, and deleted subtrees. See
+# portal.libs.elasticsearch.indexes.replay_dual_writes.
+DUAL_WRITE_DELETED_KEY = 'es-dual-write:deleted:{}'
+DUAL_WRITE_STALE_KEY = 'es-dual-write:stale:{}'
+DUAL_WRITE_SUBTREES_KEY = 'es-dual-write:subtrees:{}'
+
+_dual_writes = {}
+_dual_writes_checked = 0
+_dual_writes_lock = threading.Lock()
+
+
+def _change_keys(index):
+    return [key.format(index) for key in (DUAL_WRITE_DELETED_KEY, DUAL_WRITE_STALE_KEY, DUAL_WRITE_SUBTREES_KEY)]
+
+
+def start_dual_write(alias, index):
+    """Copy every bulk action sent to ``alias`` to ``index`` as well.
+
+    Processes pick up the change within settings.ES_DUAL_WRITE_CHECK_INTERVAL
+    seconds.
+    """
+    pipe = cache.get_redis().pipeline()
+    pipe.delete(*_change_keys(index))
+    pipe.hset(DUAL_WRITE_KEY, alias, index)
+    pipe.execute()
+
+
+def stop_dual_write(alias):
+    redis = cache.get_redis()
+    index = redis.hget(DUAL_WRITE_KEY, alias)
+    redis.hdel(DUAL_WRITE_KEY, alias)
+    if index is not None:
+        redis.delete(*_change_keys(index.decode()))
+
+
+def record_dual_write_subtrees(index, system, paths):
+    """Record that subtrees were deleted from a dual-write target."""
+    try:
+        cache.get_redis().rpush(DUAL_WRITE_SUBTREES_KEY.format(index),
+                                json.dumps({'system': system, 'paths': list(paths)}))
+    except RedisError:
+        logger.warning('Unable to record deleted subtrees of %s for dual write replay', index)
+
+
+def dual_write_changes(index):
+    """
+    Writes to a dual-write target recorded while it received dual writes.
+
+    Returns
+    -------
+    tuple
+        Deleted document IDs, IDs of documents whose update missed, and
+        deleted subtrees as ``{'system': ..., 'paths': [...]}`` dicts.
+    """
+    redis = cache.get_redis()
+    deleted_key, stale_key, subtrees_key = _change_keys(index)
+    return ({doc_id.decode() for doc_id in redis.smembers(deleted_key)},
+            {doc_id.decode() for doc_id in redis.smembers(stale_key)},
+            [json.loads(entry) for entry in redis.lrange(subtrees_key, 0, -1)])
+
+
+def dual_writes():
+    """Current alias -> index dual writes, refreshed from Redis at most every
+    settings.ES_DUAL_WRITE_CHECK_INTERVAL seconds.
+
+    :rtype: dict
+    """
+    global _dual_writes, _dual_writes_checked  # pylint: disable=global-statement
+    interval = settings.ES_DUAL_WRITE_CHECK_INTERVAL
+    if interval <= 0:
+        return {}
+    with _dual_writes_lock:
+        if time.time() - _dual_writes_checked >= interval:
+            try:
+                _dual_writes = {alias.decode(): index.decode() for alias, index
+                                in cache.get_redis().hgetall(DUAL_WRITE_KEY).items()}
+            except RedisError:
+                logger.warning('Unable to check for dual writes')
+            _dual_writes_checked = time.time()
+        return _dual_writes
+
+
+def _route(action):
+    """Drop the routing of an action on an index that does not require it,
+    e.g. a files index built before documents were routed, where a routed
+    write would add a second copy of the document on another shard.
+    """
+    if '_routing' in action and not routing_required(action.get('_index')):
+        return {key: value for key, value in action.items() if key != '_routing'}
+    return action
+
+
+class BatchResult:
+    """Outcome of a single bulk request."""
+
+    def __init__(self, success=0, failed=0, errors=None):
+        self.success = success
+        self.failed = failed
+        self.errors = errors or []
+
+    def to_dict(self):
+        return {'success': self.success, 'failed': self.failed}
+
+
+class BulkStats:
+    """Per-batch and total success/failure counts for a :class:`BulkWriter`."""
+
+    # Number of failed items kept for inspection.
+    MAX_ERRORS = 20
+
+    def __init__(self):
+        self.batches = []
+        self.errors = []
+
+    @property
+    def success(self):
+        return sum(batch.success for batch in self.batches)
+
+    @property
+    def failed(self):
+        return sum(batch.failed for batch in self.batches)
+
+    def record(self, batch):
+        self.batches.append(batch)
+        self.errors.extend(batch.errors[:self.MAX_ERRORS - len(self.errors)])
+
+    def to_dict(self):
+        return {'success': self.success,
+                'failed': self.failed,
+                'batches': [batch.to_dict() for batch in self.batches]}
+
+
+class BulkWriter:
+    """
+    Buffer bulk actions and send them to Elasticsearch in bounded batches.
+
+    Actions are flushed whenever the buffer reaches ``chunk_size`` actions or
+    ``max_chunk_bytes`` bytes, so memory use does not grow with the number of
+    actions written. Items rejected with a 429 are retried with exponential
+    backoff. With ``thread_count`` > 1, up to that many batches are sent
+    concurrently and :meth:`add` blocks while all of them are in flight.
+
+    Parameters
+    ----------
+    client: elasticsearch.Elasticsearch
+        Client to use. Defaults to the shared ``default`` connection.
+    chunk_size: int
+        Maximum number of actions per bulk request.
+    max_chunk_bytes: int
+        Maximum size in bytes of a bulk request.
+    thread_count: int
+        Number of bulk requests to run in parallel.
+    max_retries: int
+        Number of times to retry items rejected with a 429.
+
+    Example
+    -------
+    >>> with BulkWriter() as writer:
+    ...     writer.write(ops)
+    >>> writer.stats.to_dict()
+    """
+
+    def __init__(self, client=None, chunk_size=None, max_chunk_bytes=None,
+                 thread_count=None, max_retries=None, initial_backoff=2, max_backoff=60):
+        self.client = client or get_connection('default')
+        self.chunk_size = chunk_size or settings.ES_BULK_CHUNK_SIZE
+        self.max_chunk_bytes = max_chunk_bytes or settings.ES_BULK_MAX_CHUNK_BYTES
+        self.thread_count = thread_count or settings.ES_BULK_THREAD_COUNT
+        self.max_retries = settings.ES_BULK_MAX_RETRIES if max_retries is None else max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.stats = BulkStats()
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._executor = None
+        self._pending = deque()
+
+    def add(self, action):
+        """Queue a single bulk action, flushing if the buffer is full."""
+        size = len(json.dumps(action, default=str))
+        if self._buffer and self._buffer_bytes + size > self.max_chunk_bytes:
+            self.flush()
+        self._buffer.append(action)
+        self._buffer_bytes += size
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def write(self, actions):
+        """Queue every action in an iterable. Returns the writer."""
+        for action in actions:
+            self.add(action)
+        return self
+
+    def flush(self):
+        """Send buffered actions."""
+        if not self._buffer:
+            return
+        actions, self._buffer, self._buffer_bytes = self._buffer, [], 0
+        batch = [_route(action) for action in actions]
+        mirrors = dual_writes()
+        if mirrors:
+            batch += [_route(dict(action, _index=mirrors[action['_index']])) for action in actions
+                      if action.get('_index') in mirrors]
+        targets = set(mirrors.values())
+        if self.thread_count <= 1:
+            self.stats.record(self._send(batch, targets))
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.thread_count)
+        # Backpressure: wait for the oldest batch once every thread is busy.
+        while len(self._pending) >= self.thread_count:
+            self.stats.record(self._pending.popleft().result())
+        self._pending.append(self._executor.submit(self._send, batch, targets))
+
+    def close(self):
+        """Flush remaining actions and wait for in-flight batches.
+
+        Returns
+        -------
+        BulkStats
+        """
+        self.flush()
+        while self._pending:
+            self.stats.record(self._pending.popleft().result())
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self.stats.failed:
+            logger.error('Bulk indexing failed for %s documents, e.g. %s',
+                         self.stats.failed, self.stats.errors[:3])
+        return self.stats
+
+    def _send(self, batch, targets=()):
+        result = BatchResult()
+        changes = {}
+        for ok, item in streaming_bulk(self.client, batch,
+                                       chunk_size=self.chunk_size,
+                                       max_chunk_bytes=self.max_chunk_bytes,
+                                       raise_on_error=False,
+                                       max_retries=self.max_retries,
+                                       initial_backoff=self.initial_backoff,
+                                       max_backoff=self.max_backoff):
+            op_type, info = next(iter(item.items()))
+            target = info.get('_index') if info.get('_index') in targets else None
+            if target and op_type == 'delete':
+                changes.setdefault(DUAL_WRITE_DELETED_KEY.format(target), []).append(info['_id'])
+            # A document deleted twice, or deleted from a dual-write target
+            # before it was copied there, is already gone.
+            if ok or (op_type == 'delete' and info.get('status') == 404):
+                result.success += 1
+            # A document updated on a dual-write target before it was copied
+            # there is copied again once the copy is done.
+            elif target and op_type == 'update' and info.get('status') == 404:
+                changes.setdefault(DUAL_WRITE_STALE_KEY.format(target), []).append(info['_id'])
+                result.success += 1
+            else:
+                result.failed += 1
+                result.errors.append(item)
+        if changes:
+            # Recorded for portal.libs.elasticsearch.indexes.replay_dual_writes.
+            try:
+                pipe = cache.get_redis().pipeline()
+                for key, doc_ids in changes.items():
+                    pipe.sadd(key, *doc_ids)
+                pipe.execute()
+            except RedisError:
+                logger.warning('Unable to record dual writes for replay')
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def bulk_write(actions, **kwargs):
+    """
+    Write an iterable of bulk actions with a :class:`BulkWriter`.
+
+    Parameters
+    ----------
+    actions: iterable
+        Bulk actions, as accepted by ``elasticsearch.helpers.bulk``.
+    kwargs:
+        Passed to :class:`BulkWriter`.
+
+    Returns
+    -------
+    BulkStats
+    """
+    writer = BulkWriter(**kwargs)
+    writer.write(actions)
+    return writer.close()
@@ -0,0 +1,151 @@
+import pytest
+from mock import MagicMock
+from portal.libs.elasticsearch.bulk import BulkWriter, bulk_write, start_dual_write, stop_dual_write, \
+    record_dual_write_subtrees
+
+
+@pytest.fixture
+def mock_streaming_bulk(mocker):
+    def streaming_bulk_side_effect(client, actions, **kwargs):
+        for action in actions:
+            yield (not action.get('fail'), {'index': action})
+    yield mocker.patch('portal.libs.elasticsearch.bulk.streaming_bulk', side_effect=streaming_bulk_side_effect)
+
+
+def test_bulk_writer_batches_by_count(mock_streaming_bulk):
+    client = MagicMock()
+    stats = bulk_write(({'_id': i} for i in range(5)), client=client, chunk_size=2)
+
+    assert mock_streaming_bulk.call_count == 3
+    assert [batch.to_dict() for batch in stats.batches] == [
+        {'success': 2, 'failed': 0},
+        {'success': 2, 'failed': 0},
+        {'success': 1, 'failed': 0}
+    ]
+    assert stats.success == 5
+    mock_streaming_bulk.assert_called_with(client, [{'_id': 4}],
+                                           chunk_size=2,
+                                           max_chunk_bytes=10 * 1024 * 1024,
+                                           raise_on_error=False,
+                                           max_retries=5,
+                                           initial_backoff=2,
+                                           max_backoff=60)
+
+
+def test_bulk_writer_batches_by_bytes(mock_streaming_bulk):
+    writer = BulkWriter(client=MagicMock(), chunk_size=100, max_chunk_bytes=30)
+    writer.write([{'_id': 'a' * 10}, {'_id': 'b' * 10}, {'_id': 'c' * 10}])
+    stats = writer.close()
+
+    assert mock_streaming_bulk.call_count == 3
+    assert stats.success == 3
+
+
+def test_bulk_writer_counts_failures(mock_streaming_bulk):
+    stats = bulk_write([{'_id': 1}, {'_id': 2, 'fail': True}], client=MagicMock())
+
+    assert stats.success == 1
+    assert stats.failed == 1
+    assert stats.errors == [{'index': {'_id': 2, 'fail': True}}]
+
+
+def test_bulk_writer_parallel(mock_streaming_bulk):
+    with BulkWriter(client=MagicMock(), chunk_size=1, thread_count=2) as writer:
+        writer.write({'_id': i} for i in range(4))
+
+    assert mock_streaming_bulk.call_count == 4
+    assert writer.stats.success == 4
+    assert len(writer.stats.batches) == 4
+
+
+def test_bulk_writer_empty(mock_streaming_bulk):
+    stats = bulk_write([], client=MagicMock())
+
+    mock_streaming_bulk.assert_not_called()
+    assert stats.to_dict() == {'success': 0, 'failed': 0, 'batches': []}
+
+
+def test_bulk_writer_dual_write(mocker, settings, mock_streaming_bulk):
+    settings.ES_DUAL_WRITE_CHECK_INTERVAL = 5
+    mocker.patch('portal.libs.elasticsearch.bulk._dual_writes_checked', 0)
+    mock_redis = mocker.patch('portal.libs.cache.get_redis').return_value
+    mock_redis.hgetall.return_value = {b'files': b'files-new'}
+
+    stats = bulk_write([{'_index': 'files', '_id': 1}, {'_index': 'projects', '_id': 2}], client=MagicMock())
+
+    assert mock_streaming_bulk.call_args[0][1] == [
+        {'_index': 'files', '_id': 1},
+        {'_index': 'projects', '_id': 2},
+        {'_index': 'files-new', '_id': 1}
+    ]
+    assert stats.success == 3
+
+
+def test_bulk_writer_routes_only_routed_indexes(mocker, settings, mock_streaming_bulk):
+    settings.ES_DUAL_WRITE_CHECK_INTERVAL = 5
+    settings.ES_FILES_ROUTING = False
+    mocker.patch('portal.libs.elasticsearch.bulk._dual_writes_checked', 0)
+    mock_redis = mocker.patch('portal.libs.cache.get_redis').return_value
+    mock_redis.hgetall.return_value = {b'test-staging-files': b'files-new'}
+    mock_connection = mocker.patch('portal.libs.elasticsearch.utils.get_connection')
+    mock_connection.return_value.indices.get_mapping.return_value = {
+        'files-new': {'mappings': {'_routing': {'required': True}}}}
+
+    bulk_write([{'_index': 'test-staging-files', '_id': 1, '_routing': 'test.system'}], client=MagicMock())
+
+    assert mock_streaming_bulk.call_args[0][1] == [
+        {'_index': 'test-staging-files', '_id': 1},
+        {'_index': 'files-new', '_id': 1, '_routing': 'test.system'}
+    ]
+
+
+def test_bulk_writer_missing_delete_is_not_a_failure(mocker):
+    mocker.patch('portal.libs.elasticsearch.bulk.streaming_bulk',
+                 return_value=[(False, {'delete': {'_id': 1, 'status': 404}})])
+
+    stats = bulk_write([{'_id': 1, '_op_type': 'delete'}], client=MagicMock())
+
+    assert stats.success == 1
+    assert stats.failed == 0
+
+
+def test_bulk_writer_records_writes_racing_a_copy(mocker, settings):
+    settings.ES_DUAL_WRITE_CHECK_INTERVAL = 5
+    mocker.patch('portal.libs.elasticsearch.bulk._dual_writes_checked', 0)
+    mock_redis = mocker.patch('portal.libs.cache.get_redis').return_value
+    mock_redis.hgetall.return_value = {b'files': b'files-new'}
+    mocker.patch('portal.libs.elasticsearch.bulk.streaming_bulk', return_value=[
+        (True, {'update': {'_index': 'files-old', '_id': 1, 'status': 200}}),
+        (False, {'update': {'_index': 'files-new', '_id': 1, 'status': 404}}),
+        (True, {'delete': {'_index': 'files-old', '_id': 2, 'status': 200}}),
+        (False, {'delete': {'_index': 'files-new', '_id': 2, 'status': 404}}),
+        (False, {'update': {'_index': 'files-old', '_id': 3, 'status': 404}}),
+    ])
+
+    stats = bulk_write([{'_index': 'files', '_id': 1, '_op_type': 'update', 'doc': {}},
+                        {'_index': 'files', '_id': 2, '_op_type': 'delete'},
+                        {'_index': 'files', '_id': 3, '_op_type': 'update', 'doc': {}}], client=MagicMock())
+
+    # Only updates missing from the dual-write target are not failures.
+    assert stats.success == 4
+    assert stats.failed == 1
+    pipe = mock_redis.pipeline.return_value
+    pipe.sadd.assert_any_call('es-dual-write:stale:files-new', 1)
+    pipe.sadd.assert_any_call('es-dual-write:deleted:files-new', 2)
+    assert pipe.sadd.call_count == 2
+
+
+def test_start_and_stop_dual_write(mocker):
+    mock_redis = mocker.patch('portal.libs.cache.get_redis').return_value
+    mock_redis.hget.return_value = b'files-new'
+
+    start_dual_write('files', 'files-new')
+    mock_redis.pipeline.return_value.hset.assert_called_once_with('es-dual-write', 'files', 'files-new')
+    record_dual_write_subtrees('files-new', 'test.system', ['/a'])
+    mock_redis.rpush.assert_called_once_with('es-dual-write:subtrees:files-new',
+                                             '{"system": "test.system", "paths": ["/a"]}')
+
+    stop_dual_write('files')
+    mock_redis.hdel.assert_called_once_with('es-dual-write', 'files')
+    mock_redis.delete.assert_called_once_with('es-dual-write:deleted:files-new', 'es-dual-write:stale:files-new',
+                                              'es-dual-write:subtrees:files-new')
@@ -8,7 +8,7 @@ from django.conf import settings
 from elasticsearch_dsl import (Document, Date, Object, Text, Long, Boolean,
                                Keyword)
 from portal.libs.elasticsearch.analyzers import path_analyzer, file_analyzer, file_pattern_analyzer, reverse_file_analyzer
-from portal.libs.elasticsearch.utils import file_uuid_sha256, get_sha256_hash
+from portal.libs.elasticsearch.utils import file_uuid_sha256, file_routing, get_sha256_hash
 
 # pylint: disable=invalid-name
 logger = logging.getLogger(__name__)
@@ -74,6 +74,8 @@ class IndexedFile(Document):
     length = Long()
     format = Text()
     mimeType = Keyword()
+    # Lowercase file extension without the dot, for search facets.
+    extension = Keyword()
     type = Text()
     system = Text(fields={'_exact': Keyword()})
     basePath = Text(
@@ -81,6 +83,16 @@ class IndexedFile(Document):
             '_comps': Text(analyzer=path_analyzer),
             '_exact': Keyword()})
     lastUpdated = Date()
+    # lastModified of a folder as of the last crawl of its contents.
+    crawledModified = Date()
+    # When a folder's indexed contents were last checked against Tapis.
+    listingValidated = Date()
+    # Totals of the files under a folder, see portal.libs.elasticsearch.usage.
+    usage = Object(properties={
+        'bytes': Long(),
+        'files': Long(),
+        'lastModified': Date()
+    })
     pems = Object(properties={
         'username': Keyword(),
         'recursive': Boolean(),
@@ -125,7 +137,7 @@ class IndexedFile(Document):
         elasticsearch.exceptions.NotFoundError
         """
         uuid = file_uuid_sha256(system, path)
-        return cls.get(uuid)
+        return cls.get(uuid, routing=file_routing(system))
 
     def children(self):
         """
@@ -135,24 +147,24 @@ class IndexedFile(Document):
         ------
         IndexedFile
         """
-        search = self.search()
+        search = self.search().params(routing=file_routing(self.system))
         search = search.filter('term', **{'basePath._exact': self.path})
         search = search.filter('term', **{'system._exact': self.system})
 
         for hit in search.scan():
-            yield self.get(hit.meta.id)
+            yield self.get(hit.meta.id, routing=file_routing(self.system))
 
-    def delete_recursive(self):
+    def delete_recursive(self, wait=False):
         """
-        Recursively delete an indexed file and all of its children.
+        Recursively delete an indexed file and all of its children, see
+        `portal.libs.elasticsearch.utils.delete_recursive`.
 
         Returns
         -------
-        Void
+        dict
         """
-        for child in self.children():
-            child.delete_recursive()
-        self.delete()
+        from portal.libs.elasticsearch.utils import delete_recursive
+        return delete_recursive(self.system, self.path, wait=wait)
 
     class Index:
         name = settings.ES_INDEX_PREFIX.format('files')
@@ -174,6 +186,7 @@ class IndexedAllocation(Document):
 
     username = Text(fields={'_exact': Keyword()})
     value = Object()
+    updated = Date()
 
     @classmethod
     def from_username(cls, username):
@@ -5,9 +5,6 @@ from portal.libs.elasticsearch.docs.base import IndexedFile, IndexedAllocation,
 
 class TestIndexedFile(TestCase):
 
-    def setUp(self):
-        self.depth = 1
-
     @patch('portal.libs.elasticsearch.docs.base.Document.save')
     def test_save(self, mock_save):
         doc = IndexedFile()
@@ -23,7 +20,8 @@ class TestIndexedFile(TestCase):
     @patch('portal.libs.elasticsearch.docs.base.Document.get')
     def test_from_path(self, mock_get):
         IndexedFile.from_path('test.system', '/path/to/file')
-        mock_get.assert_called_once_with('c7765edebe9d7b715865b83a8319703975680be5a3f5f77503bdc47e7978429c')
+        mock_get.assert_called_once_with('c7765edebe9d7b715865b83a8319703975680be5a3f5f77503bdc47e7978429c',
+                                         routing='test.system')
 
     @patch('portal.libs.elasticsearch.docs.base.Document.search')
     @patch('portal.libs.elasticsearch.docs.base.Document.get')
@@ -34,32 +32,19 @@ class TestIndexedFile(TestCase):
         def scan_side_effect():
             yield res1
 
-        mock_search().filter().filter().scan.side_effect = scan_side_effect
+        mock_search().params().filter().filter().scan.side_effect = scan_side_effect
 
         doc = IndexedFile(system='test.system', path='/test/path')
         children = doc.children()
         next(children)
-        mock_get.assert_called_once_with('id1')
-
-    @patch('portal.libs.elasticsearch.docs.base.IndexedFile.children')
-    @patch('portal.libs.elasticsearch.docs.base.Document.delete')
-    def test_delete(self, mock_delete, mock_children):
-        child = IndexedFile()
-
-        # Return children only on the first call to prevent infinite recursion
-        def children_side_effect():
-            if self.depth > 0:
-                self.depth -= 1
-                yield child
-            else:
-                return
+        mock_get.assert_called_once_with('id1', routing='test.system')
 
-        mock_children.side_effect = children_side_effect
-
-        parent = IndexedFile()
-        parent.delete_recursive()
+    @patch('portal.libs.elasticsearch.utils.delete_recursive')
+    def test_delete(self, mock_delete):
+        doc = IndexedFile(system='test.system', path='/test/path')
+        doc.delete_recursive()
 
-        self.assertEqual(mock_delete.call_count, 2)
+        mock_delete.assert_called_once_with('test.system', '/test/path', wait=False)
 
 
 class TestIndexedAllocation(TestCase):
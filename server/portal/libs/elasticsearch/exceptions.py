@@ -25,3 +25,8 @@ class DocumentNotFound(ESException):
 
     """
     pass
+
+
+class ReindexFailed(ESException):
+    """A ``_reindex`` task failed or did not copy every document."""
+    pass
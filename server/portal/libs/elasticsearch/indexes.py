@@ -2,14 +2,23 @@
 .. module: portal.libs.elasticsearch.indexes
    :synopsis: ElasticSearch Index setup
 """
+from contextlib import contextmanager
 from datetime import datetime
 import logging
+import math
+import time
 from django.conf import settings
-from elasticsearch_dsl import Index
+from elasticsearch.exceptions import NotFoundError, TransportError
+from elasticsearch_dsl import Index, Search
+from redis import RedisError
+from portal.libs import cache
 from portal.libs.elasticsearch.docs.base import (IndexedFile,
                                                  IndexedAllocation,
                                                  IndexedProject)
 from portal.libs.elasticsearch.analyzers import file_query_analyzer
+from portal.libs.elasticsearch.bulk import dual_write_changes
+from portal.libs.elasticsearch.exceptions import ReindexFailed
+from portal.libs.elasticsearch.utils import subtrees_query
 
 #pylint: disable=invalid-name
 logger = logging.getLogger(__name__)
@@ -39,7 +48,7 @@ def setup_indexes(doc_type, reindex=False, force=False):
         # If an index exists under the alias and force=True, delete any indices
         # with that alias.
         while index.exists():
-            Index(list(index.get_alias().keys())[0]).delete(ignore=404)
+            Index(alias_index(alias)).delete(ignore=404)
             index = Index(alias)
         # Create a new index with the provided name.
         index = Index(indexName)
@@ -50,20 +59,128 @@ def setup_indexes(doc_type, reindex=False, force=False):
     return index
 
 
+def alias_index(alias, using='default'):
+    """Name of the index behind an alias."""
+    return list(Index(alias, using=using).get_alias().keys())[0]
+
+
 def index_time_string():
     """Get the current string-formatted time for use in index names."""
     return datetime.now().strftime("%Y_%m_%d_%H_%M_%S_%f")
 
 
+def files_shard_count():
+    """
+    Number of primary shards for a new files index: settings.ES_FILES_INDEX_SHARDS
+    if set, otherwise enough shards to hold the current files index with
+    settings.ES_FILES_SHARD_SIZE bytes per shard.
+    """
+    if settings.ES_FILES_INDEX_SHARDS:
+        return settings.ES_FILES_INDEX_SHARDS
+    try:
+        stats = Index(settings.ES_INDEX_PREFIX.format('files')).stats(metric='store')
+        size = stats['_all']['primaries']['store']['size_in_bytes']
+    except NotFoundError:
+        size = 0
+    return max(1, math.ceil(size / settings.ES_FILES_SHARD_SIZE))
+
+
 def setup_files_index(reindex=False, force=False):
+    """
+    Set up the files index. Documents are routed by system (see
+    `portal.libs.elasticsearch.utils.file_routing`) and stored sorted by
+    folder and name, so listing a folder reads contiguous documents.
+    """
+    shards = files_shard_count()
     index = setup_indexes('files', reindex, force)
     if not index.exists():
         index.document(IndexedFile)
         index.analyzer(file_query_analyzer)
-        index.settings(number_of_shards=3)
+        index.settings(**{
+            'number_of_shards': shards,
+            'refresh_interval': settings.ES_FILES_REFRESH_INTERVAL,
+            'sort.field': ['basePath._exact', 'name._exact'],
+            'sort.order': ['asc', 'asc']
+        })
+        if settings.ES_FILES_ALLOCATION:
+            # Keep the index on nodes with these attributes, e.g. warm nodes.
+            index.settings(**{'routing.allocation.require.{}'.format(attr): value
+                              for attr, value in settings.ES_FILES_ALLOCATION.items()})
+        index.get_or_create_mapping().meta('_routing', required=True)
         index.create()
 
 
+def update_files_mapping():
+    """
+    Add the fields of `IndexedFile` that the live files index does not map
+    yet, e.g. after a field was added to the document, so that they get
+    their declared type instead of one guessed by dynamic mapping.
+
+    Returns
+    -------
+    list
+        Fields whose type on the live index differs from `IndexedFile`,
+        typically because dynamic mapping typed them first. Those only change
+        when the index is rebuilt with reindex-files.
+    """
+    index = Index(IndexedFile.Index.name)
+    wanted = IndexedFile._doc_type.mapping.to_dict()['properties']  # pylint: disable=protected-access
+    conflicts = set()
+    for mapping in index.get_mapping().values():
+        current = mapping['mappings'].get('properties', {})
+        missing = {field: prop for field, prop in wanted.items() if field not in current}
+        conflicts.update(field for field, prop in wanted.items() if field in current
+                         and current[field].get('type', 'object') != prop.get('type', 'object'))
+        if missing:
+            index.put_mapping(body={'properties': missing})
+            logger.info('Mapped %s on the files index', ', '.join(sorted(missing)))
+    return sorted(conflicts)
+
+
+CRAWLS_KEY = 'es-files:crawls'
+# Seconds after which a crawl count left behind by a killed worker expires.
+CRAWLS_TIMEOUT = 60 * 60
+
+
+def _put_refresh_interval(interval):
+    Index(IndexedFile.Index.name).put_settings(body={'index': {'refresh_interval': interval}})
+
+
+@contextmanager
+def crawl_refresh_interval():
+    """
+    Use settings.ES_FILES_CRAWL_REFRESH_INTERVAL as the files index refresh
+    interval while any crawl runs, since crawls write far more documents
+    than are read until they finish. The normal interval is restored, and
+    the index refreshed, when the last running crawl exits.
+    """
+    interval = settings.ES_FILES_CRAWL_REFRESH_INTERVAL
+    if not interval:
+        yield
+        return
+    try:
+        pipe = cache.get_redis().pipeline()
+        pipe.incr(CRAWLS_KEY)
+        pipe.expire(CRAWLS_KEY, CRAWLS_TIMEOUT)
+        crawls = pipe.execute()[0]
+        if crawls == 1:
+            _put_refresh_interval(interval)
+    except (RedisError, TransportError):
+        logger.warning('Unable to lengthen the files index refresh interval for a crawl')
+        yield
+        return
+    try:
+        yield
+    finally:
+        try:
+            if cache.get_redis().decr(CRAWLS_KEY) <= 0:
+                cache.get_redis().delete(CRAWLS_KEY)
+                _put_refresh_interval(settings.ES_FILES_REFRESH_INTERVAL)
+                IndexedFile._index.refresh()  # pylint: disable=protected-access
+        except (RedisError, TransportError):
+            logger.warning('Unable to restore the files index refresh interval')
+
+
 def setup_allocations_index(reindex=False, force=False):
     index = setup_indexes('allocations', reindex, force)
     if not index.exists():
@@ -76,3 +193,141 @@ def setup_projects_index(reindex=False, force=False):
     if not index.exists():
         index.document(IndexedProject)
         index.create()
+
+
+def bulk_load_settings(client, index):
+    """
+    Disable replicas and refreshes on an index while it is bulk loaded.
+
+    Returns
+    -------
+    dict
+        The index's previous settings, to pass to `restore_settings`.
+    """
+    current = client.indices.get_settings(index=index)[index]['settings']['index']
+    original = {'number_of_replicas': current.get('number_of_replicas'),
+                'refresh_interval': current.get('refresh_interval')}
+    client.indices.put_settings(index=index, body={'index': {'number_of_replicas': 0,
+                                                             'refresh_interval': '-1'}})
+    return original
+
+
+def restore_settings(client, index, original):
+    """Restore settings saved by `bulk_load_settings`, then refresh."""
+    client.indices.put_settings(index=index, body={'index': original})
+    client.indices.refresh(index=index)
+
+
+def reindex(client, source, dest, requests_per_second=-1, slices='auto',
+            poll_interval=10, on_progress=None, script=None):
+    """
+    Copy every document from one index to another with a server-side
+    ``_reindex`` task, split into ``slices`` scrolls run in parallel and
+    throttled to ``requests_per_second`` documents per second.
+
+    Documents already in ``dest`` are kept, so writes made to ``dest``
+    while the task runs are not overwritten with older copies.
+
+    Parameters
+    ----------
+    client: elasticsearch.Elasticsearch
+    source: str
+        Index to copy from.
+    dest: str
+        Index to copy to.
+    on_progress: callable
+        Called with the task status every ``poll_interval`` seconds.
+    script: dict
+        Painless script run on each document, e.g. to set its routing.
+
+    Returns
+    -------
+    dict
+        The ``_reindex`` response.
+
+    Raises
+    ------
+    portal.libs.elasticsearch.exceptions.ReindexFailed
+    """
+    body = {'conflicts': 'proceed',
+            'source': {'index': source},
+            'dest': {'index': dest, 'op_type': 'create'}}
+    if script is not None:
+        body['script'] = script
+    task = client.reindex(
+        body=body,
+        wait_for_completion=False,
+        slices=slices,
+        requests_per_second=requests_per_second
+    )
+    while True:
+        status = client.tasks.get(task_id=task['task'])
+        if status.get('completed'):
+            break
+        if on_progress is not None:
+            on_progress(status['task']['status'])
+        time.sleep(poll_interval)
+
+    if 'error' in status:
+        raise ReindexFailed(status['error'])
+    response = status['response']
+    if response.get('failures'):
+        raise ReindexFailed(response['failures'][:3])
+    return response
+
+
+def replay_dual_writes(client, source, dest, script=None, chunk_size=1000):
+    """
+    Catch up an index copied by `reindex` with the dual writes that raced the
+    copy. The copy does not overwrite documents already in ``dest``, but
+    brings back documents deleted from ``dest`` before it reached them, and
+    partial updates to documents it had not reached yet failed. So:
+
+    - documents whose update missed are copied again from ``source``;
+    - documents deleted, or under subtrees deleted, while the copy ran are
+      deleted from ``dest`` if ``source`` no longer has them.
+
+    Parameters
+    ----------
+    client: elasticsearch.Elasticsearch
+    source: str
+        Index the documents were copied from.
+    dest: str
+        Dual-write target the documents were copied to.
+    script: dict
+        Painless script run on each copied document, as passed to `reindex`.
+
+    Returns
+    -------
+    dict
+        ``{'copied': int, 'deleted': int}``
+    """
+    deleted, stale, subtrees = dual_write_changes(dest)
+    client.indices.refresh(index=source)
+
+    copied = 0
+    stale = sorted(stale)
+    for start in range(0, len(stale), chunk_size):
+        body = {'source': {'index': source, 'query': {'ids': {'values': stale[start:start + chunk_size]}}},
+                'dest': {'index': dest}}
+        if script is not None:
+            body['script'] = script
+        copied += client.reindex(body=body, refresh=True)['total']
+
+    for subtree in subtrees:
+        search = Search(using=client, index=dest).source(False)\
+            .filter('term', **{'system._exact': subtree['system']})\
+            .filter(subtrees_query(subtree['paths']))
+        deleted.update(hit.meta.id for hit in search.scan())
+
+    removed = 0
+    deleted = sorted(deleted)
+    for start in range(0, len(deleted), chunk_size):
+        chunk = deleted[start:start + chunk_size]
+        kept = client.search(index=source, body={'query': {'ids': {'values': chunk}}, '_source': False},
+                             size=len(chunk))['hits']['hits']
+        gone = sorted(set(chunk) - set(hit['_id'] for hit in kept))
+        if gone:
+            removed += client.delete_by_query(index=dest, body={'query': {'ids': {'values': gone}}},
+                                              conflicts='proceed', refresh=True)['deleted']
+    return {'copied': copied, 'deleted': removed}
@@ -1,10 +1,16 @@
-from mock import patch, call
+import datetime
+from mock import patch, call, MagicMock
+from django.conf import settings
 from django.test import TestCase
-from elasticsearch_dsl import Q
+from elasticsearch.exceptions import NotFoundError
+from elasticsearch_dsl import Q, Date, Index
 from elasticsearch_dsl.response.hit import Hit
 
-from portal.libs.elasticsearch.indexes import setup_files_index, setup_projects_index, setup_indexes
-from portal.libs.elasticsearch.utils import index_listing, index_level, file_uuid_sha256, walk_children, grouper, delete_recursive
+from portal.libs.elasticsearch.exceptions import ReindexFailed
+from portal.libs.elasticsearch.indexes import setup_files_index, setup_projects_index, setup_indexes, reindex, \
+    files_shard_count, crawl_refresh_interval, update_files_mapping, replay_dual_writes
+from portal.libs.elasticsearch.utils import index_listing, index_level, clear_crawled, file_uuid_sha256, walk_children, grouper, delete_recursive, \
+    move_subtrees, indexed_level, listing_diff, routing_required, file_routing, mark_validated, files_keyword_field
 
 
 class TestESSetupMethods(TestCase):
@@ -33,13 +39,67 @@ class TestESSetupMethods(TestCase):
             call().aliases(**{'test-staging-type': {}})
         ])
 
+    @patch('portal.libs.elasticsearch.indexes.files_shard_count')
     @patch('portal.libs.elasticsearch.indexes.setup_indexes')
     @patch('portal.libs.elasticsearch.indexes.index_time_string')
-    def test_files_setup(self, mock_timestring, mock_setup):
+    def test_files_setup(self, mock_timestring, mock_setup, mock_shards):
 
         setup_files_index()
         mock_setup.assert_called_with('files', False, False)
 
+    @patch('portal.libs.elasticsearch.indexes.files_shard_count')
+    @patch('portal.libs.elasticsearch.indexes.setup_indexes')
+    def test_files_setup_profile(self, mock_setup, mock_shards):
+        mock_shards.return_value = 2
+        index = Index('test-staging-files-TIME_NOW')
+        mock_setup.return_value = index
+
+        with patch.object(Index, 'exists', return_value=False), patch.object(Index, 'create'):
+            setup_files_index()
+
+        body = index.to_dict()
+        self.assertEqual(body['settings']['number_of_shards'], 2)
+        self.assertEqual(body['settings']['sort.field'], ['basePath._exact', 'name._exact'])
+        self.assertEqual(body['mappings']['_routing'], {'required': True})
+
+    @patch('portal.libs.elasticsearch.indexes.Index')
+    def test_update_files_mapping(self, mock_index):
+        mock_index.return_value.get_mapping.return_value = {
+            'test-staging-files-old': {'mappings': {'properties': {
+                'name': {'type': 'text'},
+                'extension': {'type': 'text', 'fields': {'keyword': {'type': 'keyword'}}}}}}}
+
+        self.assertEqual(update_files_mapping(), ['extension'])
+
+        properties = mock_index.return_value.put_mapping.call_args[1]['body']['properties']
+        self.assertEqual(properties['mimeType'], {'type': 'keyword'})
+        self.assertEqual(properties['listingValidated'], {'type': 'date'})
+        self.assertNotIn('name', properties)
+        self.assertNotIn('extension', properties)
+
+    @patch('portal.libs.elasticsearch.indexes.Index')
+    def test_files_shard_count(self, mock_index):
+        mock_index.return_value.stats.return_value = {
+            '_all': {'primaries': {'store': {'size_in_bytes': 70 * 1024 ** 3}}}}
+        self.assertEqual(files_shard_count(), 3)
+
+        mock_index.return_value.stats.side_effect = NotFoundError
+        self.assertEqual(files_shard_count(), 1)
+
+    @patch('portal.libs.elasticsearch.indexes.IndexedFile._index')
+    @patch('portal.libs.elasticsearch.indexes._put_refresh_interval')
+    @patch('portal.libs.cache.get_redis')
+    def test_crawl_refresh_interval(self, mock_redis, mock_put, mock_index):
+        mock_redis.return_value.pipeline.return_value.execute.return_value = [1, True]
+        mock_redis.return_value.decr.return_value = 0
+
+        with self.settings(ES_FILES_CRAWL_REFRESH_INTERVAL='30s'):
+            with crawl_refresh_interval():
+                mock_put.assert_called_once_with('30s')
+
+        mock_put.assert_called_with('1s')
+        mock_index.refresh.assert_called_once()
+
     @patch('portal.libs.elasticsearch.indexes.setup_indexes')
     @patch('portal.libs.elasticsearch.indexes.index_time_string')
     def test_projects_setup(self, mock_timestring, mock_setup):
@@ -47,6 +107,66 @@ class TestESSetupMethods(TestCase):
         setup_projects_index()
         mock_setup.assert_called_with('projects', False, False)
 
+    @patch('portal.libs.elasticsearch.indexes.time')
+    def test_reindex(self, mock_time):
+        mock_client = MagicMock()
+        mock_client.reindex.return_value = {'task': 'node:1'}
+        mock_client.tasks.get.side_effect = [
+            {'completed': False, 'task': {'status': {'total': 10, 'created': 5}}},
+            {'completed': True, 'response': {'total': 10, 'created': 10, 'failures': []}}
+        ]
+        on_progress = MagicMock()
+
+        result = reindex(mock_client, 'source', 'dest', requests_per_second=100, slices='auto',
+                         on_progress=on_progress)
+
+        self.assertEqual(result, {'total': 10, 'created': 10, 'failures': []})
+        mock_client.reindex.assert_called_with(
+            body={'conflicts': 'proceed',
+                  'source': {'index': 'source'},
+                  'dest': {'index': 'dest', 'op_type': 'create'}},
+            wait_for_completion=False, slices='auto', requests_per_second=100)
+        mock_client.tasks.get.assert_called_with(task_id='node:1')
+        on_progress.assert_called_once_with({'total': 10, 'created': 5})
+
+    @patch('portal.libs.elasticsearch.indexes.Search')
+    @patch('portal.libs.elasticsearch.indexes.dual_write_changes')
+    def test_replay_dual_writes(self, mock_changes, mock_search):
+        mock_changes.return_value = ({'deleted', 'recreated'}, {'updated'},
+                                     [{'system': 'test.system', 'paths': ['/gone']}])
+        mock_search().source().filter().filter().scan.return_value = [Hit({'_id': 'under-gone'})]
+        mock_client = MagicMock()
+        mock_client.reindex.return_value = {'total': 1}
+        mock_client.search.return_value = {'hits': {'hits': [{'_id': 'recreated'}]}}
+        mock_client.delete_by_query.return_value = {'deleted': 2}
+        script = {'source': 'ctx._routing = ctx._source.system', 'lang': 'painless'}
+
+        result = replay_dual_writes(mock_client, 'source', 'dest', script=script)
+
+        self.assertEqual(result, {'copied': 1, 'deleted': 2})
+        mock_changes.assert_called_once_with('dest')
+        mock_client.reindex.assert_called_once_with(
+            body={'source': {'index': 'source', 'query': {'ids': {'values': ['updated']}}},
+                  'dest': {'index': 'dest'},
+                  'script': script},
+            refresh=True)
+        mock_search().source().filter().filter.assert_called_with(
+            Q('bool', should=[Q('term', **{'path._exact': '/gone'}), Q('term', **{'basePath._exact': '/gone'}),
+                              Q('prefix', **{'basePath._exact': '/gone/'})], minimum_should_match=1))
+        self.assertEqual(mock_client.search.call_args[1]['body']['query'],
+                         {'ids': {'values': ['deleted', 'recreated', 'under-gone']}})
+        # Documents the source has again are kept.
+        mock_client.delete_by_query.assert_called_once_with(
+            index='dest', body={'query': {'ids': {'values': ['deleted', 'under-gone']}}},
+            conflicts='proceed', refresh=True)
+
+    def test_reindex_failures(self):
+        mock_client = MagicMock()
+        mock_client.tasks.get.return_value = {'completed': True,
+                                              'response': {'failures': [{'cause': 'mapping'}]}}
+        with self.assertRaises(ReindexFailed):
+            reindex(mock_client, 'source', 'dest')
+
 
 class TestESUtils(TestCase):
 
@@ -62,79 +182,181 @@ class TestESUtils(TestCase):
         with self.assertRaises(StopIteration):
             next(g)
 
+    @patch('portal.libs.elasticsearch.utils.get_connection')
+    def test_routing_required_follows_mapping(self, mock_connection):
+        mock_connection.return_value.indices.get_mapping.return_value = {
+            'test-staging-files-old': {'mappings': {'properties': {}}}}
+        with self.settings(ES_FILES_ROUTING=None):
+            self.assertIsNone(file_routing('test.system'))
+
+            mock_connection.return_value.indices.get_mapping.return_value = {
+                'test-staging-files-new': {'mappings': {'_routing': {'required': True}}}}
+            self.assertEqual(file_routing('test.system'), 'test.system')
+        mock_connection.return_value.indices.get_mapping.assert_called_with(index='test-staging-files')
+
+        with self.settings(ES_FILES_ROUTING=False):
+            self.assertIsNone(file_routing('test.system'))
+
+    @patch('portal.libs.elasticsearch.utils.get_connection')
+    def test_routing_required_cached(self, mock_connection):
+        mock_connection.return_value.indices.get_mapping.return_value = {
+            'other-index': {'mappings': {'_routing': {'required': True}}}}
+        with self.settings(ES_FILES_MAPPING_CHECK_INTERVAL=60):
+            self.assertTrue(routing_required('other-index'))
+            self.assertTrue(routing_required('other-index'))
+        mock_connection.return_value.indices.get_mapping.assert_called_once()
+
+    @patch('portal.libs.elasticsearch.utils.get_connection')
+    def test_files_keyword_field(self, mock_connection):
+        mock_connection.return_value.indices.get_mapping.return_value = {
+            'test-staging-files-old': {'mappings': {'properties': {
+                'extension': {'type': 'text', 'fields': {'keyword': {'type': 'keyword', 'ignore_above': 256}}}}}}}
+        self.assertEqual(files_keyword_field('extension'), 'extension.keyword')
+
+        mock_connection.return_value.indices.get_mapping.return_value = {
+            'test-staging-files-new': {'mappings': {'properties': {'extension': {'type': 'keyword'}}}}}
+        self.assertEqual(files_keyword_field('extension'), 'extension')
+
     @patch('portal.libs.elasticsearch.docs.base.IndexedFile.search')
     def test_walk_children(self, mock_search):
-        mock_search().filter().filter().scan.return_value = [Hit({})]
+        mock_search().params().filter().filter().scan.return_value = [Hit({})]
 
         children = walk_children('test.system', '/file/path', include_parent=True, recurse=True)
         next(children)
-        mock_search().filter().filter.assert_called_with(Q({'prefix': {'basePath._exact': '/file/path'}}) | Q({'term': {'path._exact': '/file/path'}}))
+        mock_search().params().filter().filter.assert_called_with(Q({'prefix': {'basePath._exact': '/file/path'}}) | Q({'term': {'path._exact': '/file/path'}}))
 
         children = walk_children('test.system', '/file/path', include_parent=True, recurse=False)
         next(children)
-        mock_search().filter().filter.assert_called_with(Q({'term': {'basePath._exact': '/file/path'}}) | Q({'term': {'path._exact': '/file/path'}}))
+        mock_search().params().filter().filter.assert_called_with(Q({'term': {'basePath._exact': '/file/path'}}) | Q({'term': {'path._exact': '/file/path'}}))
 
         children = walk_children('test.system', '/file/path', include_parent=False, recurse=True)
         next(children)
-        mock_search().filter().filter.assert_called_with(Q({'prefix': {'basePath._exact': '/file/path'}}))
+        mock_search().params().filter().filter.assert_called_with(Q({'prefix': {'basePath._exact': '/file/path'}}))
 
         children = walk_children('test.system', '/file/path', include_parent=False, recurse=False)
         next(children)
-        mock_search().filter().filter.assert_called_with(Q({'term': {'basePath._exact': '/file/path'}}))
+        mock_search().params().filter().filter.assert_called_with(Q({'term': {'basePath._exact': '/file/path'}}))
+
+    @patch('elasticsearch_dsl.search.get_connection')
+    def test_delete_recursive(self, mock_connection):
+        mock_es = mock_connection.return_value
+        mock_es.delete_by_query.return_value = {'task': 'node:1'}
+
+        result = delete_recursive('test.system', ['/test/folder', 'test/file'])
+
+        self.assertEqual(result, {'task': 'node:1'})
+        mock_es.delete_by_query.assert_called_once()
+        kwargs = mock_es.delete_by_query.call_args[1]
+        self.assertEqual(kwargs['index'], ['test-staging-files'])
+        self.assertEqual(kwargs['routing'], 'test.system')
+        self.assertEqual(kwargs['slices'], 'auto')
+        self.assertFalse(kwargs['wait_for_completion'])
+        self.assertEqual(kwargs['conflicts'], 'proceed')
+        filters = kwargs['body']['query']['bool']['filter']
+        self.assertEqual(filters[0], {'term': {'system._exact': 'test.system'}})
+        self.assertEqual(filters[1]['bool']['should'], [
+            {'term': {'path._exact': '/test/folder'}},
+            {'term': {'basePath._exact': '/test/folder'}},
+            {'prefix': {'basePath._exact': '/test/folder/'}},
+            {'term': {'path._exact': '/test/file'}},
+            {'term': {'basePath._exact': '/test/file'}},
+            {'prefix': {'basePath._exact': '/test/file/'}},
+        ])
 
-    @patch('portal.libs.elasticsearch.utils.walk_children')
-    @patch('portal.libs.elasticsearch.utils.bulk')
-    @patch('portal.libs.elasticsearch.utils.get_connection')
-    def test_delete_recursive(self, mock_conn, mock_bulk, mock_children):
-        mock_conn.return_value = 'default'
+    @patch('portal.libs.elasticsearch.bulk.record_dual_write_subtrees')
+    @patch('portal.libs.elasticsearch.bulk.dual_writes')
+    @patch('elasticsearch_dsl.search.get_connection')
+    def test_delete_recursive_dual_write(self, mock_connection, mock_dual_writes, mock_record):
+        mock_dual_writes.return_value = {'test-staging-files': 'test-staging-files-new'}
 
-        def children_side_effect(*args, **kwargs):
-            dummy_hit = Hit({})
-            dummy_hit.system = 'test.system'
-            dummy_hit.path = '/test/file'
-            dummy_hit.meta.id = 'ABCDEF'
-            yield dummy_hit
-        mock_children.side_effect = children_side_effect
+        delete_recursive('test.system', '/test/folder', wait=True)
+
+        kwargs = mock_connection.return_value.delete_by_query.call_args[1]
+        self.assertEqual(kwargs['index'], ['test-staging-files', 'test-staging-files-new'])
+        self.assertTrue(kwargs['wait_for_completion'])
+        mock_record.assert_called_once_with('test-staging-files-new', 'test.system', ['/test/folder'])
 
-        test_op = {'_index': 'test-staging-files',
-                   '_id': 'ABCDEF',
-                   '_op_type': 'delete'}
+    @patch('portal.libs.elasticsearch.utils.current_time')
+    @patch('portal.libs.elasticsearch.bulk.bulk_write')
+    @patch('portal.libs.elasticsearch.docs.base.IndexedFile.search')
+    def test_move_subtrees(self, mock_search, mock_bulk_write, mock_time):
+        mock_time.return_value = 'TIME_NOW'
 
-        delete_recursive('test.system', '/test/file')
-        mock_children.assert_called_once_with('test.system',
-                                              '/test/file',
-                                              recurse=True)
+        def hit(path):
+            dummy_hit = Hit({'_id': file_uuid_sha256('test.system', path),
+                             '_source': {'system': 'test.system', 'path': path, 'name': path.split('/')[-1],
+                                         'basePath': path.rsplit('/', 1)[0] or '/'}})
+            return dummy_hit
+        mock_search().params().filter().filter().scan.return_value = [hit('/src/dir'), hit('/src/dir/sub/file')]
+
+        move_subtrees('test.system', [('/src/dir', 'dest/renamed')])
+
+        mock_search().params().filter().filter.assert_called_with(
+            Q('bool', should=[Q('term', **{'path._exact': '/src/dir'}),
+                              Q('term', **{'basePath._exact': '/src/dir'}),
+                              Q('prefix', **{'basePath._exact': '/src/dir/'})],
+              minimum_should_match=1))
+        self.assertEqual(list(mock_bulk_write.call_args[0][0]), [
+            {'_index': 'test-staging-files', '_id': file_uuid_sha256('test.system', '/dest/renamed'),
+             '_op_type': 'index', '_routing': 'test.system',
+             '_source': {'system': 'test.system', 'path': '/dest/renamed', 'name': 'renamed',
+                         'basePath': '/dest', 'lastUpdated': 'TIME_NOW'}},
+            {'_index': 'test-staging-files', '_id': file_uuid_sha256('test.system', '/src/dir'),
+             '_op_type': 'delete', '_routing': 'test.system'},
+            {'_index': 'test-staging-files', '_id': file_uuid_sha256('test.system', '/dest/renamed/sub/file'),
+             '_op_type': 'index', '_routing': 'test.system',
+             '_source': {'system': 'test.system', 'path': '/dest/renamed/sub/file', 'name': 'file',
+                         'basePath': '/dest/renamed/sub', 'lastUpdated': 'TIME_NOW'}},
+            {'_index': 'test-staging-files', '_id': file_uuid_sha256('test.system', '/src/dir/sub/file'),
+             '_op_type': 'delete', '_routing': 'test.system'},
+        ])
 
-        mock_map = mock_bulk.call_args.args[1]
-        self.assertEqual(next(mock_map), test_op)
+    def test_delete_recursive_nothing(self):
+        self.assertIsNone(delete_recursive('test.system', []))
 
-    @patch('portal.libs.elasticsearch.utils.bulk')
+    @patch('portal.libs.elasticsearch.bulk.bulk_write')
     @patch('portal.libs.elasticsearch.utils.current_time')
-    @patch('portal.libs.elasticsearch.utils.get_connection')
-    def test_index_listing(self, mock_conn, mock_time, mock_bulk):
+    def test_index_listing(self, mock_time, mock_bulk_write):
         files = [
-            {'name': 'file1', 'system': 'test.system', 'path': '/test/file1'},
+            {'name': 'file1.TXT', 'system': 'test.system', 'path': '/test/file1.TXT'},
+            {'name': '.hidden', 'system': 'test.system', 'path': '/test/.hidden'},
+            {'name': 'folder.d', 'format': 'folder', 'system': 'test.system', 'path': '/test/folder.d'},
         ]
-        mock_conn.return_value = 'default'
         mock_time.return_value = 'TIME_NOW'
 
         index_listing(files)
 
-        mock_bulk.assert_called_once_with(
-            'default', [{'_index': 'test-staging-files',
-                         '_id': 'd9c58e96e64076fa1205c5ba23b1f5cbd609efc9d30683db00988ca95c47cfd0',
-                         'doc': {'system': 'test.system',
-                                 'name': 'file1',
-                                 'path': '/test/file1',
-                                 'lastUpdated': 'TIME_NOW',
-                                 'basePath': '/test'},
-                         '_op_type': 'update',
-                         'doc_as_upsert': True}])
-
+        mock_bulk_write.assert_called_once()
+        self.assertEqual(
+            list(mock_bulk_write.call_args.args[0]),
+            [{'_index': 'test-staging-files',
+              '_id': file_uuid_sha256('test.system', '/test/file1.TXT'),
+              'doc': {'system': 'test.system',
+                      'name': 'file1.TXT',
+                      'path': '/test/file1.TXT',
+                      'lastUpdated': 'TIME_NOW',
+                      'basePath': '/test',
+                      'extension': 'txt'},
+              '_op_type': 'update',
+              'doc_as_upsert': True,
+              '_routing': 'test.system'},
+             {'_index': 'test-staging-files',
+              '_id': file_uuid_sha256('test.system', '/test/folder.d'),
+              'doc': {'system': 'test.system',
+                      'name': 'folder.d',
+                      'format': 'folder',
+                      'path': '/test/folder.d',
+                      'lastUpdated': 'TIME_NOW',
+                      'basePath': '/test'},
+              '_op_type': 'update',
+              'doc_as_upsert': True,
+              '_routing': 'test.system'}])
+
+    @patch('portal.libs.elasticsearch.utils.mark_validated')
     @patch('portal.libs.elasticsearch.utils.index_listing')
     @patch('portal.libs.elasticsearch.utils.walk_children')
     @patch('portal.libs.elasticsearch.utils.delete_recursive')
-    def test_index_level(self, mock_delete, mock_children, mock_index):
+    def test_index_level(self, mock_delete, mock_children, mock_index, mock_mark):
 
         def children_side_effect(*args, **kwargs):
             dummy_hit = Hit({})
@@ -147,7 +369,139 @@ class TestESUtils(TestCase):
         testfile = {'system': 'test.system', 'path': '/test/file', 'name': 'file'}
         testfolder = {'system': 'test.system', 'path': '/test/folder', 'name': 'folder'}
 
-        index_level('/test', [testfolder], [testfile], 'test.system')
+        descend = index_level('/test', [testfolder], [testfile], 'test.system')
 
+        mock_children.assert_called_once_with('test.system', '/test', include_parent=False)
         mock_index.assert_called_once_with([testfolder, testfile])
-        mock_delete.assert_called_once_with('test.system', '/deleted/file')
+        mock_delete.assert_called_once_with('test.system', ['/deleted/file'])
+        mock_mark.assert_called_once_with('test.system', '/test', None)
+        self.assertEqual(descend, [testfolder])
+
+        mock_mark.reset_mock()
+        index_level('/test', [testfolder], [testfile], 'test.system', crawled_modified='MTIME')
+        mock_mark.assert_called_once_with('test.system', '/test', 'MTIME')
+
+    @patch('portal.libs.elasticsearch.utils.mark_validated')
+    @patch('portal.libs.elasticsearch.utils.index_listing')
+    @patch('portal.libs.elasticsearch.utils.walk_children')
+    @patch('portal.libs.elasticsearch.utils.delete_recursive')
+    def test_index_level_incremental(self, mock_delete, mock_children, mock_index, mock_mark):
+        mtime = '2018-09-11T11:38:34.000-05:00'
+
+        def hit(path, **kwargs):
+            dummy_hit = Hit({})
+            dummy_hit.system = 'test.system'
+            dummy_hit.path = path
+            dummy_hit.lastModified = Date().deserialize(mtime)
+            dummy_hit.length = 9
+            for key, value in kwargs.items():
+                setattr(dummy_hit, key, value)
+            return dummy_hit
+
+        mock_children.return_value = [
+            hit('/test/unchanged'),
+            hit('/test/changed', length=10),
+            hit('/test/crawled', crawledModified=Date().deserialize(mtime)),
+            hit('/test/uncrawled'),
+            hit('/test/deleted')
+        ]
+
+        def entry(name, fmt='raw'):
+            return {'system': 'test.system', 'path': '/test/' + name, 'name': name,
+                    'lastModified': mtime, 'length': 9, 'format': fmt}
+
+        unchanged, changed, new = entry('unchanged'), entry('changed'), entry('new')
+        crawled, uncrawled = entry('crawled', 'folder'), entry('uncrawled', 'folder')
+
+        descend = index_level('/test', [crawled, uncrawled], [unchanged, changed, new],
+                              'test.system', incremental=True)
+
+        mock_index.assert_called_once_with([changed, new])
+        mock_delete.assert_called_once_with('test.system', ['/test/deleted'])
+        mock_mark.assert_called_once_with('test.system', '/test', None)
+        self.assertEqual(descend, [uncrawled])
+
+    @patch('portal.libs.elasticsearch.bulk.bulk_write')
+    def test_clear_crawled(self, mock_bulk_write):
+        clear_crawled('test.system', ['/a/b/c', '/a/d'])
+
+        ops = mock_bulk_write.call_args[0][0]
+        self.assertEqual([op['_id'] for op in ops],
+                         [file_uuid_sha256('test.system', '/a'), file_uuid_sha256('test.system', '/a/b')])
+        self.assertEqual(ops[0]['doc'], {'crawledModified': None})
+
+        mock_bulk_write.reset_mock()
+        clear_crawled('test.system', ['/a'])
+        mock_bulk_write.assert_not_called()
+
+    @patch('portal.libs.elasticsearch.docs.base.IndexedFile.search')
+    def test_indexed_level(self, mock_search):
+        mock_hit = Hit({})
+        mock_hit.path = '/test/file'
+        mock_res = mock_search().params().filter().filter().post_filter().sort().extra().execute()
+        mock_res.__iter__.return_value = [mock_hit]
+        mock_res.aggregations.folder.validated.value = 1600000000000
+
+        hits, validated_at = indexed_level('test.system', '/test', offset=10, limit=5)
+
+        mock_search().params().filter().filter.assert_called_with(
+            Q({'term': {'basePath._exact': '/test'}}) | Q({'term': {'path._exact': '/test'}}))
+        mock_search().params().filter().filter().post_filter.assert_called_with(Q({'term': {'basePath._exact': '/test'}}))
+        mock_search().params().filter().filter().post_filter().sort.assert_called_with('name._exact')
+        mock_search().params().filter().filter().post_filter().sort().extra.assert_called_with(from_=10, size=5)
+        self.assertEqual(hits, [{'path': '/test/file'}])
+        self.assertEqual(validated_at, datetime.datetime(2020, 9, 13, 12, 26, 40))
+
+    @patch('portal.libs.elasticsearch.docs.base.IndexedFile.search')
+    def test_indexed_level_not_validated(self, mock_search):
+        mock_res = mock_search().params().filter().filter().post_filter().sort().extra().execute()
+        mock_res.__iter__.return_value = []
+        mock_res.aggregations.folder.validated.value = None
+
+        self.assertEqual(indexed_level('test.system', '/test'), ([], None))
+
+    @patch('portal.libs.elasticsearch.utils.cache.get_redis')
+    @patch('portal.libs.elasticsearch.docs.base.IndexedFile.search')
+    def test_indexed_level_root(self, mock_search, mock_redis):
+        mock_res = mock_search().params().filter().filter().post_filter().sort().extra().execute()
+        mock_res.__iter__.return_value = []
+        mock_redis.return_value.get.return_value = b'2020-09-13T12:26:40'
+
+        self.assertEqual(indexed_level('test.system', '/'), ([], datetime.datetime(2020, 9, 13, 12, 26, 40)))
+        mock_redis.return_value.get.assert_called_with('listing-validated:test.system')
+
+    @patch('portal.libs.elasticsearch.utils.current_time')
+    @patch('portal.libs.elasticsearch.utils.cache.get_redis')
+    @patch('portal.libs.elasticsearch.bulk.bulk_write')
+    def test_mark_validated(self, mock_bulk_write, mock_redis, mock_time):
+        mock_time.return_value = datetime.datetime(2020, 9, 13, 12, 26, 40)
+
+        mark_validated('test.system', '/test', 'MTIME')
+        self.assertEqual(mock_bulk_write.call_args[0][0], [{
+            '_index': 'test-staging-files',
+            '_id': file_uuid_sha256('test.system', '/test'),
+            'doc': {'listingValidated': datetime.datetime(2020, 9, 13, 12, 26, 40), 'crawledModified': 'MTIME'},
+            '_op_type': 'update',
+            '_routing': 'test.system'}])
+
+        mock_bulk_write.reset_mock()
+        mark_validated('test.system', '/')
+        mock_bulk_write.assert_not_called()
+        mock_redis.return_value.set.assert_called_once_with(
+            'listing-validated:test.system', '2020-09-13T12:26:40', ex=settings.PORTAL_INDEXED_LISTING_MAX_AGE)
+
+        mark_validated('test.system', '/.hidden')
+        mock_bulk_write.assert_not_called()
+
+    def test_listing_diff(self):
+        indexed = [
+            {'path': '/test/same', 'lastModified': '2018-09-11T11:38:34-05:00', 'length': 9},
+            {'path': '/test/changed', 'lastModified': '2018-09-11T11:38:34-05:00', 'length': 9},
+            {'path': '/test/removed', 'lastModified': '2018-09-11T11:38:34-05:00', 'length': 9}
+        ]
+        same = {'path': '/test/same', 'lastModified': '2018-09-11T11:38:34.000-05:00', 'length': 9}
+        changed = {'path': '/test/changed', 'lastModified': '2018-09-12T11:38:34.000-05:00', 'length': 9}
+        added = {'path': '/test/added', 'lastModified': '2018-09-11T11:38:34.000-05:00', 'length': 9}
+
+        self.assertEqual(listing_diff(indexed, [same, changed, added]),
+                         {'added': [added], 'modified': [changed], 'removed': ['/test/removed']})
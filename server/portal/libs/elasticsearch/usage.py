@@ -0,0 +1,346 @@
+"""
+.. module: portal.libs.elasticsearch.usage
+   :synopsis: Storage usage rollups and reports built from indexed files.
+
+Every indexed folder carries a ``usage`` rollup with the total bytes, file
+count and newest ``lastModified`` of the files under it, so reading a folder's
+size is a single document lookup. Rollups are recomputed for a whole subtree
+with one composite aggregation after a recursive crawl, and for a folder and
+its ancestors after a single level is indexed. Each ancestor is computed with
+the usage just written for its child carried over in memory, so rollups never
+have to wait for the index to be refreshed.
+
+Reports across many documents (largest files and folders, extensions, totals
+per user or project) are cached in Redis for
+``settings.PORTAL_USAGE_CACHE_TTL`` seconds.
+"""
+import json
+import logging
+import os
+from django.conf import settings
+from elasticsearch.exceptions import NotFoundError
+from elasticsearch_dsl import Q
+from redis import RedisError
+from portal.libs import cache
+from portal.libs.elasticsearch.bulk import bulk_write
+from portal.libs.elasticsearch.docs.base import IndexedFile
+from portal.libs.elasticsearch.utils import (file_uuid_sha256, file_routing, file_routing_meta, files_keyword_field,
+                                             get_sha256_hash)
+
+# pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+# pylint: enable=invalid-name
+
+CACHE_NAME = 'usage'
+# Buckets fetched per composite aggregation request.
+COMPOSITE_SIZE = 1000
+
+
+def _normalize(path):
+    return '/' + (path or '').strip('/')
+
+
+def _system_files(system, path='/'):
+    """Search over the documents of a system, under ``path``."""
+    search = IndexedFile.search().params(routing=file_routing(system))\
+        .filter('term', **{'system._exact': system})
+    path = _normalize(path)
+    if path != '/':
+        search = search.filter('term', **{'basePath._comps': path})
+    return search
+
+
+def _is_folder():
+    return Q('term', format='folder')
+
+
+def _composite(search, name, sources, add_metrics=None):
+    """Yield every bucket of a composite aggregation, paging with ``after``."""
+    after = None
+    while True:
+        page = search.extra(size=0)
+        kwargs = {'size': COMPOSITE_SIZE, 'sources': sources}
+        if after is not None:
+            kwargs['after'] = after
+        agg = page.aggs.bucket(name, 'composite', **kwargs)
+        if add_metrics is not None:
+            add_metrics(agg)
+        result = page.execute().aggregations[name]
+        for bucket in result.buckets:
+            yield bucket
+        if not result.buckets or 'after_key' not in result:
+            return
+        after = result.after_key.to_dict()
+
+
+def _usage(bytes_=0, files=0, last_modified=None):
+    return {'bytes': int(bytes_ or 0),
+            'files': int(files or 0),
+            'lastModified': int(last_modified) if last_modified is not None else None}
+
+
+def _newest(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def _cached(name, compute, *args):
+    """Return ``compute(*args)``, cached in Redis under ``name`` and args."""
+    ttl = settings.PORTAL_USAGE_CACHE_TTL
+    if ttl <= 0:
+        return compute(*args)
+    key = 'usage:{}:{}'.format(name, get_sha256_hash(json.dumps(args)))
+    try:
+        value = cache.get_redis().get(key)
+        if value is not None:
+            cache.record(CACHE_NAME, 'hits')
+            return json.loads(value)
+        cache.record(CACHE_NAME, 'misses')
+    except RedisError:
+        logger.warning('Usage cache unavailable, computing %s', name)
+        return compute(*args)
+    result = compute(*args)
+    try:
+        cache.get_redis().set(key, json.dumps(result), ex=ttl)
+    except RedisError:
+        logger.warning('Unable to cache %s', name)
+    return result
+
+
+def rollup_subtree(system, path='/'):
+    """
+    Recompute the usage of every folder under ``path``, then of its
+    ancestors.
+
+    Direct file totals per folder come from one composite aggregation over
+    ``basePath._exact`` and are added up the tree in memory.
+
+    Returns
+    -------
+    dict
+        Usage of ``path``.
+    """
+    path = _normalize(path)
+    files = _system_files(system, path).exclude(_is_folder())
+    totals = {}
+
+    def _add_metrics(agg):
+        agg.metric('bytes', 'sum', field='length')
+        agg.metric('lastModified', 'max', field='lastModified')
+
+    for bucket in _composite(files, 'folders', [{'basePath': {'terms': {'field': 'basePath._exact'}}}],
+                             _add_metrics):
+        folder = bucket.key.basePath
+        while True:
+            usage = totals.setdefault(folder, _usage())
+            usage['bytes'] += int(bucket.bytes.value or 0)
+            usage['files'] += bucket.doc_count
+            usage['lastModified'] = _newest(usage['lastModified'], bucket.lastModified.value)
+            if folder == path or folder == '/':
+                break
+            folder = os.path.dirname(folder)
+
+    folders = _system_files(system, path).filter(_is_folder()).source(['path'])
+    folder_paths = set(hit.path for hit in folders.scan())
+    if path != '/':
+        folder_paths.add(path)
+
+    bulk_write({
+        '_index': IndexedFile.Index.name,
+        '_id': file_uuid_sha256(system, folder),
+        '_op_type': 'update',
+        'doc': {'usage': totals.get(folder, _usage())},
+        **file_routing_meta(system)
+    } for folder in folder_paths)
+
+    rollup_ancestors(system, path, totals.get(path, _usage()))
+    return totals.get(path, _usage())
+
+
+def rollup_folder(system, path, child=None, child_usage=None):
+    """
+    Recompute the usage of a single folder from its direct files and the
+    stored usage of its direct subfolders.
+
+    The usage of the subfolder ``child`` is taken from ``child_usage``
+    instead, since it may have just been written and not be searchable yet.
+
+    Returns
+    -------
+    dict
+        Usage of ``path``.
+    """
+    path = _normalize(path)
+    search = IndexedFile.search().params(routing=file_routing(system))\
+        .filter('term', **{'system._exact': system})\
+        .filter('term', **{'basePath._exact': path})\
+        .extra(size=0)
+    files = search.aggs.bucket('files', 'filter', ~_is_folder())
+    files.metric('bytes', 'sum', field='length')
+    files.metric('lastModified', 'max', field='lastModified')
+    subfolders = _is_folder()
+    if child is not None:
+        subfolders &= ~Q('term', **{'path._exact': _normalize(child)})
+    folders = search.aggs.bucket('subfolders', 'filter', subfolders)
+    folders.metric('bytes', 'sum', field='usage.bytes')
+    folders.metric('files', 'sum', field='usage.files')
+    folders.metric('lastModified', 'max', field='usage.lastModified')
+    aggs = search.execute().aggregations
+
+    child_usage = child_usage or _usage()
+    usage = _usage(
+        (aggs.files.bytes.value or 0) + (aggs.subfolders.bytes.value or 0) + child_usage['bytes'],
+        aggs.files.doc_count + (aggs.subfolders.files.value or 0) + child_usage['files'],
+        _newest(aggs.files.lastModified.value, aggs.subfolders.lastModified.value, child_usage['lastModified'])
+    )
+    if path != '/':
+        try:
+            IndexedFile(meta={'id': file_uuid_sha256(system, path), 'routing': file_routing(system)})\
+                .update(usage=usage)
+        except NotFoundError:
+            logger.debug('Folder %s:%s is not indexed', system, path)
+    return usage
+
+
+def rollup_ancestors(system, path, usage):
+    """
+    Recompute the usage of every ancestor of ``path``, deepest first, given
+    the ``usage`` just computed for ``path``.
+    """
+    path = _normalize(path)
+    while path != '/':
+        parent = os.path.dirname(path)
+        if parent == '/':
+            return
+        usage = rollup_folder(system, parent, child=path, child_usage=usage)
+        path = parent
+
+
+def folder_usage(system, path):
+    """
+    Usage of a folder, read from its rollup. The usage of a system's root
+    folder is aggregated, since the root is not indexed.
+
+    Returns
+    -------
+    dict
+        ``{'bytes': int, 'files': int, 'lastModified': epoch millis}``
+    """
+    path = _normalize(path)
+    if path == '/':
+        return system_usage(system)
+    try:
+        doc = IndexedFile.from_path(system, path)
+    except NotFoundError:
+        return _usage()
+    usage = getattr(doc, 'usage', None)
+    return usage.to_dict() if usage is not None else _usage()
+
+
+def _system_usage(system):
+    search = _system_files(system).exclude(_is_folder()).extra(size=0, track_total_hits=True)
+    search.aggs.metric('bytes', 'sum', field='length')
+    search.aggs.metric('lastModified', 'max', field='lastModified')
+    res = search.execute()
+    return _usage(res.aggregations.bytes.value, res.hits.total.value, res.aggregations.lastModified.value)
+
+
+def system_usage(system):
+    """Usage of a whole system."""
+    return _cached('system', _system_usage, system)
+
+
+def _largest_files(system, path, size):
+    search = _system_files(system, path).exclude(_is_folder())\
+        .sort({'length': {'order': 'desc'}})\
+        .source(['name', 'path', 'length', 'lastModified'])\
+        .extra(size=size)
+    return [hit.to_dict() for hit in search.execute()]
+
+
+def largest_files(system, path='/', size=10):
+    """The ``size`` largest files under ``path``."""
+    return _cached('largest-files', _largest_files, system, _normalize(path), int(size))
+
+
+def _largest_folders(system, path, size):
+    search = _system_files(system, path).filter(_is_folder())\
+        .sort({'usage.bytes': {'order': 'desc', 'unmapped_type': 'long'}})\
+        .source(['name', 'path', 'usage'])\
+        .extra(size=size)
+    return [hit.to_dict() for hit in search.execute()]
+
+
+def largest_folders(system, path='/', size=10):
+    """The ``size`` largest folders under ``path``, by their rollups."""
+    return _cached('largest-folders', _largest_folders, system, _normalize(path), int(size))
+
+
+def _extensions(system, path):
+    files = _system_files(system, path).exclude(_is_folder())
+    source = {'terms': {'field': files_keyword_field('extension'), 'missing_bucket': True}}
+    breakdown = [{'extension': bucket.key.extension,
+                  'bytes': int(bucket.bytes.value or 0),
+                  'files': bucket.doc_count}
+                 for bucket in _composite(files, 'extensions', [{'extension': source}],
+                                          lambda agg: agg.metric('bytes', 'sum', field='length'))]
+    return sorted(breakdown, key=lambda ext: ext['bytes'], reverse=True)
+
+
+def extension_breakdown(system, path='/'):
+    """Bytes and file count per extension under ``path``, largest first."""
+    return _cached('extensions', _extensions, system, _normalize(path))
+
+
+def _system_totals(prefix):
+    files = IndexedFile.search()\
+        .filter('prefix', **{'system._exact': prefix})\
+        .exclude(_is_folder())
+    return {bucket.key.system: {'bytes': int(bucket.bytes.value or 0), 'files': bucket.doc_count}
+            for bucket in _composite(files, 'systems', [{'system': {'terms': {'field': 'system._exact'}}}],
+                                     lambda agg: agg.metric('bytes', 'sum', field='length'))}
+
+
+def system_totals(prefix):
+    """Usage of every system whose ID starts with ``prefix``, by system ID."""
+    return _cached('systems', _system_totals, prefix)
+
+
+def user_totals():
+    """
+    Usage of every user's local storage systems.
+
+    Returns
+    -------
+    dict
+        ``{username: {systemId: {'bytes': int, 'files': int}}}``
+    """
+    users = {}
+    for system in settings.PORTAL_DATA_DEPOT_LOCAL_STORAGE_SYSTEMS.values():
+        prefix = system['systemId'].split('{username}')[0]
+        for system_id, usage in system_totals(prefix).items():
+            users.setdefault(system_id[len(prefix):], {})[system_id] = usage
+    return users
+
+
+def project_totals():
+    """
+    Usage of every project.
+
+    Returns
+    -------
+    dict
+        ``{projectId: {'bytes': int, 'files': int}}``
+    """
+    prefix = '{}.'.format(settings.PORTAL_PROJECTS_SYSTEM_PREFIX)
+    return {system_id[len(prefix):]: usage for system_id, usage in system_totals(prefix).items()}
+
+
+def report(system, path='/', size=10):
+    """Usage of a folder with its largest files and folders and extensions."""
+    return {
+        'usage': folder_usage(system, path),
+        'largestFiles': largest_files(system, path, size),
+        'largestFolders': largest_folders(system, path, size),
+        'extensions': extension_breakdown(system, path)
+    }
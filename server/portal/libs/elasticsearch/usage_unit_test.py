@@ -0,0 +1,155 @@
+import json
+import pytest
+from portal.libs.elasticsearch import usage
+from portal.libs.elasticsearch.utils import file_uuid_sha256
+
+
+def _response(aggregations=None, hits=None, total=0):
+    return {'hits': {'total': {'value': total, 'relation': 'eq'}, 'hits': hits or []},
+            'aggregations': aggregations or {}}
+
+
+@pytest.fixture
+def mock_es(mocker):
+    yield mocker.patch('elasticsearch_dsl.search.get_connection').return_value
+
+
+@pytest.fixture
+def mock_bulk_write(mocker):
+    yield mocker.patch('portal.libs.elasticsearch.usage.bulk_write')
+
+
+def test_rollup_subtree(mocker, mock_es, mock_bulk_write):
+    mock_index = mocker.patch('portal.libs.elasticsearch.usage.IndexedFile._index')
+    mock_ancestors = mocker.patch('portal.libs.elasticsearch.usage.rollup_ancestors')
+    mocker.patch('elasticsearch_dsl.search.scan').return_value = [
+        {'_id': '1', '_source': {'path': '/a/b'}},
+        {'_id': '2', '_source': {'path': '/a/c'}},
+    ]
+    mock_es.search.side_effect = [
+        _response({'folders': {'after_key': {'basePath': '/a/b'}, 'buckets': [
+            {'key': {'basePath': '/a'}, 'doc_count': 1, 'bytes': {'value': 10.0}, 'lastModified': {'value': 1000.0}},
+            {'key': {'basePath': '/a/b'}, 'doc_count': 2, 'bytes': {'value': 5.0}, 'lastModified': {'value': 2000.0}},
+        ]}}),
+        _response({'folders': {'buckets': []}}),
+    ]
+
+    assert usage.rollup_subtree('test.system', '/a/') == {'bytes': 15, 'files': 3, 'lastModified': 2000}
+
+    # The second request continues after the first page.
+    body = mock_es.search.call_args_list[1][1]['body']
+    assert body['aggs']['folders']['composite']['after'] == {'basePath': '/a/b'}
+    ops = {op['_id']: op['doc']['usage'] for op in mock_bulk_write.call_args[0][0]}
+    assert ops == {
+        file_uuid_sha256('test.system', '/a'): {'bytes': 15, 'files': 3, 'lastModified': 2000},
+        file_uuid_sha256('test.system', '/a/b'): {'bytes': 5, 'files': 2, 'lastModified': 2000},
+        file_uuid_sha256('test.system', '/a/c'): {'bytes': 0, 'files': 0, 'lastModified': None},
+    }
+    # Ancestors are rolled up from the totals in memory, without a refresh.
+    mock_ancestors.assert_called_once_with('test.system', '/a', {'bytes': 15, 'files': 3, 'lastModified': 2000})
+    mock_index.refresh.assert_not_called()
+
+
+def test_rollup_folder(mocker, mock_es):
+    mock_update = mocker.patch('portal.libs.elasticsearch.usage.IndexedFile.update')
+    mock_es.search.return_value = _response({
+        'files': {'doc_count': 2, 'bytes': {'value': 10.0}, 'lastModified': {'value': 1000.0}},
+        'subfolders': {'doc_count': 1, 'bytes': {'value': 5.0}, 'files': {'value': 4.0},
+                       'lastModified': {'value': 3000.0}},
+    })
+
+    result = usage.rollup_folder('test.system', '/a')
+
+    assert result == {'bytes': 15, 'files': 6, 'lastModified': 3000}
+    mock_update.assert_called_once_with(usage=result)
+
+
+def test_rollup_folder_child(mocker, mock_es):
+    mock_update = mocker.patch('portal.libs.elasticsearch.usage.IndexedFile.update')
+    mock_es.search.return_value = _response({
+        'files': {'doc_count': 2, 'bytes': {'value': 10.0}, 'lastModified': {'value': 1000.0}},
+        'subfolders': {'doc_count': 0, 'bytes': {'value': 0.0}, 'files': {'value': 0.0},
+                       'lastModified': {'value': None}},
+    })
+
+    result = usage.rollup_folder('test.system', '/a', child='/a/b',
+                                 child_usage={'bytes': 7, 'files': 1, 'lastModified': 4000})
+
+    assert result == {'bytes': 17, 'files': 3, 'lastModified': 4000}
+    # The child's indexed usage is left out of the subfolder totals.
+    body = mock_es.search.call_args[1]['body']
+    assert {'term': {'path._exact': '/a/b'}} in body['aggs']['subfolders']['filter']['bool']['must_not']
+    mock_update.assert_called_once_with(usage=result)
+
+
+def test_rollup_ancestors(mocker):
+    mock_rollup = mocker.patch('portal.libs.elasticsearch.usage.rollup_folder',
+                               side_effect=[{'bytes': 2}, {'bytes': 3}])
+
+    usage.rollup_ancestors('test.system', '/a/b/c', {'bytes': 1})
+
+    assert mock_rollup.call_args_list == [
+        mocker.call('test.system', '/a/b', child='/a/b/c', child_usage={'bytes': 1}),
+        mocker.call('test.system', '/a', child='/a/b', child_usage={'bytes': 2}),
+    ]
+
+
+def test_folder_usage(mocker):
+    mock_doc = mocker.patch('portal.libs.elasticsearch.usage.IndexedFile.from_path').return_value
+    mock_doc.usage.to_dict.return_value = {'bytes': 1, 'files': 1, 'lastModified': None}
+    mock_system_usage = mocker.patch('portal.libs.elasticsearch.usage.system_usage')
+
+    assert usage.folder_usage('test.system', '/a') == {'bytes': 1, 'files': 1, 'lastModified': None}
+    assert usage.folder_usage('test.system', '/') == mock_system_usage.return_value
+    mock_system_usage.assert_called_once_with('test.system')
+
+
+def test_extension_breakdown(mocker, mock_es):
+    mocker.patch('portal.libs.elasticsearch.usage.files_keyword_field', return_value='extension.keyword')
+    mock_es.search.side_effect = [
+        _response({'extensions': {'after_key': {'extension': 'txt'}, 'buckets': [
+            {'key': {'extension': None}, 'doc_count': 1, 'bytes': {'value': 1.0}},
+            {'key': {'extension': 'txt'}, 'doc_count': 2, 'bytes': {'value': 30.0}},
+        ]}}),
+        _response({'extensions': {'buckets': []}}),
+    ]
+
+    assert usage.extension_breakdown('test.system', '/a') == [
+        {'extension': 'txt', 'bytes': 30, 'files': 2},
+        {'extension': None, 'bytes': 1, 'files': 1},
+    ]
+    body = mock_es.search.call_args_list[0][1]['body']
+    assert {'term': {'basePath._comps': '/a'}} in body['query']['bool']['filter']
+    # An index where extension was dynamically mapped as text is read from its keyword subfield.
+    assert body['aggs']['extensions']['composite']['sources'][0]['extension']['terms']['field'] == 'extension.keyword'
+
+
+def test_user_and_project_totals(mocker, settings):
+    settings.PORTAL_DATA_DEPOT_LOCAL_STORAGE_SYSTEMS = {
+        'frontera': {'systemId': 'frontera.home.{username}'}
+    }
+    settings.PORTAL_PROJECTS_SYSTEM_PREFIX = 'test.project'
+    mock_totals = mocker.patch('portal.libs.elasticsearch.usage.system_totals')
+    mock_totals.side_effect = lambda prefix: {
+        'frontera.home.': {'frontera.home.username': {'bytes': 1, 'files': 1}},
+        'test.project.': {'test.project.PRJ-1': {'bytes': 2, 'files': 2}},
+    }[prefix]
+
+    assert usage.user_totals() == {'username': {'frontera.home.username': {'bytes': 1, 'files': 1}}}
+    assert usage.project_totals() == {'PRJ-1': {'bytes': 2, 'files': 2}}
+
+
+def test_cached(mocker, settings, mock_es):
+    settings.PORTAL_USAGE_CACHE_TTL = 60
+    mock_redis = mocker.patch('portal.libs.cache.get_redis').return_value
+    mock_redis.get.return_value = json.dumps([{'name': 'cached'}])
+
+    assert usage.largest_files('test.system', '/a') == [{'name': 'cached'}]
+    mock_es.search.assert_not_called()
+
+    mock_redis.get.return_value = None
+    mock_es.search.return_value = _response(hits=[{'_id': '1', '_source': {'name': 'big', 'length': 10}}])
+
+    assert usage.largest_files('test.system', '/a') == [{'name': 'big', 'length': 10}]
+    assert json.loads(mock_redis.set.call_args[0][1]) == [{'name': 'big', 'length': 10}]
+    assert mock_redis.set.call_args[1] == {'ex': 60}
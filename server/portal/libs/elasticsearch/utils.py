@@ -5,11 +5,16 @@ Utilities to help on elastic search implementations.
 import os
 import logging
 import datetime
-from elasticsearch.helpers import bulk
-from elasticsearch_dsl import Q
+import threading
+import time
+from django.conf import settings
+from elasticsearch.exceptions import TransportError
+from elasticsearch_dsl import Q, Date
 from elasticsearch_dsl.connections import get_connection
+from redis import RedisError
 from hashlib import sha256
 from itertools import zip_longest
+from portal.libs import cache
 # from portal.apps.projects.models import ProjectMetadata
 
 # pylint: disable=invalid-name
@@ -65,6 +70,78 @@ def file_uuid_sha256(system, path):
     return sha256((system + path).encode()).hexdigest()
 
 
+_mappings = {}
+_mappings_lock = threading.Lock()
+
+
+def index_mapping(index):
+    """
+    Mappings of the indexes behind an index or alias, by index name.
+    reindex-files swaps in a new files index while processes run, so
+    mappings are cached for at most settings.ES_FILES_MAPPING_CHECK_INTERVAL
+    seconds.
+    """
+    with _mappings_lock:
+        mappings, checked = _mappings.get(index, ({}, 0))
+        if time.time() - checked < settings.ES_FILES_MAPPING_CHECK_INTERVAL:
+            return mappings
+        try:
+            mappings = {name: mapping['mappings'] for name, mapping
+                        in get_connection('default').indices.get_mapping(index=index).items()}
+        except TransportError:
+            logger.warning('Unable to read the mapping of index %s', index)
+        _mappings[index] = (mappings, time.time())
+        return mappings
+
+
+def routing_required(index):
+    """
+    Whether documents in an index or alias must be routed, as set by the
+    ``_routing`` mapping of the index behind it. settings.ES_FILES_ROUTING,
+    if set, overrides the mapping of the files index.
+    """
+    from portal.libs.elasticsearch.docs.base import IndexedFile
+    if index == IndexedFile.Index.name and settings.ES_FILES_ROUTING is not None:
+        return settings.ES_FILES_ROUTING
+    mappings = index_mapping(index)
+    return bool(mappings) and all(mapping.get('_routing', {}).get('required', False)
+                                  for mapping in mappings.values())
+
+
+def files_keyword_field(field):
+    """
+    Name to aggregate a keyword field of the files index on. A field added to
+    IndexedFile after the live index was created is typed as text by dynamic
+    mapping until update-files-mapping or reindex-files runs, in which case
+    its ``.keyword`` subfield is used.
+    """
+    from portal.libs.elasticsearch.docs.base import IndexedFile
+    for mapping in index_mapping(IndexedFile.Index.name).values():
+        prop = mapping.get('properties', {}).get(field, {})
+        if prop.get('type') == 'text' and 'keyword' in prop.get('fields', {}):
+            return '{}.keyword'.format(field)
+    return field
+
+
+def file_routing(system):
+    """
+    Routing value of a system's documents in the files index, so that
+    queries on one system only search one shard. None while the files index
+    is one built without routing.
+    """
+    from portal.libs.elasticsearch.docs.base import IndexedFile
+    return system if routing_required(IndexedFile.Index.name) else None
+
+
+def file_routing_meta(system):
+    """
+    ``_routing`` metadata for a bulk action on a system's document.
+    :class:`~portal.libs.elasticsearch.bulk.BulkWriter` drops it for indexes
+    that do not require routing.
+    """
+    return {'_routing': system}
+
+
 def grouper(iterable, n, fillvalue=None):
     """
     Recipe from itertools docs.
@@ -97,7 +174,7 @@ def walk_children(system, path, include_parent=True, recurse=False):
 
     """
     from portal.libs.elasticsearch.docs.base import IndexedFile
-    search = IndexedFile.search()
+    search = IndexedFile.search().params(routing=file_routing(system))
     search = search.filter(Q({'term': {'system._exact': system}}))
     if recurse:
         basepath_query = Q({'prefix': {'basePath._exact': path}})
@@ -114,38 +191,253 @@ def walk_children(system, path, include_parent=True, recurse=False):
         yield hit
 
 
-def delete_recursive(system, path):
+def indexed_level(system, path, offset=0, limit=100):
     """
-    Recursively delete all Elasticsearch documents in a specified system/path.
+    Page through the indexed children of a folder, sorted by name.
 
     Parameters
     ----------
     system: str
-        The Tapis system ID containing files to be deleted.
+        The Tapis system ID.
     path: str
-        The path relative to the system root. All documents with this path as a
-        prefix will be deleted.
+        The folder path relative to the system root.
+    offset: int
+        Offset for pagination.
+    limit: int
+        Number of children to return.
 
     Returns
     -------
-    Void
+    tuple
+        The page as a list of dicts, and the time at which the indexed
+        children of the folder were last checked against a Tapis listing
+        (``None`` if they never were, see `mark_validated`).
     """
     from portal.libs.elasticsearch.docs.base import IndexedFile
-    hits = walk_children(system, path, recurse=True)
-    idx = IndexedFile.Index.name
-    client = get_connection('default')
+    children = Q({'term': {'basePath._exact': path}})
+    folder = Q({'term': {'path._exact': path}})
+    search = IndexedFile.search().params(routing=file_routing(system))
+    search = search.filter(Q({'term': {'system._exact': system}}))
+    # Match the folder too, for its validation time, but only return children.
+    search = search.filter(children | folder).post_filter(children)
+    search = search.sort('name._exact')
+    search = search.extra(from_=int(offset), size=int(limit))
+    search.aggs.bucket('folder', 'filter', folder).metric('validated', 'max', field='listingValidated')
+    res = search.execute()
+
+    if path == '/':
+        validated_at = _root_validated(system)
+    else:
+        validated = res.aggregations.folder.validated.value
+        # listingValidated is written from a naive current_time(), which
+        # Elasticsearch stores as UTC.
+        validated_at = datetime.datetime.utcfromtimestamp(validated / 1000) if validated is not None else None
+    return [hit.to_dict() for hit in res], validated_at
+
+
+def _root_validated_key(system):
+    return 'listing-validated:{}'.format(system)
+
+
+def _root_validated(system):
+    """
+    Time at which the root folder of a system was last checked against a
+    Tapis listing. The root is not indexed, so the time is kept in Redis for
+    settings.PORTAL_INDEXED_LISTING_MAX_AGE seconds.
+    """
+    try:
+        validated = cache.get_redis().get(_root_validated_key(system))
+    except RedisError:
+        return None
+    return datetime.datetime.fromisoformat(validated.decode()) if validated else None
+
+
+def mark_validated(system, path, crawled_modified=None):
+    """
+    Record that the indexed children of a folder match a Tapis listing of it,
+    so that `indexed_level` can tell how fresh they are. Indexing a level
+    only rewrites the entries that changed, so the children's lastUpdated
+    says nothing about when the folder was last checked.
+
+    Parameters
+    ----------
+    system: str
+        The Tapis system ID.
+    path: str
+        The folder path relative to the system root.
+    crawled_modified: str
+        If given, also record the folder's lastModified as of this crawl of
+        its contents (see `_is_uncrawled`).
+    """
+    from portal.libs.elasticsearch.docs.base import IndexedFile
+    from portal.libs.elasticsearch.bulk import bulk_write
+    if os.path.basename(path).startswith('.'):
+        return
+    now = current_time()
+    if path == '/':
+        try:
+            cache.get_redis().set(_root_validated_key(system), now.isoformat(),
+                                  ex=settings.PORTAL_INDEXED_LISTING_MAX_AGE)
+        except RedisError:
+            logger.warning('Unable to record the validation of %s:/', system)
+        return
+    doc = {'listingValidated': now}
+    if crawled_modified is not None:
+        doc['crawledModified'] = crawled_modified
+    bulk_write([{
+        '_index': IndexedFile.Index.name,
+        '_id': file_uuid_sha256(system, path),
+        'doc': doc,
+        '_op_type': 'update',
+        **file_routing_meta(system)
+    }])
+
+
+def listing_diff(indexed, listing):
+    """
+    Compare the indexed children of a folder with a fresh Tapis listing of it.
+
+    Parameters
+    ----------
+    indexed: list
+        Indexed children as dicts.
+    listing: list
+        Tapis files (either dict or agavepy.agave.Attrdict)
+
+    Returns
+    -------
+    dict
+        ``added`` and ``modified`` Tapis files, and the ``removed`` paths.
+    """
+    indexed = {_file['path']: _file for _file in indexed}
+    listed = set()
+    added = []
+    modified = []
+    for _file in listing:
+        listed.add(_file['path'])
+        hit = indexed.get(_file['path'])
+        if hit is None:
+            added.append(_file)
+        elif Date().deserialize(_file.get('lastModified')) != Date().deserialize(hit.get('lastModified')) \
+                or _file.get('length') != hit.get('length'):
+            modified.append(_file)
+    removed = [path for path in indexed if path not in listed]
+    return {'added': added, 'modified': modified, 'removed': removed}
+
+
+def subtrees_query(paths):
+    """Match the documents at each of `paths` and everything under them."""
+    subtrees = []
+    for path in paths:
+        subtrees += [Q('term', **{'path._exact': path}),
+                     Q('term', **{'basePath._exact': path}),
+                     Q('prefix', **{'basePath._exact': path.rstrip('/') + '/'})]
+    return Q('bool', should=subtrees, minimum_should_match=1)
+
+
+def delete_recursive(system, paths, wait=False):
+    """
+    Delete the documents at one or more paths and everything under them with
+    a single sliced ``delete_by_query`` request. The request runs as an
+    Elasticsearch task unless `wait` is True; its ID is logged and returned.
+    Files indexes receiving dual writes are included.
+
+    Parameters
+    ----------
+    system: str
+        The Tapis system ID containing files to be deleted.
+    paths: str or list
+        Paths relative to the system root.
+    wait: bool
+        Wait for the deletion to finish.
+
+    Returns
+    -------
+    dict
+        The ``delete_by_query`` response: ``{'task': task ID}``, or the
+        deletion counts if `wait` is True. None if there was nothing to
+        delete.
+    """
+    from portal.libs.elasticsearch.docs.base import IndexedFile
+    from portal.libs.elasticsearch.bulk import dual_writes, record_dual_write_subtrees
+    if isinstance(paths, str):
+        paths = [paths]
+    paths = ['/' + path.strip('/') for path in paths]
+    if not paths:
+        return None
 
-    # Group children in batches of 100 for bulk deletion.
-    for group in grouper(hits, 100):
-        filtered_group = filter(lambda hit: hit is not None, group)
-        ops = map(lambda hit: {'_index': idx,
-                               '_id': hit.meta.id,
-                               '_op_type': 'delete'},
-                  filtered_group)
-        bulk(client, ops)
+    search = IndexedFile.search()
+    mirror = dual_writes().get(IndexedFile.Index.name)
+    if mirror:
+        search = search.index(mirror)
+        record_dual_write_subtrees(mirror, system, paths)
+    search = search.params(routing=file_routing(system),
+                           conflicts='proceed',
+                           slices=settings.ES_DELETE_SLICES,
+                           refresh=True,
+                           wait_for_completion=wait)\
+        .filter('term', **{'system._exact': system})\
+        .filter(subtrees_query(paths))
+    response = search.delete().to_dict()
+    if not wait:
+        logger.info('Deleting %s paths under %s in task %s', len(paths), system, response.get('task'))
+    return response
+
+
+def move_subtrees(system, moves):
+    """
+    Rewrite the indexed documents of moved files and folders, and of
+    everything under the folders, to their new paths. Document IDs are
+    derived from paths, so each document is written under its new ID and the
+    old one deleted. Tapis is not called.
 
+    Parameters
+    ----------
+    system: str
+        The Tapis system ID the files were moved within.
+    moves: list
+        ``(source path, destination path)`` pairs.
 
-def index_level(path, folders, files, systemId, reindex=False):
+    Returns
+    -------
+    portal.libs.elasticsearch.bulk.BulkStats
+    """
+    from portal.libs.elasticsearch.docs.base import IndexedFile
+    from portal.libs.elasticsearch.bulk import bulk_write
+    moves = {'/' + src.strip('/'): '/' + dest.strip('/') for src, dest in moves}
+    idx = IndexedFile.Index.name
+    search = IndexedFile.search().params(routing=file_routing(system))\
+        .filter('term', **{'system._exact': system})\
+        .filter(subtrees_query(list(moves)))
+
+    def _moved_root(path):
+        while path not in moves:
+            if path == '/':
+                return None
+            path = os.path.dirname(path)
+        return path
+
+    def _actions():
+        now = current_time()
+        for hit in search.scan():
+            doc = hit.to_dict()
+            src = _moved_root(doc['path'])
+            if src is None:
+                continue
+            path = moves[src] + doc['path'][len(src):]
+            if path == doc['path']:
+                continue
+            if src == doc['path']:
+                doc['name'] = os.path.basename(path)
+            doc.update(path=path, basePath=os.path.dirname(path), lastUpdated=now)
+            yield {'_index': idx, '_id': file_uuid_sha256(system, path), '_op_type': 'index',
+                   '_source': doc, **file_routing_meta(system)}
+            yield {'_index': idx, '_id': hit.meta.id, '_op_type': 'delete', **file_routing_meta(system)}
+
+    return bulk_write(_actions())
+
+
+def index_level(path, folders, files, systemId, reindex=False, incremental=False, crawled_modified=None):
     """
     Index a set of folders and files corresponding to the output from one
     iteration of walk_levels
@@ -160,18 +452,85 @@ def index_level(path, folders, files, systemId, reindex=False):
         list of Tapis files (either dict or agavepy.agave.Attrdict)
     systemId: str
         ID of the Tapis system being indexed.
+    incremental: bool
+        If True, only index entries whose lastModified/length differ from the
+        indexed document, and only return folders whose contents changed since
+        they were last crawled.
+    crawled_modified: str
+        lastModified of the folder at `path`, as listed by its parent during a
+        recursive crawl. If given, the folder is recorded as crawled once its
+        entries have been written. The folder is recorded as validated either
+        way, see `mark_validated`.
 
     Returns
     -------
-    Void
+    list
+        Folders whose contents should be crawled next.
+    """
+    indexed = {hit.path: hit for hit in walk_children(systemId, path, include_parent=False)}
+
+    if incremental:
+        index_listing([_file for _file in folders + files if _is_modified(_file, indexed.get(_file['path']))])
+        descend = [folder for folder in folders if _is_uncrawled(folder, indexed.get(folder['path']))]
+    else:
+        descend = folders
+        index_listing(folders + files)
+
+    children_paths = set(_file['path'] for _file in folders + files)
+    vanished = [hit_path for hit_path in indexed if hit_path not in children_paths]
+    if vanished:
+        delete_recursive(systemId, vanished)
+
+    mark_validated(systemId, path, crawled_modified)
+
+    return descend
+
+
+def _is_modified(_file, hit):
+    """
+    Whether a listed file differs from its indexed document.
     """
+    if hit is None:
+        return True
+    return Date().deserialize(_file.get('lastModified')) != hit.lastModified \
+        or _file.get('length') != hit.length
 
-    index_listing(folders + files)
 
-    children_paths = [_file['path'] for _file in folders + files]
-    for hit in walk_children(systemId, path, recurse=False):
-        if hit['path'] not in children_paths:
-            delete_recursive(hit.system, hit.path)
+def _is_uncrawled(folder, hit):
+    """
+    Whether a listed folder has changed since its contents were last crawled.
+    A folder's mtime only changes when entries directly inside it are added,
+    removed or renamed, so changes further down the tree are only picked up by
+    a full (non-incremental) crawl.
+    """
+    if hit is None:
+        return True
+    return Date().deserialize(folder.get('lastModified')) != getattr(hit, 'crawledModified', None)
+
+
+def clear_crawled(system, paths):
+    """
+    Forget that the folders above `paths` were crawled, so that the next
+    incremental crawl descends to `paths` again. Used for folders that a crawl
+    had to skip.
+    """
+    from portal.libs.elasticsearch.docs.base import IndexedFile
+    from portal.libs.elasticsearch.bulk import bulk_write
+    ancestors = set()
+    for path in paths:
+        parent = os.path.dirname(path.rstrip('/'))
+        while parent not in ('', '/') and parent not in ancestors:
+            ancestors.add(parent)
+            parent = os.path.dirname(parent)
+    ops = [{
+        '_index': IndexedFile.Index.name,
+        '_id': file_uuid_sha256(system, ancestor),
+        'doc': {'crawledModified': None},
+        '_op_type': 'update',
+        **file_routing_meta(system)
+    } for ancestor in sorted(ancestors)]
+    if ops:
+        bulk_write(ops)
 
 
 def current_time():
@@ -192,30 +551,46 @@ def index_listing(files):
 
     Parameters
     ----------
-    files: list
-        list of Tapis files (either dict or agavepy.agave.Attrdict)
+    files: iterable
+        Tapis files (either dict or agavepy.agave.Attrdict)
 
     Returns
     -------
-    Void
+    portal.libs.elasticsearch.bulk.BulkStats
+    """
+    from portal.libs.elasticsearch.bulk import bulk_write
+    return bulk_write(listing_actions(files))
+
+
+def listing_actions(files):
+    """
+    Yield an upsert bulk action for each non-hidden file in a Tapis listing.
+
+    Parameters
+    ----------
+    files: iterable
+        Tapis files (either dict or agavepy.agave.Attrdict)
+
+    Yields
+    ------
+    dict
     """
     from portal.libs.elasticsearch.docs.base import IndexedFile
     idx = IndexedFile.Index.name
-    client = get_connection('default')
-    ops = []
     for _file in files:
         file_dict = dict(_file)
         if file_dict['name'][0] == '.':
             continue
         file_dict['lastUpdated'] = current_time()
         file_dict['basePath'] = os.path.dirname(file_dict['path'])
+        if file_dict.get('format') != 'folder':
+            file_dict['extension'] = os.path.splitext(file_dict['name'])[1][1:].lower()
         file_uuid = file_uuid_sha256(file_dict['system'], file_dict['path'])
-        ops.append({
+        yield {
             '_index': idx,
             '_id': file_uuid,
             'doc': file_dict,
             '_op_type': 'update',
-            'doc_as_upsert': True
-            })
-
-    bulk(client, ops)
+            'doc_as_upsert': True,
+            **file_routing_meta(file_dict['system'])
+        }
@@ -1,7 +1,9 @@
 import os
 import io
+import tempfile
 import magic
 import logging
+from django.conf import settings
 from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
 
 # from portal.libs.elasticsearch.indexes import IndexedFile
@@ -181,3 +183,57 @@ def copy(client, src_system, src_path, dest_system, dest_path, file_name,
             'name': dest_path_name,
             'path': os.path.join(dest_path_name, file_name),
             'systemId': dest_system}
+
+
+def download_stream(client, system, path, chunk_size=None, *args, **kwargs):
+    """Stream a file's contents without loading it into memory.
+
+    Returns the file name and an iterator over the file's contents, in chunks
+    of ``chunk_size`` bytes (``settings.PORTAL_TRANSFER_CHUNK_SIZE`` by
+    default).
+    """
+    if not path:
+        path = 'root'
+    file_name = client.files().get(fileId=path, fields="name").execute()['name']
+    request = client.files().get_media(fileId=path)
+
+    def _chunks():
+        buffer = io.BytesIO()
+        downloader = MediaIoBaseDownload(buffer, request,
+                                         chunksize=chunk_size or settings.PORTAL_TRANSFER_CHUNK_SIZE)
+        done = False
+        while not done:
+            _, done = downloader.next_chunk()
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    return file_name, _chunks()
+
+
+def upload_stream(client, system, path, file_name, chunks, chunk_size=None, *args, **kwargs):
+    """Upload a file from an iterator of chunks using a resumable upload.
+
+    Drive uploads need a seekable source, so chunks are written to a spooled
+    temporary file that spills to disk past
+    ``settings.PORTAL_TRANSFER_SPOOL_SIZE`` bytes.
+    """
+    if not path:
+        path = 'root'
+    with tempfile.SpooledTemporaryFile(max_size=settings.PORTAL_TRANSFER_SPOOL_SIZE) as spool:
+        for chunk in chunks:
+            spool.write(chunk)
+        spool.seek(0)
+        mimetype = magic.from_buffer(spool.read(2048), mime=True)
+        spool.seek(0)
+        media = MediaIoBaseUpload(spool, mimetype=mimetype, resumable=True,
+                                  chunksize=chunk_size or settings.PORTAL_TRANSFER_CHUNK_SIZE)
+        file_meta = {
+            'name': file_name,
+            'parents': [path]
+        }
+        request = client.files().create(body=file_meta, media_body=media)
+        response = None
+        while response is None:
+            _, response = request.next_chunk()
+    return response
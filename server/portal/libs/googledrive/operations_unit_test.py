@@ -189,6 +189,39 @@ def test_download(mock_googledrive_client, mock_downloader):
     assert downloaded.name == 'testfile'
 
 
+def test_download_stream(mock_googledrive_client, mock_downloader):
+    from portal.libs.googledrive.operations import download_stream
+    mock_googledrive_client.files().get().execute.return_value = {'name': 'testfile'}
+
+    downloader = mock_downloader.return_value
+
+    def next_chunk():
+        mock_downloader.call_args[0][0].write(b'data')
+        return 'status', downloader.next_chunk.call_count == 2
+    downloader.next_chunk.side_effect = next_chunk
+
+    name, chunks = download_stream(mock_googledrive_client, 'googledrive', 'testid')
+
+    assert name == 'testfile'
+    assert list(chunks) == [b'data', b'data']
+
+
+def test_upload_stream(mock_googledrive_client, mock_uploader):
+    from portal.libs.googledrive.operations import upload_stream
+    mock_googledrive_client.files().create().next_chunk.side_effect = [(None, None), (None, {'id': '1234'})]
+
+    response = upload_stream(mock_googledrive_client, 'googledrive', 'testpath', 'testfile',
+                             iter([b'Test ', b'File Content']))
+
+    assert response == {'id': '1234'}
+    assert mock_uploader.call_args[1]['mimetype'] == 'text/plain'
+    assert mock_uploader.call_args[1]['resumable']
+    mock_googledrive_client.files().create.assert_called_with(
+        body={'name': 'testfile',
+              'parents': ['testpath']},
+        media_body=mock_uploader())
+
+
 def test_copy_file(mock_googledrive_client, mocker):
     from portal.libs.googledrive.operations import copy
     mock_transfer = mocker.patch('portal.libs.transfer.operations.transfer')
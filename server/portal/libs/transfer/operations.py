@@ -1,51 +1,295 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from django.conf import settings
+from portal.libs import cache
 from portal.libs.agave import operations as tapis_operations
 from portal.libs.googledrive import operations as googledrive_operations
 
+# pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+# pylint: enable=invalid-name
+
 
 def api_mapping():
     return {
         'googledrive': {
             'upload': googledrive_operations.upload,
             'download': googledrive_operations.download,
+            'download_stream': googledrive_operations.download_stream,
+            'upload_stream': googledrive_operations.upload_stream,
             'iterate_listing': googledrive_operations.iterate_listing,
-            'mkdir': googledrive_operations.mkdir
+            'mkdir': googledrive_operations.mkdir,
+            # googleapiclient clients are not thread safe.
+            'thread_safe': False
         },
         'tapis': {
             'upload': tapis_operations.upload,
             'download': tapis_operations.download_bytes,
+            'download_stream': tapis_operations.download_stream,
+            'upload_stream': tapis_operations.upload_stream,
             'iterate_listing': tapis_operations.iterate_listing,
-            'mkdir': tapis_operations.mkdir
+            'mkdir': tapis_operations.mkdir,
+            'thread_safe': True
         }
     }
 
 
-def transfer(src_client, dest_client, src_api, dest_api, src_system,
-             dest_system, src_path, dest_path, *args, **kwargs):
+class TransferStats:
+    """Counters collected during a transfer."""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.errors = []
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def add_bytes(self, count):
+        with self._lock:
+            self.bytes += count
+
+    def add_file(self):
+        with self._lock:
+            self.files += 1
+
+    def to_dict(self):
+        elapsed = max(time.time() - self.started, 1e-6)
+        return {
+            'files': self.files,
+            'bytes': self.bytes,
+            'skipped': self.skipped,
+            'errors': len(self.errors),
+            'elapsed': round(elapsed, 3),
+            'bytesPerSec': round(self.bytes / elapsed, 3),
+        }
+
+
+class TransferState:
+    """Progress of a folder transfer, kept so a retried transfer can resume.
+
+    Records which destination folder was created for each source folder and
+    which files were already copied. State is kept in Redis under ``key`` for
+    ``settings.PORTAL_TRANSFER_STATE_TTL`` seconds, or in memory if no key is
+    given.
+    """
+
+    def __init__(self, key=None):
+        self.key = key
+        self._dirs = {}
+        self._done = set()
+
+    def dest_dir(self, src_path):
+        if self.key is None:
+            return self._dirs.get(src_path)
+        value = cache.get_redis().hget('{}:dirs'.format(self.key), src_path)
+        return value.decode() if value is not None else None
+
+    def set_dest_dir(self, src_path, dest_path):
+        if self.key is None:
+            self._dirs[src_path] = dest_path
+            return
+        pipe = cache.get_redis().pipeline()
+        pipe.hset('{}:dirs'.format(self.key), src_path, dest_path)
+        pipe.expire('{}:dirs'.format(self.key), settings.PORTAL_TRANSFER_STATE_TTL)
+        pipe.execute()
+
+    def is_done(self, src_path):
+        if self.key is None:
+            return src_path in self._done
+        return bool(cache.get_redis().sismember('{}:done'.format(self.key), src_path))
+
+    def mark_done(self, src_path):
+        if self.key is None:
+            self._done.add(src_path)
+            return
+        pipe = cache.get_redis().pipeline()
+        pipe.sadd('{}:done'.format(self.key), src_path)
+        pipe.expire('{}:done'.format(self.key), settings.PORTAL_TRANSFER_STATE_TTL)
+        pipe.execute()
+
+    def clear(self):
+        if self.key is not None:
+            cache.get_redis().delete('{}:dirs'.format(self.key), '{}:done'.format(self.key))
+
+
+class TransferError(Exception):
+    """Raised when some files of a folder transfer failed."""
+
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exc):
+        self.exc = exc
 
-    _download = api_mapping()[src_api]['download']
-    _upload = api_mapping()[dest_api]['upload']
-    file_bytes = _download(src_client, src_system, src_path)
-    file_upload = _upload(dest_client, dest_system, dest_path, file_bytes)
 
+def pipe(chunks, max_chunks=None):
+    """
+    Read ``chunks`` in a background thread and yield them through a queue of
+    at most ``max_chunks`` items, so that downloading the next chunks
+    overlaps with uploading the current one while memory stays bounded.
+    Errors raised by the source are re-raised in the consumer.
+    """
+    buffer = queue.Queue(maxsize=max_chunks or settings.PORTAL_TRANSFER_BUFFER_CHUNKS)
+    stop = threading.Event()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _produce():
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    return
+                _put(chunk)
+        except Exception as exc:  # pylint: disable=broad-except
+            _put(_Failure(exc))
+            return
+        _put(_DONE)
+
+    producer = threading.Thread(target=_produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+
+
+def _counted(chunks, stats):
+    for chunk in chunks:
+        if stats is not None:
+            stats.add_bytes(len(chunk))
+        yield chunk
+
+
+def transfer(src_client, dest_client, src_api, dest_api, src_system,
+             dest_system, src_path, dest_path, *args, stats=None, **kwargs):
+    """
+    Copy a single file between APIs, streaming it from the source to the
+    destination through a bounded buffer.
+    """
+    _download_stream = api_mapping()[src_api]['download_stream']
+    _upload_stream = api_mapping()[dest_api]['upload_stream']
+
+    file_name, chunks = _download_stream(src_client, src_system, src_path)
+    file_upload = _upload_stream(dest_client, dest_system, dest_path, file_name,
+                                 pipe(_counted(chunks, stats)))
+    if stats is not None:
+        stats.add_file()
     return file_upload
 
 
 def transfer_folder(src_client, dest_client, src_api, dest_api, src_system,
                     dest_system, src_path, dest_path, dirname, *args,
+                    stats=None, state=None, on_progress=None, max_workers=None,
+                    src_client_factory=None, dest_client_factory=None,
                     **kwargs):
-    _iterate_listing = api_mapping()[src_api]['iterate_listing']
-    _download = api_mapping()[src_api]['download']
-    _upload = api_mapping()[dest_api]['upload']
-    _mkdir = api_mapping()[dest_api]['mkdir']
-
-    newdir = _mkdir(dest_client, dest_system, dest_path, dirname)
-    for f in _iterate_listing(src_client, src_system, src_path):
-        if f['format'] == 'folder':
-            return transfer_folder(src_client, dest_client, src_api, dest_api,
-                                   src_system, dest_system, f['path'],
-                                   newdir['path'], f['name'])
-        else:
-            file_bytes = _download(src_client, src_system, f['path'])
-            file_upload = _upload(dest_client, dest_system, newdir['path'],
-                                  file_bytes)
-            return file_upload
+    """
+    Copy a folder tree between APIs.
+
+    Folders are created as the tree is walked, and files are copied by a pool
+    of ``max_workers`` threads (``settings.PORTAL_TRANSFER_MAX_WORKERS`` by
+    default). Files and folders already recorded in ``state`` are skipped,
+    so a failed transfer can be resumed with the same state.
+
+    APIs whose clients are not thread safe need a ``*_client_factory``
+    returning a new client, which is called once per worker thread. Without
+    one, files are copied one at a time.
+
+    Raises
+    ------
+    TransferError
+        If any file failed to copy. Other files are still copied.
+    """
+    stats = stats or TransferStats()
+    state = state or TransferState()
+    mapping = api_mapping()
+    _iterate_listing = mapping[src_api]['iterate_listing']
+    _mkdir = mapping[dest_api]['mkdir']
+
+    max_workers = max_workers or settings.PORTAL_TRANSFER_MAX_WORKERS
+    # Copy files in the walking thread if a client can't be shared with workers.
+    serial = (not mapping[src_api]['thread_safe'] and src_client_factory is None) or \
+        (not mapping[dest_api]['thread_safe'] and dest_client_factory is None)
+
+    local = threading.local()
+
+    def _clients():
+        if serial:
+            return src_client, dest_client
+        if not hasattr(local, 'clients'):
+            local.clients = (
+                src_client_factory() if src_client_factory else src_client,
+                dest_client_factory() if dest_client_factory else dest_client
+            )
+        return local.clients
+
+    def _copy(f, dest_dir):
+        worker_src_client, worker_dest_client = _clients()
+        transfer(worker_src_client, worker_dest_client, src_api, dest_api,
+                 src_system, dest_system, f['path'], dest_dir, stats=stats)
+        state.mark_done(f['path'])
+
+    def _finish(f, result):
+        try:
+            result()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Error transferring %s:%s', src_system, f['path'])
+            stats.errors.append(f['path'])
+        if on_progress:
+            on_progress(stats)
+
+    def _collect(done, pending):
+        for future in done:
+            _finish(pending.pop(future), future.result)
+
+    def _mkdir_once(src_dir, parent, name):
+        dest_dir = state.dest_dir(src_dir)
+        if dest_dir is None:
+            dest_dir = _mkdir(dest_client, dest_system, parent, name)['path']
+            state.set_dest_dir(src_dir, dest_dir)
+        return dest_dir
+
+    pending = {}
+    folders = [(src_path, _mkdir_once(src_path, dest_path, dirname))]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while folders:
+            src_dir, dest_dir = folders.pop()
+            for f in _iterate_listing(src_client, src_system, src_dir):
+                if f['format'] == 'folder':
+                    folders.append((f['path'], _mkdir_once(f['path'], dest_dir, f['name'])))
+                    continue
+                if state.is_done(f['path']):
+                    stats.skipped += 1
+                    continue
+                if serial:
+                    _finish(f, lambda: _copy(f, dest_dir))
+                    continue
+                # Backpressure: keep at most two files per worker queued.
+                while len(pending) >= max_workers * 2:
+                    done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                    _collect(done, pending)
+                pending[executor.submit(_copy, f, dest_dir)] = f
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            _collect(done, pending)
+
+    if stats.errors:
+        raise TransferError('Failed to transfer {} files, e.g. {}'.format(len(stats.errors), stats.errors[:3]))
+    return stats
@@ -1,5 +1,4 @@
 import pytest
-import io
 from mock import MagicMock, call
 
 
@@ -40,29 +39,35 @@ def iteration_side_effect():
 
 
 def test_transfer(mock_operations, mock_agave_client):
-    from portal.libs.transfer.operations import transfer
-    mock_bytes = MagicMock(spec=io.BytesIO)
-    mock_operations.download_bytes.return_value = mock_bytes
+    from portal.libs.transfer.operations import transfer, TransferStats
+    mock_operations.download_stream.return_value = ('file.txt', iter([b'ab', b'cd']))
+    uploaded = []
+    mock_operations.upload_stream.side_effect = \
+        lambda client, system, path, name, chunks: uploaded.extend(chunks)
+    stats = TransferStats()
+
     transfer(mock_agave_client, mock_agave_client,
              'tapis', 'tapis',
              'src.system', 'dest.system',
-             '/src/path', '/dest/path')
+             '/src/path', '/dest/path', stats=stats)
 
-    mock_operations.download_bytes.assert_called_with(mock_agave_client,
-                                                      'src.system',
-                                                      '/src/path')
-    mock_operations.upload.assert_called_with(mock_agave_client,
-                                              'dest.system',
-                                              '/dest/path',
-                                              mock_bytes)
+    mock_operations.download_stream.assert_called_with(mock_agave_client,
+                                                       'src.system',
+                                                       '/src/path')
+    assert mock_operations.upload_stream.call_args[0][:4] == (mock_agave_client,
+                                                              'dest.system',
+                                                              '/dest/path',
+                                                              'file.txt')
+    assert uploaded == [b'ab', b'cd']
+    assert stats.files == 1
+    assert stats.bytes == 4
 
 
 def test_transfer_folder(mock_operations, mock_agave_client,
                          iteration_side_effect):
     from portal.libs.transfer.operations import transfer_folder
 
-    mock_bytes = MagicMock(spec=io.BytesIO)
-    mock_operations.download_bytes.return_value = mock_bytes
+    mock_operations.download_stream.return_value = ('mockfile', iter([b'data']))
     mock_operations.iterate_listing.side_effect = iteration_side_effect
     mock_operations.mkdir.return_value = {'path': '/new/dir/path'}
 
@@ -81,10 +86,89 @@ def test_transfer_folder(mock_operations, mock_agave_client,
                                                  '/new/dir/path',
                                                  'mockdir')])
 
-    mock_operations.download_bytes.assert_called_with(mock_agave_client,
-                                                      'src.system',
-                                                      '/path/to/res2')
-    mock_operations.upload.assert_called_with(mock_agave_client,
-                                              'dest.system',
-                                              '/new/dir/path',
-                                              mock_bytes)
+    mock_operations.download_stream.assert_called_with(mock_agave_client,
+                                                       'src.system',
+                                                       '/path/to/res2')
+    assert mock_operations.upload_stream.call_args[0][:4] == (mock_agave_client,
+                                                              'dest.system',
+                                                              '/new/dir/path',
+                                                              'mockfile')
+
+
+def _file(path):
+    return {'path': path, 'name': path.split('/')[-1], 'format': 'raw'}
+
+
+def test_transfer_folder_copies_every_file(mock_operations, mock_agave_client):
+    from portal.libs.transfer.operations import transfer_folder
+
+    mock_operations.iterate_listing.return_value = [_file('/src/a'), _file('/src/b'), _file('/src/c')]
+    mock_operations.mkdir.return_value = {'path': '/dest/testdir'}
+    mock_operations.download_stream.side_effect = lambda client, system, path: (path, iter([b'x']))
+    on_progress = MagicMock()
+
+    stats = transfer_folder(mock_agave_client, mock_agave_client, 'tapis', 'tapis',
+                            'src.system', 'dest.system', '/src', '/dest', 'testdir',
+                            on_progress=on_progress)
+
+    uploaded = sorted(c[0][3] for c in mock_operations.upload_stream.call_args_list)
+    assert uploaded == ['/src/a', '/src/b', '/src/c']
+    assert stats.files == 3
+    assert on_progress.call_count == 3
+
+
+def test_transfer_folder_resumes(mock_operations, mock_agave_client):
+    from portal.libs.transfer.operations import transfer_folder, TransferState
+
+    mock_operations.iterate_listing.return_value = [_file('/src/a'), _file('/src/b')]
+    mock_operations.download_stream.side_effect = lambda client, system, path: (path, iter([b'x']))
+    state = TransferState()
+    state.set_dest_dir('/src', '/dest/testdir')
+    state.mark_done('/src/a')
+
+    stats = transfer_folder(mock_agave_client, mock_agave_client, 'tapis', 'tapis',
+                            'src.system', 'dest.system', '/src', '/dest', 'testdir',
+                            state=state)
+
+    mock_operations.mkdir.assert_not_called()
+    mock_operations.download_stream.assert_called_once_with(mock_agave_client, 'src.system', '/src/b')
+    assert stats.skipped == 1
+    assert state.is_done('/src/b')
+
+
+def test_transfer_folder_errors(mock_operations, mock_agave_client):
+    from portal.libs.transfer.operations import transfer_folder, TransferError, TransferState
+
+    mock_operations.iterate_listing.return_value = [_file('/src/a'), _file('/src/b')]
+    mock_operations.mkdir.return_value = {'path': '/dest/testdir'}
+
+    def download_side_effect(client, system, path):
+        if path == '/src/a':
+            raise Exception('download failed')
+        return path, iter([b'x'])
+    mock_operations.download_stream.side_effect = download_side_effect
+    state = TransferState()
+
+    with pytest.raises(TransferError):
+        transfer_folder(mock_agave_client, mock_agave_client, 'tapis', 'tapis',
+                        'src.system', 'dest.system', '/src', '/dest', 'testdir',
+                        state=state)
+
+    assert not state.is_done('/src/a')
+    assert state.is_done('/src/b')
+
+
+def test_pipe():
+    from portal.libs.transfer.operations import pipe
+    assert list(pipe(iter([b'a', b'b', b'c']), max_chunks=1)) == [b'a', b'b', b'c']
+
+
+def test_pipe_raises_source_errors():
+    from portal.libs.transfer.operations import pipe
+
+    def chunks():
+        yield b'a'
+        raise ValueError('read failed')
+
+    with pytest.raises(ValueError):
+        list(pipe(chunks()))
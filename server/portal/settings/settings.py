@@ -403,6 +403,62 @@ CELERY_RESULT_BACKEND = ''.join(
     ]
 )
 
+# Redis database used for portal-side caches, e.g. Tapis listings.
+PORTAL_CACHE_REDIS_URL = ''.join(
+    [
+        _RESULT_BACKEND_PROTOCOL,
+        _RESULT_BACKEND_HOST, ':', _RESULT_BACKEND_PORT,
+        '/', getattr(settings_custom, '_PORTAL_CACHE_REDIS_DB', '1')
+    ]
+)
+PORTAL_CACHE_SOCKET_TIMEOUT = getattr(settings_custom, '_PORTAL_CACHE_SOCKET_TIMEOUT', 0.5)
+# Seconds a Tapis listing is served from cache. 0 disables the listing cache.
+PORTAL_LISTING_CACHE_TTL = getattr(settings_custom, '_PORTAL_LISTING_CACHE_TTL', 30)
+# Seconds each site search section may take before partial results are
+# returned, and seconds anonymous site search results are cached. 0 disables
+# the site search cache.
+PORTAL_SITE_SEARCH_TIMEOUT = getattr(settings_custom, '_PORTAL_SITE_SEARCH_TIMEOUT', 2)
+PORTAL_SITE_SEARCH_CACHE_TTL = getattr(settings_custom, '_PORTAL_SITE_SEARCH_CACHE_TTL', 60)
+# Seconds storage usage reports are cached, and seconds usage rollups wait
+# after indexing so that indexing bursts roll up once.
+PORTAL_USAGE_CACHE_TTL = getattr(settings_custom, '_PORTAL_USAGE_CACHE_TTL', 5 * 60)
+PORTAL_USAGE_ROLLUP_DEBOUNCE = getattr(settings_custom, '_PORTAL_USAGE_ROLLUP_DEBOUNCE', 60)
+# Seconds public app definitions and resolved app tray entries are cached,
+# seconds other apps and private app listings are cached per user, and the
+# crontab schedule of the task that warms the app cache. A TTL of 0 disables
+# the app cache, an empty schedule disables warming.
+PORTAL_APP_CACHE_TTL = getattr(settings_custom, '_PORTAL_APP_CACHE_TTL', 60 * 60)
+PORTAL_APP_CACHE_USER_TTL = getattr(settings_custom, '_PORTAL_APP_CACHE_USER_TTL', 5 * 60)
+PORTAL_APP_CACHE_WARM_SCHEDULE = getattr(settings_custom, '_PORTAL_APP_CACHE_WARM_SCHEDULE', {'minute': '*/20'})
+# Number of app tray entries resolved in parallel across all requests, and
+# seconds the app tray waits for them before returning the rest as loading
+# placeholders.
+PORTAL_APPS_TRAY_MAX_WORKERS = getattr(settings_custom, '_PORTAL_APPS_TRAY_MAX_WORKERS', 8)
+PORTAL_APPS_TRAY_TIMEOUT = getattr(settings_custom, '_PORTAL_APPS_TRAY_TIMEOUT', 3)
+
+# Tapis clients are reused per user within a process. Number of clients kept,
+# connections kept per host and host pools kept by the shared HTTP adapter,
+# and seconds between client and pool metrics written to the metrics log.
+PORTAL_AGAVE_CLIENT_CACHE_SIZE = getattr(settings_custom, '_PORTAL_AGAVE_CLIENT_CACHE_SIZE', 256)
+PORTAL_AGAVE_POOL_MAXSIZE = getattr(settings_custom, '_PORTAL_AGAVE_POOL_MAXSIZE', 20)
+PORTAL_AGAVE_POOL_CONNECTIONS = getattr(settings_custom, '_PORTAL_AGAVE_POOL_CONNECTIONS', 4)
+PORTAL_AGAVE_CLIENT_STATS_INTERVAL = getattr(settings_custom, '_PORTAL_AGAVE_CLIENT_STATS_INTERVAL', 300)
+# Seconds a token refresh may hold its lock. Concurrent requests from the same
+# user wait at most this long for the refresh to finish.
+PORTAL_TOKEN_REFRESH_LOCK_TIMEOUT = getattr(settings_custom, '_PORTAL_TOKEN_REFRESH_LOCK_TIMEOUT', 15)
+
+# Cached TAS allocations older than PORTAL_ALLOCATIONS_TTL seconds are served
+# while being refreshed in the background, at most once per
+# PORTAL_ALLOCATIONS_REVALIDATE_INTERVAL seconds. Concurrent requests for
+# uncached allocations wait up to PORTAL_ALLOCATIONS_FETCH_TIMEOUT seconds
+# for a single TAS request.
+PORTAL_ALLOCATIONS_TTL = getattr(settings_custom, '_PORTAL_ALLOCATIONS_TTL', 60 * 60)
+PORTAL_ALLOCATIONS_REVALIDATE_INTERVAL = getattr(settings_custom, '_PORTAL_ALLOCATIONS_REVALIDATE_INTERVAL', 5 * 60)
+PORTAL_ALLOCATIONS_FETCH_TIMEOUT = getattr(settings_custom, '_PORTAL_ALLOCATIONS_FETCH_TIMEOUT', 30)
+# TAS user profiles are cached in Redis for PORTAL_TAS_PROFILE_TTL seconds.
+# 0 disables caching.
+PORTAL_TAS_PROFILE_TTL = getattr(settings_custom, '_PORTAL_TAS_PROFILE_TTL', 5 * 60)
+
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
@@ -562,6 +618,9 @@ PORTAL_PROJECTS_PUBLIC_KEY = settings_secret.\
 
 COMMUNITY_INDEX_SCHEDULE = settings_custom.\
     _COMMUNITY_INDEX_SCHEDULE
+# Incremental crawls only pick up changes directly inside folders whose mtime
+# changed, so they run in between the full crawls of COMMUNITY_INDEX_SCHEDULE.
+COMMUNITY_INCREMENTAL_INDEX_SCHEDULE = getattr(settings_custom, '_COMMUNITY_INCREMENTAL_INDEX_SCHEDULE', {})
 
 # This setting is not used directly most of the time.
 # We mainly use it when creating the execution system for the pems app
@@ -594,6 +653,16 @@ PORTAL_KEY_SERVICE_ACTOR_ID = getattr(settings_custom, '_PORTAL_KEY_SERVICE_ACTO
 
 PORTAL_JOB_NOTIFICATION_STATES = ["PENDING", "STAGING_INPUTS", "SUBMITTING", "QUEUED", "RUNNING",
                                   "CLEANING_UP", "FINISHED", "STOPPED", "FAILED", "BLOCKED", "PAUSED"]
+# Jobs are submitted in the background by the submit_job task. A submission
+# is retried up to PORTAL_JOB_SUBMIT_MAX_RETRIES times when Tapis is
+# unavailable, waiting PORTAL_JOB_SUBMIT_RETRY_DELAY seconds, doubled on
+# each attempt. A submission that has not progressed for
+# PORTAL_JOB_SUBMIT_STALE_AFTER seconds is queued again when it is repeated.
+# At most PORTAL_JOB_SWEEP_MAX_JOBS jobs can be submitted in one parameter sweep.
+PORTAL_JOB_SUBMIT_MAX_RETRIES = getattr(settings_custom, '_PORTAL_JOB_SUBMIT_MAX_RETRIES', 3)
+PORTAL_JOB_SUBMIT_RETRY_DELAY = getattr(settings_custom, '_PORTAL_JOB_SUBMIT_RETRY_DELAY', 10)
+PORTAL_JOB_SUBMIT_STALE_AFTER = getattr(settings_custom, '_PORTAL_JOB_SUBMIT_STALE_AFTER', 600)
+PORTAL_JOB_SWEEP_MAX_JOBS = getattr(settings_custom, '_PORTAL_JOB_SWEEP_MAX_JOBS', 100)
 
 # "View in Jupyter Notebook" base URL
 PORTAL_JUPYTER_URL = getattr(settings_custom, '_PORTAL_JUPYTER_URL', None)
@@ -615,6 +684,78 @@ ES_AUTH = settings_secret._ES_AUTH
 
 ES_INDEX_PREFIX = settings_secret._ES_INDEX_PREFIX
 
+# Listings in these data depot schemes are answered from the files index when
+# the folder was checked against Tapis within PORTAL_INDEXED_LISTING_MAX_AGE
+# seconds, then revalidated against Tapis at most once per
+# PORTAL_INDEXED_LISTING_REVALIDATE_INTERVAL seconds. Only list schemes whose
+# files are readable by every user that can reach them, since the index does
+# not track permissions.
+PORTAL_INDEXED_LISTING_SCHEMES = getattr(settings_custom, '_PORTAL_INDEXED_LISTING_SCHEMES', ['community', 'public'])
+PORTAL_INDEXED_LISTING_MAX_AGE = getattr(settings_custom, '_PORTAL_INDEXED_LISTING_MAX_AGE', 24 * 60 * 60)
+PORTAL_INDEXED_LISTING_REVALIDATE_INTERVAL = getattr(settings_custom, '_PORTAL_INDEXED_LISTING_REVALIDATE_INTERVAL', 60)
+
+# Bulk indexing: actions and bytes per bulk request, number of requests sent
+# in parallel, and how many times to retry documents rejected with a 429.
+ES_BULK_CHUNK_SIZE = getattr(settings_custom, '_ES_BULK_CHUNK_SIZE', 500)
+ES_BULK_MAX_CHUNK_BYTES = getattr(settings_custom, '_ES_BULK_MAX_CHUNK_BYTES', 10 * 1024 * 1024)
+ES_BULK_THREAD_COUNT = getattr(settings_custom, '_ES_BULK_THREAD_COUNT', 1)
+ES_BULK_MAX_RETRIES = getattr(settings_custom, '_ES_BULK_MAX_RETRIES', 5)
+# Slices run in parallel by recursive delete_by_query requests.
+ES_DELETE_SLICES = getattr(settings_custom, '_ES_DELETE_SLICES', 'auto')
+# Files index profile. New indexes route documents by system ID so that
+# queries on one system search a single shard; an index built without routing
+# is rebuilt with reindex-files. Whether to route reads and writes follows the
+# mapping of the live files index, checked every
+# ES_FILES_MAPPING_CHECK_INTERVAL seconds, unless ES_FILES_ROUTING is set to
+# True or False. New indexes get ES_FILES_INDEX_SHARDS shards,
+# or if unset one per ES_FILES_SHARD_SIZE bytes of the current index. The
+# refresh interval is lengthened to ES_FILES_CRAWL_REFRESH_INTERVAL while
+# crawls run (None leaves it unchanged). ES_FILES_ALLOCATION pins the index
+# to nodes with the given attributes, e.g. {'data': 'warm'}.
+ES_FILES_ROUTING = getattr(settings_custom, '_ES_FILES_ROUTING', None)
+ES_FILES_MAPPING_CHECK_INTERVAL = getattr(settings_custom, '_ES_FILES_MAPPING_CHECK_INTERVAL', 5)
+ES_FILES_INDEX_SHARDS = getattr(settings_custom, '_ES_FILES_INDEX_SHARDS', None)
+ES_FILES_SHARD_SIZE = getattr(settings_custom, '_ES_FILES_SHARD_SIZE', 30 * 1024 ** 3)
+ES_FILES_REFRESH_INTERVAL = getattr(settings_custom, '_ES_FILES_REFRESH_INTERVAL', '1s')
+ES_FILES_CRAWL_REFRESH_INTERVAL = getattr(settings_custom, '_ES_FILES_CRAWL_REFRESH_INTERVAL', '30s')
+ES_FILES_ALLOCATION = getattr(settings_custom, '_ES_FILES_ALLOCATION', {})
+# Seconds a process caches the list of dual-write targets set while
+# reindex-files runs. 0 disables dual writes.
+ES_DUAL_WRITE_CHECK_INTERVAL = getattr(settings_custom, '_ES_DUAL_WRITE_CHECK_INTERVAL', 5)
+# reindex-files: documents per second copied by _reindex (-1 is unthrottled)
+# and number of slices it runs in parallel ('auto' is one per shard).
+ES_REINDEX_REQUESTS_PER_SECOND = getattr(settings_custom, '_ES_REINDEX_REQUESTS_PER_SECOND', -1)
+ES_REINDEX_SLICES = getattr(settings_custom, '_ES_REINDEX_SLICES', 'auto')
+
+# Maximum number of concurrent Tapis listings made by a single crawl.
+PORTAL_INDEXER_MAX_WORKERS = getattr(settings_custom, '_PORTAL_INDEXER_MAX_WORKERS', 8)
+# Per-system caps on concurrent Tapis listings within a worker process, i.e.
+# {'cep.storage.community': 4}. Systems not listed use PORTAL_INDEXER_MAX_WORKERS.
+PORTAL_INDEXER_SYSTEM_CONCURRENCY = getattr(settings_custom, '_PORTAL_INDEXER_SYSTEM_CONCURRENCY', {})
+# Number of folders a crawl task lists before checkpointing its frontier and
+# continuing in a new task.
+PORTAL_INDEXER_CHECKPOINT_FOLDERS = getattr(settings_custom, '_PORTAL_INDEXER_CHECKPOINT_FOLDERS', 5000)
+# Seconds during which indexing requests from file operations are collected
+# and deduplicated before being queued. 0 queues every request immediately.
+PORTAL_INDEXER_DEBOUNCE = getattr(settings_custom, '_PORTAL_INDEXER_DEBOUNCE', 5)
+
+# Cross-API transfers (libs.transfer): size in bytes of streamed chunks,
+# chunks buffered between download and upload, files copied in parallel,
+# bytes kept in memory before spooling to disk for uploads that need a
+# seekable source, seconds resume state is kept, and seconds between progress
+# events.
+PORTAL_TRANSFER_CHUNK_SIZE = getattr(settings_custom, '_PORTAL_TRANSFER_CHUNK_SIZE', 8 * 1024 * 1024)
+PORTAL_TRANSFER_BUFFER_CHUNKS = getattr(settings_custom, '_PORTAL_TRANSFER_BUFFER_CHUNKS', 4)
+PORTAL_TRANSFER_MAX_WORKERS = getattr(settings_custom, '_PORTAL_TRANSFER_MAX_WORKERS', 4)
+PORTAL_TRANSFER_SPOOL_SIZE = getattr(settings_custom, '_PORTAL_TRANSFER_SPOOL_SIZE', 64 * 1024 * 1024)
+PORTAL_TRANSFER_STATE_TTL = getattr(settings_custom, '_PORTAL_TRANSFER_STATE_TTL', 24 * 60 * 60)
+PORTAL_TRANSFER_PROGRESS_INTERVAL = getattr(settings_custom, '_PORTAL_TRANSFER_PROGRESS_INTERVAL', 2)
+
+# Batch file operations: maximum number of files per request, and number of
+# Tapis calls run in parallel.
+PORTAL_DATAFILES_BATCH_MAX_ITEMS = getattr(settings_custom, '_PORTAL_DATAFILES_BATCH_MAX_ITEMS', 5000)
+PORTAL_DATAFILES_BATCH_MAX_WORKERS = getattr(settings_custom, '_PORTAL_DATAFILES_BATCH_MAX_WORKERS', 8)
+
 HAYSTACK_CONNECTIONS = {
     'default': {
         'ENGINE': 'haystack.backends.elasticsearch_backend.ElasticsearchSearchEngine',
@@ -41,6 +41,7 @@ _AGAVE_JWT_HEADER = 'HTTP_X_JWT_ASSERTION_PORTALS'
 ########################
 
 _COMMUNITY_INDEX_SCHEDULE = {}
+_COMMUNITY_INCREMENTAL_INDEX_SCHEDULE = {}
 
 ########################
 # DJANGO APP: WORKSPACE
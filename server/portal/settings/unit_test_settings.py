@@ -248,6 +248,10 @@ PORTAL_SEARCH_MANAGERS = {
 
 PORTAL_JOB_NOTIFICATION_STATES = ["PENDING", "STAGING_INPUTS", "SUBMITTING", "QUEUED", "RUNNING",
                                   "CLEANING_UP", "FINISHED", "STOPPED", "FAILED", "BLOCKED", "PAUSED"]
+PORTAL_JOB_SUBMIT_MAX_RETRIES = 3
+PORTAL_JOB_SUBMIT_RETRY_DELAY = 10
+PORTAL_JOB_SUBMIT_STALE_AFTER = 600
+PORTAL_JOB_SWEEP_MAX_JOBS = 3
 
 EXTERNAL_RESOURCE_SECRETS = {
     "google-drive": {
@@ -295,6 +299,57 @@ AGAVE_JWT_USER_CLAIM_FIELD = 'http://wso2.org/claims/fullname'
 ES_HOSTS = ['test.com']
 ES_AUTH = "user:password"
 ES_INDEX_PREFIX = "test-staging-{}"
+ES_BULK_CHUNK_SIZE = 500
+ES_BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+ES_BULK_THREAD_COUNT = 1
+ES_BULK_MAX_RETRIES = 5
+ES_DELETE_SLICES = 'auto'
+ES_DUAL_WRITE_CHECK_INTERVAL = 0
+ES_FILES_ROUTING = True
+ES_FILES_MAPPING_CHECK_INTERVAL = 0
+ES_FILES_INDEX_SHARDS = None
+ES_FILES_SHARD_SIZE = 30 * 1024 ** 3
+ES_FILES_REFRESH_INTERVAL = '1s'
+ES_FILES_CRAWL_REFRESH_INTERVAL = None
+ES_FILES_ALLOCATION = {}
+ES_REINDEX_REQUESTS_PER_SECOND = -1
+ES_REINDEX_SLICES = 'auto'
+PORTAL_INDEXER_MAX_WORKERS = 2
+PORTAL_INDEXER_SYSTEM_CONCURRENCY = {}
+PORTAL_INDEXER_CHECKPOINT_FOLDERS = 5000
+PORTAL_INDEXER_DEBOUNCE = 0
+PORTAL_CACHE_REDIS_URL = 'redis://localhost:6379/1'
+PORTAL_CACHE_SOCKET_TIMEOUT = 0.5
+PORTAL_LISTING_CACHE_TTL = 0
+PORTAL_SITE_SEARCH_TIMEOUT = 2
+PORTAL_SITE_SEARCH_CACHE_TTL = 0
+PORTAL_USAGE_CACHE_TTL = 0
+PORTAL_USAGE_ROLLUP_DEBOUNCE = 0
+PORTAL_APP_CACHE_TTL = 0
+PORTAL_APP_CACHE_USER_TTL = 0
+PORTAL_APP_CACHE_WARM_SCHEDULE = {}
+PORTAL_APPS_TRAY_MAX_WORKERS = 4
+PORTAL_APPS_TRAY_TIMEOUT = 3
+PORTAL_AGAVE_CLIENT_CACHE_SIZE = 0
+PORTAL_AGAVE_POOL_MAXSIZE = 20
+PORTAL_AGAVE_POOL_CONNECTIONS = 4
+PORTAL_AGAVE_CLIENT_STATS_INTERVAL = 300
+PORTAL_TOKEN_REFRESH_LOCK_TIMEOUT = 1
+PORTAL_ALLOCATIONS_TTL = 60 * 60
+PORTAL_ALLOCATIONS_REVALIDATE_INTERVAL = 5 * 60
+PORTAL_ALLOCATIONS_FETCH_TIMEOUT = 1
+PORTAL_TAS_PROFILE_TTL = 0
+PORTAL_INDEXED_LISTING_SCHEMES = ['community', 'public']
+PORTAL_INDEXED_LISTING_MAX_AGE = 24 * 60 * 60
+PORTAL_INDEXED_LISTING_REVALIDATE_INTERVAL = 60
+PORTAL_TRANSFER_CHUNK_SIZE = 1024
+PORTAL_TRANSFER_BUFFER_CHUNKS = 2
+PORTAL_TRANSFER_MAX_WORKERS = 2
+PORTAL_TRANSFER_SPOOL_SIZE = 4096
+PORTAL_TRANSFER_STATE_TTL = 24 * 60 * 60
+PORTAL_TRANSFER_PROGRESS_INTERVAL = 0
+PORTAL_DATAFILES_BATCH_MAX_ITEMS = 5000
+PORTAL_DATAFILES_BATCH_MAX_WORKERS = 2
 
 SYSTEM_MONITOR_URL = "https://sysmon.example.com/foo.json"
 
@@ -371,6 +426,7 @@ MIGRATION_MODULES = {
 }
 
 COMMUNITY_INDEX_SCHEDULE = {'hour': 0, 'minute': 0, 'day_of_week': 0}
+COMMUNITY_INCREMENTAL_INDEX_SCHEDULE = {}
 
 """
 SETTINGS: SUPPORTED FILE PREVIEW TYPES